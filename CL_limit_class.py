@@ -17,6 +17,15 @@ from functools import reduce
 from scipy.stats import skew, median_abs_deviation, kurtosis, norm, rankdata
 import scipy.stats as stats
 
+from result_cache import ResultCache, dataframe_fingerprint, code_version, artifact_signature, file_fingerprint, make_cache_key
+from perf_profiler import PROFILER
+from memory_monitor import MEMORY_MONITOR
+from run_journal import RunJournal, file_source_signature, directory_signature
+from chart_scheduler import in_shard
+from raw_file_index import get_raw_file_index
+from chart_config import read_config_sheet
+from result_history import ResultHistory, get_history_path, week_key
+
 # 設定中文字體（添加異常處理）
 try:
     plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei', 'SimHei', 'DejaVu Sans']
@@ -139,7 +148,8 @@ def transform_johnson_slifker_shapiro_full(data):
 class CLTightenCalculator:
     """Control Limit Tighten Calculator - 管制線收緊計算器"""
     
-    def __init__(self, chart_info_path=None, raw_data_dir=None, start_date=None, end_date=None):
+    def __init__(self, chart_info_path=None, raw_data_dir=None, start_date=None, end_date=None, use_result_cache=True,
+                 record_history=True):
         """
         初始化 CL Tighten Calculator
         
@@ -148,12 +158,16 @@ class CLTightenCalculator:
             raw_data_dir: 原始數據目錄路徑
             start_date: 自訂起始日期 (datetime object)
             end_date: 自訂結束日期 (datetime object)
+            use_result_cache: 是否沿用磁碟結果快取（相同設定列 + 相同資料 + 相同日期範圍）
+            record_history: 計算完成後是否寫入結果歷史 (output/history/result_history.sqlite)
         """
         self.chart_info_path = chart_info_path
         self.raw_data_dir = raw_data_dir
         self.start_date = start_date
         self.end_date = end_date
         self.results = []
+        self.result_cache = ResultCache('cl_tighten', enabled=use_result_cache)
+        self.record_history = record_history
         
     # === Utility Functions ===
     
@@ -1908,7 +1922,7 @@ class CLTightenCalculator:
     def load_chart_information(self, filepath):
         """讀取 Chart 設定檔 (Excel)"""
         try:
-            df_charts = pd.read_excel(filepath, sheet_name='Chart')
+            df_charts = read_config_sheet(filepath, 'Chart')
             
             # 確保 Resolution, DetectionLimit, tsmc_ucl, tsmc_lcl 存在
             if 'Resolution' not in df_charts.columns: 
@@ -1939,46 +1953,12 @@ class CLTightenCalculator:
 
     def find_matching_file(self, raw_data_directory, group_name, chart_name):
         """根據命名規則匹配對應的 Raw Data CSV (用 _ 分割做精確匹配)"""
-        group_name = str(group_name).strip()
-        chart_name = str(chart_name).strip()
-        
-        # 構建精確匹配的前綴模式
-        pattern_prefix = f"{group_name}_{chart_name}"
-        
-        matching_files = []
-        try:
-            for filename in os.listdir(raw_data_directory):
-                if not filename.endswith('.csv'):
-                    continue
-                
-                # 移除 .csv 副檔名
-                filename_without_ext = filename[:-4]
-                
-                # 檢查是否以 pattern_prefix 開頭
-                if filename_without_ext.startswith(pattern_prefix):
-                    # 檢查後面是否只有 _ 或沒有其他字符（允許尾碼）
-                    remainder = filename_without_ext[len(pattern_prefix):]
-                    if remainder == '' or remainder.startswith('_'):
-                        matching_files.append(filename)
-                        print(f"    [Debug] 找到匹配檔案: {filename}")
-        
-        except Exception as e:
-            print(f"    [Warning] 掃描目錄時發生錯誤: {e}")
-            return None
-        
-        if matching_files:
-            # 若找到多個符合的檔案，優先選擇最短的（最接近的匹配）
-            matching_files.sort(key=len)
-            selected_file = matching_files[0]
-            
-            if len(matching_files) > 1:
-                print(f"    [Debug] 找到多個候選檔案: {matching_files}，選擇最短的: {selected_file}")
-            
-            return os.path.join(raw_data_directory, selected_file)
-        
-        print(f"    [Warning] 未找到匹配檔案 (GroupName={group_name}, ChartName={chart_name})")
-        print(f"    [Debug] 期望的檔案前綴: {pattern_prefix}")
-        return None
+        # 檔名為 {Group}_{Chart}.csv 或 {Group}_{Chart}_*.csv（允許尾碼），多個時選最短的（最接近的匹配）
+        # 目錄只掃描一次，由 raw_file_index 依目錄指紋快取
+        matched_file = get_raw_file_index(raw_data_directory).find_prefix(group_name, chart_name)
+        if matched_file is None:
+            print(f"    [Warning] 未找到匹配檔案 (GroupName={group_name}, ChartName={chart_name})")
+        return matched_file
 
     def plot_control_chart(self, chart_data, chart_info, suggest_ucl, suggest_lcl,
                         static_ucl, static_lcl, cl_center, pattern, 
@@ -2372,6 +2352,24 @@ class CLTightenCalculator:
         
         group_name = chart_info_row.get('GroupName', 'N/A')
         chart_name = chart_info_row.get('ChartName', 'N/A')
+
+        # 結果快取：未指定日期範圍時使用「最近 2 年」，因此以當天日期作為時間窗的一部分
+        if self.start_date is not None and self.end_date is not None:
+            cache_window = (pd.Timestamp(self.start_date), pd.Timestamp(self.end_date))
+        else:
+            cache_window = ('last_2_years', pd.Timestamp.today().normalize())
+        cache_key = self.result_cache.make_key(
+            chart_info_row,
+            dataframe_fingerprint(raw_data_df),
+            cache_window,
+            code_version(__file__),
+        )
+        cached_entry = self.result_cache.get(cache_key)
+        if cached_entry is not None:
+            plot_file = cached_entry['output'].get('PlotFile')
+            if artifact_signature([plot_file]) == cached_entry['plot_signature']:
+                print(f"    [Debug] 使用快取結果 {group_name}_{chart_name}")
+                return dict(cached_entry['output'])
         
         print(f"    [Debug] 開始處理 {group_name}_{chart_name}")
         print(f"    [Debug] 原始 CSV 數據 shape: {raw_data_df.shape}")
@@ -2452,13 +2450,14 @@ class CLTightenCalculator:
         
         try:
             # 4. 運行核心計算
-            results = self.process_chart(
-                df=raw_data_df,
-                value_col='value',
-                date_col='date',
-                oos_col='oos_flag',
-                characteristic=chart_info_row.get('Characteristics', 'Nominal')
-            )
+            with PROFILER.stage('cl_calculation'):
+                results = self.process_chart(
+                    df=raw_data_df,
+                    value_col='value',
+                    date_col='date',
+                    oos_col='oos_flag',
+                    characteristic=chart_info_row.get('Characteristics', 'Nominal')
+                )
             
             # 5. 格式化輸出
             final_output = chart_info_row.to_dict()
@@ -2568,26 +2567,31 @@ class CLTightenCalculator:
                     print(f"     [Warning] 經過時間篩選後無數據，跳過繪圖")
                     final_output['PlotFile'] = 'No Data After Filtering'
                 else:
-                    plot_filename = self.plot_control_chart(
-                        chart_data=filtered_chart_data,
-                        chart_info=chart_info_row,
-                        suggest_ucl=final_output['Suggest UCL'],
-                        suggest_lcl=final_output['Suggest LCL'],
-                        static_ucl=final_output['Static UCL'],
-                        static_lcl=final_output['Static LCL'],
-                        cl_center=final_output['CL_Center'],
-                        pattern=final_output['Pattern'],
-                        total_data_count=final_output.get('TotalDataCount', len(raw_data_df)),
-                        used_data_count=final_output.get('DataCountUsed', 0),
-                        tsmc_ucl=chart_info_row.get('tsmc_ucl', np.nan),
-                        tsmc_lcl=chart_info_row.get('tsmc_lcl', np.nan)
-                    )
+                    with PROFILER.stage('cl_rendering'):
+                        plot_filename = self.plot_control_chart(
+                            chart_data=filtered_chart_data,
+                            chart_info=chart_info_row,
+                            suggest_ucl=final_output['Suggest UCL'],
+                            suggest_lcl=final_output['Suggest LCL'],
+                            static_ucl=final_output['Static UCL'],
+                            static_lcl=final_output['Static LCL'],
+                            cl_center=final_output['CL_Center'],
+                            pattern=final_output['Pattern'],
+                            total_data_count=final_output.get('TotalDataCount', len(raw_data_df)),
+                            used_data_count=final_output.get('DataCountUsed', 0),
+                            tsmc_ucl=chart_info_row.get('tsmc_ucl', np.nan),
+                            tsmc_lcl=chart_info_row.get('tsmc_lcl', np.nan)
+                        )
                     final_output['PlotFile'] = plot_filename if plot_filename else 'Plot Failed'
             except Exception as plot_error:
                 import traceback
                 print(f"     [Warning] 繪圖失敗: {plot_error}")
                 traceback.print_exc()
                 final_output['PlotFile'] = 'Plot Failed'
+
+            plot_signature = artifact_signature([final_output.get('PlotFile')])
+            if plot_signature:
+                self.result_cache.put(cache_key, {'output': dict(final_output), 'plot_signature': plot_signature})
             
             return final_output
             
@@ -2603,8 +2607,41 @@ class CLTightenCalculator:
                 'PlotFile': 'Calculation Error'
             }
 
-    def run_calculation(self, output_filename='CL_Calculation_Results.xlsx', progress_callback=None):
-        """執行完整的 CL 計算流程"""
+    def open_run_journal(self, resume=False):
+        """
+        開啟 CL checkpoint journal（output/checkpoints/cl_journal.jsonl）。
+        fingerprint 由設定檔內容、原始資料目錄、日期範圍與程式版本組成。
+        """
+        try:
+            fingerprint = make_cache_key(
+                'cl',
+                file_fingerprint(self.chart_info_path),
+                directory_signature(self.raw_data_dir),
+                self.start_date, self.end_date,
+                code_version(__file__),
+            )
+            journal_path = os.path.join('output', 'checkpoints', 'cl_journal.jsonl')
+            return RunJournal(journal_path, fingerprint, run_name='cl', resume=resume)
+        except Exception as e:
+            print(f"[Warning] 無法建立 CL checkpoint journal，本次不記錄: {e}")
+            return None
+
+    @staticmethod
+    def _journal_plot_available(record):
+        """續跑時若圖檔已被刪除，重新計算以產生圖檔"""
+        plot_file = record.get('PlotFile') if isinstance(record, dict) else None
+        if plot_file and str(plot_file).lower().endswith('.png'):
+            return os.path.exists(plot_file)
+        return True
+
+    def run_calculation(self, output_filename='CL_Calculation_Results.xlsx', progress_callback=None, resume=False, shard=None):
+        """
+        執行完整的 CL 計算流程
+
+        每完成一張 chart 即寫入 checkpoint journal；resume=True 時，相同輸入下已完成的 chart 直接讀回。
+        shard=(k, n) 時只計算第 k 片的 chart（見 chart_scheduler.in_shard），
+        各 chart 在設定檔中的位置記錄於 self.result_positions，供多機結果合併排序。
+        """
         
         if not self.chart_info_path or not os.path.exists(self.chart_info_path):
             raise ValueError(f"圖表資訊檔案不存在: {self.chart_info_path}")
@@ -2618,51 +2655,127 @@ class CLTightenCalculator:
             raise ValueError("無法載入有效的圖表配置")
 
         self.results = []
-        total_charts = len(all_charts_info)
+        self.result_positions = []
+        charts = [(position, row) for position, (_, row) in enumerate(all_charts_info.iterrows()) if in_shard(row, shard)]
+        total_charts = len(charts)
+        if shard is not None:
+            print(f"[Info] 分片 {shard[0]}/{shard[1]}：{total_charts} / {len(all_charts_info)} 張圖表")
+        PROFILER.reset('cl')
+        if MEMORY_MONITOR.enabled:
+            MEMORY_MONITOR.reset('cl')
+            PROFILER.add_hook(MEMORY_MONITOR)
         
         print(f"--- 2. 處理 {total_charts} 張圖表的數據 ---")
-        
-        for i, (index, chart_info) in enumerate(all_charts_info.iterrows()):
-            # 更新進度
-            if progress_callback:
-                progress_callback(i + 1, total_charts)
-
-            group_name = chart_info.get('GroupName', 'N/A')
-            chart_name = chart_info.get('ChartName', 'N/A')
-            
-            print(f"  > 處理 Chart: {group_name}_{chart_name}...")
-            
-            filepath = self.find_matching_file(self.raw_data_dir, group_name, chart_name)
+        journal = self.open_run_journal(resume=resume)
+        try:
+            for i, (position, chart_info) in enumerate(charts):
+                # 更新進度
+                if progress_callback:
+                    progress_callback(i + 1, total_charts)
+                self.result_positions.append(position)
+
+                group_name = chart_info.get('GroupName', 'N/A')
+                chart_name = chart_info.get('ChartName', 'N/A')
+            
+                print(f"  > 處理 Chart: {group_name}_{chart_name}...")
+                PROFILER.set_chart(f"{group_name}_{chart_name}")
+            
+                with PROFILER.stage('file_lookup'):
+                    filepath = self.find_matching_file(self.raw_data_dir, group_name, chart_name)
+
+                journal_key = f"{position}|{group_name}_{chart_name}"
+                source = file_source_signature(filepath)
+                resumed = journal.get(journal_key, source) if journal is not None else None
+                if resumed is not None and self._journal_plot_available(resumed['record']):
+                    print(f"    [Info] 已在 checkpoint 中完成，略過計算。")
+                    self.results.append(resumed['record'])
+                    continue
             
-            if filepath is None:
-                print(f"    [Warning] 未找到匹配的原始數據文件。跳過。")
-                result = chart_info.to_dict()
-                result['Status'] = 'No Raw Data'
-                result['PlotFile'] = 'No Raw Data'
-                self.results.append(result)
-                continue
+                if filepath is None:
+                    print(f"    [Warning] 未找到匹配的原始數據文件。跳過。")
+                    result = chart_info.to_dict()
+                    result['Status'] = 'No Raw Data'
+                    result['PlotFile'] = 'No Raw Data'
+                    self.results.append(result)
+                    if journal is not None:
+                        journal.append(journal_key, result, status='skipped', source=source)
+                    continue
 
-            try:
-                raw_df = pd.read_csv(filepath, float_precision='round_trip')
-                
-                # 強制轉換 point_val 為數字型別（容錯處理）
-                if 'point_val' in raw_df.columns:
-                    raw_df['point_val'] = pd.to_numeric(raw_df['point_val'], errors='coerce')
-                
-                results_dict = self.process_single_chart_data(chart_info, raw_df)
-                self.results.append(results_dict)
+                try:
+                    with PROFILER.stage('csv_read'):
+                        raw_df = pd.read_csv(filepath, float_precision='round_trip')
+                    
+                        # 強制轉換 point_val 為數字型別（容錯處理）
+                        if 'point_val' in raw_df.columns:
+                            raw_df['point_val'] = pd.to_numeric(raw_df['point_val'], errors='coerce')
+                
+                    results_dict = self.process_single_chart_data(chart_info, raw_df)
+                    self.results.append(results_dict)
+                    if journal is not None and results_dict.get('Status') == 'Success':
+                        journal.append(journal_key, results_dict, source=source)
+                    del raw_df
+                    if MEMORY_MONITOR.enabled and MEMORY_MONITOR.check_budget(f"CL {group_name}_{chart_name}") == 'over':
+                        # CL 結果只保留數值，超過預算時釋放殘留的 matplotlib figure
+                        plt.close('all')
                 
+                except Exception as e:
+                    print(f"    [Error] 讀取數據時發生錯誤: {e}")
+                    error_result = chart_info.to_dict()
+                    error_result['Status'] = 'File Read Error'
+                    error_result['ErrorMessage'] = str(e)
+                    error_result['PlotFile'] = 'File Read Error'
+                    self.results.append(error_result)
+
+            if journal is not None:
+                journal.mark_complete()
+        finally:
+            if journal is not None:
+                journal.close()
+
+        PROFILER.set_chart(None)
+        if PROFILER.enabled:
+            try:
+                PROFILER.print_summary()
+                PROFILER.write_json(os.path.join('output', 'cl_performance_report.json'))
+                PROFILER.write_excel(os.path.join('output', 'cl_performance_report.xlsx'))
             except Exception as e:
-                print(f"    [Error] 讀取數據時發生錯誤: {e}")
-                error_result = chart_info.to_dict()
-                error_result['Status'] = 'File Read Error'
-                error_result['ErrorMessage'] = str(e)
-                error_result['PlotFile'] = 'File Read Error'
-                self.results.append(error_result)
-                
+                print(f"[Warning] CL 效能報告輸出失敗: {e}")
+        if MEMORY_MONITOR.enabled:
+            try:
+                MEMORY_MONITOR.print_summary()
+                MEMORY_MONITOR.write_json(os.path.join('output', 'cl_memory_report.json'))
+                MEMORY_MONITOR.write_excel(os.path.join('output', 'cl_memory_report.xlsx'))
+            except Exception as e:
+                print(f"[Warning] CL 記憶體報告輸出失敗: {e}")
+
         # --- 3. 準備輸出結果 ---
+        df_output = self.build_output_dataframe(self.results)
+        if shard is None:
+            self.record_result_history()
         
-        df_output = pd.DataFrame(self.results)
+        print("\n--- 4. 計算完成 ---")
+        print(f"成功處理 {len(df_output)} 張圖表")
+        
+        # 注意：不再自動輸出 Excel 報告
+        # 如需輸出報告，請使用 export_results() 方法
+        
+        return df_output
+
+    def record_result_history(self):
+        """將成功計算的 chart 寫入結果歷史；週以結束日期（未指定時為今天）所在週計"""
+        if not self.record_history:
+            return
+        try:
+            records = [r for r in self.results if r.get('Status') == 'Success']
+            week = week_key(self.end_date if self.end_date is not None else pd.Timestamp.today())
+            ResultHistory(get_history_path()).record_run('cl', records, week=week, source=self.chart_info_path)
+        except Exception as e:
+            print(f"[Warning] CL 結果歷史寫入失敗: {e}")
+
+    @staticmethod
+    def build_output_dataframe(results):
+        """將各 chart 的結果 dict 整理為輸出用 DataFrame（固定欄位順序）"""
+        df_output = pd.DataFrame(results)
         
         # 調整輸出欄位順序
         output_cols_priority = [
@@ -2692,15 +2805,7 @@ class CLTightenCalculator:
         df_output.insert(0, 'Figure', '')
         
         existing_output_cols = [col for col in output_cols_priority if col in df_output.columns]
-        df_output = df_output[existing_output_cols]
-        
-        print("\n--- 4. 計算完成 ---")
-        print(f"成功處理 {len(df_output)} 張圖表")
-        
-        # 注意：不再自動輸出 Excel 報告
-        # 如需輸出報告，請使用 export_results() 方法
-        
-        return df_output
+        return df_output[existing_output_cols]
 
     def export_results(self, results_df, output_filename='CL_Calculation_Results.xlsx'):
         """
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Chart 設定檔快照 (Chart configuration snapshot)
+
+All_Chart_Information.xlsx 原本由 OOB (Chart / Time sheet)、CL Tighten、Tool Matching、
+Data Health Check、Cpk Dashboard 各自用 openpyxl 重新解析。這裡改為：
+- 一次開啟活頁簿讀取所有需要的 sheet (Chart、Time)
+- Characteristics 欄位只標準化一次（每個不同的值判斷一次，不逐列呼叫）
+- 解析結果以檔案內容雜湊為鍵存入磁碟快取 (cache/results/chart_config)，
+  同一行程內再以 (大小, mtime) 記憶，檔案未變動時不再解析 Excel
+
+除了 Excel 也接受 CSV / Parquet 設定檔：檔案本身即為 Chart sheet，
+Time sheet 可放在同目錄的 <檔名>_Time.csv / <檔名>_Time.parquet（沒有時視為沒有 Time sheet），
+Time 檔變動同樣會讓快取失效。Parquet 需要安裝 pyarrow 或 fastparquet。
+
+單張 chart 的設定列在前處理時轉成 ChartInfo：規格 / 管制界限、Resolution、K 門檻預先轉成 float，
+WE / CU 規則開關預先整理好，逐點的 check_rules 與 OOB 規則以屬性存取，不再做 Series 索引。
+"""
+import os
+import math
+import threading
+
+import pandas as pd
+
+from result_cache import ResultCache, file_fingerprint
+
+CONFIG_SHEETS = ('Chart', 'Time')
+CONFIG_CACHE_VERSION = 1
+TABLE_EXTENSIONS = ('.csv', '.parquet')
+
+# Characteristics 標準值（不分大小寫）
+CHARACTERISTIC_MAP = {
+    'nominal': 'Nominal',
+    'bigger': 'Bigger',
+    'smaller': 'Smaller',
+    'sigma': 'Sigma',
+}
+
+
+def normalize_characteristics(values):
+    """Characteristics 欄位標準化：只對不同的值各判斷一次再整欄對應；空值與無效值使用預設值 'Nominal'"""
+    empty_count = int(values.isna().sum())
+    if empty_count:
+        print(f"  [Warning] {empty_count} 筆 Characteristics 為空，使用預設值 'Nominal'")
+
+    mapping = {}
+    for value in values.dropna().unique():
+        text = str(value).strip()
+        normalized = CHARACTERISTIC_MAP.get(text.lower())
+        if normalized is None:
+            print(f"  [Warning] 無效的 Characteristics 值: '{text}'，使用預設值 'Nominal'")
+            normalized = 'Nominal'
+        elif text != normalized:
+            print(f"  [Info] Characteristics 標準化: '{text}' → '{normalized}'")
+        mapping[value] = normalized
+    return values.map(mapping).fillna('Nominal')
+
+CHART_RULE_FLAGS = ('WE1', 'WE2', 'WE3', 'WE4', 'WE5', 'WE6', 'WE7', 'WE8', 'WE9', 'WE10', 'CU1', 'CU2')
+DEFAULT_BY_TOOL_K_THRESHOLD = 1.67
+_LIMIT_FIELDS = (('usl', 'USL'), ('lsl', 'LSL'), ('ucl', 'UCL'), ('lcl', 'LCL'), ('target', 'Target'),
+                 ('resolution', 'Resolution'))
+_TYPED_KEYS = frozenset([key for _, key in _LIMIT_FIELDS] + list(CHART_RULE_FLAGS) + [
+    'Characteristics', 'data_type', 'by_tool_median_shift_k_threshold', 'auto_baseline_changepoint'])
+
+
+def _to_float(value):
+    """設定值轉 float；空值 / 無法轉換時為 NaN"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class ChartInfo(dict):
+    """
+    單張 chart 的設定（取代 pandas Series）：get / [] / in / items / copy / rename / to_dict 與 Series 用法相同，
+    另外提供預先解析的屬性：usl、lsl、ucl、lcl、target、resolution（float，無效為 NaN）、characteristics、
+    data_type、we_rules（設為 Y 的 WE / CU 規則，依 CHART_RULE_FLAGS 順序）、k_threshold、auto_baseline_changepoint。
+    寫入相關 key 時屬性隨之更新。
+    """
+    __slots__ = ('usl', 'lsl', 'ucl', 'lcl', 'target', 'resolution', 'characteristics', 'data_type', 'we_rules',
+                 'k_threshold', 'auto_baseline_changepoint')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._parse()
+
+    def _parse(self):
+        for attr, key in _LIMIT_FIELDS:
+            setattr(self, attr, _to_float(self.get(key)))
+        self.characteristics = self.get('Characteristics')
+        self.data_type = self.get('data_type')
+        self.we_rules = tuple(rule for rule in CHART_RULE_FLAGS if self.get(rule, 'N') == 'Y')
+        k_threshold = _to_float(self.get('by_tool_median_shift_k_threshold', DEFAULT_BY_TOOL_K_THRESHOLD))
+        self.k_threshold = k_threshold if math.isfinite(k_threshold) else DEFAULT_BY_TOOL_K_THRESHOLD
+        self.auto_baseline_changepoint = bool(self.get('auto_baseline_changepoint', False))
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if key in _TYPED_KEYS:
+            self._parse()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        if key in _TYPED_KEYS:
+            self._parse()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._parse()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        value = super().pop(key, *default)
+        if key in _TYPED_KEYS:
+            self._parse()
+        return value
+
+    def copy(self):
+        return ChartInfo(self)
+
+    def rename(self, mapping):
+        """與 Series.rename(dict) 相同：回傳改名後的新 ChartInfo"""
+        return ChartInfo((mapping.get(key, key), value) for key, value in self.items())
+
+    def to_dict(self):
+        return dict(self)
+
+    def __reduce__(self):
+        return ChartInfo, (dict(self),)
+
+
+def as_chart_info(chart_info):
+    """Series / dict / None 轉成 ChartInfo；已是 ChartInfo 時直接回傳（不複製）"""
+    if isinstance(chart_info, ChartInfo):
+        return chart_info
+    if chart_info is None:
+        return ChartInfo()
+    if isinstance(chart_info, pd.Series):
+        return ChartInfo(chart_info.to_dict())
+    return ChartInfo(chart_info)
+
+
+class ChartConfigSnapshot:
+    __slots__ = ('path', 'fingerprint', 'sheets', 'chart')
+
+    def __init__(self, path, fingerprint, sheets, chart):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.sheets = sheets  # {sheet 名稱: 原始 DataFrame}；不存在的 sheet 不列入
+        self.chart = chart  # Characteristics 已標準化的 Chart sheet
+
+    def has_sheet(self, sheet_name):
+        return sheet_name in self.sheets
+
+    def sheet(self, sheet_name):
+        """原始 sheet 的副本（呼叫端可自由修改）；不存在時與 pd.read_excel 相同丟出 ValueError"""
+        if sheet_name not in self.sheets:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+        return self.sheets[sheet_name].copy()
+
+    def chart_information(self):
+        """Characteristics 已標準化的 Chart sheet 副本"""
+        if self.chart is None:
+            raise ValueError("Worksheet named 'Chart' not found")
+        return self.chart.copy()
+
+
+def _read_table(path):
+    if path.lower().endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, encoding='utf-8-sig')
+
+
+def _time_table_path(path):
+    """CSV / Parquet 設定檔對應的 Time 檔；Excel 或沒有 Time 檔時回傳 None"""
+    stem, ext = os.path.splitext(path)
+    if ext.lower() not in TABLE_EXTENSIONS:
+        return None
+    for time_ext in TABLE_EXTENSIONS:
+        time_path = f"{stem}_Time{time_ext}"
+        if os.path.exists(time_path):
+            return time_path
+    return None
+
+
+def _parse_config(path):
+    """解析設定檔的所有需要 sheet（Excel 只開啟一次）"""
+    sheets = {}
+    if os.path.splitext(path)[1].lower() in TABLE_EXTENSIONS:
+        sheets['Chart'] = _read_table(path)
+        time_path = _time_table_path(path)
+        if time_path:
+            sheets['Time'] = _read_table(time_path)
+    else:
+        with pd.ExcelFile(path, engine='openpyxl') as workbook:
+            for sheet_name in CONFIG_SHEETS:
+                if sheet_name in workbook.sheet_names:
+                    sheets[sheet_name] = workbook.parse(sheet_name)
+
+    chart = sheets.get('Chart')
+    if chart is not None:
+        chart = chart.copy()
+        if 'Characteristics' in chart.columns:
+            chart['Characteristics'] = normalize_characteristics(chart['Characteristics'])
+    return sheets, chart
+
+
+_SNAPSHOT_MEMO = {}
+_SNAPSHOT_LOCK = threading.Lock()
+_CONFIG_CACHE = None
+
+
+def _config_cache():
+    global _CONFIG_CACHE
+    if _CONFIG_CACHE is None:
+        _CONFIG_CACHE = ResultCache('chart_config')
+    return _CONFIG_CACHE
+
+
+def load_config_snapshot(path, use_cache=True):
+    """
+    取得設定檔快照。檔案不存在或無法解析時丟出例外（與原本 pd.read_excel 相同），由呼叫端處理。
+    """
+    path = str(path)
+    time_path = _time_table_path(path)
+    memo_key = os.path.abspath(path)
+    file_sig = tuple((os.stat(p).st_size, os.stat(p).st_mtime_ns) for p in (path, time_path) if p)
+    if use_cache:
+        with _SNAPSHOT_LOCK:
+            memo = _SNAPSHOT_MEMO.get(memo_key)
+        if memo is not None and memo[0] == file_sig:
+            return memo[1]
+
+    fingerprint = file_fingerprint(path)
+    if time_path:
+        fingerprint = f"{fingerprint}:{file_fingerprint(time_path)}"
+    cache = _config_cache()
+    cache_key = cache.make_key('chart_config', CONFIG_CACHE_VERSION, fingerprint, os.path.splitext(path)[1].lower())
+    cached = cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        sheets, chart = cached
+        print(f"[Info] 使用設定檔快取: {os.path.basename(path)}")
+    else:
+        sheets, chart = _parse_config(path)
+        if use_cache:
+            cache.put(cache_key, (sheets, chart))
+
+    snapshot = ChartConfigSnapshot(path, fingerprint, sheets, chart)
+    if use_cache:
+        with _SNAPSHOT_LOCK:
+            _SNAPSHOT_MEMO[memo_key] = (file_sig, snapshot)
+    return snapshot
+
+
+def read_config_sheet(path, sheet_name='Chart'):
+    """取代 pd.read_excel(path, sheet_name=...)：回傳原始 sheet 的副本"""
+    return load_config_snapshot(path).sheet(sheet_name)
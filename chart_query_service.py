@@ -0,0 +1,589 @@
+# -*- coding: utf-8 -*-
+"""
+Chart 查詢服務 (warm query service)
+
+在記憶體中保留圖表設定、已讀入 / 前處理的原始資料與最近的計算結果，
+以本機 HTTP/JSON 回答單張 chart 的查詢，不需要開 GUI 或重跑整批：
+
+    GET /health
+    GET /charts
+    GET /oob?group=G&chart=C[&start=YYYY-MM-DD&end=YYYY-MM-DD]
+    GET /cpk?group=G&chart=C[&start=YYYY-MM-DD&end=YYYY-MM-DD]
+    GET /tool_matching?group=G&chart=C[&mode=0|1|2&base_date=YYYY-MM-DD&fill_num=5]
+    GET /window?group=G&chart=C[&start=YYYY-MM-DD&end=YYYY-MM-DD&by_tool=1&days=7&periods=7]  # daily cube 區間統計
+    GET /results                       # 本次服務已計算過的 OOB 結果
+    GET /reload                        # 清除快取，重新讀取設定檔
+    GET /history?group=G&chart=C[&tool=oob|cl]              # 結果歷史：單張 chart 每週的結果
+    GET /history/streaks[?rule=HL_P50_shift&week=YYYY-MM-DD&min_weeks=2&tool=oob]
+    GET /history/first_seen[?rule=...&group=G&chart=C&tool=oob]
+    GET /history/flapping[?last_weeks=8&min_changes=3&tool=oob]
+
+chart 也可以用 chart_id=... 指定。計算沿用 process_single_chart / 離散型流程、
+spc_cpk_dashboard 的 Cpk 分段與 tool matching 統計，結果與 GUI 相同。
+
+Qt app 或 script 可以直接使用 ChartQueryService（不經 HTTP），或以 start_query_server() 在背景執行緒提供服務：
+    python chart_query_service.py --port 8765 --preload
+"""
+import io
+import sys
+import json
+import time
+import math
+import argparse
+import datetime
+import threading
+import contextlib
+import traceback
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+import numpy as np
+import pandas as pd
+
+import oob_module_NGK_nostatic as oob
+from spc_cpk_dashboard import calculate_cpk as dashboard_cpk, filter_spec_limits, compute_cpk_equal_duration_windows
+from tool_matching_widget import ToolMatchingStats, prepare_matching_data
+from run_journal import file_source_signature
+from result_history import ResultHistory, chart_key_of, get_history_path, week_key
+from daily_cube import load_daily_cube
+from compact_frame import compact_chart_frame, expand_chart_frame
+
+DEFAULT_PORT = 8765
+
+
+def to_json_safe(value):
+    """轉為 JSON 可序列化的值：NaN / inf → None，時間 → ISO 字串"""
+    if isinstance(value, pd.DataFrame):
+        return None
+    if isinstance(value, pd.Series):
+        return {str(k): to_json_safe(v) for k, v in value.items()}
+    if isinstance(value, dict):
+        return {str(k): to_json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, np.ndarray)):
+        return [to_json_safe(v) for v in value]
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        return None if math.isnan(value) or math.isinf(value) else value
+    if isinstance(value, (pd.Timestamp, datetime.datetime, datetime.date)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, (pd.Timedelta, datetime.timedelta)):
+        return str(value)
+    return value if isinstance(value, str) else str(value)
+
+
+def _parse_date(text, end_of_day=False):
+    if text in (None, ''):
+        return None
+    try:
+        value = pd.Timestamp(text)
+    except (ValueError, TypeError):
+        raise ValueError(f"無效的日期: {text}")
+    if end_of_day and value == value.normalize():
+        value = value + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    return value
+
+
+class _ChartData:
+    """單張 chart 已讀入的資料；原始檔 (大小, mtime) 改變時重新讀取；raw_df / processed_df 以精簡 dtype 保存"""
+    __slots__ = ('signature', 'filepath', 'raw_df', 'processed_df', 'chart_info', 'data_type', 'cube')
+
+    def __init__(self, signature, filepath, raw_df, processed_df, chart_info, data_type, cube=None):
+        self.signature = signature
+        self.filepath = filepath
+        self.raw_df = raw_df
+        self.processed_df = processed_df
+        self.chart_info = chart_info
+        self.data_type = data_type
+        self.cube = cube
+
+
+class ChartQueryService:
+    """
+    使用方式：
+        service = ChartQueryService('input/All_Chart_Information.xlsx', 'input/raw_charts')
+        service.query_oob('GroupA', 'Chart1', start='2024-05-01', end='2024-05-07')
+        service.query_cpk('GroupA', 'Chart1')
+        service.query_tool_matching('GroupA', 'Chart1', mode=2)
+    """
+
+    def __init__(self, chart_info_path, raw_data_directory, settings=None,
+                 max_charts=128, max_results=512, quiet=False, refresh_interval=1.0):
+        self.chart_info_path = chart_info_path
+        self.raw_data_directory = raw_data_directory
+        self.settings = {'run_by_tool_median_shift': False, 'by_tool_median_shift_k_threshold': 1.67,
+                         'run_ewma_cusum': False, 'run_subgroup_charts': False, 'run_per_tool_oob': False,
+                         'auto_baseline_changepoint': False, 'history_new_vs_persistent': False}
+        self.settings.update(settings or {})
+        self.max_charts = max_charts
+        self.max_results = max_results
+        self.quiet = quiet
+        self.refresh_interval = refresh_interval
+
+        self.charts = OrderedDict()     # key -> 設定列
+        self.chart_ids = {}             # ChartID -> key
+        self.execution_time = None
+        self.raw_file_index = None
+        self.last_results = OrderedDict()  # key -> 最近一次 OOB 查詢結果
+        self._chart_data = OrderedDict()   # LRU: key -> _ChartData
+        self._memo = OrderedDict()         # LRU: (查詢種類, key, 參數, 資料簽章) -> 結果
+        self._workbook_sig = None
+        self._raw_dir_sig = None
+        self._last_refresh = 0.0
+        self._tool_matching = ToolMatchingStats()
+        self._history_lookup = None        # 'history_new_vs_persistent' 開啟時才讀入
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    # === 設定檔 / 原始檔 ===
+    def _quiet_context(self):
+        # 分析函式會大量 print；服務模式下預設不輸出
+        return contextlib.redirect_stdout(io.StringIO()) if self.quiet else contextlib.nullcontext()
+
+    def refresh(self, force=False):
+        """設定檔或原始資料目錄有變動時重新載入（最多每 refresh_interval 秒檢查一次）"""
+        now = time.monotonic()
+        if not force and self.charts and now - self._last_refresh < self.refresh_interval:
+            return
+        self._last_refresh = now
+
+        workbook_sig = file_source_signature(self.chart_info_path)
+        if force or workbook_sig != self._workbook_sig or not self.charts:
+            with self._quiet_context():
+                all_charts_info = oob.load_chart_information(self.chart_info_path)
+                self.execution_time = oob.load_execution_time(self.chart_info_path)
+            self.charts.clear()
+            self.chart_ids.clear()
+            for _, row in all_charts_info.iterrows():
+                key = f"{row['GroupName']}_{row['ChartName']}"
+                self.charts.setdefault(key, row)
+                chart_id = str(row.get('ChartID', '')).strip()
+                if chart_id.endswith('.0'):
+                    chart_id = chart_id[:-2]
+                self.chart_ids.setdefault(chart_id, key)
+            self._workbook_sig = workbook_sig
+            self._chart_data.clear()
+            self._memo.clear()
+            print(f"[Info] 查詢服務載入 {len(self.charts)} 張 chart")
+
+        # 新增 / 刪除檔案會改變目錄的 mtime
+        raw_dir_sig = file_source_signature(self.raw_data_directory)
+        if force or raw_dir_sig != self._raw_dir_sig or self.raw_file_index is None:
+            self.raw_file_index = oob.build_raw_file_index(self.raw_data_directory)
+            self._raw_dir_sig = raw_dir_sig
+
+    def resolve_chart(self, group=None, chart=None, chart_id=None):
+        """以 GroupName + ChartName 或 ChartID 找出 chart key"""
+        with self._lock:
+            self.refresh()
+            if chart_id:
+                key = self.chart_ids.get(str(chart_id).strip())
+                if key is None:
+                    raise KeyError(f"找不到 ChartID: {chart_id}")
+                return key
+            if not chart:
+                raise ValueError("需要 chart (及 group) 或 chart_id")
+            if group:
+                key = f"{group}_{chart}"
+                if key not in self.charts:
+                    raise KeyError(f"找不到 chart: {group}/{chart}")
+                return key
+            matches = [key for key, row in self.charts.items() if str(row['ChartName']) == str(chart)]
+            if len(matches) != 1:
+                raise KeyError(f"找不到 chart 或 ChartName 不唯一: {chart}")
+            return matches[0]
+
+    def chart_data(self, key):
+        """取得 chart 的原始 / 前處理後資料（LRU 快取，原始檔變動時重新讀取）"""
+        with self._lock:
+            row = self.charts[key]
+            filepath = oob.find_matching_file_from_index(self.raw_file_index, row['GroupName'], row['ChartName'])
+            signature = file_source_signature(filepath)
+            if signature is None:
+                raise FileNotFoundError(f"找不到 {row['GroupName']}/{row['ChartName']} 的原始資料")
+            signature = tuple(signature)
+
+            data = self._chart_data.get(key)
+            if data is not None and data.signature == signature and data.filepath == filepath:
+                self._chart_data.move_to_end(key)
+                return data
+
+            with self._quiet_context():
+                raw_df = pd.read_csv(filepath)
+                base_df = raw_df.copy()
+                if 'point_time' in base_df.columns:
+                    base_df['point_time'] = pd.to_datetime(base_df['point_time'], errors='coerce')
+                    base_df.dropna(subset=['point_time'], inplace=True)
+                is_successful, processed_df, chart_info = oob.preprocess_data(row.copy(), base_df)
+                if not is_successful or processed_df is None or processed_df.empty:
+                    processed_df, chart_info, data_type = None, row.copy(), None
+                else:
+                    data_type = oob.determine_data_type(processed_df['point_val'].dropna())
+                # 讀入時一併建立 / 讀回每日彙總 cube（以原始檔指紋持久化）
+                try:
+                    cube = load_daily_cube(filepath, base_df)
+                except Exception as e:
+                    print(f"[Warning] {key} daily cube 建立失敗: {e}")
+                    cube = None
+
+            data = _ChartData(signature, filepath, compact_chart_frame(raw_df), compact_chart_frame(processed_df),
+                              chart_info, data_type, cube)
+            self._chart_data[key] = data
+            while len(self._chart_data) > self.max_charts:
+                self._chart_data.popitem(last=False)
+            return data
+
+    def preload(self, limit=None):
+        """預先讀入 chart 資料（最多 max_charts 張）"""
+        with self._lock:
+            self.refresh(force=True)
+            keys = list(self.charts)[:min(limit or self.max_charts, self.max_charts)]
+        start = time.time()
+        loaded = 0
+        for key in keys:
+            try:
+                self.chart_data(key)
+                loaded += 1
+            except Exception as e:
+                print(f"[Warning] 預先載入 {key} 失敗: {e}")
+        print(f"[Info] 預先載入 {loaded} 張 chart，耗時 {time.time() - start:.1f} 秒")
+
+    def _memoized(self, memo_key, compute):
+        # 計算也在 lock 內進行：分析函式共用全域狀態 (stdout / matplotlib)，同時只算一張
+        with self._lock:
+            if memo_key in self._memo:
+                self._memo.move_to_end(memo_key)
+                self.hits += 1
+                return self._memo[memo_key]
+            self.misses += 1
+            value = compute()
+            self._memo[memo_key] = value
+            while len(self._memo) > self.max_results:
+                self._memo.popitem(last=False)
+            return value
+
+    # === 查詢 ===
+    def query_oob(self, group=None, chart=None, chart_id=None, start=None, end=None):
+        """單張 chart 的 OOB / WE / Cpk 結果；start / end 指定週期範圍（只給 end 時往前 7 天）"""
+        key = self.resolve_chart(group, chart, chart_id)
+        weekly_start = _parse_date(start)
+        weekly_end = _parse_date(end, end_of_day=True)
+        if weekly_start is not None and weekly_end is None:
+            raise ValueError("指定 start 時也需要 end")
+        if weekly_end is not None and weekly_start is None:
+            weekly_start = weekly_end.normalize() - pd.Timedelta(days=6)
+        data = self.chart_data(key)
+        memo_key = ('oob', key, weekly_start, weekly_end, self.execution_time, data.signature,
+                    tuple(sorted(self.settings.items())))
+        result = self._memoized(memo_key, lambda: self._compute_oob(key, data, weekly_start, weekly_end))
+        with self._lock:
+            self.last_results[key] = result
+            self.last_results.move_to_end(key)
+            while len(self.last_results) > self.max_results:
+                self.last_results.popitem(last=False)
+        return result
+
+    def _compute_oob(self, key, data, weekly_start, weekly_end):
+        if data.processed_df is None:
+            return {'chart': key, 'status': 'skipped', 'reason': '預處理失敗或資料為空'}
+
+        raw_df = expand_chart_frame(data.processed_df)
+        chart_info = data.chart_info.copy()
+        chart_info['rule_list'] = list(chart_info.we_rules)  # chart_info 為 preprocess_data 回傳的 ChartInfo
+        chart_info['data_type'] = data.data_type
+        chart_info['by_tool_median_shift_k_threshold'] = self.settings.get('by_tool_median_shift_k_threshold', 1.67)
+        chart_info['run_by_tool_median_shift'] = self.settings.get('run_by_tool_median_shift', False)
+        chart_info['run_ewma_cusum'] = self.settings.get('run_ewma_cusum', False)
+        chart_info['run_subgroup_charts'] = self.settings.get('run_subgroup_charts', False)
+        chart_info['run_per_tool_oob'] = self.settings.get('run_per_tool_oob', False)
+        chart_info['auto_baseline_changepoint'] = self.settings.get('auto_baseline_changepoint', False)
+
+        with self._quiet_context():
+            window = oob.resolve_analysis_window(raw_df, self.execution_time, weekly_start, weekly_end)
+            if window is None:
+                return {'chart': key, 'status': 'skipped', 'reason': '無法決定週期時間範圍'}
+            weekly_start_date, weekly_end_date, baseline_start_date, baseline_end_date = window
+
+            if data.data_type == 'discrete':
+                result = oob.SPCApp._process_discrete_chart(raw_df, chart_info, weekly_start_date, weekly_end_date,
+                                                            baseline_start_date, baseline_end_date)
+            else:
+                result = oob.process_single_chart(chart_info.copy(), raw_df, baseline_start_date,
+                                                  baseline_end_date, weekly_start_date, weekly_end_date)
+                if result:
+                    result['data_type'] = 'continuous'
+            if result is None:
+                return {'chart': key, 'status': 'skipped', 'reason': '分析無結果'}
+
+            result['violated_rules'] = oob.compute_violated_rules(raw_df, chart_info, weekly_start_date, weekly_end_date)
+            weekly_data = raw_df[(raw_df['point_time'] >= weekly_start_date) & (raw_df['point_time'] <= weekly_end_date)]
+            cpk_result = oob.calculate_cpk(weekly_data, chart_info)
+            result['Cpk'] = cpk_result.get('Cpk', np.nan) if cpk_result else np.nan
+            result['Ppk'] = cpk_result.get('Ppk', np.nan) if cpk_result else np.nan
+            history = self.history_lookup() if self.settings.get('history_new_vs_persistent', False) else None
+            oob.SPCApp.build_result(result, 'N/A', 'N/A', history=history, week=week_key(weekly_end_date))
+
+        for field in ('chart_path', 'weekly_chart_path'):
+            result.pop(field, None)
+        result.update({
+            'chart': key, 'status': 'processed',
+            'weekly_start_date': weekly_start_date, 'weekly_end_date': weekly_end_date,
+            'baseline_start_date': baseline_start_date, 'baseline_end_date': baseline_end_date,
+        })
+        return to_json_safe(result)
+
+    def query_cpk(self, group=None, chart=None, chart_id=None, start=None, end=None):
+        """
+        Cpk 分段 (與 SPC Cpk Dashboard 相同)：整段資料的 Cpk，以及區間平分三段的 Current / L1 / L2。
+        未指定 start / end 時取最新資料往前 3 個月。
+        """
+        key = self.resolve_chart(group, chart, chart_id)
+        start_time = _parse_date(start)
+        end_time = _parse_date(end, end_of_day=True)
+        if (start_time is None) != (end_time is None):
+            raise ValueError("start 與 end 需同時指定")
+        data = self.chart_data(key)
+        memo_key = ('cpk', key, start_time, end_time, data.signature)
+        return self._memoized(memo_key, lambda: self._compute_cpk(key, data, start_time, end_time))
+
+    def _compute_cpk(self, key, data, start_time, end_time):
+        row = self.charts[key]
+        with self._quiet_context():
+            cpk_df = filter_spec_limits(expand_chart_frame(data.raw_df), row)
+            overall = dashboard_cpk(cpk_df, row)['Cpk']
+            windows = {'Cpk': None, 'Cpk_last_month': None, 'Cpk_last2_month': None}
+            if 'point_time' in cpk_df.columns and not cpk_df.empty:
+                cpk_df = cpk_df.copy()
+                cpk_df['point_time'] = pd.to_datetime(cpk_df['point_time'])
+                if start_time is None:
+                    end_time = cpk_df['point_time'].max()
+                    start_time = end_time - pd.DateOffset(months=3)
+                windows = compute_cpk_equal_duration_windows(cpk_df, row, start_time, end_time)
+        return to_json_safe({
+            'chart': key, 'Cpk_all': overall,
+            'Cpk_current': windows['Cpk'], 'Cpk_L1': windows['Cpk_last_month'], 'Cpk_L2': windows['Cpk_last2_month'],
+            'start': start_time, 'end': end_time,
+        })
+
+    def query_tool_matching(self, group=None, chart=None, chart_id=None, mode=0, base_date=None, fill_num=5):
+        """Tool matching 統計；mode 0 = 全部資料，1 = 指定基準日，2 = 最新資料（同 Tool Matching 頁面）"""
+        key = self.resolve_chart(group, chart, chart_id)
+        mode = int(mode)
+        if mode not in (0, 1, 2):
+            raise ValueError("mode 需為 0、1 或 2")
+        fill_num = int(fill_num)
+        base = _parse_date(base_date) if mode == 1 else None
+        if mode == 1 and base is None:
+            raise ValueError("mode=1 需要 base_date")
+        data = self.chart_data(key)
+        memo_key = ('tool_matching', key, mode, base, fill_num, data.signature)
+        return self._memoized(memo_key, lambda: self._compute_tool_matching(key, data, mode, base, fill_num))
+
+    def _compute_tool_matching(self, key, data, mode, base_date, fill_num):
+        row = self.charts[key]
+        gname, cname = str(row.get('GroupName', 'Unknown')), str(row.get('ChartName', 'Unknown'))
+        characteristic = str(row.get('Characteristics', 'Nominal'))
+        with self._quiet_context():
+            subdf = prepare_matching_data(expand_chart_frame(data.raw_df), gname, cname, characteristic)
+            records = [] if subdf is None else self._tool_matching.matching_records(
+                subdf, gname, cname, characteristic, mode, base_date, fill_num
+            )
+        return to_json_safe({'chart': key, 'mode': mode, 'groups': records})
+
+    def query_window(self, group=None, chart=None, chart_id=None, start=None, end=None,
+                     by_tool=False, days=None, periods=None):
+        """
+        由 daily cube 組合的區間統計 (count / mean / std / min / max / P5 / P50 / P95)，不讀取原始點；
+        區間以日為單位。指定 days 時改為由 end 往前每 days 天一段、共 periods 段（例如週中位數趨勢）。
+        """
+        key = self.resolve_chart(group, chart, chart_id)
+        start_time, end_time = _parse_date(start), _parse_date(end)
+        by_tool = str(by_tool).lower() in ('1', 'true', 'yes')
+        cube = self.chart_data(key).cube
+        if cube is None:
+            raise ValueError(f"{key} 沒有可用的 daily cube")
+        if days:
+            table = cube.series(end_time, days=int(days), periods=int(periods or 7), by_tool=by_tool)
+        else:
+            table = cube.window(start_time, end_time, by_tool=by_tool)
+        return to_json_safe({'chart': key, 'first_day': cube.first_day, 'last_day': cube.last_day,
+                             'rows': table.to_dict('records')})
+
+    # === 結果歷史 ===
+    def history_lookup(self):
+        with self._lock:
+            if self._history_lookup is None:
+                self._history_lookup = ResultHistory(get_history_path()).load_lookup('oob')
+            return self._history_lookup
+
+    def history_chart_key(self, group=None, chart=None, chart_id=None):
+        """設定檔中的 chart → 結果歷史的 chart 鍵（ChartID，沒有時為 GroupName_ChartName）"""
+        if group is None and chart is None and chart_id is None:
+            return None
+        key = self.resolve_chart(group, chart, chart_id)
+        return chart_key_of(self.charts[key])
+
+    def query_history(self, path, params, chart_args):
+        history = ResultHistory(get_history_path())
+        tool = params.get('tool', 'oob')
+        if path == '/history':
+            chart_key = self.history_chart_key(**chart_args)
+            if chart_key is None:
+                raise ValueError("需要指定 group / chart 或 chart_id")
+            table = history.chart_history(chart_key, tool, expand=True)
+        elif path == '/history/streaks':
+            table = history.streaks(tool, week=params.get('week'), rule=params.get('rule'),
+                                    min_weeks=int(params.get('min_weeks', 1)))
+        elif path == '/history/first_seen':
+            table = history.first_seen(tool, rule=params.get('rule'), chart_key=self.history_chart_key(**chart_args))
+        elif path == '/history/flapping':
+            table = history.flapping_rules(tool, last_weeks=int(params.get('last_weeks', 8)),
+                                           min_changes=int(params.get('min_changes', 3)))
+        else:
+            raise KeyError(f"未知的路徑: {path}")
+        return to_json_safe(table.to_dict('records'))
+
+    def list_charts(self):
+        with self._lock:
+            self.refresh()
+            return [{'key': key, 'GroupName': row['GroupName'], 'ChartName': row['ChartName'],
+                     'ChartID': row.get('ChartID'), 'cached': key in self._chart_data}
+                    for key, row in self.charts.items()]
+
+    def health(self):
+        with self._lock:
+            return {'charts': len(self.charts), 'cached_charts': len(self._chart_data),
+                    'cached_results': len(self._memo), 'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._chart_data.clear()
+            self._memo.clear()
+            self.last_results.clear()
+            self._history_lookup = None
+            self.refresh(force=True)
+
+    # === HTTP 分派 ===
+    def handle(self, path, params):
+        """回傳 (HTTP status, JSON payload)"""
+        chart_args = {name: params.get(name) for name in ('group', 'chart', 'chart_id')}
+        start = time.perf_counter()
+        try:
+            if path == '/health':
+                payload = self.health()
+            elif path == '/charts':
+                payload = self.list_charts()
+            elif path == '/oob':
+                payload = self.query_oob(start=params.get('start'), end=params.get('end'), **chart_args)
+            elif path == '/cpk':
+                payload = self.query_cpk(start=params.get('start'), end=params.get('end'), **chart_args)
+            elif path == '/tool_matching':
+                payload = self.query_tool_matching(mode=params.get('mode', 0), base_date=params.get('base_date'),
+                                                   fill_num=params.get('fill_num', 5), **chart_args)
+            elif path == '/window':
+                payload = self.query_window(start=params.get('start'), end=params.get('end'),
+                                            by_tool=params.get('by_tool', False), days=params.get('days'),
+                                            periods=params.get('periods'), **chart_args)
+            elif path == '/results':
+                with self._lock:
+                    payload = list(self.last_results.values())
+            elif path.startswith('/history'):
+                payload = self.query_history(path, params, chart_args)
+            elif path == '/reload':
+                self.clear()
+                payload = self.health()
+            else:
+                return 404, {'error': f"未知的路徑: {path}"}
+        except (KeyError, FileNotFoundError) as e:
+            return 404, {'error': str(e).strip("'\"")}
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            traceback.print_exc()
+            return 500, {'error': str(e)}
+        return 200, {'elapsed_ms': round((time.perf_counter() - start) * 1000, 2), 'data': payload}
+
+
+class _QueryRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = {name: values[-1] for name, values in parse_qs(parsed.query).items()}
+        status, payload = self.server.query_service.handle(parsed.path.rstrip('/') or '/', params)
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.query_service.quiet:
+            print(f"[Info] query {self.address_string()} {format % args}")
+
+
+def start_query_server(service, host='127.0.0.1', port=DEFAULT_PORT):
+    """在背景執行緒啟動 HTTP 服務，回傳 server（呼叫 server.shutdown() 停止）"""
+    server = ThreadingHTTPServer((host, port), _QueryRequestHandler)
+    server.daemon_threads = True
+    server.query_service = service
+    thread = threading.Thread(target=server.serve_forever, name='chart-query-service', daemon=True)
+    thread.start()
+    print(f"[Info] Chart 查詢服務啟動: http://{host}:{server.server_address[1]}/")
+    return server
+
+
+def query_chart_service(endpoint, host='127.0.0.1', port=DEFAULT_PORT, timeout=30, **params):
+    """script 用的簡易 client：query_chart_service('oob', group='G', chart='C')"""
+    params = {name: value for name, value in params.items() if value is not None}
+    url = f"http://{host}:{port}/{endpoint.strip('/')}"
+    if params:
+        url += '?' + urlencode(params)
+    try:
+        with urlopen(url, timeout=timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except HTTPError as e:
+        return json.loads(e.read().decode('utf-8'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warm per-chart OOB / Cpk / tool matching query service")
+    parser.add_argument('--chart-info', default=oob.resource_path('input/All_Chart_Information.xlsx'))
+    parser.add_argument('--raw-dir', default=oob.resource_path('input/raw_charts/'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--settings', help="JSON 檔，覆寫 OOB 設定 (例如 run_by_tool_median_shift)")
+    parser.add_argument('--max-charts', type=int, default=128, help="記憶體中保留的 chart 資料數量")
+    parser.add_argument('--preload', action='store_true', help="啟動時預先讀入 chart 資料")
+    parser.add_argument('--verbose', action='store_true', help="輸出分析過程訊息")
+    args = parser.parse_args(argv)
+
+    settings = {}
+    if args.settings:
+        with open(args.settings, 'r', encoding='utf-8') as f:
+            settings = json.load(f)
+    service = ChartQueryService(args.chart_info, args.raw_dir, settings=settings,
+                                max_charts=args.max_charts, quiet=not args.verbose)
+    if args.preload:
+        service.preload()
+    server = start_query_server(service, args.host, args.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("[Info] 停止查詢服務")
+    finally:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
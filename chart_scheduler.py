@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Chart 處理順序排程：依風險優先順序處理 chart，讓工程師在整批跑完前就能先看到最嚴重的結果。
+
+排序模式：
+- workbook            ：設定檔順序（原本行為）
+- recent_data         ：原始資料檔最新的優先（以檔案修改時間判斷，不需讀檔）
+- previous_highlight  ：上一次執行中違規最多的 chart 優先（來自本次 session 的結果或上次的 checkpoint journal）
+- chart_id_list       ：指定的 ChartID 清單優先，依清單順序；其餘依設定檔順序
+
+另提供多機分片 (shard) 的 chart 分配：以 GroupName/ChartName 的穩定雜湊決定 chart 屬於第幾片，
+同一張 chart 在任何機器、任何執行次數都會分到同一片。
+"""
+import os
+import re
+import json
+import hashlib
+
+import pandas as pd
+
+PRIORITY_MODES = ('workbook', 'recent_data', 'previous_highlight', 'chart_id_list')
+
+
+def parse_chart_id_list(text):
+    """將逗號 / 分號 / 空白 / 換行分隔的 ChartID 字串轉為清單（保留順序、去除重複）"""
+    if not text:
+        return []
+    ids = []
+    for token in re.split(r'[,;\s]+', str(text)):
+        token = token.strip()
+        if token and token not in ids:
+            ids.append(token)
+    return ids
+
+
+def _normalize_chart_id(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ''
+    text = str(value).strip()
+    # Excel 讀入的整數 ChartID 可能變成 12345.0
+    return text[:-2] if text.endswith('.0') else text
+
+
+def highlight_score(record):
+    """違規嚴重度：OOB 規則數 x 10 + WE 規則數 + 有 OOC 時 +1"""
+    def rule_count(value):
+        if not value or value == 'N/A' or (isinstance(value, float) and pd.isna(value)):
+            return 0
+        return len([r for r in str(value).split(',') if r.strip()])
+
+    score = rule_count(record.get('OOB_Rule')) * 10 + rule_count(record.get('WE_Rule'))
+    try:
+        if float(record.get('ooc_cnt', 0) or 0) > 0:
+            score += 1
+    except (TypeError, ValueError):
+        pass
+    if record.get('HL_record_high_low') == 'HIGHLIGHT':
+        score += 1
+    return score
+
+
+def _result_chart_key(record):
+    return f"{record.get('group_name', 'N/A')}_{record.get('chart_name', 'N/A')}"
+
+
+def collect_highlight_scores(previous_results=None, journal_path=None):
+    """
+    取得上一次執行的違規分數 {GroupName_ChartName: score}。
+    優先使用本次 session 仍在記憶體中的結果；沒有時讀取上次的 checkpoint journal（不檢查 fingerprint）。
+    """
+    scores = {}
+    for record in previous_results or []:
+        scores[_result_chart_key(record)] = highlight_score(record)
+    if scores or not journal_path or not os.path.exists(journal_path):
+        return scores
+
+    try:
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if item.get('type') != 'chart' or item.get('status') != 'processed':
+                    continue
+                record = item.get('record') or {}
+                scores[_result_chart_key(record)] = highlight_score(record)
+    except OSError as e:
+        print(f"[Warning] 無法讀取上次的 checkpoint journal: {e}")
+    return scores
+
+
+def schedule_charts(all_charts_info, mode='workbook', file_lookup=None, highlight_scores=None, chart_ids=None):
+    """
+    回傳依優先順序排列的 [(設定檔中的位置, chart_info row), ...]。
+    同優先度時維持設定檔順序，位置可作為跨排序模式穩定的 chart 識別。
+    """
+    rows = [(position, row) for position, (_, row) in enumerate(all_charts_info.iterrows())]
+    if mode not in PRIORITY_MODES or mode == 'workbook' or not rows:
+        return rows
+
+    if mode == 'recent_data':
+        def data_time(row):
+            if file_lookup is None:
+                return float('-inf')
+            filepath = file_lookup(row['GroupName'], row['ChartName'])
+            try:
+                return os.path.getmtime(filepath) if filepath else float('-inf')
+            except OSError:
+                return float('-inf')
+        keys = {position: -data_time(row) for position, row in rows}
+
+    elif mode == 'previous_highlight':
+        scores = highlight_scores or {}
+        keys = {position: -scores.get(f"{row['GroupName']}_{row['ChartName']}", 0) for position, row in rows}
+
+    else:  # chart_id_list
+        order = {chart_id: rank for rank, chart_id in enumerate(chart_ids or [])}
+        keys = {position: order.get(_normalize_chart_id(row.get('ChartID')), len(order)) for position, row in rows}
+
+    return sorted(rows, key=lambda item: (keys[item[0]], item[0]))
+
+
+def parse_shard_spec(spec):
+    """'k/n' (1 <= k <= n) 轉為 (k, n)；None / 空字串表示不分片"""
+    if spec is None or spec == '':
+        return None
+    if isinstance(spec, (tuple, list)):
+        k, n = spec
+    else:
+        match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', str(spec))
+        if not match:
+            raise ValueError(f"分片格式錯誤 (應為 k/n，例如 1/4): {spec}")
+        k, n = match.groups()
+    k, n = int(k), int(n)
+    if n < 1 or not 1 <= k <= n:
+        raise ValueError(f"分片編號超出範圍: {k}/{n}")
+    return k, n
+
+
+def shard_index(group_name, chart_name, shard_count):
+    """GroupName/ChartName 的穩定雜湊 (md5) 對應到 1..n；不使用 hash()，因其每個 process 的 seed 不同"""
+    text = f"{str(group_name).strip()}/{str(chart_name).strip()}"
+    digest = hashlib.md5(text.encode('utf-8')).hexdigest()
+    return int(digest, 16) % shard_count + 1
+
+
+def in_shard(row, shard):
+    """設定列是否屬於 shard=(k, n)；shard 為 None 時全部屬於"""
+    if shard is None:
+        return True
+    k, n = shard
+    return shard_index(row.get('GroupName', 'N/A'), row.get('ChartName', 'N/A'), n) == k
+
+
+def summarize_results(results):
+    """
+    部分結果摘要：各類違規 chart 數量與依嚴重度排序的違規清單。
+    results 可為 ChartResult 或 dict。
+    """
+    counts = {'processed': 0, 'ooc': 0, 'we': 0, 'oob': 0}
+    violating = []
+    for record in results:
+        counts['processed'] += 1
+        ooc_cnt = record.get('ooc_cnt', 0) or 0
+        we_rule = record.get('WE_Rule', 'N/A')
+        oob_rule = record.get('OOB_Rule', 'N/A')
+        has_ooc = ooc_cnt > 0
+        has_we = bool(we_rule) and we_rule != 'N/A'
+        has_oob = bool(oob_rule) and oob_rule != 'N/A'
+        counts['ooc'] += int(has_ooc)
+        counts['we'] += int(has_we)
+        counts['oob'] += int(has_oob)
+        if has_ooc or has_we or has_oob:
+            violating.append({
+                'GroupName': record.get('group_name', 'N/A'),
+                'ChartName': record.get('chart_name', 'N/A'),
+                'ChartID': record.get('chart_ID', 'N/A'),
+                'ooc_cnt': ooc_cnt,
+                'WE_Rule': we_rule,
+                'OOB_Rule': oob_rule,
+                'score': highlight_score(record),
+            })
+    violating.sort(key=lambda row: row['score'], reverse=True)
+    return counts, violating
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+精簡 dtype 的 chart 資料 (compact chart frames)
+
+session 中保留的 chart 資料（SPCApp.csv_cache / prepared_cache、查詢服務的 _ChartData）原本每列都是
+Python 字串：GroupName / ChartName / Batch_ID / Matching 各一個 str 物件，point_time 也是字串，每列約 300 bytes。
+保存時改為：
+- 重複的字串欄位 → category（整數 code + 一份不重複值）
+- point_time → datetime64[ns]（原始 CSV 以與分析相同的 pd.to_datetime(errors='coerce') 先轉好）
+- point_val → float32，但只在能還原成完全相同的 float64 時（round(float32, 小數位數) == 原值）；
+  resolution 不允許時保留 float64
+每列約 15~20 bytes。
+
+分析前以 expand_chart_frame 還原成原本的 dtype（object 字串、float64），計算結果與未精簡時逐位元相同；
+expand 產生新的 DataFrame，可取代原本取用快取時的 .copy()。
+"""
+import numpy as np
+import pandas as pd
+
+COMPACT_TEXT_COLUMNS = ('GroupName', 'ChartName', 'Batch_ID', 'Matching', 'ByTool')
+COMPACT_VALUE_COLUMN = 'point_val'
+COMPACT_MAX_DECIMALS = 8
+COMPACT_CATEGORY_RATIO = 0.5   # 不重複值超過列數的一半（例如每列不同的 Batch_ID）時不轉 category
+_DECIMALS_ATTR = 'compact_decimals'
+_CATEGORY_ATTR = 'compact_categories'
+
+
+def float32_decimals(values):
+    """
+    float32 + 四捨五入到 d 位小數可完全還原 values (float64) 時回傳最小的 d，否則 None。
+    先以前 256 個值找候選 d，再整欄驗證。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return None
+    finite = np.isfinite(values)
+    if not finite.all() and not np.isnan(values[~finite]).all():
+        return None  # inf 不處理
+
+    def restores(sample, decimals):
+        restored = np.round(sample.astype(np.float32).astype(np.float64), decimals)
+        return np.array_equal(restored, sample, equal_nan=True)
+
+    head = values[:256]
+    for decimals in range(COMPACT_MAX_DECIMALS + 1):
+        if restores(head, decimals):
+            return decimals if restores(values, decimals) else None
+    return None
+
+
+def compact_chart_frame(df, parse_time=True):
+    """
+    回傳精簡 dtype 的新 DataFrame（欄位與列順序不變）。
+    parse_time：point_time 為字串時以 pd.to_datetime(errors='coerce') 轉成 datetime64。
+    """
+    if df is None:
+        return None
+    data = {}
+    categories = []
+    decimals = None
+    for name in df.columns:
+        column = df[name]
+        if name in COMPACT_TEXT_COLUMNS and column.dtype == object \
+                and column.nunique(dropna=True) <= max(COMPACT_CATEGORY_RATIO * len(column), 1):
+            column = column.astype('category')
+            categories.append(name)
+        elif name == 'point_time' and parse_time and not pd.api.types.is_datetime64_any_dtype(column):
+            column = pd.to_datetime(column, errors='coerce')
+        elif name == COMPACT_VALUE_COLUMN and column.dtype == np.float64:
+            decimals = float32_decimals(column.to_numpy())
+            if decimals is not None:
+                column = column.astype(np.float32)
+        data[name] = column
+    compact = pd.DataFrame(data, index=df.index, columns=df.columns)
+    compact.attrs[_DECIMALS_ATTR] = decimals
+    compact.attrs[_CATEGORY_ATTR] = tuple(categories)
+    return compact
+
+
+def expand_chart_frame(df):
+    """compact_chart_frame 的還原：category → object 字串、float32 → 原本的 float64；一律回傳新的 DataFrame"""
+    if df is None:
+        return None
+    categories = df.attrs.get(_CATEGORY_ATTR, ())
+    decimals = df.attrs.get(_DECIMALS_ATTR)
+    expanded = df.copy()
+    for name in categories:
+        if name in expanded.columns:
+            expanded[name] = expanded[name].astype(object)
+    if decimals is not None and COMPACT_VALUE_COLUMN in expanded.columns:
+        values = expanded[COMPACT_VALUE_COLUMN].to_numpy(dtype=np.float64)
+        expanded[COMPACT_VALUE_COLUMN] = np.round(values, decimals)
+    expanded.attrs = {}
+    return expanded
+
+
+def frame_bytes_per_row(df):
+    """每列佔用的記憶體（含字串物件）"""
+    if df is None or len(df) == 0:
+        return 0.0
+    return float(df.memory_usage(deep=True, index=False).sum()) / len(df)
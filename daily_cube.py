@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+每張 chart 的每日彙總 (daily aggregate cube)
+
+原始 CSV 讀入時建立一次，以 (日期, 機台) 為單位保存：
+    count、sum、sum of squares（減去 shift 後再累計，避免大數相減的精度損失）、min、max、quantile sketch
+quantile sketch：該格點數 <= CUBE_SKETCH_SIZE 時保存全部排序後的值（權重 1，分位數與 np.percentile 相同），
+否則保存 CUBE_SKETCH_SIZE 個等間隔的順序統計量，權重為 點數 / CUBE_SKETCH_SIZE（近似值）。
+
+結果以原始檔指紋為鍵存入磁碟快取 (cache/results/daily_cube)，檔案未變動時直接讀回；
+任意日期區間 / 機台的 count、mean、std、min、max、分位數都由 cube 組合，不再讀取原始點。
+時間窗以「日」為單位：start / end 所在的日期整天列入。
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from result_cache import ResultCache, file_fingerprint
+
+CUBE_SKETCH_SIZE = 32
+DAILY_CUBE_VERSION = 1
+CUBE_TOOL_COLUMNS = ('Matching', 'ByTool')  # 與 Tool Matching 相同的機台欄位（新版 / 舊版）
+CUBE_DEFAULT_TOOL = 'Unknown'
+CUBE_QUANTILES = (5, 50, 95)
+WINDOW_COLUMNS = ['count', 'mean', 'std', 'min', 'max']
+
+
+def _to_day(values):
+    """時間 → 自 1970-01-01 起的日數 (int64)"""
+    return pd.to_datetime(values).to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+
+class DailyCube:
+    """
+    cells 依 (day, tool) 排序；sketch_offsets[i]:sketch_offsets[i + 1] 為第 i 格的 sketch。
+    day 為自 1970-01-01 起的日數，tool 為 tools 清單的索引。
+    """
+    __slots__ = ('tools', 'shift', 'day', 'tool', 'count', 'sum', 'sumsq', 'min', 'max',
+                 'sketch_offsets', 'sketch_values', 'sketch_weights')
+
+    def __init__(self, tools, shift, day, tool, count, sum, sumsq, min, max,
+                 sketch_offsets, sketch_values, sketch_weights):
+        self.tools = list(tools)
+        self.shift = float(shift)
+        self.day = day
+        self.tool = tool
+        self.count = count
+        self.sum = sum
+        self.sumsq = sumsq
+        self.min = min
+        self.max = max
+        self.sketch_offsets = sketch_offsets
+        self.sketch_values = sketch_values
+        self.sketch_weights = sketch_weights
+
+    def __len__(self):
+        return len(self.day)
+
+    @property
+    def first_day(self):
+        return pd.Timestamp(np.datetime64(int(self.day.min()), 'D')) if len(self.day) else None
+
+    @property
+    def last_day(self):
+        return pd.Timestamp(np.datetime64(int(self.day.max()), 'D')) if len(self.day) else None
+
+    # === 建立 ===
+    @classmethod
+    def build(cls, raw_df, time_column='point_time', value_column='point_val', tool_column=None):
+        """由原始資料建立；時間或數值無效的點不列入"""
+        if tool_column is None:
+            tool_column = next((col for col in CUBE_TOOL_COLUMNS if col in raw_df.columns), None)
+        times = pd.to_datetime(raw_df[time_column], errors='coerce')
+        values = pd.to_numeric(raw_df[value_column], errors='coerce').to_numpy(dtype=float)
+        valid = times.notna().to_numpy() & ~np.isnan(values)
+        if tool_column is not None:
+            tool_codes, tools = pd.factorize(raw_df[tool_column].fillna(CUBE_DEFAULT_TOOL).astype(str))
+        else:
+            tool_codes, tools = np.zeros(len(raw_df), dtype=np.int64), pd.Index([CUBE_DEFAULT_TOOL])
+        days = _to_day(times[valid]) if valid.any() else np.zeros(0, dtype=np.int64)
+        values, tool_codes = values[valid], tool_codes[valid]
+        shift = float(np.median(values)) if len(values) else 0.0
+
+        # 一次排序：(day, tool, value)，同一格的值連續且由小到大
+        order = np.lexsort((values, tool_codes, days))
+        days, tool_codes, values = days[order], tool_codes[order], values[order]
+        boundary = np.ones(len(values), dtype=bool)
+        boundary[1:] = (days[1:] != days[:-1]) | (tool_codes[1:] != tool_codes[:-1])
+        starts = np.flatnonzero(boundary)
+        counts = np.diff(np.append(starts, len(values)))
+        shifted = values - shift
+        if len(values):
+            sums = np.add.reduceat(shifted, starts)
+            sumsqs = np.add.reduceat(shifted * shifted, starts)
+        else:
+            sums = sumsqs = np.zeros(0)
+
+        # sketch：每格 min(n, CUBE_SKETCH_SIZE) 個順序統計量
+        sizes = np.minimum(counts, CUBE_SKETCH_SIZE)
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        cell = np.repeat(np.arange(len(counts)), sizes)
+        rank = np.arange(offsets[-1]) - offsets[:-1][cell]
+        n = counts[cell]
+        position = np.where(n <= CUBE_SKETCH_SIZE, rank,
+                            np.floor((rank + 0.5) * n / CUBE_SKETCH_SIZE).astype(np.int64))
+        sketch_values = values[starts[cell] + position]
+        sketch_weights = np.where(n <= CUBE_SKETCH_SIZE, 1.0, n / CUBE_SKETCH_SIZE)
+
+        return cls(tools, shift, days[starts], tool_codes[starts].astype(np.int32), counts.astype(np.int64),
+                   sums, sumsqs, values[starts] if len(values) else np.zeros(0),
+                   values[starts + counts - 1] if len(values) else np.zeros(0),
+                   offsets.astype(np.int64), sketch_values, sketch_weights)
+
+    # === 查詢 ===
+    def _select(self, start=None, end=None, tools=None):
+        mask = np.ones(len(self.day), dtype=bool)
+        if start is not None:
+            mask &= self.day >= _to_day([start])[0]
+        if end is not None:
+            mask &= self.day <= _to_day([end])[0]
+        if tools is not None:
+            codes = [self.tools.index(str(t)) for t in tools if str(t) in self.tools]
+            mask &= np.isin(self.tool, codes)
+        return np.flatnonzero(mask)
+
+    def _sketch(self, cells):
+        sizes = self.sketch_offsets[cells + 1] - self.sketch_offsets[cells]
+        index = np.repeat(self.sketch_offsets[cells] - np.cumsum(np.append(0, sizes[:-1])), sizes) + np.arange(sizes.sum())
+        return self.sketch_values[index], self.sketch_weights[index]
+
+    def _summarize(self, cells, quantiles):
+        count = int(self.count[cells].sum())
+        row = {'count': count}
+        if count == 0:
+            row.update({col: np.nan for col in WINDOW_COLUMNS[1:]})
+            row.update({f'P{q:g}': np.nan for q in quantiles})
+            return row
+        total, total_sq = self.sum[cells].sum(), self.sumsq[cells].sum()
+        row['mean'] = self.shift + total / count
+        row['std'] = float(np.sqrt(max(total_sq - total * total / count, 0.0) / (count - 1))) if count > 1 else np.nan
+        row['min'] = float(self.min[cells].min())
+        row['max'] = float(self.max[cells].max())
+        values, weights = self._sketch(cells)
+        for q, value in zip(quantiles, weighted_percentiles(values, weights, quantiles)):
+            row[f'P{q:g}'] = value
+        return row
+
+    def window(self, start=None, end=None, tools=None, by_tool=False, quantiles=CUBE_QUANTILES):
+        """
+        [start, end] 日期區間（整天）的統計；by_tool=True 時每個機台一列。
+        回傳 DataFrame：(tool,) count, mean, std, min, max, P05/P50/P95...
+        """
+        cells = self._select(start, end, tools)
+        if not by_tool:
+            return pd.DataFrame([self._summarize(cells, quantiles)])
+        rows = []
+        cell_tools = self.tool[cells]
+        for code in np.unique(cell_tools):
+            rows.append({'tool': self.tools[code], **self._summarize(cells[cell_tools == code], quantiles)})
+        return pd.DataFrame(rows, columns=['tool', *WINDOW_COLUMNS, *[f'P{q:g}' for q in quantiles]])
+
+    def series(self, end=None, days=7, periods=7, tools=None, by_tool=False, quantiles=CUBE_QUANTILES):
+        """
+        由 end 往前每 days 天一段、共 periods 段的統計（例如週中位數趨勢：days=7, periods=7）。
+        period 0 為最近一段；回傳欄位 period, start, end, (tool,) 統計。
+        """
+        end_day = _to_day([end])[0] if end is not None else (int(self.day.max()) if len(self.day) else 0)
+        rows = []
+        for period in range(periods):
+            last = end_day - period * days
+            first = last - days + 1
+            start_ts = pd.Timestamp(np.datetime64(int(first), 'D'))
+            end_ts = pd.Timestamp(np.datetime64(int(last), 'D'))
+            frame = self.window(start_ts, end_ts, tools, by_tool, quantiles)
+            frame.insert(0, 'end', end_ts)
+            frame.insert(0, 'start', start_ts)
+            frame.insert(0, 'period', period)
+            rows.append(frame)
+        return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
+
+    def daily(self, start=None, end=None, tools=None):
+        """每日（所有機台合計）的 count / mean / std / min / max，供 summary plot 使用"""
+        cells = self._select(start, end, tools)
+        frame = pd.DataFrame({'day': self.day[cells], 'count': self.count[cells], 'sum': self.sum[cells],
+                              'sumsq': self.sumsq[cells], 'min': self.min[cells], 'max': self.max[cells]})
+        grouped = frame.groupby('day', sort=True).agg(count=('count', 'sum'), sum=('sum', 'sum'), sumsq=('sumsq', 'sum'),
+                                                      min=('min', 'min'), max=('max', 'max'))
+        count = grouped['count'].to_numpy(dtype=float)
+        variance = np.maximum(grouped['sumsq'] - grouped['sum'] ** 2 / count, 0) / np.where(count > 1, count - 1, np.nan)
+        return pd.DataFrame({
+            'date': pd.to_datetime(grouped.index.to_numpy().astype('datetime64[D]')),
+            'count': grouped['count'].to_numpy(),
+            'mean': self.shift + grouped['sum'].to_numpy() / count,
+            'std': np.sqrt(variance.to_numpy()),
+            'min': grouped['min'].to_numpy(),
+            'max': grouped['max'].to_numpy(),
+        })
+
+
+def weighted_percentiles(values, weights, quantiles):
+    """
+    加權分位數：每個值代表 weight 個點，排在其區段的中央；權重皆為 1 時與 np.percentile (linear) 相同。
+    """
+    if len(values) == 0:
+        return [np.nan] * len(quantiles)
+    order = np.argsort(values, kind='stable')
+    values, weights = values[order], weights[order]
+    cumulative = np.cumsum(weights)
+    ranks = cumulative - weights + (weights - 1) / 2.0
+    total = cumulative[-1]
+    return [float(np.interp(q / 100.0 * (total - 1), ranks, values)) for q in quantiles]
+
+
+# === 持久化 ===
+_CUBE_MEMO = {}
+_CUBE_LOCK = threading.Lock()
+_CUBE_CACHE = None
+
+
+def _cube_cache():
+    global _CUBE_CACHE
+    if _CUBE_CACHE is None:
+        _CUBE_CACHE = ResultCache('daily_cube')
+    return _CUBE_CACHE
+
+
+def load_daily_cube(filepath, raw_df=None, use_cache=True):
+    """
+    取得原始檔的 daily cube：同一行程內以 (大小, mtime) 記憶，否則以檔案指紋讀磁碟快取，
+    都沒有時由 raw_df（未提供時讀取 CSV）建立並存入快取。
+    """
+    filepath = str(filepath)
+    memo_key = os.path.abspath(filepath)
+    stat = os.stat(filepath)
+    file_sig = (stat.st_size, stat.st_mtime_ns)
+    if use_cache:
+        with _CUBE_LOCK:
+            memo = _CUBE_MEMO.get(memo_key)
+        if memo is not None and memo[0] == file_sig:
+            return memo[1]
+
+    cache = _cube_cache()
+    cache_key = cache.make_key('daily_cube', DAILY_CUBE_VERSION, CUBE_SKETCH_SIZE, file_fingerprint(filepath))
+    cube = cache.get(cache_key) if use_cache else None
+    if cube is None:
+        cube = DailyCube.build(raw_df if raw_df is not None else pd.read_csv(filepath))
+        if use_cache:
+            cache.put(cache_key, cube)
+    if use_cache:
+        with _CUBE_LOCK:
+            _CUBE_MEMO[memo_key] = (file_sig, cube)
+    return cube
@@ -9,6 +9,8 @@ import os
 import sys
 from difflib import SequenceMatcher
 from translations import tr, get_translator
+from raw_file_index import get_raw_file_index
+from chart_config import read_config_sheet
 
 # ============================================================================
 # 1. Worker Thread (負責邏輯與資料檢查)
@@ -43,17 +45,9 @@ class DataValidatorWorker(QtCore.QThread):
             if not os.path.exists(directory):
                 return None
             
-            # 列出目錄中所有檔案
-            file_path = os.path.join(directory, expected_filename)
-            
-            # 篩選出以指定前綴開頭且以.csv結尾的檔案
-            if os.path.isfile(file_path):
-                return file_path
-            
+            # 目錄索引只建立一次（raw_file_index 依目錄指紋快取）
             # Exact match only; do not fall back to prefix-based matching.
-                # 如果找到多個，選擇第一個（可以根據需要調整排序邏輯）
-            
-            return None
+            return get_raw_file_index(directory).find_file(expected_filename)
             
         except Exception as e:
             print(f"Error searching for exact CSV file: {e}")
@@ -82,7 +76,7 @@ class DataValidatorWorker(QtCore.QThread):
         try:
             # 2. 讀取 Excel
             try:
-                df_info = pd.read_excel(self.excel_path, sheet_name='Chart', engine='openpyxl')
+                df_info = read_config_sheet(self.excel_path, 'Chart')
             except PermissionError:
                 self.emit_log("Unable to Execute", "Excel Load", 
                               f"Permission denied: File is locked or in use", 
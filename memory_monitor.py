@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+記憶體監控：記錄各處理階段 (stage) 與各 chart 的 RSS / tracemalloc 變化，
+統計快取 (csv_cache、result['raw_df']、互動圖 canvas、By Tool canvas) 佔用的記憶體，
+並提供預算守門 (budget guard)：接近上限時警告，超過時由呼叫端釋放可重建的物件。
+
+透過 StageProfiler 的 stage hook 掛入，與計時共用同一組 stage 名稱。
+"""
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+
+try:
+    import psutil  # 可選依賴
+except ImportError:
+    psutil = None
+
+MB = 1024 * 1024
+
+# 結果紀錄中會持有大型物件的欄位 → 歸屬分類
+RESULT_MEMORY_FIELDS = {
+    'raw_df': 'raw_df',
+    'spc_canvas': 'spc_canvas',
+    'weekly_canvas': 'spc_canvas',
+    'by_tool_color_canvas': 'by_tool_canvas',
+    'by_tool_group_canvas': 'by_tool_canvas',
+}
+
+
+def _windows_rss_bytes():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+            ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+            ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t),
+        ]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    handle = ctypes.windll.kernel32.GetCurrentProcess()
+    if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+        return int(counters.WorkingSetSize)
+    return None
+
+
+def process_rss_bytes():
+    """目前行程的 RSS (bytes)；無法取得時回傳 None"""
+    try:
+        if psutil is not None:
+            return int(psutil.Process().memory_info().rss)
+        if sys.platform.startswith('linux'):
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        if sys.platform == 'win32':
+            return _windows_rss_bytes()
+        import resource
+        # macOS 的 ru_maxrss 單位為 bytes（此為峰值，作為近似）
+        return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    except Exception:
+        return None
+
+
+def total_physical_bytes():
+    """實體記憶體總量 (bytes)；無法取得時回傳 None"""
+    try:
+        if psutil is not None:
+            return int(psutil.virtual_memory().total)
+        if hasattr(os, 'sysconf') and 'SC_PHYS_PAGES' in os.sysconf_names:
+            return int(os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE'))
+        if sys.platform == 'win32':
+            import ctypes
+
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                            ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                            ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                            ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                            ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(status)
+            ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+            return int(status.ullTotalPhys)
+    except Exception:
+        pass
+    return None
+
+
+def canvas_nbytes(canvas):
+    """
+    估計 FigureCanvas 佔用的記憶體：Agg 繪圖緩衝區 (寬 x 高 x RGBA) + 各 artist 的資料陣列。
+    """
+    figure = getattr(canvas, 'figure', canvas)
+    try:
+        width, height = figure.bbox.size
+        total = int(width * height * 4)
+        for ax in figure.get_axes():
+            for line in ax.get_lines():
+                total += line.get_xydata().nbytes
+            for collection in ax.collections:
+                offsets = collection.get_offsets()
+                total += getattr(offsets, 'nbytes', 0)
+        return total
+    except Exception:
+        return 0
+
+
+def object_nbytes(obj):
+    """DataFrame 以 memory_usage(deep=True) 計算，canvas 以估計值計算"""
+    if obj is None:
+        return 0
+    if hasattr(obj, 'memory_usage') and hasattr(obj, 'columns'):
+        try:
+            return int(obj.memory_usage(deep=True).sum())
+        except Exception:
+            return 0
+    if hasattr(obj, 'figure') or hasattr(obj, 'get_axes'):
+        return canvas_nbytes(obj)
+    return sys.getsizeof(obj)
+
+
+def attribute_retained_memory(csv_cache=None, results=None):
+    """
+    統計快取與結果紀錄持有的記憶體（同一物件只計一次）。
+    回傳 {分類: {'objects': 數量, 'bytes': 大小}}
+    """
+    seen = set()
+    usage = {}
+
+    def add(category, obj):
+        if obj is None or id(obj) in seen:
+            return
+        seen.add(id(obj))
+        entry = usage.setdefault(category, {'objects': 0, 'bytes': 0})
+        entry['objects'] += 1
+        entry['bytes'] += object_nbytes(obj)
+
+    for df in (csv_cache or {}).values():
+        add('csv_cache', df)
+    for result in results or []:
+        # ChartResult 由 chart store 持有大型物件，只統計目前實際載入的部分
+        held = result.held_objects() if hasattr(result, 'held_objects') else result
+        for field, category in RESULT_MEMORY_FIELDS.items():
+            add(category, held.get(field))
+    return usage
+
+
+class _StageSample:
+    __slots__ = ('rss', 'traced')
+
+
+class MemoryMonitor:
+    """
+    掛在 StageProfiler 上的記憶體 hook：
+        monitor = MemoryMonitor(enabled=True, trace_python=True, budget_mb=4096)
+        PROFILER.add_hook(monitor)
+    """
+
+    def __init__(self, enabled=False, trace_python=False, budget_mb=0, warn_ratio=0.85):
+        self.enabled = enabled
+        self.trace_python = trace_python
+        self.warn_ratio = warn_ratio
+        self.set_budget(budget_mb)
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+        self.reset()
+
+    def set_budget(self, budget_mb):
+        """budget_mb <= 0 時使用實體記憶體的 75%"""
+        if budget_mb and budget_mb > 0:
+            self.budget_bytes = int(budget_mb * MB)
+        else:
+            total = total_physical_bytes()
+            self.budget_bytes = int(total * 0.75) if total else None
+
+    def reset(self, run_name=None):
+        with self._lock:
+            self.run_name = run_name
+            self.run_started = time.time()
+            self.stage_records = {}  # {(chart, stage): {...}}
+            self.chart_peaks = {}    # {chart: peak rss}
+            self.peak_rss = 0
+            self.attribution = {}
+            self.budget_events = []
+        if self.enabled and self.trace_python and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self):
+        if self._started_tracemalloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._started_tracemalloc = False
+
+    # === StageProfiler hook 介面 ===
+    def on_stage_enter(self, stage, chart):
+        if not self.enabled:
+            return None
+        sample = _StageSample()
+        sample.rss = process_rss_bytes()
+        sample.traced = None
+        if tracemalloc.is_tracing():
+            sample.traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        return sample
+
+    def on_stage_exit(self, stage, chart, sample):
+        if sample is None:
+            return
+        rss_after = process_rss_bytes()
+        traced_delta = traced_peak = None
+        if sample.traced is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            traced_delta = current - sample.traced
+            traced_peak = peak - sample.traced
+        with self._lock:
+            record = self.stage_records.setdefault((chart, stage), {
+                'calls': 0, 'rss_delta': 0, 'rss_peak': 0, 'py_alloc_delta': 0, 'py_alloc_peak': 0,
+            })
+            record['calls'] += 1
+            if rss_after is not None and sample.rss is not None:
+                record['rss_delta'] += rss_after - sample.rss
+                record['rss_peak'] = max(record['rss_peak'], rss_after)
+                self.peak_rss = max(self.peak_rss, rss_after)
+                self.chart_peaks[chart] = max(self.chart_peaks.get(chart, 0), rss_after)
+            if traced_delta is not None:
+                record['py_alloc_delta'] += traced_delta
+                record['py_alloc_peak'] = max(record['py_alloc_peak'], traced_peak)
+
+    # === 快取歸屬與預算 ===
+    def update_attribution(self, csv_cache=None, results=None):
+        self.attribution = attribute_retained_memory(csv_cache, results)
+        return self.attribution
+
+    def check_budget(self, context=''):
+        """
+        回傳 'ok' / 'warn' / 'over'。
+        超過 warn_ratio 時印出警告，超過預算時由呼叫端負責釋放記憶體。
+        """
+        if not self.enabled or not self.budget_bytes:
+            return 'ok'
+        rss = process_rss_bytes()
+        if rss is None:
+            return 'ok'
+        self.peak_rss = max(self.peak_rss, rss)
+        if rss >= self.budget_bytes:
+            status = 'over'
+        elif rss >= self.budget_bytes * self.warn_ratio:
+            status = 'warn'
+        else:
+            return 'ok'
+        self.budget_events.append({
+            'time': time.strftime('%H:%M:%S'), 'context': context, 'status': status,
+            'rss_mb': rss / MB, 'budget_mb': self.budget_bytes / MB,
+        })
+        print(f"[Warning] 記憶體使用 {rss / MB:.0f} MB / 預算 {self.budget_bytes / MB:.0f} MB ({status}) {context}")
+        return status
+
+    # === 報表 ===
+    def summary(self, top_n=20):
+        stages = {}
+        for (chart, stage), record in self.stage_records.items():
+            entry = stages.setdefault(stage, {'stage': stage, 'charts': 0, 'rss_delta_mb': 0.0,
+                                              'rss_peak_mb': 0.0, 'py_alloc_delta_mb': 0.0,
+                                              'py_alloc_peak_mb': 0.0})
+            entry['charts'] += 1
+            entry['rss_delta_mb'] += record['rss_delta'] / MB
+            entry['rss_peak_mb'] = max(entry['rss_peak_mb'], record['rss_peak'] / MB)
+            entry['py_alloc_delta_mb'] += record['py_alloc_delta'] / MB
+            entry['py_alloc_peak_mb'] = max(entry['py_alloc_peak_mb'], record['py_alloc_peak'] / MB)
+
+        per_chart = {}
+        for (chart, stage), record in self.stage_records.items():
+            entry = per_chart.setdefault(chart, {'chart': chart, 'rss_delta_mb': 0.0, 'py_alloc_delta_mb': 0.0,
+                                                 'rss_peak_mb': self.chart_peaks.get(chart, 0) / MB})
+            entry['rss_delta_mb'] += record['rss_delta'] / MB
+            entry['py_alloc_delta_mb'] += record['py_alloc_delta'] / MB
+        heaviest = sorted(per_chart.values(), key=lambda c: c['rss_delta_mb'], reverse=True)[:top_n]
+
+        return {
+            'run_name': self.run_name,
+            'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.run_started)),
+            'peak_rss_mb': self.peak_rss / MB,
+            'budget_mb': (self.budget_bytes / MB) if self.budget_bytes else None,
+            'tracemalloc': tracemalloc.is_tracing(),
+            'stages': list(stages.values()),
+            'heaviest_charts': heaviest,
+            'retained': [{'category': k, 'objects': v['objects'], 'mb': v['bytes'] / MB}
+                         for k, v in self.attribution.items()],
+            'budget_events': list(self.budget_events),
+        }
+
+    def print_summary(self, top_n=10):
+        report = self.summary(top_n=top_n)
+        print(f"=== Memory profile: peak RSS {report['peak_rss_mb']:.0f} MB ===")
+        for s in report['stages']:
+            print(f"  {s['stage']:<22} rss_delta={s['rss_delta_mb']:8.1f} MB  peak={s['rss_peak_mb']:8.1f} MB  "
+                  f"py_alloc_peak={s['py_alloc_peak_mb']:7.1f} MB")
+        for r in report['retained']:
+            print(f"  [retained] {r['category']:<16} {r['objects']:5d} objects {r['mb']:9.1f} MB")
+        return report
+
+    def write_json(self, path, top_n=50):
+        report = self.summary(top_n=top_n)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=float)
+        return path
+
+    def write_excel(self, path, top_n=50):
+        import pandas as pd
+        report = self.summary(top_n=top_n)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+            pd.DataFrame(report['stages']).to_excel(writer, sheet_name='Memory By Stage', index=False)
+            pd.DataFrame(report['heaviest_charts']).to_excel(writer, sheet_name='Memory By Chart', index=False)
+            pd.DataFrame(report['retained']).to_excel(writer, sheet_name='Retained Memory', index=False)
+            pd.DataFrame(report['budget_events']).to_excel(writer, sheet_name='Budget Events', index=False)
+        return path
+
+
+# 環境變數 OOB_MEMORY_MONITOR=1 可在不改設定的情況下強制開啟
+MEMORY_ENV_ENABLED = os.environ.get('OOB_MEMORY_MONITOR', '0') == '1'
+MEMORY_MONITOR = MemoryMonitor(
+    enabled=MEMORY_ENV_ENABLED,
+    trace_python=os.environ.get('OOB_MEMORY_TRACEMALLOC', '0') == '1',
+)
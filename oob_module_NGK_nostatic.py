@@ -6,12 +6,33 @@ import json
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy.signal import lfilter
+from scipy.special import gammaln
 from datetime import datetime, timedelta
 import traceback
 # CL Tighten Calculator
 from CL_limit_class import CLTightenCalculator
 # Translation System
 from translations import TranslationManager, get_translator, tr
+from result_cache import ResultCache, dataframe_fingerprint, code_version, artifact_signature, file_fingerprint, make_cache_key
+from perf_profiler import PROFILER, PROFILE_ENV_ENABLED
+from memory_monitor import MEMORY_MONITOR, MEMORY_ENV_ENABLED, MB
+from result_store import CANVAS_FIELDS, ChartDataStore, ChartResult, results_to_dataframe
+from run_journal import RunJournal, file_source_signature, directory_signature
+import oob_rule_registry
+from oob_rule_registry import RuleRegistry, RuleContext, RuleStageCache
+from raw_file_index import get_raw_file_index
+import chart_config
+from chart_config import CHARACTERISTIC_MAP, as_chart_info, load_config_snapshot, read_config_sheet
+from result_rollup import ROLLUP_COUNT_COLUMNS, material_rollup, material_totals, top_rules
+from result_history import HISTORY_COLUMNS, ResultHistory, get_history_path, week_key
+from threshold_sweep import SWEEP_RULES, threshold_sweep
+from tool_implication import tool_implication_ranking
+import compact_frame
+from compact_frame import compact_chart_frame, expand_chart_frame
+import per_tool_oob
+from per_tool_oob import default_per_tool_oob_result, per_tool_highlight_table, per_tool_oob_result
+from chart_scheduler import PRIORITY_MODES, parse_chart_id_list, collect_highlight_scores, schedule_charts, summarize_results
 # Excel 和圖片處理
 from openpyxl import Workbook
 from openpyxl.drawing.image import Image as OpenpyxlImage
@@ -220,6 +241,22 @@ class OOBSettingsDialog(QtWidgets.QDialog):
         k_threshold_layout.addWidget(self.by_tool_median_shift_k_combo)
         k_threshold_layout.addStretch()
         display_layout.addLayout(k_threshold_layout)
+
+        self.run_ewma_cusum_checkbox = ToggleSwitch(label_text=tr("run_ewma_cusum", "Run EWMA / CUSUM"))
+        self.run_ewma_cusum_checkbox.setChecked(False)
+        display_layout.addWidget(self.run_ewma_cusum_checkbox)
+
+        self.run_subgroup_charts_checkbox = ToggleSwitch(label_text=tr("run_subgroup_charts", "Run X-bar/R, X-bar/S (Batch_ID)"))
+        self.run_subgroup_charts_checkbox.setChecked(False)
+        display_layout.addWidget(self.run_subgroup_charts_checkbox)
+
+        self.run_per_tool_oob_checkbox = ToggleSwitch(label_text=tr("run_per_tool_oob", "Run Per-Tool OOB (Matching)"))
+        self.run_per_tool_oob_checkbox.setChecked(False)
+        display_layout.addWidget(self.run_per_tool_oob_checkbox)
+
+        self.auto_baseline_checkbox = ToggleSwitch(label_text=tr("auto_baseline_changepoint", "Auto Baseline (Change Point)"))
+        self.auto_baseline_checkbox.setChecked(False)
+        display_layout.addWidget(self.auto_baseline_checkbox)
         
         self.interactive_charts_checkbox = ToggleSwitch(label_text=tr("use_interactive_charts"))
         self.interactive_charts_checkbox.setChecked(True)
@@ -228,6 +265,65 @@ class OOBSettingsDialog(QtWidgets.QDialog):
         self.use_batch_id_labels_checkbox = ToggleSwitch(label_text=tr("use_batch_id_labels"))
         self.use_batch_id_labels_checkbox.setChecked(False)
         display_layout.addWidget(self.use_batch_id_labels_checkbox)
+
+        self.use_result_cache_checkbox = ToggleSwitch(label_text=tr("use_result_cache", "Reuse Cached Results"))
+        self.use_result_cache_checkbox.setChecked(True)
+        display_layout.addWidget(self.use_result_cache_checkbox)
+
+        self.stage_profiling_checkbox = ToggleSwitch(label_text=tr("enable_stage_profiling", "Stage Timing Report"))
+        self.stage_profiling_checkbox.setChecked(False)
+        display_layout.addWidget(self.stage_profiling_checkbox)
+
+        self.memory_monitor_checkbox = ToggleSwitch(label_text=tr("enable_memory_monitor", "Memory Monitor / Budget Guard"))
+        self.memory_monitor_checkbox.setChecked(False)
+        display_layout.addWidget(self.memory_monitor_checkbox)
+
+        memory_budget_layout = QHBoxLayout()
+        memory_budget_layout.setSpacing(10)
+        self.memory_budget_label = QLabel(tr("memory_budget_mb", "Memory Budget (MB, 0 = auto):"))
+        self.memory_budget_label.setMaximumWidth(220)
+        self.memory_budget_spin = QtWidgets.QSpinBox()
+        self.memory_budget_spin.setRange(0, 1024 * 1024)
+        self.memory_budget_spin.setSingleStep(512)
+        self.memory_budget_spin.setValue(0)
+        self.memory_budget_spin.setFixedWidth(100)
+        memory_budget_layout.addWidget(self.memory_budget_label)
+        memory_budget_layout.addWidget(self.memory_budget_spin)
+        memory_budget_layout.addStretch()
+        display_layout.addLayout(memory_budget_layout)
+
+        self.resume_checkpoint_checkbox = ToggleSwitch(label_text=tr("resume_from_checkpoint", "Resume From Checkpoint"))
+        self.resume_checkpoint_checkbox.setChecked(False)
+        display_layout.addWidget(self.resume_checkpoint_checkbox)
+
+        self.record_history_checkbox = ToggleSwitch(label_text=tr("record_result_history", "Record Result History"))
+        self.record_history_checkbox.setChecked(True)
+        display_layout.addWidget(self.record_history_checkbox)
+
+        self.history_status_checkbox = ToggleSwitch(label_text=tr("history_new_vs_persistent", "Mark New / Persistent Rules"))
+        self.history_status_checkbox.setChecked(False)
+        display_layout.addWidget(self.history_status_checkbox)
+
+        self.threshold_sweep_checkbox = ToggleSwitch(label_text=tr("export_threshold_sweep", "Export Threshold Sweep"))
+        self.threshold_sweep_checkbox.setChecked(False)
+        display_layout.addWidget(self.threshold_sweep_checkbox)
+
+        priority_layout = QHBoxLayout()
+        priority_layout.setSpacing(10)
+        self.priority_mode_label = QLabel(tr("chart_priority_mode", "Processing Order:"))
+        self.priority_mode_label.setMaximumWidth(220)
+        self.priority_mode_combo = QtWidgets.QComboBox()
+        for mode in PRIORITY_MODES:
+            self.priority_mode_combo.addItem(tr(f"priority_{mode}", mode.replace('_', ' ').title()), mode)
+        self.priority_mode_combo.setFixedWidth(180)
+        self.priority_mode_combo.currentIndexChanged.connect(self._toggle_priority_ids)
+        self.priority_ids_edit = QtWidgets.QLineEdit()
+        self.priority_ids_edit.setPlaceholderText(tr("priority_chart_ids", "ChartID list, e.g. 1001, 1002"))
+        self.priority_ids_edit.setEnabled(False)
+        priority_layout.addWidget(self.priority_mode_label)
+        priority_layout.addWidget(self.priority_mode_combo)
+        priority_layout.addWidget(self.priority_ids_edit)
+        display_layout.addLayout(priority_layout)
         
         main_layout.addWidget(display_group)
         
@@ -362,6 +458,10 @@ class OOBSettingsDialog(QtWidgets.QDialog):
         
         main_layout.addLayout(button_layout)
     
+    def _toggle_priority_ids(self, *_):
+        """ 只有 ChartID 清單模式需要輸入 ChartID """
+        self.priority_ids_edit.setEnabled(self.priority_mode_combo.currentData() == 'chart_id_list')
+
     def _toggle_time_range_controls(self, checked):
         """ 啟用/停用時間範圍控制 """
         self.start_datetime_edit.setEnabled(checked)
@@ -403,8 +503,22 @@ class OOBSettingsDialog(QtWidgets.QDialog):
             'show_by_tool_charts': self.show_by_tool_checkbox.isChecked(),
             'run_by_tool_median_shift': self.run_by_tool_median_shift_checkbox.isChecked(),
             'by_tool_median_shift_k_threshold': float(self.by_tool_median_shift_k_combo.currentText()),
+            'run_ewma_cusum': self.run_ewma_cusum_checkbox.isChecked(),
+            'run_subgroup_charts': self.run_subgroup_charts_checkbox.isChecked(),
+            'run_per_tool_oob': self.run_per_tool_oob_checkbox.isChecked(),
+            'auto_baseline_changepoint': self.auto_baseline_checkbox.isChecked(),
             'use_interactive_charts': self.interactive_charts_checkbox.isChecked(),
             'use_batch_id_labels': self.use_batch_id_labels_checkbox.isChecked(),
+            'use_result_cache': self.use_result_cache_checkbox.isChecked(),
+            'enable_stage_profiling': self.stage_profiling_checkbox.isChecked(),
+            'enable_memory_monitor': self.memory_monitor_checkbox.isChecked(),
+            'memory_budget_mb': self.memory_budget_spin.value(),
+            'resume_from_checkpoint': self.resume_checkpoint_checkbox.isChecked(),
+            'record_result_history': self.record_history_checkbox.isChecked(),
+            'history_new_vs_persistent': self.history_status_checkbox.isChecked(),
+            'export_threshold_sweep': self.threshold_sweep_checkbox.isChecked(),
+            'chart_priority_mode': self.priority_mode_combo.currentData(),
+            'priority_chart_ids': self.priority_ids_edit.text().strip(),
             'custom_time_range_enabled': self.custom_time_range_checkbox.isChecked(),
             'start_time': self.start_datetime_edit.date(),
             'end_time': self.end_datetime_edit.date()
@@ -424,10 +538,40 @@ class OOBSettingsDialog(QtWidgets.QDialog):
                 k_value = k_value[:-2]
             if self.by_tool_median_shift_k_combo.findText(k_value) >= 0:
                 self.by_tool_median_shift_k_combo.setCurrentText(k_value)
+        if 'run_ewma_cusum' in settings:
+            self.run_ewma_cusum_checkbox.setChecked(settings['run_ewma_cusum'])
+        if 'run_subgroup_charts' in settings:
+            self.run_subgroup_charts_checkbox.setChecked(settings['run_subgroup_charts'])
+        if 'run_per_tool_oob' in settings:
+            self.run_per_tool_oob_checkbox.setChecked(settings['run_per_tool_oob'])
+        if 'auto_baseline_changepoint' in settings:
+            self.auto_baseline_checkbox.setChecked(settings['auto_baseline_changepoint'])
         if 'use_interactive_charts' in settings:
             self.interactive_charts_checkbox.setChecked(settings['use_interactive_charts'])
         if 'use_batch_id_labels' in settings:
             self.use_batch_id_labels_checkbox.setChecked(settings['use_batch_id_labels'])
+        if 'use_result_cache' in settings:
+            self.use_result_cache_checkbox.setChecked(settings['use_result_cache'])
+        if 'enable_stage_profiling' in settings:
+            self.stage_profiling_checkbox.setChecked(settings['enable_stage_profiling'])
+        if 'enable_memory_monitor' in settings:
+            self.memory_monitor_checkbox.setChecked(settings['enable_memory_monitor'])
+        if 'memory_budget_mb' in settings:
+            self.memory_budget_spin.setValue(int(settings['memory_budget_mb'] or 0))
+        if 'resume_from_checkpoint' in settings:
+            self.resume_checkpoint_checkbox.setChecked(settings['resume_from_checkpoint'])
+        if 'record_result_history' in settings:
+            self.record_history_checkbox.setChecked(settings['record_result_history'])
+        if 'history_new_vs_persistent' in settings:
+            self.history_status_checkbox.setChecked(settings['history_new_vs_persistent'])
+        if 'export_threshold_sweep' in settings:
+            self.threshold_sweep_checkbox.setChecked(settings['export_threshold_sweep'])
+        if 'chart_priority_mode' in settings:
+            index = self.priority_mode_combo.findData(settings['chart_priority_mode'])
+            if index >= 0:
+                self.priority_mode_combo.setCurrentIndex(index)
+        if 'priority_chart_ids' in settings:
+            self.priority_ids_edit.setText(settings['priority_chart_ids'] or '')
         if 'custom_time_range_enabled' in settings:
             self.custom_time_range_checkbox.setChecked(settings['custom_time_range_enabled'])
         if 'start_time' in settings:
@@ -453,8 +597,24 @@ class OOBSettingsDialog(QtWidgets.QDialog):
         self.show_by_tool_checkbox.setText(tr("show_by_tool_charts"))
         self.run_by_tool_median_shift_checkbox.setText(tr("run_by_tool_median_shift", "Run Tool Median Shift"))
         self.by_tool_median_shift_k_label.setText(tr("by_tool_median_shift_k_threshold", "Tool Median Shift K:"))
+        self.run_ewma_cusum_checkbox.setText(tr("run_ewma_cusum", "Run EWMA / CUSUM"))
+        self.run_subgroup_charts_checkbox.setText(tr("run_subgroup_charts", "Run X-bar/R, X-bar/S (Batch_ID)"))
+        self.run_per_tool_oob_checkbox.setText(tr("run_per_tool_oob", "Run Per-Tool OOB (Matching)"))
+        self.auto_baseline_checkbox.setText(tr("auto_baseline_changepoint", "Auto Baseline (Change Point)"))
         self.interactive_charts_checkbox.setText(tr("use_interactive_charts"))
         self.use_batch_id_labels_checkbox.setText(tr("use_batch_id_labels"))
+        self.use_result_cache_checkbox.setText(tr("use_result_cache", "Reuse Cached Results"))
+        self.stage_profiling_checkbox.setText(tr("enable_stage_profiling", "Stage Timing Report"))
+        self.memory_monitor_checkbox.setText(tr("enable_memory_monitor", "Memory Monitor / Budget Guard"))
+        self.memory_budget_label.setText(tr("memory_budget_mb", "Memory Budget (MB, 0 = auto):"))
+        self.resume_checkpoint_checkbox.setText(tr("resume_from_checkpoint", "Resume From Checkpoint"))
+        self.record_history_checkbox.setText(tr("record_result_history", "Record Result History"))
+        self.history_status_checkbox.setText(tr("history_new_vs_persistent", "Mark New / Persistent Rules"))
+        self.threshold_sweep_checkbox.setText(tr("export_threshold_sweep", "Export Threshold Sweep"))
+        self.priority_mode_label.setText(tr("chart_priority_mode", "Processing Order:"))
+        for index, mode in enumerate(PRIORITY_MODES):
+            self.priority_mode_combo.setItemText(index, tr(f"priority_{mode}", mode.replace('_', ' ').title()))
+        self.priority_ids_edit.setPlaceholderText(tr("priority_chart_ids", "ChartID list, e.g. 1001, 1002"))
         self.custom_time_range_checkbox.setText(tr("enable_custom_time_range"))
         self.start_time_label.setText(tr("start_time"))
         self.end_time_label.setText(tr("end_time"))
@@ -490,7 +650,7 @@ def load_execution_time(raw_data_file):
         # 讀取 Excel 的 'Time' sheet
         # 加上 try/except 處理讀取 Sheet 可能發生的錯誤
         try:
-            df = pd.read_excel(raw_data_file, sheet_name='Time', engine='openpyxl')
+            df = read_config_sheet(raw_data_file, 'Time')
         except Exception as e:
             print(f" - load_execution_time: 無法讀取 'Time' Sheet 或檔案格式錯誤: {e}. 返回 None.")
             return None
@@ -532,9 +692,9 @@ def load_execution_time(raw_data_file):
         return None
 
 def load_chart_information(raw_data_file):
-    import pandas as pd
     print("載入圖表信息...")
-    all_charts_info = pd.read_excel(raw_data_file, sheet_name='Chart', engine='openpyxl')
+    # 設定檔快照：Chart / Time sheet 一次解析並快取，Characteristics 已在快照中標準化（不分大小寫）
+    all_charts_info = load_config_snapshot(raw_data_file).chart_information()
     
     # 必須欄位（不含 CHART_CREATE_TIME）
     required_columns = ['GroupName', 'ChartName', 'Material_no', 'USL', 'LSL', 'UCL', 'LCL', 'Target', 'ChartID', 'Characteristics']
@@ -542,11 +702,6 @@ def load_chart_information(raw_data_file):
         if col not in all_charts_info.columns:
             raise KeyError(f"欄位 '{col}' 不存在於圖表信息中")
     
-    # 標準化 Characteristics 欄位（不分大小寫）
-    if 'Characteristics' in all_charts_info.columns:
-        all_charts_info['Characteristics'] = all_charts_info['Characteristics'].apply(normalize_characteristic)
-        print(f"  已標準化 {len(all_charts_info)} 筆圖表的 Characteristics 欄位")
-    
     return all_charts_info
 
 def normalize_characteristic(value):
@@ -574,14 +729,7 @@ def normalize_characteristic(value):
     value_str = str(value).strip()
     
     # 不分大小寫對應表
-    mapping = {
-        'nominal': 'Nominal',
-        'bigger': 'Bigger',
-        'smaller': 'Smaller',
-        'sigma': 'Sigma'
-    }
-    
-    normalized = mapping.get(value_str.lower(), None)
+    normalized = CHARACTERISTIC_MAP.get(value_str.lower(), None)
     
     if normalized is None:
         print(f"  [Warning] 無效的 Characteristics 值: '{value_str}'，使用預設值 'Nominal'")
@@ -662,10 +810,12 @@ def update_chart_limits(raw_df, chart_info):
     
     return raw_df, chart_info
 
-def exclude_oos_data(raw_df):
+def exclude_oos_data(raw_df, usl=None, lsl=None):
+    """排除規格外的點；usl / lsl 未指定時使用第一列的規格（新增資料分批處理時沿用整份資料第一列的規格）"""
     import pandas as pd
-    usl = raw_df['usl_val'].iat[0]
-    lsl = raw_df['lsl_val'].iat[0]
+    if usl is None and lsl is None:
+        usl = raw_df['usl_val'].iat[0]
+        lsl = raw_df['lsl_val'].iat[0]
     
     if pd.notna(usl) and pd.notna(lsl):
         return raw_df[(raw_df['point_val'] <= usl) & (raw_df['point_val'] >= lsl)]
@@ -696,7 +846,8 @@ def preprocess_data(chart_info, raw_df):
         raw_df = raw_df[columns_to_keep]
         
         
-        chart_info = chart_info.rename({
+        # 設定列只在這裡轉成 ChartInfo 一次，之後的分析 / 繪圖以預先解析的屬性存取
+        chart_info = as_chart_info(chart_info).rename({
             'Material_no': 'material_no', 
             'GroupName': 'group_name',
             'ChartName': 'chart_name'
@@ -710,54 +861,17 @@ def preprocess_data(chart_info, raw_df):
         print(f'預處理過程中出錯: {e}')
         return False, None, None
 
-# 優化後的 find_matching_file 函數
+# 原始資料檔案查找：共用 raw_file_index 的目錄索引（目錄未變動時不重新掃描）
 def find_matching_file(directory, group_name, chart_name):
-    group_name = str(group_name)
-    chart_name = str(chart_name)
-    
-    # 預編譯正則表達式
-    pattern = re.compile(rf"{re.escape(group_name)}_{re.escape(chart_name)}(?:_\d+_\d+)?\.csv$")
-    
-    # 使用列表推導式來提高效率
-    matching_files = [
-        os.path.join(directory, filename)
-        for filename in os.listdir(directory)
-        if pattern.match(filename)
-    ]
-    
-    return matching_files[0] if matching_files else None
+    return get_raw_file_index(directory).find(str(group_name), str(chart_name))
 
 
 def build_raw_file_index(directory):
-    try:
-        filenames = [name for name in os.listdir(directory) if name.lower().endswith('.csv')]
-    except Exception as e:
-        print(f"[Warning] Failed to build raw CSV index: {e}")
-        return {'exact': {}, 'filenames': [], 'directory': directory}
-
-    return {
-        'exact': {os.path.splitext(name)[0]: os.path.join(directory, name) for name in filenames},
-        'filenames': filenames,
-        'directory': directory
-    }
+    return get_raw_file_index(directory)
 
 
 def find_matching_file_from_index(file_index, group_name, chart_name):
-    group_name = str(group_name)
-    chart_name = str(chart_name)
-    base_name = f"{group_name}_{chart_name}"
-
-    exact_path = file_index.get('exact', {}).get(base_name)
-    if exact_path:
-        return exact_path
-
-    pattern = re.compile(rf"{re.escape(group_name)}_{re.escape(chart_name)}(?:_\d+_\d+)?\.csv$")
-    directory = file_index.get('directory', '')
-    for filename in file_index.get('filenames', []):
-        if pattern.match(filename):
-            return os.path.join(directory, filename)
-
-    return None
+    return file_index.find(str(group_name), str(chart_name))
 
 
 def make_output_image_path(prefix, group_name, chart_name):
@@ -907,12 +1021,20 @@ def record_high_low_calculator(current_week_data, historical_data):
             'record_high_low_display': 'None (High=0, Low=0, Total=0)',
             'highlight_status': 'NO_HIGHLIGHT'
         }
-def review_kshift_results(results, resolution, characteristic, data_percentiles, base_percentiles):
-    # 設定 highlight 的初始值
-    highlight_conditions = {key: 'NO_HIGHLIGHT' for key in ['P95_shift', 'P50_shift', 'P05_shift']}
+KSHIFT_PERCENTILES = ('P95', 'P50', 'P05')
+KSHIFT_K_THRESHOLD = 1.67  # K 絕對值超過此值才 highlight
+KSHIFT_EFFECTIVE_KEYS = tuple(f'{percentile}_effective_k' for percentile in KSHIFT_PERCENTILES)
+
+
+def kshift_effective_k(results, resolution, characteristic, data_percentiles, base_percentiles):
+    """
+    各百分位數可參與 highlight 判斷的 K 絕對值：差值未達 resolution、K 為 NaN 或被 characteristic 取消者為 NaN。
+    highlight 條件即 effective K > 門檻（K 絕對值為無限時一定成立），門檻掃描直接拿這個值比較。
+    """
+    effective = {}
 
-    # 檢查各個百分位數的 k 值是否需要高亮 (簡化版: 絕對差值 > resolution OR K絕對值 > 2)
-    for percentile in ['P95', 'P50', 'P05']:
+    # 檢查各個百分位數的 k 值是否需要高亮 (簡化版: 絕對差值 > resolution 且 K絕對值 > 門檻)
+    for percentile in KSHIFT_PERCENTILES:
         k_value = results.get(f'{percentile}_k', np.nan) # 使用 .get 安全獲取 K 值 (絕對值)
 
         # 獲取當前和基線的百分位數，並計算絕對差值 (K 值計算的分子)
@@ -923,8 +1045,6 @@ def review_kshift_results(results, resolution, characteristic, data_percentiles,
         if not pd.isna(data_p) and not pd.isna(base_p):
             abs_diff = abs(data_p - base_p)
 
-        # --- 修改點開始：簡化高亮條件 ---
-
         # 判斷 resolution 是否有效（可選填）
         has_valid_resolution = not pd.isna(resolution) and resolution is not None and resolution > 0
         
@@ -936,64 +1056,61 @@ def review_kshift_results(results, resolution, characteristic, data_percentiles,
             # 沒填寫 resolution: 只要有差異就算顯著
             is_significant_diff = not pd.isna(abs_diff)
 
-        # 判斷 K 絕對值是否超過 1.67 (且非NaN)
-        is_significant_k = not pd.isna(k_value) and abs(k_value) > 1.67
-
-        # 新增判斷 k_value 是否為無限值
-        is_infinite_k = not pd.isna(k_value) and np.isinf(abs(k_value))
-
-        # 設定初始高亮: 絕對差值 > resolution 且 (K絕對值 > 1.67 或 K絕對值為無限)
-        if is_significant_diff and (is_significant_k or is_infinite_k):  # 使用 AND 和 OR 結合邏輯
-            highlight_conditions[f'{percentile}_shift'] = 'HIGHLIGHT'   
-
-        # --- 修改點結束 ---
-
+        effective[percentile] = abs(k_value) if is_significant_diff and not pd.isna(k_value) else np.nan
 
-    # 根據 characteristic 來更新 highlight (這部分邏輯不變，用於取消高亮)
+    # 根據 characteristic 取消高亮
     # 確保訪問 results 和 percentiles 時使用 .get() 和檢查 None/NaN
     if characteristic == 'Bigger':
         # 檢查 data_percentiles 和 base_percentiles 的鍵是否存在且值非空
         if data_percentiles.get('P95') is not None and base_percentiles.get('P05') is not None and data_percentiles['P95'] >= base_percentiles['P05']:
-            highlight_conditions['P95_shift'] = 'NO_HIGHLIGHT'
+            effective['P95'] = np.nan
         if data_percentiles.get('P50') is not None and base_percentiles.get('P25') is not None and data_percentiles['P50'] >= base_percentiles['P25']:
-            highlight_conditions['P50_shift'] = 'NO_HIGHLIGHT'
+            effective['P50'] = np.nan
         # 檢查 results 的鍵是否存在且值非空
         if results.get('P95_k_ori') is not None and results['P95_k_ori'] >= 0:
-            highlight_conditions['P95_shift'] = 'NO_HIGHLIGHT'
+            effective['P95'] = np.nan
         if results.get('P50_k_ori') is not None and results['P50_k_ori'] >= 0:
-            highlight_conditions['P50_shift'] = 'NO_HIGHLIGHT'
+            effective['P50'] = np.nan
         if results.get('P05_k_ori') is not None and results['P05_k_ori'] >= 0:
-            highlight_conditions['P05_shift'] = 'NO_HIGHLIGHT'
+            effective['P05'] = np.nan
 
     elif characteristic in ['Smaller', 'Sigma']:  # Sigma 使用與 Smaller 相同的邏輯
         if data_percentiles.get('P05') is not None and base_percentiles.get('P95') is not None and data_percentiles['P05'] <= base_percentiles['P95']:
-            highlight_conditions['P05_shift'] = 'NO_HIGHLIGHT'
+            effective['P05'] = np.nan
         if data_percentiles.get('P50') is not None and base_percentiles.get('P75') is not None and data_percentiles['P50'] <= base_percentiles['P75']:
-            highlight_conditions['P50_shift'] = 'NO_HIGHLIGHT'
+            effective['P50'] = np.nan
         if results.get('P95_k_ori') is not None and results['P95_k_ori'] <= 0:
-            highlight_conditions['P95_shift'] = 'NO_HIGHLIGHT'
+            effective['P95'] = np.nan
         if results.get('P50_k_ori') is not None and results['P50_k_ori'] <= 0:
-            highlight_conditions['P50_shift'] = 'NO_HIGHLIGHT'
+            effective['P50'] = np.nan
         if results.get('P05_k_ori') is not None and results['P05_k_ori'] <= 0:
-            highlight_conditions['P05_shift'] = 'NO_HIGHLIGHT'
+            effective['P05'] = np.nan
 
     elif characteristic == 'Nominal':
         if data_percentiles.get('P95') is not None and base_percentiles.get('P95') is not None and data_percentiles['P95'] <= base_percentiles['P95']:
-            highlight_conditions['P95_shift'] = 'NO_HIGHLIGHT'
+            effective['P95'] = np.nan
         if data_percentiles.get('P05') is not None and base_percentiles.get('P05') is not None and data_percentiles['P05'] >= base_percentiles['P05']:
-            highlight_conditions['P05_shift'] = 'NO_HIGHLIGHT'
+            effective['P05'] = np.nan
         # 檢查 P25, P50, P75 的鍵是否存在且值非空
         if (base_percentiles.get('P25') is not None and
             data_percentiles.get('P50') is not None and
             base_percentiles.get('P75') is not None and
             base_percentiles['P25'] <= data_percentiles['P50'] <= base_percentiles['P75']):
-            highlight_conditions['P50_shift'] = 'NO_HIGHLIGHT'
+            effective['P50'] = np.nan
         if results.get('P95_k_ori') is not None and results['P95_k_ori'] <= 0:
-            highlight_conditions['P95_shift'] = 'NO_HIGHLIGHT'
+            effective['P95'] = np.nan
         if results.get('P05_k_ori') is not None and results['P05_k_ori'] >= 0:
-            highlight_conditions['P05_shift'] = 'NO_HIGHLIGHT'
+            effective['P05'] = np.nan
 
-    return highlight_conditions
+    return effective
+
+
+def review_kshift_results(results, resolution, characteristic, data_percentiles, base_percentiles,
+                          k_threshold=KSHIFT_K_THRESHOLD):
+    # 絕對差值 >= resolution 且 K 絕對值 > k_threshold (或為無限值)，且未被 characteristic 取消
+    effective = kshift_effective_k(results, resolution, characteristic, data_percentiles, base_percentiles)
+    return {f'{percentile}_shift': 'HIGHLIGHT' if effective[percentile] > k_threshold else 'NO_HIGHLIGHT'
+            for percentile in KSHIFT_PERCENTILES}
 
 
 
@@ -1008,12 +1125,14 @@ def safe_division(numerator, denominator, epsilon=1e-9):
     return np.round(numerator, 8) / denominator
 
 
-def kshift_sigma_ratio_calculator(base, data, characteristic, resolution, ucl, lcl):
+def kshift_sigma_ratio_calculator(base, data, characteristic, resolution, ucl, lcl, k_threshold=KSHIFT_K_THRESHOLD):
     print = oob_calc_print
     """
     計算 K-shift 和 Sigma 比例相關指標，並判斷高亮狀態。
     處理週數據點數為 1 時的滾動計算和數據填充。
     加入安全除法避免標準差為零導致的問題。
+    P*_effective_k：當週與滾動結果 (有時) 都能 highlight 時取兩者較小的 K，否則為 NaN；
+    P*_shift 即 P*_effective_k > k_threshold，門檻掃描可直接以此值比較不同門檻。
     """
     results = {
         'P95_k': np.nan,
@@ -1025,7 +1144,10 @@ def kshift_sigma_ratio_calculator(base, data, characteristic, resolution, ucl, l
         'P05_k_ori': np.nan,
         'P95_shift': 'NO_HIGHLIGHT',
         'P50_shift': 'NO_HIGHLIGHT',
-        'P05_shift': 'NO_HIGHLIGHT'
+        'P05_shift': 'NO_HIGHLIGHT',
+        'P95_effective_k': np.nan,
+        'P50_effective_k': np.nan,
+        'P05_effective_k': np.nan,
     }
 
     print("--- 進入 kshift_sigma_ratio_calculator 函數 ---")
@@ -1053,7 +1175,8 @@ def kshift_sigma_ratio_calculator(base, data, characteristic, resolution, ucl, l
 
     # 計算基線百分位數。請確保 get_percentiles 能處理 base_cnt = 3 的情況
     try:
-        base_percentiles = get_percentiles(base_values)
+        # 呼叫端可提供已計算的基線百分位數（規則共用的 baseline_percentiles / sliding monitor 的增量狀態）
+        base_percentiles = base.get('percentiles') or get_percentiles(base_values)
         print(f"  kshift: 計算出的 base_percentiles (部分): P05={base_percentiles.get('P05')}, P50={base_percentiles.get('P50')}, P95={base_percentiles.get('P95')}")
         # 檢查計算分母所需的關鍵百分位數是否存在且不是 NaN
         if np.isnan(base_percentiles.get('P99.865', np.nan)) or np.isnan(base_percentiles.get('P0.135', np.nan)) or np.isnan(base_percentiles.get('P50', np.nan)):
@@ -1272,17 +1395,17 @@ def kshift_sigma_ratio_calculator(base, data, characteristic, resolution, ucl, l
     # --- 判斷當前高亮條件 ---
     try:
         # 確保傳給 review_kshift_results 的 percentiles 字典是完整的
-        current_highlight_conditions = review_kshift_results(results, resolution, characteristic, data_percentiles, base_percentiles)
-        print(f"  kshift: current_highlight_conditions: {current_highlight_conditions}")
+        current_effective_k = kshift_effective_k(results, resolution, characteristic, data_percentiles, base_percentiles)
+        print(f"  kshift: current_effective_k: {current_effective_k}")
     except Exception as e:
         print(f"  kshift: 判斷當前高亮條件時發生錯誤: {e}")
         traceback.print_exc()
         # 如果判斷高亮失敗，相關結果可能不準確，但可以返回計算出的 K 值
-        current_highlight_conditions = {key: 'ERROR' for key in ['P95_shift', 'P50_shift', 'P05_shift']} # 用 ERROR 標記
+        current_effective_k = {percentile: np.nan for percentile in KSHIFT_PERCENTILES}
 
 
     # --- 計算滾動結果高亮條件 (如果存在滾動數據) ---
-    rolling_highlight_conditions = {key: 'NO_HIGHLIGHT' for key in ['P95_shift', 'P50_shift', 'P05_shift']}
+    rolling_effective_k = None
 
     if rolled_data is not None:
         print(f"  kshift: 處理 rolled_data != None 分支，rolled_data shape: {rolled_data['values'].shape}")
@@ -1301,22 +1424,25 @@ def kshift_sigma_ratio_calculator(base, data, characteristic, resolution, ucl, l
 
             # 判斷滾動結果高亮條件
             # 確保傳給 review_kshift_results 的 percentiles 字典是完整的
-            rolling_highlight_conditions = review_kshift_results(rolling_results, resolution, characteristic, rolled_data['percentiles'], base_percentiles)
-            print(f"  kshift: rolling_highlight_conditions: {rolling_highlight_conditions}")
+            rolling_effective_k = kshift_effective_k(rolling_results, resolution, characteristic, rolled_data['percentiles'], base_percentiles)
+            print(f"  kshift: rolling_effective_k: {rolling_effective_k}")
 
         except Exception as e:
             print(f"  kshift: 判斷滾動高亮條件時發生錯誤: {e}")
             traceback.print_exc()
-            # 如果判斷滾動高亮失敗，用 ERROR 標記
-            rolling_highlight_conditions = {key: 'ERROR' for key in ['P95_shift', 'P50_shift', 'P05_shift']}
+            # 如果判斷滾動高亮失敗，視為不高亮
+            rolling_effective_k = {percentile: np.nan for percentile in KSHIFT_PERCENTILES}
 
 
     # --- 最終的高亮條件 ---
-    # 結合當前和滾動的高亮結果
-    # 檢查 current_highlight_conditions 和 rolling_highlight_conditions 中的值是否是預期的 'HIGHLIGHT'/'NO_HIGHLIGHT'/'ERROR'
-    results['P95_shift'] = 'HIGHLIGHT' if current_highlight_conditions.get('P95_shift') == 'HIGHLIGHT' and (rolled_data is None or rolling_highlight_conditions.get('P95_shift') == 'HIGHLIGHT') else 'NO_HIGHLIGHT'
-    results['P50_shift'] = 'HIGHLIGHT' if current_highlight_conditions.get('P50_shift') == 'HIGHLIGHT' and (rolled_data is None or rolling_highlight_conditions.get('P50_shift') == 'HIGHLIGHT') else 'NO_HIGHLIGHT'
-    results['P05_shift'] = 'HIGHLIGHT' if current_highlight_conditions.get('P05_shift') == 'HIGHLIGHT' and (rolled_data is None or rolling_highlight_conditions.get('P05_shift') == 'HIGHLIGHT') else 'NO_HIGHLIGHT'
+    # 結合當前和滾動的高亮結果：兩者都要超過門檻，等同取較小的 effective K 比較
+    for percentile in KSHIFT_PERCENTILES:
+        effective_k = current_effective_k[percentile]
+        if rolling_effective_k is not None:
+            rolled_k = rolling_effective_k[percentile]
+            effective_k = np.nan if pd.isna(effective_k) or pd.isna(rolled_k) else min(effective_k, rolled_k)
+        results[f'{percentile}_effective_k'] = effective_k
+        results[f'{percentile}_shift'] = 'HIGHLIGHT' if effective_k > k_threshold else 'NO_HIGHLIGHT'
 
     print(f"  kshift: 最終 shift 結果: P95={results['P95_shift']}, P50={results['P50_shift']}, P05={results['P05_shift']}")
     print("--- 退出 kshift_sigma_ratio_calculator 函數 ---")
@@ -1376,33 +1502,196 @@ def ooc_calculator(data, ucl, lcl):
     return data_cnt, ooc_cnt, ooc_ratio
 
 # OOC結果檢查
-def review_ooc_results(ooc_cnt, ooc_ratio, threshold=0.05):
+OOC_RATIO_THRESHOLD = 0.05  # 週數據 OOC 比例超過此值 (且 OOC 點數 > 1) 才 highlight
+
+
+def review_ooc_results(ooc_cnt, ooc_ratio, threshold=OOC_RATIO_THRESHOLD):
     return 'HIGHLIGHT' if ooc_ratio > threshold and ooc_cnt > 1 else 'NO_HIGHLIGHT'
 
 
 def review_3o7d_results(ooc_cnt):
     return 'HIGHLIGHT' if ooc_cnt >= 3 else 'NO_HIGHLIGHT'
 
+
+# EWMA / CUSUM 參數（λ=0.2、L=3；k=0.5σ、h=5σ，常用的小偏移偵測設定）
+EWMA_LAMBDA = 0.2
+EWMA_L = 3.0
+CUSUM_K = 0.5
+CUSUM_H = 5.0
+
+
+def baseline_center_sigma(base_values, ucl=None, lcl=None):
+    """
+    EWMA / CUSUM 的中心與 σ，與 kshift 的 P50 分母相同：
+    中心 = 基線 P50，σ = max((P99.865 - P0.135) / 6, (UCL - LCL) / 12)
+    """
+    base_percentiles = get_percentiles(base_values)
+    sigma = safe_division(base_percentiles['P99.865'] - base_percentiles['P0.135'], 6)
+    if ucl is not None and lcl is not None and not pd.isna(ucl) and not pd.isna(lcl):
+        sigma = np.nanmax([sigma, safe_division(ucl - lcl, 12)])
+    return base_percentiles['P50'], np.round(sigma, 8)
+
+
+def ewma_cusum_calculator(baseline_values, weekly_values, ucl=None, lcl=None):
+    """
+    EWMA 與 tabular CUSUM 小偏移偵測。
+    基線只用來估計中心與 σ；遞迴從當週第一點重新開始（EWMA z_0 = 中心、CUSUM C_0 = 0，t 由週起點計），
+    當週判斷不會沿用基線累積的狀態。O(n) 遞迴濾波：EWMA 用 lfilter，CUSUM 用累積和的封閉解。
+    """
+    print = oob_calc_print
+    result = {'HL_EWMA': 'NO_HIGHLIGHT', 'HL_CUSUM': 'NO_HIGHLIGHT'}
+    base = np.asarray(baseline_values, dtype=float)
+    week = np.asarray(weekly_values, dtype=float)
+    base = base[~np.isnan(base)]
+    week = week[~np.isnan(week)]
+    if len(base) < 2 or len(week) == 0:
+        return result
+
+    center, sigma = baseline_center_sigma(base, ucl, lcl)
+    if not np.isfinite(sigma) or sigma <= 0:
+        print("  ewma_cusum: 基線 σ 無效，略過")
+        return result
+
+    # EWMA: z_t = λ x_t + (1 - λ) z_{t-1}，z_0 = 中心；界限使用隨 t 收斂的精確變異數
+    lam = EWMA_LAMBDA
+    ewma, _ = lfilter([lam], [1.0, lam - 1.0], week, zi=[(1.0 - lam) * center])
+    steps = np.arange(1, len(week) + 1)
+    ewma_width = EWMA_L * sigma * np.sqrt(lam / (2.0 - lam) * (1.0 - (1.0 - lam) ** (2 * steps)))
+    ewma_hit = np.abs(ewma - center) > ewma_width
+
+    # CUSUM: C_t = max(0, C_{t-1} + d_t) 的封閉解 C_t = S_t - min(0, min_{j<=t} S_j)，S 為 d 的累積和
+    def tabular_cusum(deviation):
+        cumulative = np.cumsum(deviation)
+        return cumulative - np.minimum(np.minimum.accumulate(cumulative), 0.0)
+
+    slack = CUSUM_K * sigma
+    cusum_upper = tabular_cusum(week - center - slack)
+    cusum_lower = tabular_cusum(center - slack - week)
+    cusum_hit = np.maximum(cusum_upper, cusum_lower) > CUSUM_H * sigma
+
+    result['HL_EWMA'] = 'HIGHLIGHT' if ewma_hit.any() else 'NO_HIGHLIGHT'
+    result['HL_CUSUM'] = 'HIGHLIGHT' if cusum_hit.any() else 'NO_HIGHLIGHT'
+    print(f"  ewma_cusum: center={center}, sigma={sigma}, EWMA 超限 {int(ewma_hit.sum())} 點, CUSUM 超限 {int(cusum_hit.sum())} 點")
+    return result
+
+
+# X-bar/R、X-bar/S 子群 (以 Batch_ID 為子群) 常數：d2、d3 以子群大小 n 為索引 (n = 2..10)
+SUBGROUP_RANGE_MAX_N = 10  # 子群最大點數 <= 10 用 R̄/d2，超過改用 S̄/c4
+SUBGROUP_D2 = np.array([np.nan, np.nan, 1.128, 1.693, 2.059, 2.326, 2.534, 2.704, 2.847, 2.970, 3.078])
+SUBGROUP_D3 = np.array([np.nan, np.nan, 0.853, 0.888, 0.880, 0.864, 0.848, 0.833, 0.820, 0.808, 0.797])
+SUBGROUP_L = 3.0
+
+
+def subgroup_c4(n):
+    """c4(n) = sqrt(2/(n-1)) * Γ(n/2) / Γ((n-1)/2)；n < 2 為 NaN"""
+    n = np.asarray(n, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c4 = np.sqrt(2.0 / (n - 1.0)) * np.exp(gammaln(n / 2.0) - gammaln((n - 1.0) / 2.0))
+    return np.where(n >= 2, c4, np.nan)
+
+
+def subgroup_statistics(data, batch_column='Batch_ID'):
+    """
+    以 Batch_ID 分子群，一次 groupby 彙總出每個子群的 n、平均、全距與標準差。
+    子群依資料中第一次出現的順序排列；沒有 Batch_ID 欄位時回傳空表。
+    """
+    columns = ['n', 'mean', 'range', 'std']
+    if data is None or data.empty or batch_column not in data.columns:
+        return pd.DataFrame(columns=columns)
+    stats = data['point_val'].groupby(data[batch_column], sort=False).agg(['count', 'mean', 'max', 'min', 'std'])
+    stats = stats[stats['count'] > 0]
+    return pd.DataFrame({
+        'n': stats['count'].astype(int),
+        'mean': stats['mean'],
+        'range': stats['max'] - stats['min'],
+        'std': stats['std'],
+    })
+
+
+def within_subgroup_sigma(subgroups):
+    """
+    子群內 σ 與採用的方法：
+    - 子群最大點數 <= SUBGROUP_RANGE_MAX_N：X-bar/R，σ = 各子群 R/d2(n) 的平均
+    - 否則：X-bar/S，σ = 各子群 S/c4(n) 的平均
+    需要至少 2 個點數 >= 2 的子群，否則回傳 (NaN, 'N/A')。
+    """
+    multi = subgroups[subgroups['n'] >= 2] if len(subgroups) else subgroups
+    if len(multi) < 2:
+        return np.nan, 'N/A'
+    n = multi['n'].to_numpy()
+    if n.max() <= SUBGROUP_RANGE_MAX_N:
+        sigma = np.mean(multi['range'].to_numpy() / SUBGROUP_D2[n])
+        method = 'R'
+    else:
+        sigma = np.mean(multi['std'].to_numpy() / subgroup_c4(n))
+        method = 'S'
+    return (float(sigma), method) if np.isfinite(sigma) and sigma > 0 else (np.nan, 'N/A')
+
+
+def subgroup_chart_calculator(baseline_subgroups, weekly_subgroups):
+    """
+    X-bar/R 或 X-bar/S 子群管制圖：中心線與子群內 σ 來自基線子群，判斷當週子群。
+    - HL_subgroup_mean  ：當週任一子群平均超出 X̿ ± 3σ/√n
+    - HL_subgroup_spread：當週任一子群全距 (R 法) 或標準差 (S 法) 超出 R / S 管制界限
+    全部以子群大小向量化計算，不逐子群迴圈。
+    """
+    print = oob_calc_print
+    result = {'HL_subgroup_mean': 'NO_HIGHLIGHT', 'HL_subgroup_spread': 'NO_HIGHLIGHT'}
+    sigma, method = within_subgroup_sigma(baseline_subgroups)
+    if method == 'N/A' or len(weekly_subgroups) == 0:
+        print("  subgroup_chart: 基線子群不足 (需至少 2 個點數 >= 2 的 Batch)，略過")
+        return result
+
+    center = np.average(baseline_subgroups['mean'].to_numpy(), weights=baseline_subgroups['n'].to_numpy())
+    n = weekly_subgroups['n'].to_numpy()
+    mean_hit = np.abs(weekly_subgroups['mean'].to_numpy() - center) > SUBGROUP_L * sigma / np.sqrt(n)
+
+    # 全距只適用 d2/d3 表內的子群大小，其他子群改用標準差判斷
+    use_range = (method == 'R') & (n >= 2) & (n <= SUBGROUP_RANGE_MAX_N)
+    use_std = ~use_range & (n >= 2)
+    table_n = np.clip(n, 0, SUBGROUP_RANGE_MAX_N)
+    d2, d3 = SUBGROUP_D2[table_n], SUBGROUP_D3[table_n]
+    c4 = subgroup_c4(n)
+    with np.errstate(invalid='ignore'):
+        range_hit = use_range & ((weekly_subgroups['range'].to_numpy() > (d2 + SUBGROUP_L * d3) * sigma) |
+                                 (weekly_subgroups['range'].to_numpy() < (d2 - SUBGROUP_L * d3) * sigma))
+        s_width = SUBGROUP_L * np.sqrt(1.0 - c4 ** 2)
+        std_hit = use_std & ((weekly_subgroups['std'].to_numpy() > (c4 + s_width) * sigma) |
+                             (weekly_subgroups['std'].to_numpy() < (c4 - s_width) * sigma))
+    spread_hit = range_hit | std_hit
+
+    result['HL_subgroup_mean'] = 'HIGHLIGHT' if mean_hit.any() else 'NO_HIGHLIGHT'
+    result['HL_subgroup_spread'] = 'HIGHLIGHT' if spread_hit.any() else 'NO_HIGHLIGHT'
+    print(f"  subgroup_chart: X-bar/{method}, center={center}, sigma_within={sigma}, "
+          f"當週子群 {len(n)} 個, 平均超限 {int(mean_hit.sum())}, 離散超限 {int(spread_hit.sum())}")
+    return result
+
 # 計算Sticking Rate
-def sticking_rate_calculator(baseline_data, weekly_data):
+def sticking_rate_calculator(baseline_data, weekly_data, baseline_counts=None):
+    """baseline_counts：基線各值點數 (需有 mode() 與 get(value, 0))；提供時基線的眾數與比例不再掃描 baseline_data"""
     def get_mode(data):
         return data.mode()[0]
 
     def get_percentage(data, value):
         return (data == value).sum() / len(data)
 
+    def get_baseline_percentage(value):
+        if baseline_counts is None:
+            return get_percentage(baseline_data, value)
+        return baseline_counts.get(value, 0) / len(baseline_data)
+
     # 如果週資料少於10筆，與基線資料進行合併
     if len(weekly_data) < 10:
         rolling_window_size = 20 if len(baseline_data) > 1000 else 10
         weekly_data = pd.concat([baseline_data.tail(rolling_window_size), weekly_data])
 
     threshold = 0.7
-    baseline_mode = get_mode(baseline_data)
+    baseline_mode = get_mode(baseline_data) if baseline_counts is None else baseline_counts.mode()
     weekly_mode = get_mode(weekly_data)
 
-    baseline_mode_percentage_in_baseline = get_percentage(baseline_data, baseline_mode)
+    baseline_mode_percentage_in_baseline = get_baseline_percentage(baseline_mode)
     baseline_mode_percentage_in_weekly = get_percentage(weekly_data, baseline_mode)
-    weekly_mode_percentage_in_baseline = get_percentage(baseline_data, weekly_mode)
+    weekly_mode_percentage_in_baseline = get_baseline_percentage(weekly_mode)
     weekly_mode_percentage_in_weekly = get_percentage(weekly_data, weekly_mode)
 
     baseline_mode_diff = abs(baseline_mode_percentage_in_baseline - baseline_mode_percentage_in_weekly)
@@ -1422,9 +1711,12 @@ def sticking_rate_calculator(baseline_data, weekly_data):
     }
 
 # 趨勢檢查
-def trending(raw_df, weekly_start_date, weekly_end_date, baseline_start_date, baseline_end_date):
+def trending(raw_df, weekly_start_date, weekly_end_date, baseline_start_date, baseline_end_date,
+             baseline_percentiles=None):
+    """baseline_percentiles：已計算的基線百分位數 (需有 P95 / P05)；提供時 raw_df 只需包含最近 7 週的資料"""
     # 時間欄位轉換
-    raw_df['point_time'] = pd.to_datetime(raw_df['point_time'])
+    if not pd.api.types.is_datetime64_any_dtype(raw_df['point_time']):  # 已是 datetime 時略過整欄轉換
+        raw_df['point_time'] = pd.to_datetime(raw_df['point_time'])
     weekly_end_date = pd.to_datetime(weekly_end_date)
     baseline_start_date = pd.to_datetime(baseline_start_date)
     baseline_end_date = pd.to_datetime(baseline_end_date)
@@ -1480,17 +1772,21 @@ def trending(raw_df, weekly_start_date, weekly_end_date, baseline_start_date, ba
         return all(earlier < later for earlier, later in zip(medians, medians[1:]))
 
     # 基準區間百分位
-    baseline_df = raw_df[
-        (raw_df['point_time'] >= baseline_start_date) &
-        (raw_df['point_time'] <= baseline_end_date)
-    ]
-    baseline_values = baseline_df['point_val']
+    if baseline_percentiles is not None:
+        p95 = baseline_percentiles['P95']
+        p05 = baseline_percentiles['P05']
+    else:
+        baseline_df = raw_df[
+            (raw_df['point_time'] >= baseline_start_date) &
+            (raw_df['point_time'] <= baseline_end_date)
+        ]
+        baseline_values = baseline_df['point_val']
 
-    if baseline_values.empty:
-        return 'NO_HIGHLIGHT'
+        if baseline_values.empty:
+            return 'NO_HIGHLIGHT'
 
-    p95 = np.percentile(baseline_values, 95)
-    p05 = np.percentile(baseline_values, 5)
+        p95 = np.percentile(baseline_values, 95)
+        p05 = np.percentile(baseline_values, 5)
 
     # 檢查是否上升或下降
     check_medians = [m for m in weekly_medians[:num_weeks_to_check] if not np.isnan(m)]
@@ -1585,6 +1881,8 @@ def discrete_oob_calculator(base_data, weekly_data, chart_info, raw_df=None,
         results['HL_P95_shift'] = kshift_results.get('P95_shift', 'NO_HIGHLIGHT')
         results['HL_P50_shift'] = kshift_results.get('P50_shift', 'NO_HIGHLIGHT')
         results['HL_P05_shift'] = kshift_results.get('P05_shift', 'NO_HIGHLIGHT')
+        for key in KSHIFT_EFFECTIVE_KEYS:
+            results[key] = kshift_results.get(key, np.nan)
         
         # 5. 新增的 category_LT_Shift 計算
         print("  離散型 OOB: 計算 category_LT_Shift...")
@@ -1821,6 +2119,8 @@ def discrete_kshift_calculator(base_data, weekly_data, characteristic, resolutio
                     kshift_results['P95_shift'] = 'NO_HIGHLIGHT'
                     kshift_results['P50_shift'] = 'NO_HIGHLIGHT' 
                     kshift_results['P05_shift'] = 'NO_HIGHLIGHT'
+                    for key in KSHIFT_EFFECTIVE_KEYS:
+                        kshift_results[key] = np.nan
                 else:
                     print("  discrete_kshift: 有百分位數超出基線範圍，維持原始 K-shift 結果")
             else:
@@ -1938,6 +2238,7 @@ def default_by_tool_median_shift_result(reason='N/A'):
         'by_tool_median_shift_max_tool': 'N/A',
         'by_tool_median_shift_max_diff': np.nan,
         'by_tool_median_shift_max_k': np.nan,
+        'by_tool_median_shift_effective_k': np.nan,  # 差值達 resolution 時的 max K，否則 NaN（門檻掃描用）
         'by_tool_median_shift_tool_count': 0,
         'by_tool_median_shift_top_tools': 'N/A',
         'by_tool_median_shift_top_count': 0,
@@ -1948,14 +2249,8 @@ def default_by_tool_median_shift_result(reason='N/A'):
 def by_tool_median_shift_calculator(raw_df, baseline_data, weekly_data, chart_info, min_points=3):
     result = default_by_tool_median_shift_result('N/A')
     try:
-        if chart_info is None:
-            chart_info = {}
-        k_threshold = pd.to_numeric(
-            pd.Series([chart_info.get('by_tool_median_shift_k_threshold', 1.67)]),
-            errors='coerce'
-        ).iloc[0]
-        if pd.isna(k_threshold) or not np.isfinite(k_threshold):
-            k_threshold = 1.67
+        info = as_chart_info(chart_info)
+        k_threshold = info.k_threshold  # 無效時為預設 1.67
         if weekly_data is None or weekly_data.empty:
             return default_by_tool_median_shift_result('No weekly data')
         if baseline_data is None or baseline_data.empty:
@@ -1970,17 +2265,16 @@ def by_tool_median_shift_calculator(raw_df, baseline_data, weekly_data, chart_in
         if weekly.empty:
             return default_by_tool_median_shift_result('No valid weekly values')
 
-        tool_stats = (
-            weekly.groupby('Matching')['point_val']
-            .agg(median='median', count='count')
-            .reset_index()
-        )
+        # 以機台的整數 code 分組（factorize 排序後與依字串分組的順序相同）
+        tool_codes, tool_names = pd.factorize(weekly['Matching'], sort=True)
+        tool_stats = weekly['point_val'].groupby(tool_codes).agg(median='median', count='count')
+        tool_stats.insert(0, 'Matching', tool_names[tool_stats.index])
+        tool_stats = tool_stats.reset_index(names='tool_code')
         eligible = tool_stats[tool_stats['count'] >= min_points].copy()
         if len(eligible) < 2:
             return default_by_tool_median_shift_result(f'Insufficient eligible tools (n={len(eligible)})')
 
-        eligible_tools = set(eligible['Matching'])
-        eligible_values = weekly[weekly['Matching'].isin(eligible_tools)]['point_val']
+        eligible_values = weekly['point_val'][np.isin(tool_codes, eligible['tool_code'].to_numpy())]
         overall_median = float(np.median(eligible_values))
         eligible['distance_to_overall'] = (eligible['median'] - overall_median).abs()
         eligible = eligible.sort_values(
@@ -2008,8 +2302,7 @@ def by_tool_median_shift_calculator(raw_df, baseline_data, weekly_data, chart_in
         if pd.notna(percentile_deno) and np.isfinite(percentile_deno) and percentile_deno > 0:
             deno_candidates.append(float(percentile_deno))
 
-        ucl = pd.to_numeric(pd.Series([chart_info.get('UCL')]), errors='coerce').iloc[0]
-        lcl = pd.to_numeric(pd.Series([chart_info.get('LCL')]), errors='coerce').iloc[0]
+        ucl, lcl = info.ucl, info.lcl
         if pd.notna(ucl) and pd.notna(lcl):
             ucl_lcl_deno = safe_division(ucl - lcl, 12)
             if pd.notna(ucl_lcl_deno) and np.isfinite(ucl_lcl_deno) and ucl_lcl_deno > 0:
@@ -2030,11 +2323,11 @@ def by_tool_median_shift_calculator(raw_df, baseline_data, weekly_data, chart_in
         max_diff = float(max_row['median_diff'])
         max_k = float(max_row['tool_median_k'])
 
-        resolution = pd.to_numeric(pd.Series([chart_info.get('Resolution')]), errors='coerce').iloc[0]
+        resolution = info.resolution
         has_valid_resolution = pd.notna(resolution) and resolution > 0
         resolution_ok = True if not has_valid_resolution else max_diff >= float(resolution)
-        k_ok = pd.notna(max_k) and np.isfinite(max_k) and max_k > float(k_threshold)
-        highlight = 'HIGHLIGHT' if k_ok and resolution_ok else 'NO_HIGHLIGHT'
+        effective_k = max_k if resolution_ok and pd.notna(max_k) and np.isfinite(max_k) else np.nan
+        highlight = 'HIGHLIGHT' if effective_k > float(k_threshold) else 'NO_HIGHLIGHT'
 
         tool_records = []
         for _, row in compare.iterrows():
@@ -2068,6 +2361,7 @@ def by_tool_median_shift_calculator(raw_df, baseline_data, weekly_data, chart_in
             'by_tool_median_shift_max_tool': max_tool,
             'by_tool_median_shift_max_diff': max_diff,
             'by_tool_median_shift_max_k': max_k,
+            'by_tool_median_shift_effective_k': effective_k,
             'by_tool_median_shift_tool_count': int(len(eligible)),
             'by_tool_median_shift_top_tools': top_tools,
             'by_tool_median_shift_top_count': int(len(shifted_records)),
@@ -2080,7 +2374,280 @@ def by_tool_median_shift_calculator(raw_df, baseline_data, weekly_data, chart_in
         return default_by_tool_median_shift_result('Error')
 
 
-def process_single_chart(chart_info, raw_df, initial_baseline_start_date, baseline_end_date, weekly_start_date, weekly_end_date):
+# 變點 (change point) 自動基線：二元切割 (binary segmentation)，每段最少點數與懲罰係數
+CHANGEPOINT_MIN_SEGMENT = 10  # 與「基線至少 10 點」一致
+CHANGEPOINT_PENALTY = 3.0  # 切點成立門檻 = CHANGEPOINT_PENALTY * ln(n)（以雜訊 σ² 標準化）
+
+
+def detect_change_points(values, min_size=CHANGEPOINT_MIN_SEGMENT, penalty=CHANGEPOINT_PENALTY):
+    """
+    均值變點偵測 (binary segmentation)。
+    以累積和計算每個候選切點的 SSE 減少量 n_L*n_R/n*(mean_L - mean_R)^2，
+    每層只需 O(n) 向量運算，整體約 O(n log n)。
+    雜訊 σ 由一階差分的 MAD 估計，不受階梯變化本身影響。
+    回傳排序後的切點索引（新段落的第一點）。
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    n = len(values)
+    if n < 2 * min_size:
+        return []
+
+    diffs = np.diff(values)
+    noise = np.median(np.abs(diffs - np.median(diffs))) / (0.6745 * np.sqrt(2.0))
+    if not noise > 0:
+        noise = np.std(diffs) / np.sqrt(2.0)
+    if not noise > 0:
+        return []
+
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    threshold = penalty * np.log(n) * noise ** 2
+    change_points = []
+    segments = [(0, n)]
+    while segments:
+        lo, hi = segments.pop()
+        size = hi - lo
+        if size < 2 * min_size:
+            continue
+        splits = np.arange(lo + min_size, hi - min_size + 1)
+        total = csum[hi] - csum[lo]
+        left = csum[splits] - csum[lo]
+        gain = left ** 2 / (splits - lo) + (total - left) ** 2 / (hi - splits) - total ** 2 / size
+        best = int(np.argmax(gain))
+        if gain[best] > threshold:
+            split = int(splits[best])
+            change_points.append(split)
+            segments.extend([(lo, split), (split, hi)])
+    return sorted(change_points)
+
+
+def changepoint_baseline_start(raw_df, baseline_start_date, baseline_end_date):
+    """
+    基線期內若有製程階梯變化，改以最後一個穩定段落（週數據前的最後一段）的起點作為基線開始日期；
+    沒有變點時回傳原本的開始日期。
+    """
+    print = oob_calc_print
+    baseline = raw_df[(raw_df['point_time'] >= baseline_start_date) & (raw_df['point_time'] <= baseline_end_date)]
+    if baseline.empty:
+        return baseline_start_date
+    baseline = baseline.sort_values('point_time', kind='stable')
+    change_points = detect_change_points(baseline['point_val'].to_numpy())
+    if not change_points:
+        print(f"  自動基線: 基線期內未偵測到變點，維持 {baseline_start_date}")
+        return baseline_start_date
+    new_start = baseline['point_time'].iloc[change_points[-1]]
+    print(f"  自動基線: 偵測到 {len(change_points)} 個變點，基線改為最後穩定段 {new_start} 至 {baseline_end_date} "
+          f"({len(baseline) - change_points[-1]} 點)")
+    return new_start
+
+
+# === OOB 規則註冊（共用輸入 + 規則）===
+# 新增偵測規則：註冊需要的 input provider 與 rule，process_single_chart / _process_discrete_chart 會自動執行，
+# HL_* 欄位會自動加入 OOB_KEYS（OOB_Rule 摘要）。
+OOB_RULES = RuleRegistry()
+RULE_STAGES = RuleStageCache()  # session 內的規則結果記憶：只切換規則開關 / 門檻時，其他規則不重算
+
+RECORD_HIGH_LOW_DEFAULT = {
+    'HL_record_high_low': 'NO_HIGHLIGHT',
+    'record_high': False,
+    'record_low': False,
+    'record_high_count': 0,
+    'record_low_count': 0,
+    'record_high_low_count': 0,
+    'record_high_low_risk': 'NONE',
+    'record_high_low_display': 'None (High=0, Low=0, Total=0)',
+}
+
+
+def calculate_point_statistics(data):
+    """點數、平均與樣本標準差；單點或標準差無效時 σ 視為 0（避免 ddof=1 產生 NaN）"""
+    if data.shape[0] <= 1:
+        sigma = 0.0
+    else:
+        sigma = data['point_val'].std()
+    if np.isnan(sigma):
+        oob_calc_print(f"  calculate_statistics 警告: 計算 sigma 得到 NaN. Data shape: {data.shape}")
+        sigma = 0.0
+    return {
+        'values': data['point_val'].values,
+        'cnt': data.shape[0],
+        'mean': data['point_val'].mean(),
+        'sigma': sigma
+    }
+
+
+@OOB_RULES.input('weekly_stats')
+def _input_weekly_stats(ctx):
+    return calculate_point_statistics(ctx['weekly_data'])
+
+
+@OOB_RULES.input('baseline_stats')
+def _input_baseline_stats(ctx):
+    return calculate_point_statistics(ctx['baseline_data'])
+
+
+@OOB_RULES.input('weekly_values')
+def _input_weekly_values(ctx):
+    return ctx['weekly_data']['point_val'].values
+
+
+@OOB_RULES.input('baseline_values')
+def _input_baseline_values(ctx):
+    return ctx['baseline_data']['point_val'].values
+
+
+@OOB_RULES.input('baseline_percentiles')
+def _input_baseline_percentiles(ctx):
+    """K-shift 與 trending 共用的基線百分位數"""
+    return get_percentiles(ctx['baseline_values'])
+
+
+@OOB_RULES.input('baseline_extremes')
+def _input_baseline_extremes(ctx):
+    """基線的 [最小值, 最大值]（Record High/Low 只需要極值）"""
+    values = ctx['baseline_values']
+    return np.array([np.min(values), np.max(values)]) if len(values) else np.array([])
+
+
+@OOB_RULES.input('baseline_counts')
+def _input_baseline_counts(ctx):
+    """基線各值的點數；None 表示由 sticking 直接掃描基線（sliding monitor 以增量狀態提供）"""
+    return None
+
+
+@OOB_RULES.input('recent_data')
+def _input_recent_data(ctx):
+    """週期結束前 7 週 (49 天) 的資料，trending 的週中位數只需要這一段"""
+    raw_df = ctx['raw_df']
+    weekly_end = pd.to_datetime(ctx['window'][1])
+    return raw_df[(raw_df['point_time'] >= weekly_end - timedelta(days=48)) & (raw_df['point_time'] <= weekly_end)]
+
+
+@OOB_RULES.input('weekly_subgroups')
+def _input_weekly_subgroups(ctx):
+    return subgroup_statistics(ctx['weekly_data'])
+
+
+@OOB_RULES.input('baseline_subgroups')
+def _input_baseline_subgroups(ctx):
+    return subgroup_statistics(ctx['baseline_data'])
+
+
+@OOB_RULES.input('ooc')
+def _input_ooc(ctx):
+    """(週數據點數, OOC 點數, OOC 比例)"""
+    return ooc_calculator(ctx['weekly_data'], ctx.chart_info.ucl, ctx.chart_info.lcl)
+
+
+@OOB_RULES.rule('kshift', keys=('HL_P95_shift', 'HL_P50_shift', 'HL_P05_shift'),
+                inputs=('baseline_stats', 'weekly_stats', 'baseline_percentiles'), chart_types=('continuous',))
+def _rule_kshift(ctx):
+    info = ctx.chart_info
+    kshift_results = kshift_sigma_ratio_calculator(
+        {**ctx['baseline_stats'], 'percentiles': ctx['baseline_percentiles']}, ctx['weekly_stats'],
+        info.characteristics, info.resolution, info.ucl, info.lcl
+    )
+    return {
+        'HL_P95_shift': kshift_results.get('P95_shift', 'N/A'),
+        'HL_P50_shift': kshift_results.get('P50_shift', 'N/A'),
+        'HL_P05_shift': kshift_results.get('P05_shift', 'N/A'),
+        **{key: kshift_results.get(key, np.nan) for key in KSHIFT_EFFECTIVE_KEYS},
+    }
+
+
+@OOB_RULES.rule('discrete_oob',
+                keys=('HL_P95_shift', 'HL_P50_shift', 'HL_P05_shift', 'HL_sticking_shift', 'HL_trending', 'HL_category_LT_shift'),
+                inputs=('baseline_stats', 'weekly_stats', 'raw_df', 'window'), chart_types=('discrete',),
+                aliases=('kshift', 'sticking', 'trending', 'category_lt_shift'))
+def _rule_discrete_oob(ctx):
+    weekly_start, weekly_end, baseline_start, baseline_end = ctx['window']
+    discrete_oob_result = discrete_oob_calculator(
+        ctx['baseline_stats'], ctx['weekly_stats'], ctx.chart_info, ctx['raw_df'],
+        weekly_start, weekly_end, baseline_start, baseline_end
+    )
+    keys = ('HL_P95_shift', 'HL_P50_shift', 'HL_P05_shift', 'HL_sticking_shift', 'HL_trending', 'HL_category_LT_shift')
+    result = {key: discrete_oob_result.get(key, 'NO_HIGHLIGHT') for key in keys}
+    result.update({key: discrete_oob_result.get(key, np.nan) for key in KSHIFT_EFFECTIVE_KEYS})
+    return result
+
+
+@OOB_RULES.rule('high_ooc', keys=('HL_high_OOC',), inputs=('ooc',), needs_baseline=False)
+def _rule_high_ooc(ctx):
+    ooc_results = ctx['ooc']
+    return {'HL_high_OOC': review_ooc_results(ooc_results[1], ooc_results[2]), 'ooc_ratio': ooc_results[2]}
+
+
+@OOB_RULES.rule('3o7d', keys=('HL_3O7D',), inputs=('ooc',), needs_baseline=False)
+def _rule_3o7d(ctx):
+    return {'HL_3O7D': review_3o7d_results(ctx['ooc'][1])}
+
+
+@OOB_RULES.rule('sticking', keys=('HL_sticking_shift',), inputs=('baseline_data', 'weekly_data', 'baseline_counts'),
+                chart_types=('continuous',))
+def _rule_sticking(ctx):
+    sticking_rate_results = sticking_rate_calculator(ctx['baseline_data']['point_val'], ctx['weekly_data']['point_val'],
+                                                     baseline_counts=ctx['baseline_counts'])
+    return {'HL_sticking_shift': sticking_rate_results.get('highlight_status', 'N/A')}
+
+
+@OOB_RULES.rule('trending', keys=('HL_trending',), inputs=('recent_data', 'window', 'baseline_percentiles'),
+                chart_types=('continuous',))
+def _rule_trending(ctx):
+    return {'HL_trending': trending(ctx['recent_data'].copy(), *ctx['window'],
+                                    baseline_percentiles=ctx['baseline_percentiles'])}
+
+
+@OOB_RULES.rule('record_high_low', keys=('HL_record_high_low',), inputs=('weekly_values', 'baseline_extremes'),
+                default=lambda reason: RECORD_HIGH_LOW_DEFAULT)
+def _rule_record_high_low(ctx):
+    record_results = record_high_low_calculator(ctx['weekly_values'], ctx['baseline_extremes'])
+    result = dict(RECORD_HIGH_LOW_DEFAULT)
+    result.update({key: record_results[key] for key in result if key in record_results})
+    result['HL_record_high_low'] = record_results.get('highlight_status', 'N/A')
+    return result
+
+
+@OOB_RULES.rule('by_tool_median_shift', keys=('HL_by_tool_median_shift',),
+                inputs=('raw_df', 'baseline_data', 'weekly_data'),
+                default=default_by_tool_median_shift_result, setting='run_by_tool_median_shift',
+                params=('by_tool_median_shift_k_threshold',))
+def _rule_by_tool_median_shift(ctx):
+    by_tool_median_results = by_tool_median_shift_calculator(
+        ctx['raw_df'], ctx['baseline_data'], ctx['weekly_data'], ctx.chart_info
+    )
+    result = default_by_tool_median_shift_result('N/A')
+    result.update({key: by_tool_median_results[key] for key in result if key in by_tool_median_results})
+    return result
+
+
+@OOB_RULES.rule('ewma_cusum', keys=('HL_EWMA', 'HL_CUSUM'), inputs=('baseline_values', 'weekly_values'),
+                setting='run_ewma_cusum')
+def _rule_ewma_cusum(ctx):
+    return ewma_cusum_calculator(ctx['baseline_values'], ctx['weekly_values'], ctx.chart_info.ucl, ctx.chart_info.lcl)
+
+
+@OOB_RULES.rule('subgroup_chart', keys=('HL_subgroup_mean', 'HL_subgroup_spread'),
+                inputs=('baseline_subgroups', 'weekly_subgroups'), chart_types=('continuous',),
+                setting='run_subgroup_charts', aliases=('xbar', 'xbar_r', 'xbar_s'))
+def _rule_subgroup_chart(ctx):
+    return subgroup_chart_calculator(ctx['baseline_subgroups'], ctx['weekly_subgroups'])
+
+
+# 每機台的 K-shift / High OOC / Record High/Low：只輸出明細欄位，不影響 chart 層級的 HL
+@OOB_RULES.rule('per_tool_oob', keys=(), inputs=('baseline_data', 'weekly_data'),
+                default=default_per_tool_oob_result, setting='run_per_tool_oob', aliases=('per_tool',))
+def _rule_per_tool_oob(ctx):
+    try:
+        return per_tool_oob_result(ctx['weekly_data'], ctx['baseline_data'], ctx.chart_info,
+                                   k_threshold=KSHIFT_K_THRESHOLD, ooc_threshold=OOC_RATIO_THRESHOLD)
+    except Exception as e:
+        print(f"  per_tool_oob error: {e}")
+        traceback.print_exc()
+        return default_per_tool_oob_result('Error')
+
+
+def process_single_chart(chart_info, raw_df, initial_baseline_start_date, baseline_end_date, weekly_start_date, weekly_end_date,
+                         stage_key=None):
     print = oob_calc_print
     print("--- 進入外部 process_single_chart 函數 ---")
     print(f"  接收到的 raw_df shape: {raw_df.shape}")
@@ -2091,6 +2658,7 @@ def process_single_chart(chart_info, raw_df, initial_baseline_start_date, baseli
     if raw_df is None or raw_df.empty:
         print("  raw_df 是空的或 None, 返回 None")
         return None
+    chart_info = as_chart_info(chart_info)
 
     try:
         print("  正在篩選週數據...")
@@ -2132,6 +2700,9 @@ def process_single_chart(chart_info, raw_df, initial_baseline_start_date, baseli
             actual_baseline_start_date = initial_baseline_start_date
             print(f"  基線數據點數量 ({baseline_count_one_year}) >= 10，使用一年基線期: {actual_baseline_start_date} 至 {baseline_end_date}")
 
+        if chart_info.auto_baseline_changepoint and not baseline_insufficient:
+            actual_baseline_start_date = changepoint_baseline_start(raw_df, actual_baseline_start_date, baseline_end_date)
+
         # 步驟 3: 使用最終確定的基線範圍過濾數據
         print("  正在篩選最終基線數據...")
         baseline_data = raw_df[(raw_df['point_time'] >= actual_baseline_start_date) & (raw_df['point_time'] <= baseline_end_date)].copy() # Use copy()
@@ -2147,165 +2718,35 @@ def process_single_chart(chart_info, raw_df, initial_baseline_start_date, baseli
         # --- 基線數據範圍選擇邏輯結束 ---
 
 
-        # 計算統計數據（週數據與基線數據）
-        def calculate_statistics(data):
-             # 新增檢查，避免對只有一個點的數據計算標準差產生 NaN (ddof=1 時)
-             if data.shape[0] <= 1:
-                  sigma = 0.0 if data.shape[0] == 1 else 0.0 # 單點或零點標準差視為 0
-             else:
-                  sigma = data['point_val'].std() # ddof=1 是 pandas 預設，計算樣本標準差
-
-             # 如果 sigma 是 NaN (例如，所有值都相同，但數據點多於 1 且少於某個閾值，或計算出問題)
-             if np.isnan(sigma):
-                 print(f"  calculate_statistics 警告: 計算 sigma 得到 NaN. Data shape: {data.shape}")
-                 sigma = 0.0 # 將無效的標準差視為 0
-
-             return {
-                 'values': data['point_val'].values,
-                 'cnt': data.shape[0],
-                 'mean': data['point_val'].mean(),
-                 'sigma': sigma # 使用處理過的 sigma
-                 }
-
-        print("  正在計算週數據統計...")
-        weekly_data_dict = calculate_statistics(weekly_data)
-        print(f"  週數據統計結果 (部分): cnt={weekly_data_dict['cnt']}, mean={weekly_data_dict['mean']}, sigma={weekly_data_dict['sigma']}")
-
+        # 計算統計數據（週數據與基線數據）；規則共用的輸入由 RuleContext 依需求計算一次
+        window = (weekly_start_date, weekly_end_date, actual_baseline_start_date, baseline_end_date)
+        baseline_valid = not baseline_insufficient and not baseline_empty
+        context = RuleContext(
+            OOB_RULES, chart_info, 'continuous', baseline_valid=baseline_valid,
+            stage_key=(stage_key, window, baseline_valid) if stage_key is not None else None,
+            raw_df=raw_df, weekly_data=weekly_data, baseline_data=baseline_data, window=window,
+        )
+        print("  正在計算週數據統計...")
+        weekly_data_dict = context['weekly_stats']
+        print(f"  週數據統計結果 (部分): cnt={weekly_data_dict['cnt']}, mean={weekly_data_dict['mean']}, sigma={weekly_data_dict['sigma']}")
 
-        # IMPORTANT: 這裡的 baseline_data_dict 現在是使用 *實際確定* 的基線範圍數據計算的
-        print("  正在計算基線數據統計...")
-        baseline_data_dict = calculate_statistics(baseline_data) if not baseline_empty else None
-        if baseline_data_dict is not None:
+        if not baseline_empty:
+            # IMPORTANT: 基線統計使用 *實際確定* 的基線範圍數據計算
+            baseline_data_dict = context['baseline_stats']
             print(f"  基線數據統計結果 (部分): cnt={baseline_data_dict['cnt']}, mean={baseline_data_dict['mean']}, sigma={baseline_data_dict['sigma']}")
+            if baseline_data_dict['sigma'] == 0 or np.isnan(baseline_data_dict['sigma']):
+                print("  警告: 基線標準差為零或無效，可能影響 K 值計算和需要標準差的其他指標。")
         else:
             print("  基線數據為空，跳過基線統計輸出")
 
-        # 確保基線統計數據的標準差不會導致後續計算問題
-        if baseline_data_dict and 'sigma' in baseline_data_dict and (baseline_data_dict['sigma'] == 0 or np.isnan(baseline_data_dict['sigma'])):
-             print("  警告: 基線標準差為零或無效，可能影響 K 值計算和需要標準差的其他指標。")
-             # 您可以選擇在這裡返回 None，或讓後續函數自行處理 NaN/inf
+        # 依註冊順序執行 OOB 規則（kshift、OOC、sticking、trending、record high/low、by tool、EWMA/CUSUM…）
+        # 基線不足的規則與設定檔 OOB_Rules 欄位停用的規則回傳預設結果
+        rule_outputs, highlighted = OOB_RULES.evaluate(context, profiler=PROFILER, stage_cache=RULE_STAGES)
+        highlight_status = 'HIGHLIGHT' if highlighted else 'NO_HIGHLIGHT'
+        print(f"  OOB 規則結果: {rule_outputs}")
+        print(f"  計算出的 highlight_status: {highlight_status}")
 
-        print("  正在呼叫 kshift_sigma_ratio_calculator...")
-        # 傳入使用實際基線範圍計算出的 baseline_data_dict
-        # kshift_sigma_ratio_calculator 需要處理 sigma=0 或其他分母為 0 的情況 (已在 safe_division 中處理)
-        if not baseline_insufficient and not baseline_empty:
-            kshift_results = kshift_sigma_ratio_calculator(baseline_data_dict, weekly_data_dict, chart_info.get('Characteristics'), chart_info.get('Resolution'), chart_info.get('UCL'), chart_info.get('LCL')) # 使用 .get 防止 key 錯誤
-        else:
-            kshift_results = {'P95_shift': 'NO_HIGHLIGHT', 'P50_shift': 'NO_HIGHLIGHT', 'P05_shift': 'NO_HIGHLIGHT'}
-
-        print(f"  kshift_sigma_ratio_calculator 返回: {kshift_results}")
-
-        print("  正在呼叫 ooc_calculator...")
-        # ooc_calculator 使用週數據計算 OOC 點數
-        ooc_results = ooc_calculator(weekly_data, chart_info.get('UCL'), chart_info.get('LCL')) # 使用 .get 防止 key 錯誤
-        print(f"  ooc_calculator 返回: {ooc_results}")
-
-        print("  正在呼叫 review_ooc_results...")
-        ooc_highlight = review_ooc_results(ooc_results[1], ooc_results[2]) # 注意 ooc_results[1] 是 ooc_cnt, ooc_results[2] 是 ooc_points
-        three_o7d_highlight = review_3o7d_results(ooc_results[1])
-        print(f"  review_ooc_results 返回: {ooc_highlight}")
-        print(f"  review_3o7d_results 返回: {three_o7d_highlight}")
-
-        print("  正在呼叫 sticking_rate_calculator...")
-        # sticking_rate_calculator 需要週數據和基線數據的 Series
-        # IMPORTANT: 這裡傳入的 baseline_data['point_val'] 是使用 *實際確定* 的基線範圍數據
-        sticking_rate_results = sticking_rate_calculator(baseline_data['point_val'], weekly_data['point_val']) if not baseline_insufficient and not baseline_empty else {'highlight_status': 'NO_HIGHLIGHT'}
-        print(f"  sticking_rate_calculator 返回: {sticking_rate_results}")
-
-        print("  正在呼叫 trending...")
-        # trending 也需要使用實際確定後的基線範圍
-        trending_results = trending(raw_df, weekly_start_date, weekly_end_date, actual_baseline_start_date, baseline_end_date) if not baseline_insufficient and not baseline_empty else 'NO_HIGHLIGHT'
-        print(f"  trending 返回: {trending_results}")
-
-        print("  正在呼叫 record_high_low_calculator...")
-        # DEBUG: 輸出時間範圍信息
-        print(f"  DEBUG: 基線時間範圍 - 從 {actual_baseline_start_date} 到 {baseline_end_date}")
-        print(f"  DEBUG: 當週時間範圍 - 從 {weekly_start_date} 到 {weekly_end_date}")
-        print(f"  DEBUG: 基線結束與當週開始間隔 = {weekly_start_date - baseline_end_date}")
-        # 計算當週數據是否創下歷史新高或新低
-        record_results = record_high_low_calculator(weekly_data['point_val'].values, baseline_data['point_val'].values) if not baseline_insufficient and not baseline_empty else {
-            'highlight_status': 'NO_HIGHLIGHT',
-            'record_high': False,
-            'record_low': False,
-            'record_high_count': 0,
-            'record_low_count': 0,
-            'record_high_low_count': 0,
-            'record_high_low_risk': 'NONE',
-            'record_high_low_display': 'None (High=0, Low=0, Total=0)'
-        }
-        print(f"  record_high_low_calculator 返回: {record_results}")
-
-        # 判斷是否需要 highlight (任何一個子指標需要高亮，則總體高亮)
-        if chart_info.get('run_by_tool_median_shift', False):
-            by_tool_median_results = by_tool_median_shift_calculator(
-                raw_df, baseline_data, weekly_data, chart_info
-            ) if not baseline_insufficient and not baseline_empty else default_by_tool_median_shift_result('No valid baseline')
-        else:
-            by_tool_median_results = default_by_tool_median_shift_result('Disabled')
-        print(f"  by_tool_median_shift_calculator result: {by_tool_median_results}")
-
-        highlight_status = 'HIGHLIGHT' if (
-             kshift_results.get('P95_shift') == 'HIGHLIGHT' or
-             kshift_results.get('P50_shift') == 'HIGHLIGHT' or
-             kshift_results.get('P05_shift') == 'HIGHLIGHT' or
-             sticking_rate_results.get('highlight_status') == 'HIGHLIGHT' or
-             trending_results == 'HIGHLIGHT' or
-             ooc_highlight == 'HIGHLIGHT' or # 應該也要考慮 ooc_highlight
-             three_o7d_highlight == 'HIGHLIGHT' or
-             by_tool_median_results.get('HL_by_tool_median_shift') == 'HIGHLIGHT' or
-             record_results.get('highlight_status') == 'HIGHLIGHT' # 新增 record high/low 判斷
-        ) else 'NO_HIGHLIGHT'
-        print(f"  計算出的 highlight_status: {highlight_status}")
-
-
-        # 組織結果
-        # 注意使用 .get(key, default_value) 來安全存取字典鍵，防止 KeyError
-        result = {
-            'data_cnt': ooc_results[0], # 週數據點數
-            'ooc_cnt': ooc_results[1], # 週數據 OOC 點數
-            'WE_Rule': '', # 這個欄位在 GUI 類的 build_result 中填充
-            'OOB_Rule': '' if not baseline_empty else 'N/A - No Baseline', # 基線為空時標記
-            'HL_P95_shift': kshift_results.get('P95_shift', 'N/A'), # 使用 get 並提供預設值，避免 key 錯誤
-            'HL_P50_shift': kshift_results.get('P50_shift', 'N/A'),
-            'HL_P05_shift': kshift_results.get('P05_shift', 'N/A'),
-            'HL_sticking_shift': sticking_rate_results.get('highlight_status', 'N/A'),
-            'HL_trending': trending_results, # trending_results 本身就是 HIGHLIGHT/NO_HIGHLIGHT
-            'HL_high_OOC': ooc_highlight, # ooc_highlight 本身就是 HIGHLIGHT/NO_HIGHLIGHT
-            'HL_3O7D': three_o7d_highlight,
-            'HL_by_tool_median_shift': by_tool_median_results.get('HL_by_tool_median_shift', 'NO_HIGHLIGHT'),
-            'HL_record_high_low': record_results.get('highlight_status', 'N/A'), # 新增 record high/low 欄位
-            'record_high': record_results.get('record_high', False), # 是否創新高
-            'record_low': record_results.get('record_low', False), # 是否創新低
-            'Material_no': chart_info.get('material_no', 'N/A'),
-            'record_high_count': record_results.get('record_high_count', 0),
-            'record_low_count': record_results.get('record_low_count', 0),
-            'record_high_low_count': record_results.get('record_high_low_count', 0),
-            'record_high_low_risk': record_results.get('record_high_low_risk', 'NONE'),
-            'record_high_low_display': record_results.get('record_high_low_display', 'None (High=0, Low=0, Total=0)'),
-            'by_tool_median_shift_display': by_tool_median_results.get('by_tool_median_shift_display', 'N/A'),
-            'by_tool_median_shift_golden_tool': by_tool_median_results.get('by_tool_median_shift_golden_tool', 'N/A'),
-            'by_tool_median_shift_max_tool': by_tool_median_results.get('by_tool_median_shift_max_tool', 'N/A'),
-            'by_tool_median_shift_max_diff': by_tool_median_results.get('by_tool_median_shift_max_diff', np.nan),
-            'by_tool_median_shift_max_k': by_tool_median_results.get('by_tool_median_shift_max_k', np.nan),
-            'by_tool_median_shift_tool_count': by_tool_median_results.get('by_tool_median_shift_tool_count', 0),
-            'by_tool_median_shift_top_tools': by_tool_median_results.get('by_tool_median_shift_top_tools', 'N/A'),
-            'by_tool_median_shift_top_count': by_tool_median_results.get('by_tool_median_shift_top_count', 0),
-            'by_tool_median_shift_all_tools_json': by_tool_median_results.get('by_tool_median_shift_all_tools_json', '[]'),
-            'group_name': chart_info.get('group_name', 'N/A'),
-            'chart_name': chart_info.get('chart_name', 'N/A'),
-            'chart_ID': chart_info.get('ChartID', 'N/A'),
-            'Characteristics': chart_info.get('Characteristics', 'N/A'),
-            'USL': chart_info.get('USL', 'N/A'),
-            'LSL': chart_info.get('LSL', 'N/A'),
-            'UCL': chart_info.get('UCL', 'N/A'),
-            'LCL': chart_info.get('LCL', 'N/A'),
-            'Target': chart_info.get('Target', 'N/A'),
-            'Resolution': chart_info.get('Resolution', 'N/A'),
-            'baseline_insufficient': baseline_insufficient,  # 新增標記，供後續使用
-            'baseline_empty': baseline_empty  # 新增標記，記錄基線是否為空
-            # 可以考慮添加 actual_baseline_start_date 到結果中，用於記錄實際使用的基線範圍
-            # 'Actual_Baseline_Start': actual_baseline_start_date
-        }
+        result = build_chart_result(chart_info, context['ooc'], baseline_insufficient, baseline_empty, rule_outputs)
         print("--- 外部 process_single_chart 函數成功退出 ---")
         return result
 
@@ -2315,6 +2756,75 @@ def process_single_chart(chart_info, raw_df, initial_baseline_start_date, baseli
         traceback.print_exc()
         return None
 
+
+def build_chart_result(chart_info, ooc_results, baseline_insufficient, baseline_empty, rule_outputs):
+    """連續型 chart 的單張結果 (process_single_chart 與 sliding_monitor 共用)"""
+    # 組織結果
+    # 注意使用 .get(key, default_value) 來安全存取字典鍵，防止 KeyError
+    result = {
+        'data_cnt': ooc_results[0], # 週數據點數
+        'ooc_cnt': ooc_results[1], # 週數據 OOC 點數
+        'WE_Rule': '', # 這個欄位在 GUI 類的 build_result 中填充
+        'OOB_Rule': '' if not baseline_empty else 'N/A - No Baseline', # 基線為空時標記
+        'Material_no': chart_info.get('material_no', 'N/A'),
+        'group_name': chart_info.get('group_name', 'N/A'),
+        'chart_name': chart_info.get('chart_name', 'N/A'),
+        'chart_ID': chart_info.get('ChartID', 'N/A'),
+        'Characteristics': chart_info.get('Characteristics', 'N/A'),
+        'USL': chart_info.get('USL', 'N/A'),
+        'LSL': chart_info.get('LSL', 'N/A'),
+        'UCL': chart_info.get('UCL', 'N/A'),
+        'LCL': chart_info.get('LCL', 'N/A'),
+        'Target': chart_info.get('Target', 'N/A'),
+        'Resolution': chart_info.get('Resolution', 'N/A'),
+        'baseline_insufficient': baseline_insufficient,  # 新增標記，供後續使用
+        'baseline_empty': baseline_empty  # 新增標記，記錄基線是否為空
+        # 可以考慮添加 actual_baseline_start_date 到結果中，用於記錄實際使用的基線範圍
+        # 'Actual_Baseline_Start': actual_baseline_start_date
+    }
+    result.update(rule_outputs)
+    return result
+
+
+def resolve_analysis_window(raw_df, execution_time=None, custom_weekly_start=None, custom_weekly_end=None):
+    """
+    決定週期與基線時間範圍，回傳 (weekly_start, weekly_end, baseline_start, baseline_end)；
+    無法決定週期結束時間時回傳 None。
+    """
+    latest_raw_data_time = raw_df['point_time'].max()
+
+    # 優先使用自定義週期時間範圍
+    if custom_weekly_start is not None and custom_weekly_end is not None:
+        print(f" - analyze_chart: 使用自定義週期時間範圍: {custom_weekly_start} to {custom_weekly_end}")
+        weekly_start_date = custom_weekly_start
+        weekly_end_date = custom_weekly_end
+    else:
+        # 如果沒有自定義時間範圍，使用原本的邏輯
+        if execution_time is None or pd.isna(execution_time):
+            print(" - analyze_chart: execution_time is None or NaT, using latest data time as weekly end date.")
+            weekly_end_date = latest_raw_data_time
+        else:
+            print(f" - analyze_chart: execution_time is provided ({execution_time}), using it as weekly end date.")
+            weekly_end_date = execution_time
+
+        if pd.isna(weekly_end_date):
+            print(f" - analyze_chart: Unable to determine weekly end date (latest_raw_data_time is also invalid). Skipping analysis.")
+            return None
+
+        weekly_start_date = weekly_end_date - pd.Timedelta(days=6)
+
+    # baseline 邏輯保持不變：以週期開始時間的前一秒作為基線結束
+    baseline_end_date = weekly_start_date - pd.Timedelta(seconds=1)
+    # 這裡使用初始的一年基線範圍
+    initial_baseline_start_date = baseline_end_date - pd.Timedelta(days=365)
+
+    print(f" - analyze_chart: 計算出的時間範圍")
+    print(f"   Weekly 週期: {weekly_start_date} to {weekly_end_date}")
+    print(f"   Initial Baseline 基線: {initial_baseline_start_date} to {baseline_end_date}")
+    print(f"   Baseline 時間長度: {(baseline_end_date - initial_baseline_start_date).days} 天")
+    return weekly_start_date, weekly_end_date, initial_baseline_start_date, baseline_end_date
+
+
 def calculate_sigma(UCL, LCL, mean):
     """
     計算 sigma_upper 和 sigma_lower
@@ -2337,19 +2847,21 @@ def calculate_sigma(UCL, LCL, mean):
         return np.nan, np.nan
 
 def check_rules(raw_df, chart_info):
-    import pandas as pd
-    import numpy as np
-    
-    mean = chart_info.get('Target')
-    UCL = chart_info.get('UCL')
-    LCL = chart_info.get('LCL')
-    characteristics = chart_info['Characteristics']
+    # 逐點呼叫：設定以 ChartInfo 的預先解析屬性存取，資料以 numpy 切片判斷
+    info = as_chart_info(chart_info)
+    mean = info.target
+    UCL = info.ucl
+    LCL = info.lcl
+    characteristics = info.characteristics
+    enabled = info.we_rules
+    values = raw_df['point_val'].to_numpy(dtype=float)
+    n = len(values)
     
     # 計算 sigma（可能返回 NaN）
     sigma_upper, sigma_lower = calculate_sigma(UCL, LCL, mean)
     
     # 檢查 sigma 是否有效
-    sigma_valid = not pd.isna(sigma_upper) and not pd.isna(sigma_lower) and not pd.isna(mean)
+    sigma_valid = not np.isnan(sigma_upper) and not np.isnan(sigma_lower) and not np.isnan(mean)
     
     if sigma_valid:
         UWL = mean + 2 * sigma_upper
@@ -2373,65 +2885,59 @@ def check_rules(raw_df, chart_info):
     }
 
     # WE1/WE5: 只需要 UCL/LCL，不依賴 sigma
-    if not pd.isna(UCL) and UCL is not None:
-        rules["WE1"] = raw_df['point_val'].iloc[-1] > UCL
+    if not np.isnan(UCL):
+        rules["WE1"] = values[-1] > UCL
     
-    if not pd.isna(LCL) and LCL is not None:
-        rules["WE5"] = raw_df['point_val'].iloc[-1] < LCL
+    if not np.isnan(LCL):
+        rules["WE5"] = values[-1] < LCL
     
     # CU1/CU2: 趨勢規則，不依賴 sigma
-    if chart_info.get('CU1', 'N') == 'Y' and len(raw_df) >= 7:
-        tail_7 = raw_df['point_val'].tail(7)
-        diffs = tail_7.diff().dropna()
-        rules["CU1"] = (diffs > 0).all()
+    if 'CU1' in enabled and n >= 7:
+        diffs = np.diff(values[-7:])
+        rules["CU1"] = (diffs[~np.isnan(diffs)] > 0).all()
     
-    if chart_info.get('CU2', 'N') == 'Y' and len(raw_df) >= 7:
-        tail_7 = raw_df['point_val'].tail(7)
-        diffs = tail_7.diff().dropna()
-        rules["CU2"] = (diffs < 0).all()
+    if 'CU2' in enabled and n >= 7:
+        diffs = np.diff(values[-7:])
+        rules["CU2"] = (diffs[~np.isnan(diffs)] < 0).all()
 
     # WE2-WE10 需要 sigma 有效才能判斷
     if not sigma_valid:
         return rules  # Sigma 無效，直接返回（WE2-WE10 保持 False，但 WE1/WE5/CU1/CU2 已判斷）
     
-    if chart_info.get('WE2', 'N') == 'Y' and len(raw_df) >= 3:
-        rules["WE2"] = (raw_df['point_val'].tail(3) > UWL).sum() >= 2 if characteristics not in ['Bigger', 'Smaller', 'Sigma'] else False
-    if chart_info.get('WE3', 'N') == 'Y' and len(raw_df) >= 5:
+    two_sided = characteristics not in ['Bigger', 'Smaller', 'Sigma']
+    if 'WE2' in enabled and n >= 3:
+        rules["WE2"] = (values[-3:] > UWL).sum() >= 2 if two_sided else False
+    if 'WE3' in enabled and n >= 5:
         threshold = mean + sigma_upper  # 修正：使用標準的 1σ 線
-        rules["WE3"] = (raw_df['point_val'].tail(5) > threshold).sum() >= 4
-    if chart_info.get('WE4', 'N') == 'Y' and len(raw_df) >= 8:
-        rules["WE4"] = (raw_df['point_val'].tail(8) > mean).all()
-    if chart_info.get('WE6', 'N') == 'Y' and len(raw_df) >= 3:
-        rules["WE6"] = (raw_df['point_val'].tail(3) < LWL).sum() >= 2 if characteristics not in ['Bigger', 'Smaller', 'Sigma'] else False
-    if chart_info.get('WE7', 'N') == 'Y' and len(raw_df) >= 5:
+        rules["WE3"] = (values[-5:] > threshold).sum() >= 4
+    if 'WE4' in enabled and n >= 8:
+        rules["WE4"] = (values[-8:] > mean).all()
+    if 'WE6' in enabled and n >= 3:
+        rules["WE6"] = (values[-3:] < LWL).sum() >= 2 if two_sided else False
+    if 'WE7' in enabled and n >= 5:
         threshold = mean - sigma_lower  # 修正：使用標準的 1σ 線
-        rules["WE7"] = (raw_df['point_val'].tail(5) < threshold).sum() >= 4
-    if chart_info.get('WE8', 'N') == 'Y' and len(raw_df) >= 8:
-        rules["WE8"] = (raw_df['point_val'].tail(8) < mean).all()
-    if chart_info.get('WE9', 'N') == 'Y' and len(raw_df) >= 15:
+        rules["WE7"] = (values[-5:] < threshold).sum() >= 4
+    if 'WE8' in enabled and n >= 8:
+        rules["WE8"] = (values[-8:] < mean).all()
+    if 'WE9' in enabled and n >= 15:
         # 取得最後 15 筆資料
-        tail_points = raw_df['point_val'].tail(15)
+        tail_points = values[-15:]
         
         # 如果所有資料點報定值（唯一值數量為 1），則直接返回 False
-        if tail_points.nunique() == 1:  # 檢查唯一值數量是否為 1
+        if np.unique(tail_points[~np.isnan(tail_points)]).size == 1:  # 檢查唯一值數量是否為 1
             rules["WE9"] = False
         else:
             # 修正：使用 >= 和 <= 包含邊界值
             condition_result = (tail_points >= (mean - sigma_lower)) & \
                             (tail_points <= (mean + sigma_upper))
             rules["WE9"] = condition_result.all()
-    if chart_info.get('WE10', 'N') == 'Y' and len(raw_df) >= 8:                   
-        rules["WE10"] = ((raw_df['point_val'].tail(8) < (mean - sigma_lower) ) | 
-                        (raw_df['point_val'].tail(8) > (mean + sigma_upper) )).all() if characteristics not in ['Bigger', 'Smaller', 'Sigma'] else False
+    if 'WE10' in enabled and n >= 8:
+        tail_points = values[-8:]
+        rules["WE10"] = ((tail_points < (mean - sigma_lower)) |
+                        (tail_points > (mean + sigma_upper))).all() if two_sided else False
     
     return rules
-def calculate_cpk(raw_df, chart_info):
-    mean = raw_df['point_val'].mean()
-    std = raw_df['point_val'].std()
-    characteristic = chart_info['Characteristics']
-    usl = chart_info.get('USL', None)
-    lsl = chart_info.get('LSL', None)
-
+def _capability_index(mean, std, characteristic, usl, lsl):
     cpk = None
 
     if std > 0:
@@ -2450,7 +2956,28 @@ def calculate_cpk(raw_df, chart_info):
     if cpk is not None:
         cpk = round(cpk, 3)  # 統一四捨五入到小數第三位
 
-    return {'Cpk': cpk}
+    return cpk
+
+
+def calculate_cpk(raw_df, chart_info, subgroups=None):
+    """
+    Cpk 使用子群內 σ (Batch_ID 子群，X-bar/R 或 X-bar/S)，Ppk 使用整體 σ。
+    沒有可用子群 (無 Batch_ID 或每個 Batch 只有 1 點) 時 Cpk 與 Ppk 相同。
+    """
+    mean = raw_df['point_val'].mean()
+    std = raw_df['point_val'].std()
+    characteristic = chart_info['Characteristics']
+    usl = chart_info.get('USL', None)
+    lsl = chart_info.get('LSL', None)
+
+    if subgroups is None:
+        subgroups = subgroup_statistics(raw_df)
+    sigma_within, method = within_subgroup_sigma(subgroups)
+
+    ppk = _capability_index(mean, std, characteristic, usl, lsl)
+    cpk = ppk if method == 'N/A' else _capability_index(mean, sigma_within, characteristic, usl, lsl)
+
+    return {'Cpk': cpk, 'Ppk': ppk}
 def plot_spc_chart(raw_df, chart_info, weekly_start_date, weekly_end_date, debug=False):
     import os
     import numpy as np
@@ -2600,6 +3127,7 @@ def compute_violated_rules(raw_df, chart_info, weekly_start_date, weekly_end_dat
     df['point_time'] = pd.to_datetime(df['point_time'])
     df = df.sort_values('point_time').reset_index(drop=True)
 
+    chart_info = as_chart_info(chart_info)
     violated_rules = {rule: False for rule in chart_info.get('rule_list', [])}
     if df.empty:
         return violated_rules
@@ -2611,10 +3139,10 @@ def compute_violated_rules(raw_df, chart_info, weekly_start_date, weekly_end_dat
         return violated_rules
 
     for i in range(int(weekly_indices.min()), int(weekly_indices.max()) + 1):
-        data_subset = df.iloc[:i + 1].tail(15)
+        data_subset = df.iloc[max(i - 14, 0):i + 1]  # 最後 15 筆；check_rules 只讀取，不需複製
         if data_subset.empty:
             continue
-        rules = check_rules(data_subset.copy(), chart_info)
+        rules = check_rules(data_subset, chart_info)
         for rule, violated in rules.items():
             if violated:
                 violated_rules[rule] = True
@@ -3418,10 +3946,39 @@ def plot_weekly_spc_chart_interactive(raw_df, chart_info, weekly_start_date, wee
     return canvas
 
 
-def save_results_to_excel(results_df, scale_factor=0.3):
+# 匯出 Excel 的欄位與順序
+RESULT_EXPORT_COLUMNS = [
+    'data_cnt', 'ooc_cnt', 'WE_Rule', 'OOB_Rule', 'data_type', 'Material_no', 'group_name',
+    'chart_name', 'chart_ID', 'Characteristics', 'USL', 'LSL', 'UCL', 'LCL', 'Target', 'Cpk',
+    'Ppk', 'Resolution', 'HL_by_tool_median_shift', 'by_tool_median_shift_display',
+    'by_tool_median_shift_golden_tool', 'by_tool_median_shift_max_tool',
+    'by_tool_median_shift_max_diff', 'by_tool_median_shift_max_k',
+    'by_tool_median_shift_tool_count', 'by_tool_median_shift_top_tools',
+    'by_tool_median_shift_top_count', 'by_tool_median_shift_all_tools_json', 'HL_record_high_low',
+    'record_high', 'record_low', 'record_high_count', 'record_low_count', 'record_high_low_count',
+    'record_high_low_risk', 'record_high_low_display', 'chart_path', 'weekly_chart_path',
+    'by_tool_color_path', 'by_tool_group_path',
+]
+
+
+def build_results_dataframe(results):
+    """將結果紀錄整理為匯出用 DataFrame（固定欄位順序，NaN/Inf 轉為 'N/A'）"""
+    results_df = results_to_dataframe(results)
+
+    # 確保所有預期的列都存在，包括新增的數據類型欄位
+    for col in RESULT_EXPORT_COLUMNS:
+        if col not in results_df.columns:
+            results_df[col] = np.nan
+
+    results_df = results_df[RESULT_EXPORT_COLUMNS + [col for col in HISTORY_COLUMNS if col in results_df.columns]]
+    return results_df.replace([np.nan, np.inf, -np.inf], 'N/A')
+
+
+def save_results_to_excel(results_df, scale_factor=0.3, output_path='result_with_images.xlsx', extra_sheets=None):
+    """extra_sheets：{sheet 名稱: DataFrame}，接在結果 sheet 後各自輸出（例如料號彙總）"""
     results_df['group_name'] = results_df['group_name'].replace("Default", "")  # 替換 Default 為空白
 
-    workbook = xlsxwriter.Workbook('result_with_images.xlsx')
+    workbook = xlsxwriter.Workbook(output_path)
     worksheet = workbook.add_worksheet()
 
     cell_format = workbook.add_format({'align': 'center', 'valign': 'vcenter', 'font_name': 'Arial', 'font_size': 10})
@@ -3554,9 +4111,91 @@ def save_results_to_excel(results_df, scale_factor=0.3):
     for row_idx in range(1, len(results_df) + 1):
         worksheet.set_row(row_idx, max_image_height)
 
+    for sheet_name, sheet_df in (extra_sheets or {}).items():
+        if sheet_df is None:
+            continue
+        write_table_sheet(workbook, sheet_name, sheet_df, header_format, cell_format)
+
     workbook.close()
 
 
+def write_table_sheet(workbook, sheet_name, table_df, header_format, cell_format):
+    """將 DataFrame 寫成獨立 sheet（無圖片），欄寬依內容調整"""
+    worksheet = workbook.add_worksheet(str(sheet_name)[:31])
+    table_df = table_df.replace([np.inf, -np.inf], np.nan).astype(object).where(table_df.notna(), '')
+    for col_idx, header in enumerate(table_df.columns):
+        worksheet.write(0, col_idx, str(header), header_format)
+        values = table_df.iloc[:, col_idx].tolist()
+        for row_idx, value in enumerate(values, start=1):
+            worksheet.write(row_idx, col_idx, value, cell_format)
+        width = max([len(str(header))] + [len(str(value)) for value in values])
+        worksheet.set_column(col_idx, col_idx, width + 5)
+    worksheet.freeze_panes(1, 0)
+
+
+def build_material_rollup_sheets(results):
+    """匯出用的料號彙總 sheet"""
+    try:
+        return {'Material Rollup': material_rollup(results, OOB_KEYS)}
+    except Exception as e:
+        print(f"[Warning] 料號彙總計算失敗，略過匯出: {e}")
+        return {}
+
+
+def build_per_tool_sheets(results):
+    """匯出用的每機台 OOB 明細 sheet"""
+    try:
+        return {'Per Tool OOB': per_tool_highlight_table(results)}
+    except Exception as e:
+        print(f"[Warning] 每機台 OOB 明細整理失敗，略過匯出: {e}")
+        return {}
+
+
+def build_tool_implication_sheets(results):
+    """匯出用的機台關聯排名 sheet：By Tool Median Shift 中牽連最多 chart 的機台"""
+    try:
+        return {'Tool Implication': tool_implication_ranking(results)}
+    except Exception as e:
+        print(f"[Warning] 機台關聯排名計算失敗，略過匯出: {e}")
+        return {}
+
+
+def build_threshold_sweep_sheets(results, settings):
+    """匯出用的門檻掃描 sheet：K-shift / High OOC / By Tool 各門檻的 highlight 比例"""
+    try:
+        by_tool_k = float(settings.get('by_tool_median_shift_k_threshold', 1.67))
+        current = {'kshift_k': KSHIFT_K_THRESHOLD, 'ooc_ratio': OOC_RATIO_THRESHOLD, 'by_tool_k': by_tool_k}
+        parameters = [name for name in SWEEP_RULES
+                      if name != 'by_tool_k' or settings.get('run_by_tool_median_shift', False)]
+        return {'Threshold Sweep': threshold_sweep(results, current=current, parameters=parameters)}
+    except Exception as e:
+        print(f"[Warning] 門檻掃描計算失敗，略過匯出: {e}")
+        return {}
+
+
+# 附加 sheet 會讀取的設定；分片執行時記錄在分片 header，合併時沿用
+EXPORT_SHEET_SETTING_KEYS = ['run_per_tool_oob', 'export_threshold_sweep', 'run_by_tool_median_shift',
+                             'by_tool_median_shift_k_threshold']
+
+
+def build_export_sheets(results, settings=None):
+    """result_with_images.xlsx 的附加 sheet：SPCApp.save_results 與分片合併 (shard_runner) 共用，兩者輸出相同"""
+    settings = settings or {}
+    extra_sheets = build_material_rollup_sheets(results)
+    if settings.get('run_per_tool_oob', False):
+        extra_sheets.update(build_per_tool_sheets(results))
+    if settings.get('run_by_tool_median_shift', False):
+        extra_sheets.update(build_tool_implication_sheets(results))
+    if settings.get('export_threshold_sweep', False):
+        extra_sheets.update(build_threshold_sweep_sheets(results, settings))
+    return extra_sheets
+
+
+def analysis_code_version():
+    """分析結果快取 / checkpoint 的程式版本：OOB 主程式與分析用到的外部模組"""
+    return code_version(sys.modules[__name__], per_tool_oob, oob_rule_registry, chart_config, compact_frame)
+
+
 # 🔧 封裝路徑處理函式
 def resource_path(relative_path):
     if getattr(sys, 'frozen', False):  # 如果是打包環境
@@ -3568,8 +4207,13 @@ def resource_path(relative_path):
 
 # 常數定義
 HEADERS = ["Chart Info.", "Total Chart", "Weekly Chart", "By Tool (Color)", "By Tool (Group)"]
-OOB_KEYS = ['HL_P95_shift', 'HL_P50_shift', 'HL_P05_shift', 'HL_sticking_shift', 'HL_trending', 'HL_high_OOC', 'HL_3O7D', 'HL_by_tool_median_shift', 'HL_record_high_low', 'HL_category_LT_shift']
+# 會影響 OOB 計算結果的設定（作為結果快取鍵的一部分；純顯示設定不列入）
+OOB_ANALYSIS_SETTING_KEYS = ['run_by_tool_median_shift', 'by_tool_median_shift_k_threshold', 'run_ewma_cusum',
+                             'run_subgroup_charts', 'run_per_tool_oob', 'auto_baseline_changepoint']
+OOB_KEYS = ['HL_P95_shift', 'HL_P50_shift', 'HL_P05_shift', 'HL_sticking_shift', 'HL_trending', 'HL_high_OOC', 'HL_3O7D', 'HL_by_tool_median_shift', 'HL_record_high_low', 'HL_category_LT_shift', 'HL_EWMA', 'HL_CUSUM']
+OOB_KEYS += [key for key in OOB_RULES.highlight_keys() if key not in OOB_KEYS]  # 新註冊規則的 HL 欄位
 OOB_SUMMARY_KEYS = [key for key in OOB_KEYS if key != 'HL_record_high_low']
+MATERIAL_ROLLUP_DISPLAY_LIMIT = 20  # Summary Dashboard 料號彙總表顯示的料號數
 
 
 class TriangleButton(QtWidgets.QPushButton):
@@ -3648,6 +4292,9 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
         self.raw_data_directory = resource_path('input/raw_charts/')
         self.image_path = resource_path('image.png')
         self.results = []
+        self.grid_rows = {}  # chart_key -> image grid 列號（display_image 當下的處理順序，results 排序後不變）
+        self.grid_results = {}  # chart_key -> 已顯示在 grid 的結果紀錄，canvas 被換出時用來記錄圖片路徑
+        self.headless = False  # 無 GUI 的服務模式 (oob_watch_service)：錯誤只印出，不跳對話框
 
         # 翻譯系統
         self.translator = get_translator()
@@ -3655,7 +4302,12 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
 
         # 性能優化：添加快取
         self.csv_cache = {}  # CSV 文件快取
+        self.prepared_cache = {}  # chart_key -> 前處理後資料；跨次執行保留，原始檔或設定列變動時重建
+        # raw_df / canvas 依需求重建；互動圖只保留最近顯示的少量 canvas，其餘換成圖片
+        self.chart_store = ChartDataStore(self.materialize_chart_data, canvas_releaser=self.on_canvas_evicted)
         self.chart_types_cache = {}  # 數據類型快取
+        self.history_lookup = None  # 開啟「新出現 / 持續」標示時，本次執行前的規則歷史
+        self.result_cache = ResultCache('oob')  # 磁碟結果快取（跨次執行）
         
         self.filter_type_combo = None
         self.filter_value_combo = None
@@ -3671,6 +4323,9 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
         # Summary Tab 中 TableWidget 屬性
         self.violation_table_label = None
         self.violation_table = None
+        self.material_rollup_label = None
+        self.material_rollup_table = None
+        self.material_rollup = None
 
         # QMainWindow 需要一個中央小部件
         self.central_widget = QtWidgets.QWidget()
@@ -4039,8 +4694,23 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
             'show_by_tool_charts': False,
             'run_by_tool_median_shift': False,
             'by_tool_median_shift_k_threshold': 1.67,
+            'run_ewma_cusum': False,
+            'run_subgroup_charts': False,
+            'run_per_tool_oob': False,
+            'auto_baseline_changepoint': False,
             'use_interactive_charts': True,
             'use_batch_id_labels': False,
+            'use_result_cache': True,
+            'enable_stage_profiling': False,
+            'enable_memory_monitor': False,
+            'memory_budget_mb': 0,
+            'resume_from_checkpoint': False,
+            'chart_priority_mode': 'workbook',
+            'priority_chart_ids': '',
+            'record_result_history': True,
+            'history_new_vs_persistent': False,
+            'export_threshold_sweep': False,
+            'partial_summary_interval_sec': 15,
             'custom_time_range_enabled': False,
             'start_time': QtCore.QDateTime.currentDateTime().addDays(-30),
             'end_time': QtCore.QDateTime.currentDateTime(),
@@ -4237,6 +4907,8 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
             # 更新表頭
             headers = [tr('group_name'), tr('chart_name'), tr('ooc_count'), tr('we_rules'), tr('oob_rules')]
             self.violation_table.setHorizontalHeaderLabels(headers)
+            self.material_rollup_label.setText(f"<b>{tr('material_rollup', 'Material Rollup')}</b>")
+            self.material_rollup_table.setHorizontalHeaderLabels(self.material_rollup_headers())
             
             # 更新統計數字標籤的前綴文字（保留數字部分）
             if hasattr(self, 'total_charts_label_summary'):
@@ -4454,6 +5126,27 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
         self.violation_table.setMinimumHeight(260)
         summary_layout.addWidget(self.violation_table)
 
+        # 料號彙總表（每個料號一列小計，依異常 chart 數排序）
+        self.material_rollup_label = QtWidgets.QLabel(f"<b>{tr('material_rollup', 'Material Rollup')}</b>")
+        self.material_rollup_label.setFont(get_app_font(12, QtGui.QFont.Weight.Bold))
+        self.material_rollup_label.setAlignment(QtCore.Qt.AlignmentFlag.AlignLeft)
+        summary_layout.addWidget(self.material_rollup_label)
+
+        self.material_rollup_table = QtWidgets.QTableWidget()
+        self.material_rollup_table.setColumnCount(len(self.material_rollup_headers()))
+        self.material_rollup_table.setHorizontalHeaderLabels(self.material_rollup_headers())
+        self.material_rollup_table.horizontalHeader().setStretchLastSection(True)
+        self.material_rollup_table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeMode.ResizeToContents)
+        self.material_rollup_table.verticalHeader().setVisible(False)
+        self.material_rollup_table.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.material_rollup_table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectionBehavior.SelectRows)
+        self.material_rollup_table.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.SingleSelection)
+        self.material_rollup_table.setAlternatingRowColors(True)
+        self.material_rollup_table.setShowGrid(False)
+        self.material_rollup_table.verticalHeader().setDefaultSectionSize(32)
+        self.material_rollup_table.setMinimumHeight(220)
+        summary_layout.addWidget(self.material_rollup_table)
+
         summary_layout.addStretch()
 
         summary_layout.setContentsMargins(20, 20, 20, 20)
@@ -4641,6 +5334,8 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
         # 清理表格內容
         if self.violation_table:
              self.violation_table.setRowCount(0) # 將行數設為 0 清空表格
+        if self.material_rollup_table:
+             self.material_rollup_table.setRowCount(0)
         print("Summary charts and table cleared.")
     
     def refresh_summary_charts(self):
@@ -4834,8 +5529,42 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
         self.violation_table.horizontalHeader().setSectionResizeMode(3, QtWidgets.QHeaderView.ResizeMode.Stretch)
         self.violation_table.horizontalHeader().setSectionResizeMode(4, QtWidgets.QHeaderView.ResizeMode.Stretch)
 
+        self.update_material_rollup_table()
+
         print("Summary Dashboard updated.")
 
+    def material_rollup_headers(self):
+        from translations import tr
+        return [tr('material_no', 'Material'), tr('rollup_charts', 'Charts'), tr('rollup_highlighted', 'Highlighted'),
+                'OOC', 'WE', 'OOB', tr('top_oob_rules', 'Top OOB Rules')]
+
+    def update_material_rollup_table(self, limit=MATERIAL_ROLLUP_DISPLAY_LIMIT):
+        """以 groupby 彙總結果表，只顯示異常 chart 數最多的前 limit 個料號（完整內容見匯出的 Material Rollup sheet）"""
+        if self.material_rollup_table is None:
+            return
+        try:
+            self.material_rollup = material_rollup(self.results, OOB_KEYS)
+        except Exception as e:
+            print(f"[Warning] 料號彙總計算失敗: {e}")
+            self.material_rollup = None
+            return
+        totals = material_totals(self.material_rollup)
+        if totals is None or totals.empty:
+            return
+        rule_columns = [col for col in totals.columns if col not in ROLLUP_COUNT_COLUMNS + ['Material_no', 'highlight_rate']]
+        totals = totals.head(limit)
+        self.material_rollup_table.setRowCount(len(totals))
+        for row_index, row in enumerate(totals.to_dict('records')):
+            values = [str(row['Material_no'])] + [str(int(row[col])) for col in ROLLUP_COUNT_COLUMNS]
+            values.append(top_rules(row, rule_columns))
+            for col_index, text in enumerate(values):
+                item = QtWidgets.QTableWidgetItem(text)
+                item.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
+                self.material_rollup_table.setItem(row_index, col_index, item)
+        self.material_rollup_table.resizeColumnsToContents()
+        self.material_rollup_table.horizontalHeader().setSectionResizeMode(len(values) - 1, QtWidgets.QHeaderView.ResizeMode.Stretch)
+        print(f"[Info] 料號彙總：{len(self.material_rollup)} 列（顯示前 {len(totals)} 個料號）")
+
     # --- UI部件 (需要確保這些方法在類別定義內) ---
     def create_start_button(self):
         button = QtWidgets.QPushButton("Start Processing", self)
@@ -4911,10 +5640,14 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
             QtWidgets.QApplication.processEvents()
 
     def process_charts(self):
-        self.results = []
+        previous_results, self.results = self.results, []
         total_charts_count = 0
         skipped_charts_count = 0
         processed_charts_count = 0
+        journal = None
+        PROFILER.enabled = PROFILE_ENV_ENABLED or bool(self.oob_settings.get('enable_stage_profiling', False))
+        PROFILER.reset('oob')
+        self.configure_memory_monitor('oob')
 
         try:
             self.validate_files_and_directories()
@@ -4923,6 +5656,7 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
             self.progress_bar.setFormat("0%")
             self.pump_ui_status("0% - Preparing...", 0, force=True)
             self.clear_image_grid()
+            self.chart_store.clear()
 
             all_charts_info = load_chart_information(self.filepath)
             total_charts_count = len(all_charts_info)
@@ -4933,9 +5667,11 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
             print("=== Building raw CSV file index ===")
             self.raw_file_index = build_raw_file_index(self.raw_data_directory)
             self.chart_types_cache = {}
+            self.history_lookup = self.load_history_lookup()
             
-            # 清空 CSV 快取（如果之前有的話）
+            # 清空原始 CSV 快取；前處理後的資料 (prepared_cache) 保留，設定變更後重新分析不必再讀檔 / 解析
             self.csv_cache.clear()
+            self.prune_prepared_cache(all_charts_info)
             print("=== 預處理完成，開始處理圖表 ===")
 
             # if self.display_gui_checkbox.isChecked():
@@ -4944,27 +5680,15 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
             execution_time = load_execution_time(self.filepath)
             
             # 從設定中獲取自定義時間範圍
-            custom_weekly_start = None
-            custom_weekly_end = None
-            if self.oob_settings.get('custom_time_range_enabled', False):
-                # 將 QDate 或 QDateTime 轉換為 pandas datetime
-                qt_start = self.oob_settings['start_time']
-                qt_end = self.oob_settings['end_time']
-                
-                # 支持 QDate 和 QDateTime 兼容
-                if isinstance(qt_start, QtCore.QDateTime):
-                    custom_weekly_start = pd.to_datetime(f"{qt_start.date().year()}-{qt_start.date().month():02d}-{qt_start.date().day():02d} 00:00:00")
-                else:  # QDate
-                    custom_weekly_start = pd.to_datetime(f"{qt_start.year()}-{qt_start.month():02d}-{qt_start.day():02d} 00:00:00")
-                
-                if isinstance(qt_end, QtCore.QDateTime):
-                    custom_weekly_end = pd.to_datetime(f"{qt_end.date().year()}-{qt_end.date().month():02d}-{qt_end.date().day():02d} 23:59:59")
-                else:  # QDate
-                    custom_weekly_end = pd.to_datetime(f"{qt_end.year()}-{qt_end.month():02d}-{qt_end.day():02d} 23:59:59")
-                
-                print(f" - 自定義時間範圍: {custom_weekly_start} to {custom_weekly_end}")
+            custom_weekly_start, custom_weekly_end = self.get_custom_time_range()
+
+            # 排程需要上次的違規紀錄，必須在開啟（覆寫）journal 之前讀取
+            schedule = self.build_chart_schedule(all_charts_info, previous_results)
+            previous_results = None
+            self._last_partial_publish_ms = QtCore.QDateTime.currentMSecsSinceEpoch()
+            journal = self.open_run_journal(execution_time, custom_weekly_start, custom_weekly_end)
 
-            for i, (_, chart_info) in enumerate(all_charts_info.iterrows()):
+            for i, (position, chart_info) in enumerate(schedule):
                 group_name = str(chart_info['GroupName'])
                 chart_name = str(chart_info['ChartName'])
                 chart_key = f"{group_name}_{chart_name}"
@@ -4972,76 +5696,59 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
                 chart_label = f"{group_name}/{chart_name}"
                 self.pump_ui_status(f"{current_percent}% - Loading CSV {chart_label}", current_percent, force=True)
                 print(f"\n正在處理圖表: GroupName={group_name}, ChartName={chart_name}")
+                PROFILER.set_chart(chart_key)
+                journal_key = f"{position}|{chart_key}"
+                filepath = None
+                resumed = None
+                chart_failed = False
+                processed_before = processed_charts_count
 
                 try:
-                    filepath = find_matching_file_from_index(self.raw_file_index, group_name, chart_name)
-                    
-                    if filepath and os.path.exists(filepath):
-                        # 性能優化：使用快取讀取 CSV
-                        raw_df = self.get_cached_csv(filepath)
-                        
-                        if raw_df is not None:
-                            print(f" - 原始資料 shape: {raw_df.shape}")
-
-                            # 性能優化：使用預處理的數據類型
-                            if chart_key not in self.chart_types_cache and 'point_val' in raw_df.columns:
-                                self.chart_types_cache[chart_key] = determine_data_type(raw_df['point_val'].dropna())
-                            data_type = self.chart_types_cache.get(chart_key, 'continuous')
-                            chart_info = chart_info.copy()  # 避免修改原始數據
-                            chart_info['data_type'] = data_type
-                            print(f" - 使用快取的數據類型: {data_type}")
-
-                            if 'point_time' in raw_df.columns:
-                                raw_df['point_time'] = pd.to_datetime(raw_df['point_time'], errors='coerce')
-                                raw_df.dropna(subset=['point_time'], inplace=True)
-
-                            self.pump_ui_status(f"{current_percent}% - Preprocessing {chart_label}", force=False)
-                            is_successful, processed_df, updated_chart_info = preprocess_data(chart_info, raw_df)
-
-                            if not is_successful or processed_df is None or processed_df.empty:
-                                print(f"[Info] 圖表 {group_name}/{chart_name} 預處理失敗或資料為空，跳過。")
-                                skipped_charts_count += 1
-                            else:
-                                print(f" - 預處理後資料 shape: {processed_df.shape}")
-                                print(f" - 準備分析圖表: {group_name}/{chart_name}")
-
-                                show_charts_gui = self.oob_settings.get('show_charts_gui', True)
-                                self.pump_ui_status(f"{current_percent}% - Analyzing OOB {chart_label}", force=True)
-
-                                # 從設定中檢查是否使用互動式圖表和 Batch_ID 標籤
-                                use_interactive = self.oob_settings.get('use_interactive_charts', True)
-                                use_batch_id = self.oob_settings.get('use_batch_id_labels', False)
-                                result = self.analyze_chart(
-                                    execution_time, processed_df, updated_chart_info,
-                                    use_interactive, use_batch_id,
-                                    custom_weekly_start, custom_weekly_end,
-                                    render_charts=show_charts_gui
-                                )
-
-                                if result:
-                                    self.results.append(result)
-                                    processed_charts_count += 1
-
-                                    if show_charts_gui:
-                                        # 檢查是否有互動圖表或靜態圖表
-                                        has_interactive = 'spc_canvas' in result and 'weekly_canvas' in result
-                                        has_static = 'chart_path' in result and 'weekly_chart_path' in result
-                                        
-                                        if has_interactive or has_static:
-                                            self.pump_ui_status(f"{current_percent}% - Rendering UI chart {chart_label}", force=True)
-                                            self.display_image(result, len(self.results) - 1)
-                                            self.pump_ui_status(f"{current_percent}% - Rendered UI chart {chart_label}", force=False)
-                                            chart_type = "互動式" if has_interactive else "靜態"
-                                            print(f" - 顯示{chart_type}圖表完成: {group_name}/{chart_name}")
-                                        else:
-                                            print(f"[Warning] 圖表 {group_name}/{chart_name} 缺少圖表資料，無法顯示。")
-                                    else:
-                                        print(f" - GUI 顯示已禁用，跳過顯示圖表: {group_name}/{chart_name}")
+                    with PROFILER.stage('file_lookup'):
+                        filepath = find_matching_file_from_index(self.raw_file_index, group_name, chart_name)
+
+                    if journal is not None:
+                        resumed = journal.get(journal_key, file_source_signature(filepath))
+                    if resumed is not None:
+                        if resumed['status'] == 'processed':
+                            result = self.make_result_record(chart_key, dict(resumed['record']), filepath, chart_info)
+                            self.results.append(result)
+                            processed_charts_count += 1
+                            if self.oob_settings.get('show_charts_gui', True):
+                                self.display_image(result, len(self.results) - 1)
+                        else:
+                            skipped_charts_count += 1
+                        print(f"[Info] 圖表 {group_name}/{chart_name} 已在 checkpoint 中完成 ({resumed['status']})，略過計算。")
+                    elif filepath and os.path.exists(filepath):
+                        show_charts_gui = self.oob_settings.get('show_charts_gui', True)
+                        chart_info, result = self.load_and_analyze_chart(
+                            filepath, chart_key, chart_info, execution_time,
+                            custom_weekly_start, custom_weekly_end,
+                            render_charts=show_charts_gui, status_prefix=f"{current_percent}% - "
+                        )
+
+                        if result:
+                            result = self.make_result_record(chart_key, result, filepath, chart_info)
+                            self.results.append(result)
+                            processed_charts_count += 1
+
+                            if show_charts_gui:
+                                # 檢查是否有互動圖表或靜態圖表
+                                has_interactive = 'spc_canvas' in result and 'weekly_canvas' in result
+                                has_static = 'chart_path' in result and 'weekly_chart_path' in result
+                                
+                                if has_interactive or has_static:
+                                    self.pump_ui_status(f"{current_percent}% - Rendering UI chart {chart_label}", force=True)
+                                    with PROFILER.stage('rendering'):
+                                        self.display_image(result, len(self.results) - 1)
+                                    self.pump_ui_status(f"{current_percent}% - Rendered UI chart {chart_label}", force=False)
+                                    chart_type = "互動式" if has_interactive else "靜態"
+                                    print(f" - 顯示{chart_type}圖表完成: {group_name}/{chart_name}")
                                 else:
-                                    print(f"[Info] 圖表 {group_name}/{chart_name} 分析返回 None，跳過結果記錄。")
-                                    skipped_charts_count += 1
+                                    print(f"[Warning] 圖表 {group_name}/{chart_name} 缺少圖表資料，無法顯示。")
+                            else:
+                                print(f" - GUI 顯示已禁用，跳過顯示圖表: {group_name}/{chart_name}")
                         else:
-                            print(f"[Error] 無法讀取檔案: {filepath}")
                             skipped_charts_count += 1
                     else:
                         print(f"[Info] 圖表 {group_name}/{chart_name} 對應檔案 {filepath} 不存在，跳過處理。")
@@ -5050,10 +5757,24 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
                 except FileNotFoundError:
                     print(f"[Warning] 檔案未找到，跳過圖表: {group_name}/{chart_name}")
                     skipped_charts_count += 1
+                    chart_failed = True
                 except Exception as e:
                     print(f"[Error] 處理圖表 {group_name}/{chart_name} 時發生錯誤: {str(e)}")
                     traceback.print_exc()
                     skipped_charts_count += 1
+                    chart_failed = True
+
+                # 發生例外的 chart 不寫入 journal，續跑時會重新計算
+                # journal 只供續跑；結果仍留在 self.results 直到 save_results（見 run_journal 模組說明）
+                if journal is not None and resumed is None and not chart_failed:
+                    if processed_charts_count > processed_before:
+                        journal.append(journal_key, self.journal_record(self.results[-1]), 'processed',
+                                       file_source_signature(filepath))
+                    else:
+                        journal.append(journal_key, None, 'skipped', file_source_signature(filepath))
+
+                if MEMORY_MONITOR.enabled:
+                    self.enforce_memory_budget(f"after {group_name}/{chart_name}")
 
                 percent = min(85, int(((i + 1) / max(total_charts_count, 1)) * 85))
                 self.progress_bar.setValue(max(self.progress_bar.value(), percent))
@@ -5061,12 +5782,22 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
                     f"{percent}% - {processed_charts_count}/{total_charts_count} {tr('processed')}",
                     force=(i == total_charts_count - 1)
                 )
-
+                if i < total_charts_count - 1:
+                    self.publish_partial_summary(total_charts_count, processed_charts_count, skipped_charts_count)
+
+            PROFILER.set_chart(None)
+            if journal is not None:
+                journal.mark_complete()
+            # 輸出檔維持設定檔順序，不受處理順序影響
+            workbook_order = {f"{row['GroupName']}_{row['ChartName']}": position for position, row in schedule}
+            self.results.sort(key=lambda r: workbook_order.get(f"{r.get('group_name')}_{r.get('chart_name')}", len(workbook_order)))
             self.progress_bar.setValue(max(self.progress_bar.value(), 85))
             self.progress_bar.setFormat("85% - Saving results...")
             self.pump_ui_status("85% - Updating summary dashboard...", self.progress_bar.value(), force=True)
 
             self.update_summary_dashboard(total_charts_count, processed_charts_count, skipped_charts_count)
+            self.write_partial_summary(complete=True)
+            self.record_result_history()
 
             if self.results:
                 self.pump_ui_status("85% - Saving results...", 85, force=True)
@@ -5080,6 +5811,11 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
             self.pump_ui_status(f"100% - {tr('complete')}!", 100, force=True)
             QtCore.QTimer.singleShot(3000, self.progress_bar.hide)
 
+            if PROFILER.enabled:
+                self.write_performance_report()
+            if MEMORY_MONITOR.enabled:
+                self.write_memory_report()
+
             # 清理快取（可選）
             print(f"處理完成，清理快取。CSV 快取大小: {len(self.csv_cache)}")
             # 如果記憶體有限，可以清空快取
@@ -5092,6 +5828,9 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
         except Exception as e:
             self.show_error("Processing Error", str(e))
             traceback.print_exc()
+        finally:
+            if journal is not None:
+                journal.close()
 
     # --- 新增清理 Grid Layout 的方法 (針對第一個分頁) ---
     def clear_image_grid(self):
@@ -5112,6 +5851,8 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
                     item.widget().deleteLater()
                 elif item.layout():
                      self.clear_layout(item.layout())
+        self.grid_rows.clear()
+        self.grid_results.clear()
         print("Image grid cleared.")
 
     def clear_layout(self, layout):
@@ -5214,23 +5955,138 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
         """
         if filepath not in self.csv_cache:
             try:
-                self.csv_cache[filepath] = pd.read_csv(filepath)
+                # 快取以精簡 dtype 保存（category 字串、datetime64 時間、可還原時 float32），取用時還原
+                self.csv_cache[filepath] = compact_chart_frame(pd.read_csv(filepath))
                 print(f"  CSV 文件已快取: {os.path.basename(filepath)}")
             except Exception as e:
                 print(f"  CSV 讀取錯誤 {filepath}: {e}")
                 return None
         
-        return self.csv_cache[filepath].copy() if self.csv_cache[filepath] is not None else None
+        return expand_chart_frame(self.csv_cache[filepath])
+
+
+    def load_and_analyze_chart(self, filepath, chart_key, chart_info, execution_time,
+                               custom_weekly_start=None, custom_weekly_end=None,
+                               render_charts=True, status_prefix=''):
+        """
+        讀檔 → 數據類型判斷 → 前處理 → analyze_chart。
+        回傳 (加上 data_type 的 chart_info, result)；讀檔 / 前處理失敗或分析無結果時 result 為 None。
+        """
+        group_name = str(chart_info['GroupName'])
+        chart_name = str(chart_info['ChartName'])
+        chart_label = f"{group_name}/{chart_name}"
+
+        # 同一個 session 已前處理過且原始檔、設定列未變動：直接重新分析
+        source_info = chart_info
+        prepared = self.get_prepared_chart(chart_key, filepath, source_info)
+        if prepared is not None:
+            data_type, processed_df, updated_chart_info = prepared
+            chart_info = chart_info.copy()
+            chart_info['data_type'] = data_type
+            print(f" - 使用 session 中已前處理的資料: {chart_label} {processed_df.shape}")
+            return chart_info, self.analyze_prepared_chart(
+                chart_label, processed_df, updated_chart_info.copy(), execution_time,
+                custom_weekly_start, custom_weekly_end, render_charts, status_prefix
+            )
+
+        # 性能優化：使用快取讀取 CSV
+        with PROFILER.stage('csv_read'):
+            raw_df = self.get_cached_csv(filepath)
+        if raw_df is None:
+            print(f"[Error] 無法讀取檔案: {filepath}")
+            return chart_info, None
+        print(f" - 原始資料 shape: {raw_df.shape}")
+
+        # 性能優化：使用預處理的數據類型
+        if chart_key not in self.chart_types_cache and 'point_val' in raw_df.columns:
+            with PROFILER.stage('data_type_detection'):
+                self.chart_types_cache[chart_key] = determine_data_type(raw_df['point_val'].dropna())
+        data_type = self.chart_types_cache.get(chart_key, 'continuous')
+        chart_info = chart_info.copy()  # 避免修改原始數據
+        chart_info['data_type'] = data_type
+        print(f" - 使用快取的數據類型: {data_type}")
+
+        self.pump_ui_status(f"{status_prefix}Preprocessing {chart_label}", force=False)
+        with PROFILER.stage('preprocessing'):
+            if 'point_time' in raw_df.columns:
+                raw_df['point_time'] = pd.to_datetime(raw_df['point_time'], errors='coerce')
+                raw_df.dropna(subset=['point_time'], inplace=True)
+            is_successful, processed_df, updated_chart_info = preprocess_data(chart_info, raw_df)
+
+        if not is_successful or processed_df is None or processed_df.empty:
+            print(f"[Info] 圖表 {group_name}/{chart_name} 預處理失敗或資料為空，跳過。")
+            return chart_info, None
+
+        print(f" - 預處理後資料 shape: {processed_df.shape}")
+        self.store_prepared_chart(chart_key, filepath, source_info, data_type, processed_df, updated_chart_info)
+        return chart_info, self.analyze_prepared_chart(
+            chart_label, processed_df, updated_chart_info, execution_time,
+            custom_weekly_start, custom_weekly_end, render_charts, status_prefix
+        )
+
+    def analyze_prepared_chart(self, chart_label, processed_df, updated_chart_info, execution_time,
+                               custom_weekly_start=None, custom_weekly_end=None,
+                               render_charts=True, status_prefix=''):
+        """前處理後的資料 → analyze_chart；無結果時回傳 None"""
+        print(f" - 準備分析圖表: {chart_label}")
+        self.pump_ui_status(f"{status_prefix}Analyzing OOB {chart_label}", force=True)
+
+        # 從設定中檢查是否使用互動式圖表和 Batch_ID 標籤
+        use_interactive = self.oob_settings.get('use_interactive_charts', True)
+        use_batch_id = self.oob_settings.get('use_batch_id_labels', False)
+        result = self.analyze_chart(
+            execution_time, processed_df, updated_chart_info,
+            use_interactive, use_batch_id,
+            custom_weekly_start, custom_weekly_end,
+            render_charts=render_charts
+        )
+        if not result:
+            print(f"[Info] 圖表 {chart_label} 分析返回 None，跳過結果記錄。")
+        return result
 
+    # === session 內保留的前處理資料 ===
+    def _prepared_signature(self, filepath, chart_info):
+        # 設定列識別不含讀檔後加入的 data_type（結果記錄中的 chart_info 已帶有 data_type）
+        source = file_source_signature(filepath)
+        if source is None:
+            return None
+        return tuple(source), make_cache_key({key: value for key, value in chart_info.items() if key != 'data_type'})
+
+    def get_prepared_chart(self, chart_key, filepath, chart_info):
+        """回傳 (data_type, processed_df, 前處理後的 chart_info)；沒有或已過期時回傳 None；processed_df 為還原後的新副本"""
+        entry = self.prepared_cache.get(chart_key)
+        if entry is None:
+            return None
+        signature, filepath_cached, (data_type, compact_df, updated_chart_info) = entry
+        if filepath_cached != filepath or signature != self._prepared_signature(filepath, chart_info):
+            self.prepared_cache.pop(chart_key, None)
+            return None
+        return data_type, expand_chart_frame(compact_df), updated_chart_info
+
+    def store_prepared_chart(self, chart_key, filepath, chart_info, data_type, processed_df, updated_chart_info):
+        try:
+            signature = self._prepared_signature(filepath, chart_info)
+        except Exception as e:
+            print(f"[Warning] 無法記錄 {chart_key} 的前處理資料: {e}")
+            return
+        if signature is not None:
+            # 保存精簡 dtype 的副本：analyze_chart 會在 chart_info 寫入設定
+            self.prepared_cache[chart_key] = (signature, filepath,
+                                              (data_type, compact_chart_frame(processed_df), updated_chart_info.copy()))
+
+    def prune_prepared_cache(self, all_charts_info):
+        """移除設定檔中已不存在的 chart；原始檔 / 設定列的變動在取用時檢查"""
+        keys = {f"{row['GroupName']}_{row['ChartName']}" for _, row in all_charts_info.iterrows()}
+        for chart_key in [key for key in self.prepared_cache if key not in keys]:
+            del self.prepared_cache[chart_key]
+        if self.prepared_cache:
+            print(f"[Info] session 中保留 {len(self.prepared_cache)} 張 chart 的前處理資料，重新分析不需讀檔")
 
     def analyze_chart(self, execution_time, raw_df, chart_info, use_interactive_charts=False, use_batch_id_labels=False, custom_weekly_start=None, custom_weekly_end=None, render_charts=True):
         # 補齊 rule_list，確保每個 chart 都有正確的 WE 規則清單以及 CU1/CU2 趨勢規則
+        chart_info = as_chart_info(chart_info)
         if 'rule_list' not in chart_info or not chart_info['rule_list']:
-            rule_list = []
-            for rule in ['WE1','WE2','WE3','WE4','WE5','WE6','WE7','WE8','WE9','WE10','CU1','CU2']:
-                if chart_info.get(rule, 'N') == 'Y':
-                    rule_list.append(rule)
-        chart_info['rule_list'] = rule_list
+            chart_info['rule_list'] = list(chart_info.we_rules)
         group_name = str(chart_info.get('group_name', chart_info.get('GroupName', 'Unknown')))
         chart_name = str(chart_info.get('chart_name', chart_info.get('ChartName', 'Unknown')))
         self.pump_ui_status(f"Analyzing OOB {group_name}/{chart_name}", force=False)
@@ -5241,46 +6097,39 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
                 print(f" - analyze_chart: 'point_time' column missing or not datetime type for {group_name}/{chart_name}. Skipping analysis.")
                 return None
 
-        latest_raw_data_time = raw_df['point_time'].max()
-
-        # 優先使用自定義週期時間範圍
-        if custom_weekly_start is not None and custom_weekly_end is not None:
-            print(f" - analyze_chart: 使用自定義週期時間範圍: {custom_weekly_start} to {custom_weekly_end}")
-            weekly_start_date = custom_weekly_start
-            weekly_end_date = custom_weekly_end
-        else:
-            # 如果沒有自定義時間範圍，使用原本的邏輯
-            if execution_time is None or pd.isna(execution_time):
-                print(" - analyze_chart: execution_time is None or NaT, using latest data time as weekly end date.")
-                weekly_end_date = latest_raw_data_time
-            else:
-                print(f" - analyze_chart: execution_time is provided ({execution_time}), using it as weekly end date.")
-                weekly_end_date = execution_time
-
-            if pd.isna(weekly_end_date):
-                print(f" - analyze_chart: Unable to determine weekly end date (latest_raw_data_time is also invalid). Skipping analysis.")
-                return None
-
-            weekly_start_date = weekly_end_date - pd.Timedelta(days=6)
-
-        # baseline 邏輯保持不變：以週期開始時間的前一秒作為基線結束
-        baseline_end_date = weekly_start_date - pd.Timedelta(seconds=1)
-        # 這裡使用初始的一年基線範圍
-        initial_baseline_start_date = baseline_end_date - pd.Timedelta(days=365)
-
-        print(f" - analyze_chart: 計算出的時間範圍")
-        print(f"   Weekly 週期: {weekly_start_date} to {weekly_end_date}")
-        print(f"   Initial Baseline 基線: {initial_baseline_start_date} to {baseline_end_date}")
-        print(f"   Baseline 時間長度: {(baseline_end_date - initial_baseline_start_date).days} 天")
+        analysis_window = resolve_analysis_window(raw_df, execution_time, custom_weekly_start, custom_weekly_end)
+        if analysis_window is None:
+            return None
+        weekly_start_date, weekly_end_date, initial_baseline_start_date, baseline_end_date = analysis_window
 
         try:
+            # === 結果快取：相同設定列 + 相同資料 + 相同時間窗 + 相同設定 + 相同程式版本 ===
+            cache_key = None
+            cached_entry = None
+            # 資料指紋同時供結果快取與 RULE_STAGES 使用，關閉磁碟快取時規則結果記憶仍然有效
+            data_fingerprint = dataframe_fingerprint(raw_df)
+            if self.oob_settings.get('use_result_cache', True):
+                cache_key = self.result_cache.make_key(
+                    chart_info,
+                    data_fingerprint,
+                    (weekly_start_date, weekly_end_date, initial_baseline_start_date, baseline_end_date),
+                    {key: self.oob_settings.get(key) for key in OOB_ANALYSIS_SETTING_KEYS},
+                    analysis_code_version(),
+                )
+                cached_entry = self.result_cache.get(cache_key)
+                if cached_entry is not None:
+                    print(f" - analyze_chart: 使用快取結果 for {group_name}/{chart_name}")
+
             # === 提前進行數據類型判斷 ===
-            if raw_df is None or raw_df.empty or 'point_val' not in raw_df.columns:
+            if cached_entry is not None:
+                data_type = cached_entry['data_type']
+            elif raw_df is None or raw_df.empty or 'point_val' not in raw_df.columns:
                 print(" - analyze_chart: raw_df 無效或為空，預設為連續型")
                 data_type = 'continuous'
             else:
                 # 使用全部 point_val（移除 NaN）來判斷是否為離散
-                data_type = determine_data_type(raw_df['point_val'].dropna())
+                with PROFILER.stage('data_type_detection'):
+                    data_type = determine_data_type(raw_df['point_val'].dropna())
                 print(f" - analyze_chart: 數據類型判斷結果: {data_type}")
             
             chart_info['data_type'] = data_type
@@ -5292,22 +6141,42 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
                 'run_by_tool_median_shift',
                 False
             )
+            chart_info['run_ewma_cusum'] = self.oob_settings.get('run_ewma_cusum', False)
+            chart_info['run_subgroup_charts'] = self.oob_settings.get('run_subgroup_charts', False)
+            chart_info['run_per_tool_oob'] = self.oob_settings.get('run_per_tool_oob', False)
+            chart_info['auto_baseline_changepoint'] = self.oob_settings.get('auto_baseline_changepoint', False)
+
+            # 規則結果記憶的識別：設定列 + 資料 + 程式版本，不含規則自己的開關 / 門檻（由 RULE_STAGES 各自處理）
+            stage_key = None
+            if cached_entry is None:
+                stage_settings = OOB_RULES.stage_settings()
+                stage_key = self.result_cache.make_key(
+                    {key: value for key, value in chart_info.items() if key not in stage_settings},
+                    data_fingerprint,
+                    analysis_code_version(),
+                )
 
             # === 根據數據類型分流處理 ===
-            if data_type == 'discrete':
+            if cached_entry is not None:
+                result = dict(cached_entry['result'])
+            elif data_type == 'discrete':
                 print(f" - analyze_chart: 執行離散型專用流程 for {group_name}/{chart_name}")
-                result = self._process_discrete_chart(raw_df, chart_info, weekly_start_date, weekly_end_date, 
-                                                    initial_baseline_start_date, baseline_end_date)
+                with PROFILER.stage('discrete_oob'):
+                    result = self._process_discrete_chart(raw_df, chart_info, weekly_start_date, weekly_end_date, 
+                                                        initial_baseline_start_date, baseline_end_date,
+                                                        stage_key=stage_key)
             else:
                 print(f" - analyze_chart: 執行連續型流程 for {group_name}/{chart_name}")
                 result = process_single_chart(chart_info.copy(), raw_df, initial_baseline_start_date, 
-                                            baseline_end_date, weekly_start_date, weekly_end_date)
+                                            baseline_end_date, weekly_start_date, weekly_end_date,
+                                            stage_key=stage_key)
                 if result:
                     result['data_type'] = 'continuous'
 
             if result is None:
                 print(f" - analyze_chart: 處理返回 None for {group_name}/{chart_name}")
                 return None
+            analysis_result = dict(result)
 
             # === 共同的後處理步驟 ===
             print(f" - analyze_chart: 準備生成圖表 for {group_name}/{chart_name}")
@@ -5331,38 +6200,61 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
             violated_rules = None
 
             if use_interactive_charts and render_charts:
-                # 生成互動式 SPC 圖表（返回 FigureCanvas）
-                spc_canvas, violated_rules = plot_spc_chart_interactive(raw_df, chart_info, weekly_start_date, weekly_end_date, record_results=record_results, use_batch_id_labels=use_batch_id_labels, oob_info=oob_summary)
-                print(f" - analyze_chart: plot_spc_chart_interactive 完成")
-
-                # 生成互動式週圖表（返回 FigureCanvas）
-                weekly_canvas = plot_weekly_spc_chart_interactive(raw_df, chart_info, weekly_start_date, weekly_end_date, record_results=record_results, use_batch_id_labels=use_batch_id_labels, oob_info=oob_summary)
-                print(f" - analyze_chart: plot_weekly_spc_chart_interactive 完成")
+                with PROFILER.stage('rendering'):
+                    # 生成互動式 SPC 圖表（返回 FigureCanvas）
+                    spc_canvas, violated_rules = plot_spc_chart_interactive(raw_df, chart_info, weekly_start_date, weekly_end_date, record_results=record_results, use_batch_id_labels=use_batch_id_labels, oob_info=oob_summary)
+                    print(f" - analyze_chart: plot_spc_chart_interactive 完成")
+
+                    # 生成互動式週圖表（返回 FigureCanvas）
+                    weekly_canvas = plot_weekly_spc_chart_interactive(raw_df, chart_info, weekly_start_date, weekly_end_date, record_results=record_results, use_batch_id_labels=use_batch_id_labels, oob_info=oob_summary)
+                    print(f" - analyze_chart: plot_weekly_spc_chart_interactive 完成")
                 
                 # 儲存 canvas 供 UI 使用
                 result['spc_canvas'] = spc_canvas
                 result['weekly_canvas'] = weekly_canvas
             elif render_charts:
-                # 生成靜態 SPC 圖表
-                image_path, violated_rules = plot_spc_chart(raw_df, chart_info, weekly_start_date, weekly_end_date)
-                print(f" - analyze_chart: plot_spc_chart 完成，image_path: {image_path}")
-
-                # 生成靜態週圖表
-                weekly_image_path = plot_weekly_spc_chart(raw_df, chart_info, weekly_start_date, weekly_end_date)
-                print(f" - analyze_chart: plot_weekly_spc_chart 完成，weekly_image_path: {weekly_image_path}")
+                with PROFILER.stage('rendering'):
+                    # 生成靜態 SPC 圖表
+                    image_path, violated_rules = plot_spc_chart(raw_df, chart_info, weekly_start_date, weekly_end_date)
+                    print(f" - analyze_chart: plot_spc_chart 完成，image_path: {image_path}")
+
+                    # 生成靜態週圖表
+                    weekly_image_path = plot_weekly_spc_chart(raw_df, chart_info, weekly_start_date, weekly_end_date)
+                    print(f" - analyze_chart: plot_weekly_spc_chart 完成，weekly_image_path: {weekly_image_path}")
+            elif cached_entry is not None:
+                violated_rules = dict(cached_entry['violated_rules'])
+                print(" - analyze_chart: skipped chart rendering; reused cached violated rules")
             else:
-                violated_rules = compute_violated_rules(raw_df, chart_info, weekly_start_date, weekly_end_date)
+                with PROFILER.stage('we_rules'):
+                    violated_rules = compute_violated_rules(raw_df, chart_info, weekly_start_date, weekly_end_date)
                 print(" - analyze_chart: skipped chart rendering; computed violated rules only")
 
             # Cpk 計算
-            weekly_data = raw_df[(raw_df['point_time'] >= weekly_start_date) & 
-                               (raw_df['point_time'] <= weekly_end_date)].copy()
-            cpk_result = calculate_cpk(weekly_data, chart_info)
-            result['Cpk'] = cpk_result.get('Cpk', np.nan) if cpk_result else np.nan
+            if cached_entry is not None:
+                result['Cpk'] = cached_entry['Cpk']
+                result['Ppk'] = cached_entry.get('Ppk', np.nan)
+            else:
+                with PROFILER.stage('cpk'):
+                    weekly_data = raw_df[(raw_df['point_time'] >= weekly_start_date) & 
+                                       (raw_df['point_time'] <= weekly_end_date)].copy()
+                    cpk_result = calculate_cpk(weekly_data, chart_info)
+                result['Cpk'] = cpk_result.get('Cpk', np.nan) if cpk_result else np.nan
+                result['Ppk'] = cpk_result.get('Ppk', np.nan) if cpk_result else np.nan
+
+            if cache_key and cached_entry is None and violated_rules is not None:
+                self.result_cache.put(cache_key, {
+                    'data_type': data_type,
+                    'result': analysis_result,
+                    'violated_rules': violated_rules,
+                    'Cpk': result['Cpk'],
+                    'Ppk': result['Ppk'],
+                })
+            result['result_cache_key'] = cache_key
 
             # 更新結果
             result['violated_rules'] = violated_rules if violated_rules is not None else {}
-            self.build_result(result, image_path, weekly_image_path)
+            self.build_result(result, image_path, weekly_image_path,
+                              history=self.history_lookup, week=week_key(weekly_end_date))
 
             # 儲存原始處理後的資料，供 UI 在需要時繪製額外圖表
             try:
@@ -5378,7 +6270,8 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
                         raw_df['Matching'] = 'Unknown'
                         result['raw_df'] = raw_df
                 else:
-                    result['raw_df'] = raw_df.copy()
+                    # 不再複製：結果紀錄只在 chart_store 中保留最近使用的少量 DataFrame
+                    result['raw_df'] = raw_df
 
                 result['weekly_start_date'] = weekly_start_date
                 result['weekly_end_date'] = weekly_end_date
@@ -5401,11 +6294,13 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
                 traceback.print_exc()
                 return None
 
-    def _process_discrete_chart(self, raw_df, chart_info, weekly_start_date, weekly_end_date, 
-                              initial_baseline_start_date, baseline_end_date):
+    @staticmethod
+    def _process_discrete_chart(raw_df, chart_info, weekly_start_date, weekly_end_date,
+                                initial_baseline_start_date, baseline_end_date, stage_key=None):
         """
         離散型數據的專用處理流程，包含 record high low 判斷
         """
+        chart_info = as_chart_info(chart_info)
         group_name = chart_info.get('group_name', 'Unknown')
         chart_name = chart_info.get('chart_name', 'Unknown')
         
@@ -5433,6 +6328,9 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
             else:
                 actual_baseline_start_date = initial_baseline_start_date
 
+            if chart_info.auto_baseline_changepoint and not baseline_insufficient:
+                actual_baseline_start_date = changepoint_baseline_start(raw_df, actual_baseline_start_date, baseline_end_date)
+
             # 篩選最終數據
             baseline_data = raw_df[(raw_df['point_time'] >= actual_baseline_start_date) & 
                                  (raw_df['point_time'] <= baseline_end_date)].copy()
@@ -5448,25 +6346,18 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
                 print(f" - _process_discrete_chart: 週數據為空，跳過處理")
                 return None
 
-            # === 計算統計數據 ===
-            def calculate_statistics(data):
-                if data.shape[0] <= 1:
-                    sigma = 0.0
-                else:
-                    sigma = data['point_val'].std()
-                if np.isnan(sigma):
-                    sigma = 0.0
-                return {
-                    'values': data['point_val'].values,
-                    'cnt': data.shape[0],
-                    'mean': data['point_val'].mean(),
-                    'sigma': sigma
-                }
-
-            base_data_dict = calculate_statistics(baseline_data) if not baseline_empty else None
-            weekly_data_dict = calculate_statistics(weekly_data)
+            # === 規則輸入 (統計數據、OOC…) 由 RuleContext 依需求計算一次 ===
+            window = (weekly_start_date, weekly_end_date, actual_baseline_start_date, baseline_end_date)
+            baseline_valid = not baseline_insufficient and not baseline_empty
+            context = RuleContext(
+                OOB_RULES, chart_info, 'discrete', baseline_valid=baseline_valid,
+                stage_key=(stage_key, window, baseline_valid) if stage_key is not None else None,
+                raw_df=raw_df, weekly_data=weekly_data, baseline_data=baseline_data, window=window,
+            )
+            weekly_data_dict = context['weekly_stats']
 
             if not baseline_empty:
+                base_data_dict = context['baseline_stats']
                 print(f" - _process_discrete_chart: 基線統計 - cnt={base_data_dict['cnt']}, mean={base_data_dict['mean']}")
             else:
                 print(f" - _process_discrete_chart: 基線數據為空，跳過基線統計輸出")
@@ -5494,102 +6385,17 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
                 'data_type': 'discrete'
             }
 
-            if not baseline_insufficient and not baseline_empty:
-                # === OOC 計算 ===
-                print(" - _process_discrete_chart: 計算 OOC...")
-                weekly_df = pd.DataFrame({'point_val': weekly_data['point_val']})
-                ooc_results = ooc_calculator(weekly_df, chart_info.get('UCL'), chart_info.get('LCL'))
-                ooc_highlight = review_ooc_results(ooc_results[1], ooc_results[2])
-                three_o7d_highlight = review_3o7d_results(ooc_results[1])
-                result['ooc_cnt'] = ooc_results[1]
-                
-                # === 離散型 OOB 計算 ===
-                print(" - _process_discrete_chart: 計算離散型 OOB...")
-                discrete_oob_result = discrete_oob_calculator(
-                    base_data_dict, weekly_data_dict, chart_info,
-                    raw_df, weekly_start_date, weekly_end_date,
-                    actual_baseline_start_date, baseline_end_date
-                )
-                
-                # === Record High Low 計算 ===
-                print(" - _process_discrete_chart: 計算 record high low...")
-                # DEBUG: 輸出時間範圍信息
-                print(f" - DEBUG: 基線時間範圍 - 從 {actual_baseline_start_date} 到 {baseline_end_date}")
-                print(f" - DEBUG: 當週時間範圍 - 從 {weekly_start_date} 到 {weekly_end_date}")
-                print(f" - DEBUG: 基線結束與當週開始間隔 = {weekly_start_date - baseline_end_date}")
-                record_results = record_high_low_calculator(
-                    weekly_data['point_val'].values, 
-                    baseline_data['point_val'].values
-                )
-                if chart_info.get('run_by_tool_median_shift', False):
-                    by_tool_median_results = by_tool_median_shift_calculator(
-                        raw_df, baseline_data, weekly_data, chart_info
-                    )
-                else:
-                    by_tool_median_results = default_by_tool_median_shift_result('Disabled')
-                
-                # === 更新結果 ===
-                result.update({
-                    'HL_P95_shift': discrete_oob_result.get('HL_P95_shift', 'NO_HIGHLIGHT'),
-                    'HL_P50_shift': discrete_oob_result.get('HL_P50_shift', 'NO_HIGHLIGHT'),
-                    'HL_P05_shift': discrete_oob_result.get('HL_P05_shift', 'NO_HIGHLIGHT'),
-                    'HL_sticking_shift': discrete_oob_result.get('HL_sticking_shift', 'NO_HIGHLIGHT'),
-                    'HL_trending': discrete_oob_result.get('HL_trending', 'NO_HIGHLIGHT'),
-                    'HL_high_OOC': ooc_highlight,
-                    'HL_3O7D': three_o7d_highlight,
-                    'HL_by_tool_median_shift': by_tool_median_results.get('HL_by_tool_median_shift', 'NO_HIGHLIGHT'),
-                    'HL_category_LT_shift': discrete_oob_result.get('HL_category_LT_shift', 'NO_HIGHLIGHT'),
-                    'HL_record_high_low': record_results.get('highlight_status', 'NO_HIGHLIGHT'),
-                    'record_high': record_results.get('record_high', False),
-                    'record_low': record_results.get('record_low', False),
-                    'record_high_count': record_results.get('record_high_count', 0),
-                    'record_low_count': record_results.get('record_low_count', 0),
-                    'record_high_low_count': record_results.get('record_high_low_count', 0),
-                    'record_high_low_risk': record_results.get('record_high_low_risk', 'NONE'),
-                    'record_high_low_display': record_results.get('record_high_low_display', 'None (High=0, Low=0, Total=0)'),
-                    'by_tool_median_shift_display': by_tool_median_results.get('by_tool_median_shift_display', 'N/A'),
-                    'by_tool_median_shift_golden_tool': by_tool_median_results.get('by_tool_median_shift_golden_tool', 'N/A'),
-                    'by_tool_median_shift_max_tool': by_tool_median_results.get('by_tool_median_shift_max_tool', 'N/A'),
-                    'by_tool_median_shift_max_diff': by_tool_median_results.get('by_tool_median_shift_max_diff', np.nan),
-                    'by_tool_median_shift_max_k': by_tool_median_results.get('by_tool_median_shift_max_k', np.nan),
-                    'by_tool_median_shift_tool_count': by_tool_median_results.get('by_tool_median_shift_tool_count', 0),
-                    'by_tool_median_shift_top_tools': by_tool_median_results.get('by_tool_median_shift_top_tools', 'N/A'),
-                    'by_tool_median_shift_top_count': by_tool_median_results.get('by_tool_median_shift_top_count', 0),
-                    'by_tool_median_shift_all_tools_json': by_tool_median_results.get('by_tool_median_shift_all_tools_json', '[]')
-                })
-                
+            if context.baseline_valid:
+                # === 離散型 OOB 規則（OOC、離散 k-shift / category LT / trending、record high low、by tool…）===
+                print(" - _process_discrete_chart: 計算離散型 OOB 規則...")
+                rule_outputs, _ = OOB_RULES.evaluate(context, stage_cache=RULE_STAGES)
+                result['ooc_cnt'] = context['ooc'][1]
+                result.update(rule_outputs)
                 print(f" - _process_discrete_chart: 離散型 OOB 計算完成")
                 
             else:
                 # 基線不足時設置所有 OOB 為 NO_HIGHLIGHT
-                result.update({
-                    'HL_P95_shift': 'NO_HIGHLIGHT',
-                    'HL_P50_shift': 'NO_HIGHLIGHT',
-                    'HL_P05_shift': 'NO_HIGHLIGHT',
-                    'HL_sticking_shift': 'NO_HIGHLIGHT',
-                    'HL_trending': 'NO_HIGHLIGHT',
-                    'HL_high_OOC': 'NO_HIGHLIGHT',
-                    'HL_3O7D': 'NO_HIGHLIGHT',
-                    'HL_by_tool_median_shift': 'NO_HIGHLIGHT',
-                    'HL_category_LT_shift': 'NO_HIGHLIGHT',
-                    'HL_record_high_low': 'NO_HIGHLIGHT',
-                    'record_high': False,
-                    'record_low': False,
-                    'record_high_count': 0,
-                    'record_low_count': 0,
-                    'record_high_low_count': 0,
-                    'record_high_low_risk': 'NONE',
-                    'record_high_low_display': 'None (High=0, Low=0, Total=0)',
-                    'by_tool_median_shift_display': 'No valid baseline',
-                    'by_tool_median_shift_golden_tool': 'N/A',
-                    'by_tool_median_shift_max_tool': 'N/A',
-                    'by_tool_median_shift_max_diff': np.nan,
-                    'by_tool_median_shift_max_k': np.nan,
-                    'by_tool_median_shift_tool_count': 0,
-                    'by_tool_median_shift_top_tools': 'N/A',
-                    'by_tool_median_shift_top_count': 0,
-                    'by_tool_median_shift_all_tools_json': '[]'
-                })
+                result.update(OOB_RULES.defaults('discrete', 'No valid baseline'))
                 print(f" - _process_discrete_chart: 基線數據不足，所有 OOB 設為 NO_HIGHLIGHT")
 
             print(f" - _process_discrete_chart: 離散型處理完成 {group_name}/{chart_name}")
@@ -5600,7 +6406,9 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
             traceback.print_exc()
             return None
 
-    def build_result(self, result, image_path, weekly_image_path):
+    @staticmethod
+    def build_result(result, image_path, weekly_image_path, history=None, week=None):
+        """history：RuleHistoryLookup；指定時加入本週規則與上週比較的 History_Status / New_Rules 等欄位"""
         violated_rules = result.get('violated_rules', {})
         we_true_keys = [k for k, v in violated_rules.items() if v]
         result['WE_Rule'] = ', '.join(we_true_keys) if we_true_keys else 'N/A'
@@ -5644,6 +6452,12 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
         if 'Cpk' not in result:
             result['Cpk'] = np.nan
 
+        if history is not None:
+            try:
+                result.update(history.annotate(result, week))
+            except Exception as e:
+                print(f"[Warning] 結果歷史比對失敗: {e}")
+
         print(f" - build_result 完成更新 result for {result.get('group_name', 'Unknown')}/{result.get('chart_name', 'Unknown')}")
 
     def ensure_result_chart_images(self, result):
@@ -5677,7 +6491,287 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
                 weekly_chart_path = plot_weekly_spc_chart(raw_df, chart_info, ws, we)
             result['weekly_chart_path'] = weekly_chart_path
 
-    def save_results(self):
+    def make_result_record(self, chart_key, result, filepath, source_info):
+        """
+        將 analyze_chart 回傳的 dict 轉為精簡紀錄：純量欄位放進 ChartResult，
+        raw_df / chart_info / canvas 交給 chart_store，之後依需求重新載入。
+        """
+        store_key = chart_key
+        suffix = 1
+        while store_key in self.chart_store:  # 設定檔中重複的 Group/Chart
+            suffix += 1
+            store_key = f"{chart_key}#{suffix}"
+        raw_df = result.pop('raw_df', None)
+        chart_info = result.pop('chart_info', None)
+        self.chart_store.register(store_key, filepath, source_info.copy(), chart_info=chart_info, raw_df=raw_df)
+        return ChartResult(store_key, self.chart_store, result)
+
+    def get_custom_time_range(self):
+        """自定義週期時間範圍（未啟用時回傳 (None, None)）"""
+        custom_weekly_start = None
+        custom_weekly_end = None
+        if self.oob_settings.get('custom_time_range_enabled', False):
+            # 將 QDate 或 QDateTime 轉換為 pandas datetime
+            qt_start = self.oob_settings['start_time']
+            qt_end = self.oob_settings['end_time']
+            
+            # 支持 QDate 和 QDateTime 兼容
+            if isinstance(qt_start, QtCore.QDateTime):
+                custom_weekly_start = pd.to_datetime(f"{qt_start.date().year()}-{qt_start.date().month():02d}-{qt_start.date().day():02d} 00:00:00")
+            else:  # QDate
+                custom_weekly_start = pd.to_datetime(f"{qt_start.year()}-{qt_start.month():02d}-{qt_start.day():02d} 00:00:00")
+            
+            if isinstance(qt_end, QtCore.QDateTime):
+                custom_weekly_end = pd.to_datetime(f"{qt_end.date().year()}-{qt_end.date().month():02d}-{qt_end.date().day():02d} 23:59:59")
+            else:  # QDate
+                custom_weekly_end = pd.to_datetime(f"{qt_end.year()}-{qt_end.month():02d}-{qt_end.day():02d} 23:59:59")
+            
+            print(f" - 自定義時間範圍: {custom_weekly_start} to {custom_weekly_end}")
+        return custom_weekly_start, custom_weekly_end
+
+    def load_history_lookup(self):
+        """開啟「新出現 / 持續」標示時，讀入本次執行前的規則歷史"""
+        if not self.oob_settings.get('history_new_vs_persistent', False):
+            return None
+        try:
+            lookup = ResultHistory(get_history_path()).load_lookup('oob')
+            print(f"[Info] 已載入結果歷史：{len(lookup)} 張 chart")
+            return lookup
+        except Exception as e:
+            print(f"[Warning] 無法讀取結果歷史，本次不標示新出現 / 持續: {e}")
+            return None
+
+    def record_result_history(self):
+        """將本次的純量結果寫入結果歷史 (output/history/result_history.sqlite)"""
+        if not self.results or not self.oob_settings.get('record_result_history', True):
+            return
+        try:
+            ResultHistory(get_history_path()).record_run('oob', self.results, source=self.filepath)
+        except Exception as e:
+            print(f"[Warning] 結果歷史寫入失敗: {e}")
+
+    def oob_journal_path(self):
+        return os.path.join(resource_path('output'), 'checkpoints', 'oob_journal.jsonl')
+
+    def build_chart_schedule(self, all_charts_info, previous_results=None):
+        """依 chart_priority_mode 決定處理順序，回傳 [(設定檔位置, chart_info), ...]"""
+        mode = self.oob_settings.get('chart_priority_mode', 'workbook')
+        highlight_scores = None
+        chart_ids = None
+        if mode == 'previous_highlight':
+            highlight_scores = collect_highlight_scores(previous_results, self.oob_journal_path())
+            if not highlight_scores:
+                print("[Info] 找不到上次的執行結果，依設定檔順序處理")
+        elif mode == 'chart_id_list':
+            chart_ids = parse_chart_id_list(self.oob_settings.get('priority_chart_ids', ''))
+        schedule = schedule_charts(
+            all_charts_info, mode,
+            file_lookup=lambda g, c: find_matching_file_from_index(self.raw_file_index, g, c),
+            highlight_scores=highlight_scores,
+            chart_ids=chart_ids,
+        )
+        if mode != 'workbook':
+            preview = ', '.join(f"{row['GroupName']}/{row['ChartName']}" for _, row in schedule[:5])
+            print(f"[Info] 處理順序: {mode}，前 5 張: {preview}")
+        return schedule
+
+    def publish_partial_summary(self, total, processed, skipped, force=False):
+        """依 partial_summary_interval_sec 節流，處理中途更新 Summary Dashboard 與 partial_summary.csv"""
+        interval = self.oob_settings.get('partial_summary_interval_sec', 15)
+        if not interval or interval <= 0 or not self.results:
+            return
+        now_ms = QtCore.QDateTime.currentMSecsSinceEpoch()
+        if not force and (now_ms - getattr(self, '_last_partial_publish_ms', 0)) < interval * 1000:
+            return
+        self._last_partial_publish_ms = now_ms
+        try:
+            self.update_summary_dashboard(total, processed, skipped)
+            self.write_partial_summary(complete=False)
+        except Exception as e:
+            print(f"[Warning] 部分結果摘要更新失敗: {e}")
+
+    def write_partial_summary(self, complete=False):
+        """將目前已完成的違規 chart（依嚴重度排序）寫入 output/partial_summary.csv"""
+        try:
+            counts, violating = summarize_results(self.results)
+            columns = ['GroupName', 'ChartName', 'ChartID', 'ooc_cnt', 'WE_Rule', 'OOB_Rule', 'score']
+            summary_df = pd.DataFrame(violating, columns=columns)
+            output_path = os.path.join(resource_path('output'), 'partial_summary.csv')
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            tmp_path = f"{output_path}.tmp"
+            summary_df.to_csv(tmp_path, index=False, encoding='utf-8-sig')
+            os.replace(tmp_path, output_path)
+            state = "完成" if complete else "進行中"
+            print(f"[Info] 部分結果摘要 ({state}): 已處理 {counts['processed']}，OOC {counts['ooc']}，"
+                  f"WE {counts['we']}，OOB {counts['oob']} -> {output_path}")
+        except Exception as e:
+            print(f"[Warning] 部分結果摘要寫入失敗: {e}")
+
+    def open_run_journal(self, execution_time, custom_weekly_start, custom_weekly_end):
+        """
+        開啟 checkpoint journal。fingerprint 由設定檔內容、原始資料目錄、時間窗、分析設定與程式版本組成，
+        任一項改變都會重新開始；勾選 resume_from_checkpoint 時才會沿用既有紀錄。
+        """
+        try:
+            fingerprint = make_cache_key(
+                'oob',
+                file_fingerprint(self.filepath),
+                directory_signature(self.raw_data_directory),
+                execution_time, custom_weekly_start, custom_weekly_end,
+                {key: self.oob_settings.get(key) for key in OOB_ANALYSIS_SETTING_KEYS},
+                self.oob_settings.get('use_interactive_charts', True),
+                analysis_code_version(),
+            )
+            return RunJournal(self.oob_journal_path(), fingerprint, run_name='oob',
+                              resume=self.oob_settings.get('resume_from_checkpoint', False))
+        except Exception as e:
+            print(f"[Warning] 無法建立 checkpoint journal，本次不記錄: {e}")
+            return None
+
+    def journal_record(self, result):
+        """寫入 journal 的內容：純量結果 + 分析後的 chart_info（續跑時匯出圖片需要）"""
+        record = result.to_dict()
+        record['chart_info'] = result.get('chart_info')
+        return record
+
+    def materialize_chart_data(self, entry):
+        """依檔案路徑與設定列重新產生與分析時相同的 processed raw_df"""
+        if not entry.filepath or entry.source_info is None:
+            return None
+        chart_key = f"{entry.source_info['GroupName']}_{entry.source_info['ChartName']}"
+        prepared = self.get_prepared_chart(chart_key, entry.filepath, entry.source_info)
+        if prepared is not None:
+            processed_df = prepared[1]
+        else:
+            raw_df = self.get_cached_csv(entry.filepath)
+            if raw_df is None:
+                return None
+            if 'point_time' in raw_df.columns:
+                raw_df['point_time'] = pd.to_datetime(raw_df['point_time'], errors='coerce')
+                raw_df.dropna(subset=['point_time'], inplace=True)
+            is_successful, processed_df, _ = preprocess_data(entry.source_info.copy(), raw_df)
+            if not is_successful:
+                return None
+        if 'Matching' not in processed_df.columns:
+            processed_df = processed_df.copy()
+            processed_df['Matching'] = 'Unknown'
+        return processed_df
+
+    def configure_memory_monitor(self, run_name):
+        """依設定開關記憶體監控，並掛到 stage profiler 上"""
+        enabled = MEMORY_ENV_ENABLED or bool(self.oob_settings.get('enable_memory_monitor', False))
+        MEMORY_MONITOR.enabled = enabled
+        if not enabled:
+            PROFILER.remove_hook(MEMORY_MONITOR)
+            MEMORY_MONITOR.stop()
+            return
+        MEMORY_MONITOR.set_budget(self.oob_settings.get('memory_budget_mb', 0))
+        MEMORY_MONITOR.reset(run_name)
+        PROFILER.add_hook(MEMORY_MONITOR)
+        budget = MEMORY_MONITOR.budget_bytes
+        print(f"[Info] 記憶體監控已啟用，預算: {budget / MB:.0f} MB" if budget else "[Info] 記憶體監控已啟用（無預算上限）")
+
+    def enforce_memory_budget(self, context=''):
+        """接近預算時記錄各快取佔用；超過預算時釋放可重建的物件"""
+        status = MEMORY_MONITOR.check_budget(context)
+        if status == 'ok':
+            return status
+        MEMORY_MONITOR.update_attribution(self.csv_cache, self.results)
+        if status == 'over':
+            self.release_memory()
+            after = MEMORY_MONITOR.check_budget(f"{context} (after release)")
+            if after == 'over':
+                print("[Warning] 釋放快取與圖表後記憶體仍超過預算，建議關閉 GUI 圖表顯示或分批處理")
+        return status
+
+    def release_memory(self):
+        """
+        降級處理：清空 CSV 快取，並把互動式/By Tool canvas 換成已存檔的圖片，
+        釋放 Figure。匯出時 ensure_result_chart_images 會依 raw_df 重新產生缺少的圖片。
+        """
+        import gc
+        released_canvases = 0
+        cached_files = len(self.csv_cache) + len(self.prepared_cache)
+        self.csv_cache.clear()
+        self.prepared_cache.clear()
+        RULE_STAGES.clear()
+        released_frames = self.chart_store.release_frames()
+
+        for result in self.results:
+            for canvas_key in CANVAS_FIELDS:
+                canvas = result.pop(canvas_key, None)
+                if canvas is not None and self.release_chart_canvas(result, canvas_key, canvas):
+                    released_canvases += 1
+
+        gc.collect()
+        print(f"[Warning] 記憶體超過預算：已清除 {cached_files} 個 CSV 快取、{released_frames} 個 raw_df、"
+              f"釋放 {released_canvases} 個圖表 canvas")
+
+    def on_canvas_evicted(self, chart_key, canvas_key, canvas):
+        """chart_store 的 canvas LRU 換出時呼叫：已顯示的 chart 換成圖片，其餘直接關閉 Figure"""
+        result = self.grid_results.get(chart_key)
+        if result is None:
+            plt.close(canvas.figure)
+            return
+        self.release_chart_canvas(result, canvas_key, canvas)
+
+    def release_chart_canvas(self, result, canvas_key, canvas):
+        """
+        把互動圖 canvas 存成圖片並關閉 Figure；GUI 上的格子換成圖片 (SPC / Weekly)
+        或「Load By Tool Charts」按鈕 (By Tool)。回傳是否成功釋放。
+        """
+        group_name = result.get('group_name', 'NA')
+        chart_name = result.get('chart_name', 'NA')
+        row = None
+        if self.oob_settings.get('show_charts_gui', True) and getattr(self, 'image_grid_layout', None) is not None:
+            # results 可能已依設定檔順序重排，grid 列號以 display_image 時記錄的為準
+            row = self.grid_rows.get(result.chart_key)
+        try:
+            if canvas_key in ('spc_canvas', 'weekly_canvas'):
+                path_key, prefix, column = (('chart_path', 'SPC', 1) if canvas_key == 'spc_canvas'
+                                            else ('weekly_chart_path', 'Weekly_SPC', 2))
+                image_path = result.get(path_key)
+                if not image_path or image_path == 'N/A' or not os.path.exists(str(image_path)):
+                    image_path = save_canvas_figure(canvas, make_output_image_path(prefix, group_name, chart_name))
+                    result[path_key] = image_path
+                if row is not None:
+                    self._replace_grid_layout(row, column, self.create_image_layout(image_path))
+            elif row is not None:
+                column, title = ((3, "By Tool (Color)") if canvas_key == 'by_tool_color_canvas'
+                                 else (4, "By Tool (Group)"))
+                self._replace_grid_layout(row, column, self.create_by_tool_placeholder_layout(result, row, title))
+            plt.close(canvas.figure)
+            return True
+        except Exception as e:
+            print(f"[Warning] 釋放 {group_name}/{chart_name} {canvas_key} 失敗: {e}")
+            return False
+
+    def write_memory_report(self):
+        """輸出記憶體報告 (JSON + Excel)"""
+        try:
+            MEMORY_MONITOR.update_attribution(self.csv_cache, self.results)
+            output_dir = resource_path('output')
+            MEMORY_MONITOR.print_summary()
+            json_path = MEMORY_MONITOR.write_json(os.path.join(output_dir, 'memory_report.json'))
+            excel_path = MEMORY_MONITOR.write_excel(os.path.join(output_dir, 'memory_report.xlsx'))
+            print(f"[Info] 記憶體報告已輸出: {json_path}, {excel_path}")
+        except Exception as e:
+            print(f"[Warning] 記憶體報告輸出失敗: {e}")
+            traceback.print_exc()
+
+    def write_performance_report(self):
+        """輸出分段計時報告 (JSON + Excel summary sheet)"""
+        try:
+            output_dir = resource_path('output')
+            PROFILER.print_summary()
+            json_path = PROFILER.write_json(os.path.join(output_dir, 'performance_report.json'))
+            excel_path = PROFILER.write_excel(os.path.join(output_dir, 'performance_report.xlsx'))
+            print(f"[Info] 效能報告已輸出: {json_path}, {excel_path}")
+        except Exception as e:
+            print(f"[Warning] 效能報告輸出失敗: {e}")
+            traceback.print_exc()
+
+    def save_results(self, excel_path='result_with_images.xlsx'):
         # 產生 By Tool 圖表圖片供 Excel 使用
         by_tool_dir = os.path.join(resource_path('output'), 'by_tool_images')
         os.makedirs(by_tool_dir, exist_ok=True)
@@ -5685,35 +6779,61 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
         for idx, result in enumerate(self.results):
             result.setdefault('by_tool_color_path', 'N/A')
             result.setdefault('by_tool_group_path', 'N/A')
-            raw_df = result.get('raw_df')
-            chart_info = result.get('chart_info')
             ws = result.get('weekly_start_date')
             we = result.get('weekly_end_date')
             oob_info = result.get('OOB_Rule', 'N/A')
-            if raw_df is None or chart_info is None:
+            if not result.has_chart_data():
                 continue
+            PROFILER.set_chart(f"{result.get('group_name', 'NA')}_{result.get('chart_name', 'NA')}")
+            if MEMORY_MONITOR.enabled:
+                self.enforce_memory_budget(f"exporting {result.get('group_name', 'NA')}/{result.get('chart_name', 'NA')}")
+            image_cache_key = None
+            if result.get('result_cache_key'):
+                image_cache_key = self.result_cache.make_key('export_images', result['result_cache_key'], oob_info)
             try:
+                if image_cache_key:
+                    # 相同結果上次匯出的圖片仍在且未被覆寫時直接沿用
+                    cached_images = self.result_cache.get(image_cache_key)
+                    if cached_images and artifact_signature(cached_images['paths']) == cached_images['signature']:
+                        (result['chart_path'], result['weekly_chart_path'],
+                         result['by_tool_color_path'], result['by_tool_group_path']) = cached_images['paths']
+                        continue
+
+                # 圖片快取未命中時才重新載入原始資料
+                raw_df = result.get('raw_df')
+                chart_info = result.get('chart_info')
+                if raw_df is None or chart_info is None:
+                    continue
+
                 self.pump_ui_status(f"85% - Preparing export charts {idx + 1}/{total_results}", force=(idx == 0))
-                self.ensure_result_chart_images(result)
+                with PROFILER.stage('rendering'):
+                    self.ensure_result_chart_images(result)
 
                 base_name = f"{result.get('group_name', 'NA')}_{result.get('chart_name', 'NA')}"
                 safe_name = re.sub(r'[\\/*?:"<>|]', '_', base_name)
                 color_path = os.path.join(by_tool_dir, f"{safe_name}_bytool_color.png")
                 group_path = os.path.join(by_tool_dir, f"{safe_name}_bytool_group.png")
 
-                color_canvas = result.get('by_tool_color_canvas')
-                if color_canvas is None:
-                    self.pump_ui_status(f"85% - Generating by-tool color chart {idx + 1}/{total_results}", force=False)
-                    color_canvas = plot_spc_by_tool_color(raw_df, chart_info, ws, we, oob_info=oob_info)
-                color_canvas.figure.savefig(color_path, dpi=120, bbox_inches='tight')
-                result['by_tool_color_path'] = color_path
-
-                group_canvas = result.get('by_tool_group_canvas')
-                if group_canvas is None:
-                    self.pump_ui_status(f"85% - Generating by-tool group chart {idx + 1}/{total_results}", force=False)
-                    group_canvas = plot_spc_by_tool_group(raw_df, chart_info, ws, we, oob_info=oob_info)
-                group_canvas.figure.savefig(group_path, dpi=120, bbox_inches='tight')
-                result['by_tool_group_path'] = group_path
+                with PROFILER.stage('by_tool_rendering'):
+                    color_canvas = result.get('by_tool_color_canvas')
+                    if color_canvas is None:
+                        self.pump_ui_status(f"85% - Generating by-tool color chart {idx + 1}/{total_results}", force=False)
+                        color_canvas = plot_spc_by_tool_color(raw_df, chart_info, ws, we, oob_info=oob_info)
+                    color_canvas.figure.savefig(color_path, dpi=120, bbox_inches='tight')
+                    result['by_tool_color_path'] = color_path
+
+                    group_canvas = result.get('by_tool_group_canvas')
+                    if group_canvas is None:
+                        self.pump_ui_status(f"85% - Generating by-tool group chart {idx + 1}/{total_results}", force=False)
+                        group_canvas = plot_spc_by_tool_group(raw_df, chart_info, ws, we, oob_info=oob_info)
+                    group_canvas.figure.savefig(group_path, dpi=120, bbox_inches='tight')
+                    result['by_tool_group_path'] = group_path
+
+                if image_cache_key:
+                    export_paths = [result.get('chart_path'), result.get('weekly_chart_path'), color_path, group_path]
+                    signature = artifact_signature(export_paths)
+                    if signature:
+                        self.result_cache.put(image_cache_key, {'paths': export_paths, 'signature': signature})
             except Exception as e:
                 print(f"[Warning] Failed to save By Tool charts: {e}")
             finally:
@@ -5725,35 +6845,16 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
                         force=(idx == total_results - 1)
                     )
 
-        results_df = pd.DataFrame(self.results)
-
-        # 確保所有預期的列都存在，包括新增的數據類型欄位
-        expected_cols = ['data_cnt', 'ooc_cnt', 'WE_Rule', 'OOB_Rule', 'data_type', 'Material_no',
-                         'group_name', 'chart_name', 'chart_ID', 'Characteristics',
-                         'USL', 'LSL', 'UCL', 'LCL', 'Target', 'Cpk', 'Resolution',
-                         'HL_by_tool_median_shift', 'by_tool_median_shift_display',
-                         'by_tool_median_shift_golden_tool', 'by_tool_median_shift_max_tool',
-                         'by_tool_median_shift_max_diff', 'by_tool_median_shift_max_k',
-                         'by_tool_median_shift_tool_count', 'by_tool_median_shift_top_tools',
-                         'by_tool_median_shift_top_count', 'by_tool_median_shift_all_tools_json',
-                         'HL_record_high_low', 'record_high', 'record_low',
-                         'record_high_count', 'record_low_count', 'record_high_low_count',
-                         'record_high_low_risk', 'record_high_low_display',
-                 'chart_path', 'weekly_chart_path', 'by_tool_color_path', 'by_tool_group_path']
-        for col in expected_cols:
-            if col not in results_df.columns:
-                results_df[col] = np.nan
-
-        cols_to_order = [col for col in expected_cols if col in results_df.columns]
-        results_df = results_df[cols_to_order]
-
-        results_df = results_df.replace([np.nan, np.inf, -np.inf], 'N/A')
+        PROFILER.set_chart(None)
+        results_df = build_results_dataframe(self.results)
 
         try:
              if hasattr(self, 'progress_bar'):
                  self.progress_bar.setValue(max(self.progress_bar.value(), 96))
                  self.pump_ui_status("96% - Writing Excel...", self.progress_bar.value(), force=True)
-             save_results_to_excel(results_df)
+             extra_sheets = build_export_sheets(self.results, self.oob_settings)
+             with PROFILER.stage('excel_export'):
+                 save_results_to_excel(results_df, output_path=excel_path, extra_sheets=extra_sheets)
              if hasattr(self, 'progress_bar'):
                  self.progress_bar.setValue(max(self.progress_bar.value(), 98))
                  self.pump_ui_status("98% - Excel saved", self.progress_bar.value(), force=True)
@@ -5769,12 +6870,13 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
         # 檢查是否有互動式圖表 canvas
         spc_canvas = result.get('spc_canvas')
         weekly_canvas = result.get('weekly_canvas')
-        raw_df = result.get('raw_df')
-        chart_info = result.get('chart_info')
+        has_chart_data = result.has_chart_data()  # 不觸發 raw_df 重新載入
         current_oob_summary = result.get('OOB_Rule', 'N/A')
         show_by_tool = self.oob_settings.get('show_by_tool_charts', False)
         ws = result.get('weekly_start_date')
         we = result.get('weekly_end_date')
+        self.grid_rows[result.chart_key] = index
+        self.grid_results[result.chart_key] = result
 
         # 1. Total Chart
         if spc_canvas:
@@ -5802,7 +6904,7 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
 
         # 3. By Tool (Color)
         tool_color_layout = QtWidgets.QVBoxLayout()
-        if show_by_tool and raw_df is not None and chart_info is not None:
+        if show_by_tool and has_chart_data:
             tool_color_canvas = result.get('by_tool_color_canvas')
             if tool_color_canvas is not None:
                 tool_color_layout = self.create_canvas_layout(tool_color_canvas, min_width=500, min_height=180)
@@ -5811,7 +6913,7 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
 
         # 4. By Tool (Group)
         tool_group_layout = QtWidgets.QVBoxLayout()
-        if show_by_tool and raw_df is not None and chart_info is not None:
+        if show_by_tool and has_chart_data:
             tool_group_canvas = result.get('by_tool_group_canvas')
             if tool_group_canvas is not None:
                 tool_group_layout = self.create_canvas_layout(tool_group_canvas, min_width=500, min_height=180)
@@ -6189,6 +7291,9 @@ class SPCApp(QtWidgets.QMainWindow): # 將 QTabWidget 改為 QMainWindow
         dialog.exec()
 
     def show_error(self, title, message, warning=False):
+        if self.headless:
+            print(f"[{'Warning' if warning else 'Error'}] {title}: {message}")
+            return
         if warning:
             QtWidgets.QMessageBox.warning(self, title, message)
         else:
@@ -6915,6 +8020,7 @@ class CLTightenWidget(QtWidgets.QWidget):
         # 更新按鈕文字
         self.start_button.setText(tr("start_cl_calculation"))
         self.export_button.setText(f"📁 {tr('export_results')}")
+        self.resume_checkbox.setText(tr("resume_from_checkpoint", "Resume From Checkpoint"))
         
         # 更新 Range 標籤
         if hasattr(self, 'range_label'):
@@ -7027,6 +8133,11 @@ class CLTightenWidget(QtWidgets.QWidget):
         self.export_button.setCursor(QtCore.Qt.CursorShape.PointingHandCursor)
         self.export_button.setStyleSheet(self.export_button.styleSheet() + btn_style)
 
+        self.resume_checkbox = QtWidgets.QCheckBox(tr("resume_from_checkpoint", "Resume From Checkpoint"))
+        self.resume_checkbox.setFixedHeight(32)
+        self.resume_checkbox.setChecked(False)
+
+        toolbar_layout.addWidget(self.resume_checkbox)
         toolbar_layout.addWidget(self.start_button)
         toolbar_layout.addWidget(self.export_button)
         
@@ -7290,7 +8401,8 @@ class CLTightenWidget(QtWidgets.QWidget):
             # 執行計算
             results_df = self.calculator.run_calculation(
                 'CL_Calculation_Results.xlsx',
-                progress_callback=progress_callback
+                progress_callback=progress_callback,
+                resume=self.resume_checkbox.isChecked()
             )
             
             # 完成後隱藏進度條或設為 100%
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+OOB 規則註冊表 (rule registry)
+
+每條 OOB 規則宣告：
+- keys        ：輸出的 HL_* 欄位（任一為 HIGHLIGHT 即該 chart 高亮）
+- inputs      ：需要的共用輸入（週數據值、基線統計、OOC 計數、時間窗…）
+- chart_types ：適用的數據類型 (continuous / discrete)
+- needs_baseline / setting：基線不足時或設定關閉時改用 default 結果
+- params      ：規則另外讀取的 chart_info 設定（例如 K 門檻）
+
+同一個 session 內重新分析時（例如只切換 run_by_tool_median_shift），可傳入 RuleStageCache：
+每條規則的結果以 (chart 資料 + 時間窗, 規則名稱, 規則的 params) 記憶，只有受設定影響的規則重新計算。
+
+共用輸入由 RuleContext 依需求計算，每張 chart 只算一次，多條規則共用；
+新增偵測規則只需註冊 input provider 與 rule，不必再寫一次資料篩選。
+
+每張 chart 可在設定檔 (Chart sheet) 的 OOB_Rules 欄位指定規則：
+    (空白)                      → 預設規則（由設定開關決定，例如 run_by_tool_median_shift）
+    kshift, trending            → 只跑列出的規則（離散型 chart 的 discrete_oob 也可用 kshift / sticking / trending 選取）
+    all                         → 全部規則（包含預設關閉的）
+    -sticking, -record_high_low → 預設規則中排除指定規則
+"""
+import re
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+OOB_RULE_COLUMN = 'OOB_Rules'
+NO_HIGHLIGHT = 'NO_HIGHLIGHT'
+HIGHLIGHT = 'HIGHLIGHT'
+
+
+class OOBRule:
+    __slots__ = ('name', 'keys', 'inputs', 'evaluate', 'default', 'chart_types', 'needs_baseline', 'setting', 'aliases',
+                 'params')
+
+    def __init__(self, name, keys, inputs, evaluate, default=None, chart_types=('continuous', 'discrete'),
+                 needs_baseline=True, setting=None, aliases=(), params=()):
+        self.name = name
+        self.keys = tuple(keys)
+        self.inputs = tuple(inputs)
+        self.evaluate = evaluate
+        self.default = default
+        self.chart_types = tuple(chart_types)
+        self.needs_baseline = needs_baseline
+        self.setting = setting  # chart_info 中的開關 key；None 表示預設啟用
+        self.aliases = tuple(aliases)  # OOB_Rules 欄位中也可用來選取此規則的名稱
+        self.params = tuple(params)  # 規則另外讀取的 chart_info 設定，變更時只有此規則需要重算
+
+    def default_result(self, reason):
+        if self.default is not None:
+            return dict(self.default(reason))
+        return {key: NO_HIGHLIGHT for key in self.keys}
+
+    def __repr__(self):
+        return f"OOBRule({self.name!r}, keys={self.keys})"
+
+
+class RuleContext:
+    """單張 chart 的規則輸入；get(name) 第一次呼叫時才由 provider 計算，之後直接沿用"""
+
+    def __init__(self, registry, chart_info, chart_type='continuous', baseline_valid=True, stage_key=None, **values):
+        self.registry = registry
+        self.chart_info = chart_info
+        self.chart_type = chart_type
+        self.baseline_valid = baseline_valid
+        self.stage_key = stage_key  # chart 資料 + 時間窗的識別；None 時不使用 RuleStageCache
+        self._values = dict(values)
+
+    def get(self, name):
+        if name not in self._values:
+            provider = self.registry.inputs.get(name)
+            if provider is None:
+                raise KeyError(f"未註冊的 OOB 規則輸入: {name}")
+            self._values[name] = provider(self)
+        return self._values[name]
+
+    __getitem__ = get
+
+
+class RuleStageCache:
+    """規則結果的 LRU 記憶（同一個 session 內）；key 為 (context.stage_key, 規則名稱, 規則 params 的值)"""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(result)
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = dict(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RuleRegistry:
+    """
+    使用方式：
+        OOB_RULES = RuleRegistry()
+
+        @OOB_RULES.input('weekly_values')
+        def _weekly_values(ctx):
+            return ctx['weekly_data']['point_val'].values
+
+        @OOB_RULES.rule('my_rule', keys=('HL_my_rule',), inputs=('weekly_values',))
+        def _my_rule(ctx):
+            return {'HL_my_rule': 'HIGHLIGHT' if ... else 'NO_HIGHLIGHT'}
+
+        outputs, highlighted = OOB_RULES.evaluate(context)
+    """
+
+    def __init__(self, column=OOB_RULE_COLUMN):
+        self.column = column
+        self.inputs = {}
+        self.rules = []
+
+    # === 註冊 ===
+    def input(self, name):
+        def decorator(provider):
+            self.inputs[name] = provider
+            return provider
+        return decorator
+
+    def rule(self, name, keys, inputs=(), **options):
+        def decorator(evaluate):
+            self.register(OOBRule(name, keys, inputs, evaluate, **options))
+            return evaluate
+        return decorator
+
+    def register(self, rule):
+        self.rules = [r for r in self.rules if r.name != rule.name] + [rule]
+        return rule
+
+    def rules_for(self, chart_type):
+        return [rule for rule in self.rules if chart_type in rule.chart_types]
+
+    def stage_settings(self):
+        """規則的開關與 params：不屬於 chart 資料識別，由各規則自己的記憶 key 處理"""
+        names = set()
+        for rule in self.rules:
+            if rule.setting is not None:
+                names.add(rule.setting)
+            names.update(rule.params)
+        return names
+
+    def highlight_keys(self):
+        keys = []
+        for rule in self.rules:
+            keys.extend(key for key in rule.keys if key not in keys)
+        return keys
+
+    # === 每張 chart 的啟用規則 ===
+    def parse_rule_spec(self, value):
+        if value is None or (isinstance(value, float) and pd.isna(value)):
+            return []
+        return [token.lower() for token in re.split(r'[,;\s]+', str(value).strip()) if token]
+
+    def enabled_rules(self, chart_info, chart_type):
+        rules = self.rules_for(chart_type)
+        tokens = self.parse_rule_spec(chart_info.get(self.column) if chart_info is not None else None)
+        selected = {token for token in tokens if not token.startswith('-')}
+        removed = {token[1:] for token in tokens if token.startswith('-')}
+
+        known = {'all'}
+        for rule in self.rules:
+            known.add(rule.name)
+            known.update(rule.aliases)
+        unknown = (selected | removed) - known
+        if unknown:
+            # 未知名稱忽略（只有未知名稱時視同空白，使用預設規則）
+            print(f"[Warning] {self.column} 欄位包含未知的 OOB 規則，已忽略: {', '.join(sorted(unknown))}")
+            selected -= unknown
+
+        enabled = set()
+        for rule in rules:
+            if 'all' in selected:
+                on = True
+            elif selected:
+                on = rule.name in selected or any(alias in selected for alias in rule.aliases)
+            else:
+                on = rule.setting is None or bool(chart_info.get(rule.setting, False))
+            if on and rule.name not in removed:
+                enabled.add(rule.name)
+        return enabled
+
+    # === 計算 ===
+    def defaults(self, chart_type, reason):
+        outputs = {}
+        for rule in self.rules_for(chart_type):
+            outputs.update(rule.default_result(reason))
+        return outputs
+
+    def evaluate(self, context, profiler=None, stage_cache=None):
+        """依序執行適用的規則，回傳 (合併後的輸出, 是否有任何 HL 為 HIGHLIGHT)"""
+        enabled = self.enabled_rules(context.chart_info, context.chart_type)
+        if context.stage_key is None:
+            stage_cache = None
+        outputs = {}
+        highlighted = False
+        for rule in self.rules_for(context.chart_type):
+            if rule.name not in enabled:
+                result = rule.default_result('Disabled')
+            elif rule.needs_baseline and not context.baseline_valid:
+                result = rule.default_result('No valid baseline')
+            else:
+                stage_key = None
+                result = None
+                if stage_cache is not None:
+                    stage_key = (context.stage_key, rule.name,
+                                 tuple(str(context.chart_info.get(name)) for name in rule.params))
+                    result = stage_cache.get(stage_key)
+                if result is None:
+                    if profiler is not None:
+                        with profiler.stage(rule.name):
+                            result = rule.evaluate(context)
+                    else:
+                        result = rule.evaluate(context)
+                    if stage_key is not None:
+                        stage_cache.put(stage_key, result)
+            outputs.update(result)
+            highlighted = highlighted or any(result.get(key) == HIGHLIGHT for key in rule.keys)
+        return outputs, highlighted
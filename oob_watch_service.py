@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+OOB 監看服務 (watch-folder daemon)
+
+長時間執行、不開 GUI：監看原始資料目錄 (input/raw_charts) 與圖表設定檔 (All_Chart_Information.xlsx)，
+只重新計算受影響 chart 的 OOB 分析，並持續更新結果表 (output/oob_live_results.csv) 與 Excel 報表。
+
+- 變更會先 debounce：目錄安靜 debounce 秒後才整批處理（持續有檔案寫入時最多等 max-delay 秒），
+  一次倒進 500 個檔案只會觸發一個批次，而不是 500 次單張計算。
+- 批次夠大時交給 worker process 平行計算；每個 worker 保留一個 headless SPCApp，跨批次重複使用。
+- 每張 chart 的結果寫入 output/checkpoints/oob_watch_journal.jsonl，服務重啟時未變動的 chart 不需重算。
+
+使用方式：
+    python oob_watch_service.py --chart-info input/All_Chart_Information.xlsx --raw-dir input/raw_charts
+    python oob_watch_service.py --once          # 只同步一次（適合排程器呼叫）
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# 服務模式不開視窗；必須在匯入 PyQt6 之前設定
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6 import QtWidgets, QtCore
+
+import oob_module_NGK_nostatic as oob
+from result_cache import make_cache_key
+from result_store import RESULT_FIELDS, CANVAS_FIELDS, results_to_dataframe
+from run_journal import RunJournal, file_source_signature
+from chart_scheduler import summarize_results
+
+WORKBOOK_CHANGED = '<chart-info-workbook>'
+LIVE_TABLE_COLUMNS = [field for field in RESULT_FIELDS
+                      if field not in CANVAS_FIELDS and field != 'result_cache_key'] + ['last_updated']
+
+
+def scan_directory(directory, suffix='.csv'):
+    """{檔名: (大小, mtime_ns)}，只讀 metadata"""
+    snapshot = {}
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.lower().endswith(suffix):
+                    stat = entry.stat()
+                    snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    except OSError as e:
+        print(f"[Warning] 無法掃描目錄 {directory}: {e}")
+    return snapshot
+
+
+class ChangeDebouncer:
+    """收集變更，安靜 debounce_sec 秒後才整批送出；持續有變更時最多等 max_delay_sec 秒"""
+
+    def __init__(self, debounce_sec=5.0, max_delay_sec=60.0):
+        self.debounce_sec = debounce_sec
+        self.max_delay_sec = max_delay_sec
+        self.pending = set()
+        self._first_change = None
+        self._last_change = None
+
+    def add(self, items, now=None):
+        if not items:
+            return
+        now = time.monotonic() if now is None else now
+        self.pending.update(items)
+        if self._first_change is None:
+            self._first_change = now
+        self._last_change = now
+
+    def ready(self, now=None):
+        if not self.pending:
+            return False
+        now = time.monotonic() if now is None else now
+        return (now - self._last_change >= self.debounce_sec
+                or now - self._first_change >= self.max_delay_sec)
+
+    def drain(self):
+        pending, self.pending = self.pending, set()
+        self._first_change = self._last_change = None
+        return pending
+
+
+def chart_key_of(chart_info):
+    return f"{chart_info['GroupName']}_{chart_info['ChartName']}"
+
+
+_QT_APP = None  # QApplication 需保留參照，否則會被回收
+
+
+def create_headless_app(chart_info_path, raw_data_directory, settings=None):
+    """建立不顯示的 SPCApp，沿用 GUI 版的分析流程與設定"""
+    global _QT_APP
+    _QT_APP = QtWidgets.QApplication.instance() or QtWidgets.QApplication([sys.argv[0]])
+    app = oob.SPCApp()
+    app.headless = True
+    app.filepath = chart_info_path
+    app.raw_data_directory = raw_data_directory
+    app.oob_settings.update(settings or {})
+    app.oob_settings['show_charts_gui'] = False
+    for key in ('start_time', 'end_time'):
+        # JSON 設定檔中的日期為字串，轉為 GUI 使用的 QDate
+        if isinstance(app.oob_settings.get(key), str):
+            app.oob_settings[key] = QtCore.QDate.fromString(app.oob_settings[key][:10], 'yyyy-MM-dd')
+    return app
+
+
+def analyze_chart_task(app, key, chart_info, filepath, execution_time, window):
+    """
+    計算單張 chart，回傳 (key, status, record)。
+    status: 'processed' / 'skipped' / 'failed'；record 與 checkpoint journal 的格式相同。
+    """
+    chart_key = chart_key_of(chart_info)
+    try:
+        if not filepath or not os.path.exists(filepath):
+            print(f"[Info] 圖表 {chart_key} 對應檔案不存在，跳過處理。")
+            return key, 'skipped', None
+        # 檔案已變動：丟棄舊的 CSV 與數據類型快取
+        app.csv_cache.pop(filepath, None)
+        app.chart_types_cache.pop(chart_key, None)
+        _, result = app.load_and_analyze_chart(
+            filepath, chart_key, chart_info, execution_time, window[0], window[1], render_charts=False
+        )
+        if not result:
+            return key, 'skipped', None
+        record = app.journal_record(app.make_result_record(chart_key, result, filepath, chart_info))
+        return key, 'processed', record
+    except Exception as e:
+        print(f"[Error] 處理圖表 {chart_key} 時發生錯誤: {e}")
+        traceback.print_exc()
+        return key, 'failed', None
+    finally:
+        app.chart_store.clear()
+        app.csv_cache.pop(filepath, None)
+        app.prepared_cache.pop(chart_key, None)  # 只在檔案變動時重算，不需保留前處理資料
+
+
+# === worker process ===
+_WORKER_APP = None
+
+
+def _init_worker(chart_info_path, raw_data_directory, settings, log_dir):
+    global _WORKER_APP
+    if log_dir:
+        # worker 的分析訊息寫入各自的 log，避免與主程式輸出交錯
+        os.makedirs(log_dir, exist_ok=True)
+        log_file = open(os.path.join(log_dir, f"worker_{os.getpid()}.log"), 'a', encoding='utf-8', buffering=1)
+        sys.stdout = sys.stderr = log_file
+    _WORKER_APP = create_headless_app(chart_info_path, raw_data_directory, settings)
+
+
+def _worker_analyze(key, chart_info, filepath, execution_time, window):
+    print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] 正在處理圖表: {chart_key_of(chart_info)}")
+    return analyze_chart_task(_WORKER_APP, key, chart_info, filepath, execution_time, window)
+
+
+class OOBWatchService:
+    """
+    使用方式：
+        service = OOBWatchService(chart_info_path, raw_data_directory, workers=4)
+        service.sync()            # 初次同步（重啟時沿用 journal 中未變動的結果）
+        service.run_forever()     # 持續監看
+    """
+
+    def __init__(self, chart_info_path, raw_data_directory, settings=None, workers=None,
+                 poll_interval=2.0, debounce_sec=5.0, max_batch_delay=60.0, parallel_threshold=4,
+                 excel_path='result_with_images.xlsx', table_path=None):
+        self.chart_info_path = os.path.abspath(chart_info_path)
+        self.raw_data_directory = os.path.abspath(raw_data_directory)
+        self.settings = dict(settings or {})
+        self.workers = max(1, workers if workers else min(4, (os.cpu_count() or 2) - 1))
+        self.poll_interval = poll_interval
+        self.parallel_threshold = max(1, parallel_threshold)
+        self.excel_path = excel_path
+        self.table_path = table_path or os.path.join(oob.resource_path('output'), 'oob_live_results.csv')
+        self.log_dir = os.path.join(oob.resource_path('output'), 'watch_logs')
+        self.debouncer = ChangeDebouncer(debounce_sec, max_batch_delay)
+
+        self.app = create_headless_app(self.chart_info_path, self.raw_data_directory, self.settings)
+        self.charts = {}        # key -> 設定列
+        self.row_keys = {}      # key -> 設定列內容的雜湊
+        self.filepaths = {}     # key -> 對應的原始檔
+        self.records = {}       # key -> 結果紀錄（只有 processed）
+        self.statuses = {}      # key -> processed / skipped / failed
+        self.updated = {}       # key -> 最後計算時間
+        self.execution_time = None
+        self.window = (None, None)
+        self.journal = None
+        self._journal_fingerprint = None
+        self._journal_appends = 0
+        self._workbook_sig = None
+        self._snapshot = {}
+        self._pool = None
+
+    # === 設定檔與原始檔 ===
+    def reload_workbook(self):
+        """重新讀取設定檔，回傳內容有變動（含新增）的 chart key；讀取失敗時回傳 None"""
+        try:
+            all_charts_info = oob.load_chart_information(self.chart_info_path)
+            execution_time = oob.load_execution_time(self.chart_info_path)
+        except Exception as e:
+            # Excel 可能正在存檔中，下一輪再試
+            print(f"[Warning] 無法讀取設定檔，稍後重試: {e}")
+            return None
+
+        charts, row_keys, seen = {}, {}, {}
+        for _, row in all_charts_info.iterrows():
+            chart_key = chart_key_of(row)
+            seen[chart_key] = seen.get(chart_key, 0) + 1
+            key = chart_key if seen[chart_key] == 1 else f"{chart_key}#{seen[chart_key]}"
+            charts[key] = row
+            row_keys[key] = make_cache_key(row.to_dict())
+
+        window = self.app.get_custom_time_range()
+        time_changed = (execution_time, window) != (self.execution_time, self.window)
+        removed = set(self.charts) - set(charts)
+        for key in removed:
+            for state in (self.records, self.statuses, self.updated, self.filepaths):
+                state.pop(key, None)
+
+        changed = {key for key in charts if time_changed or row_keys[key] != self.row_keys.get(key)}
+        self.charts, self.row_keys = charts, row_keys
+        self.execution_time, self.window = execution_time, window
+        print(f"[Info] 設定檔載入 {len(charts)} 張 chart：變動 {len(changed)}，移除 {len(removed)}")
+        self.open_journal()
+        return changed
+
+    def refresh_file_mapping(self, changed_files=()):
+        """重建原始檔索引，回傳對應檔案有變動的 chart key"""
+        file_index = oob.build_raw_file_index(self.raw_data_directory)
+        changed_files = set(changed_files)
+        affected = set()
+        for key, row in self.charts.items():
+            filepath = oob.find_matching_file_from_index(file_index, row['GroupName'], row['ChartName'])
+            if filepath != self.filepaths.get(key) or (filepath and os.path.basename(filepath) in changed_files):
+                affected.add(key)
+            self.filepaths[key] = filepath
+        return affected
+
+    def chart_source(self, key):
+        """journal 的來源簽章：原始檔 (大小, mtime) + 設定列內容"""
+        return [file_source_signature(self.filepaths.get(key)), self.row_keys.get(key)]
+
+    # === checkpoint journal ===
+    def open_journal(self):
+        fingerprint = make_cache_key(
+            'oob_watch', self.execution_time, self.window,
+            {key: self.app.oob_settings.get(key) for key in oob.OOB_ANALYSIS_SETTING_KEYS},
+            oob.analysis_code_version(),
+        )
+        if self.journal is not None and fingerprint == self._journal_fingerprint:
+            return
+        self.close_journal()
+        try:
+            path = os.path.join(oob.resource_path('output'), 'checkpoints', 'oob_watch_journal.jsonl')
+            self.journal = RunJournal(path, fingerprint, run_name='oob_watch', resume=True)
+            self._journal_fingerprint = fingerprint
+            self._journal_appends = 0
+        except Exception as e:
+            print(f"[Warning] 無法建立 checkpoint journal，重啟後需全部重算: {e}")
+            self.journal = None
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = None
+        self._journal_fingerprint = None
+
+    def compact_journal(self):
+        """同一張 chart 重算多次會累積多筆紀錄，超過一定數量時重新整理"""
+        if self.journal is None or self._journal_appends < max(1000, 4 * len(self.charts)):
+            return
+        self.close_journal()
+        self.open_journal()
+
+    # === 同步與批次計算 ===
+    def sync(self):
+        """初次同步：journal 中來源未變動的 chart 直接沿用，其餘重新計算"""
+        self._workbook_sig = file_source_signature(self.chart_info_path)
+        self._snapshot = scan_directory(self.raw_data_directory)
+        if self.reload_workbook() is None:
+            raise RuntimeError(f"無法讀取設定檔: {self.chart_info_path}")
+        self.refresh_file_mapping()
+
+        affected = set()
+        for key in self.charts:
+            entry = self.journal.get(key, self.chart_source(key)) if self.journal is not None else None
+            if entry is None:
+                affected.add(key)
+                continue
+            self.statuses[key] = entry['status']
+            self.updated[key] = '(checkpoint)'
+            if entry['status'] == 'processed':
+                self.records[key] = entry['record']
+        print(f"[Info] 沿用 checkpoint {len(self.charts) - len(affected)} 張，需要計算 {len(affected)} 張")
+        self.run_batch(affected)
+        self.publish()
+
+    def poll(self):
+        """檢查設定檔與原始檔目錄的變動，交給 debouncer"""
+        workbook_sig = file_source_signature(self.chart_info_path)
+        if workbook_sig != self._workbook_sig:
+            self._workbook_sig = workbook_sig
+            self.debouncer.add({WORKBOOK_CHANGED})
+
+        snapshot = scan_directory(self.raw_data_directory)
+        changed = {name for name in set(snapshot) | set(self._snapshot)
+                   if snapshot.get(name) != self._snapshot.get(name)}
+        self._snapshot = snapshot
+        self.debouncer.add(changed)
+
+    def process_pending(self):
+        pending = self.debouncer.drain()
+        affected = set()
+        if WORKBOOK_CHANGED in pending:
+            pending.discard(WORKBOOK_CHANGED)
+            changed_rows = self.reload_workbook()
+            if changed_rows is None:
+                self.debouncer.add({WORKBOOK_CHANGED})
+            else:
+                affected |= changed_rows
+        affected |= self.refresh_file_mapping(pending)
+        print(f"[Info] 偵測到 {len(pending)} 個原始檔變動，受影響 chart: {len(affected)}")
+        self.run_batch(affected)
+        self.publish()
+
+    def run_batch(self, keys):
+        keys = [key for key in self.charts if key in keys]  # 依設定檔順序
+        if not keys:
+            return
+        tasks = [(key, self.charts[key], self.filepaths.get(key), self.execution_time, self.window) for key in keys]
+        start = time.time()
+        parallel = self.workers > 1 and len(tasks) >= self.parallel_threshold
+        print(f"[Info] 開始計算 {len(tasks)} 張 chart（{'平行 ' + str(self.workers) + ' workers' if parallel else '單一程序'}）")
+        outcomes = self._run_parallel(tasks) if parallel else None
+        if outcomes is None:
+            outcomes = [analyze_chart_task(self.app, *task) for task in tasks]
+
+        failed = 0
+        now = time.strftime('%Y-%m-%d %H:%M:%S')
+        for key, status, record in outcomes:
+            self.statuses[key] = status
+            self.updated[key] = now
+            if status == 'processed':
+                self.records[key] = record
+            else:
+                self.records.pop(key, None)
+            if status == 'failed':
+                # 發生例外的 chart 不寫入 journal，重啟或檔案再次變動時重算
+                failed += 1
+                continue
+            if self.journal is not None:
+                self.journal.append(key, record, status, self.chart_source(key))
+                self._journal_appends += 1
+        self.compact_journal()
+        print(f"[Info] 批次完成：{len(tasks)} 張，失敗 {failed} 張，耗時 {time.time() - start:.1f} 秒")
+
+    def _run_parallel(self, tasks):
+        """交給 worker process 平行計算；pool 異常時回傳 None 改由主程序計算"""
+        try:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_init_worker,
+                    initargs=(self.chart_info_path, self.raw_data_directory, self.settings, self.log_dir),
+                )
+            futures = [self._pool.submit(_worker_analyze, *task) for task in tasks]
+            return [future.result() for future in futures]
+        except BrokenProcessPool as e:
+            print(f"[Warning] worker process 異常終止，改由主程序計算: {e}")
+        except Exception as e:
+            print(f"[Warning] 平行計算失敗，改由主程序計算: {e}")
+            traceback.print_exc()
+        self.shutdown_pool()
+        return None
+
+    def shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    # === 輸出 ===
+    def publish(self):
+        """依設定檔順序重建結果，更新結果表與 Excel 報表（兩者都先寫暫存檔再取代）"""
+        app = self.app
+        app.chart_store.clear()
+        app.results = [
+            app.make_result_record(chart_key_of(self.charts[key]), dict(self.records[key]),
+                                   self.filepaths.get(key), self.charts[key])
+            for key in self.charts if key in self.records
+        ]
+        self.write_live_table()
+
+        if app.results:
+            tmp_path = f"{self.excel_path}.tmp"
+            try:
+                app.save_results(excel_path=tmp_path)
+                if os.path.exists(tmp_path):
+                    os.replace(tmp_path, self.excel_path)
+                    print(f"[Info] Excel 報表已更新: {os.path.abspath(self.excel_path)}")
+            except PermissionError:
+                print(f"[Warning] {self.excel_path} 可能正被 Excel 開啟，下次批次再更新")
+            except Exception as e:
+                print(f"[Error] Excel 報表更新失敗: {e}")
+                traceback.print_exc()
+
+        counts, violating = summarize_results(app.results)
+        skipped = sum(1 for status in self.statuses.values() if status != 'processed')
+        print(f"[Info] 目前結果：{counts['processed']} 張完成，{skipped} 張略過，"
+              f"OOC {counts['ooc']} / WE {counts['we']} / OOB {counts['oob']}，違規 {len(violating)} 張")
+        # 長時間執行：匯出後釋放 CSV 快取與重新載入的 DataFrame
+        app.csv_cache.clear()
+        app.chart_store.release_frames()
+
+    def write_live_table(self):
+        try:
+            table = results_to_dataframe(self.app.results)
+            table['last_updated'] = [self.updated.get(key, '') for key in self.charts if key in self.records]
+            table = table.reindex(columns=LIVE_TABLE_COLUMNS)
+            os.makedirs(os.path.dirname(self.table_path), exist_ok=True)
+            tmp_path = f"{self.table_path}.tmp"
+            table.to_csv(tmp_path, index=False, encoding='utf-8-sig')
+            os.replace(tmp_path, self.table_path)
+        except Exception as e:
+            print(f"[Warning] 結果表更新失敗: {e}")
+
+    # === 主迴圈 ===
+    def run_forever(self):
+        print(f"[Info] 開始監看 {self.raw_data_directory} 與 {self.chart_info_path}（Ctrl+C 結束）")
+        try:
+            while True:
+                time.sleep(self.poll_interval)
+                self.poll()
+                if self.debouncer.ready():
+                    self.process_pending()
+        except KeyboardInterrupt:
+            print("[Info] 停止監看")
+
+    def close(self):
+        self.shutdown_pool()
+        self.close_journal()
+
+
+def load_settings_file(path):
+    if not path:
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OOB watch-folder service")
+    parser.add_argument('--chart-info', default=oob.resource_path('input/All_Chart_Information.xlsx'))
+    parser.add_argument('--raw-dir', default=oob.resource_path('input/raw_charts/'))
+    parser.add_argument('--settings', help="JSON 檔，覆寫 OOB 設定 (例如 run_by_tool_median_shift)")
+    parser.add_argument('--workers', type=int, default=0, help="worker process 數量，0 = 自動")
+    parser.add_argument('--poll', type=float, default=2.0, help="檢查間隔（秒）")
+    parser.add_argument('--debounce', type=float, default=5.0, help="目錄安靜多久後開始計算（秒）")
+    parser.add_argument('--max-delay', type=float, default=60.0, help="持續有變更時最多等待（秒）")
+    parser.add_argument('--excel', default='result_with_images.xlsx')
+    parser.add_argument('--once', action='store_true', help="同步一次後結束")
+    args = parser.parse_args(argv)
+
+    service = OOBWatchService(
+        args.chart_info, args.raw_dir, settings=load_settings_file(args.settings),
+        workers=args.workers, poll_interval=args.poll, debounce_sec=args.debounce,
+        max_batch_delay=args.max_delay, excel_path=args.excel,
+    )
+    try:
+        service.sync()
+        if not args.once:
+            service.run_forever()
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Per-tool OOB：每張 chart 依 Matching 機台分別判斷 K-shift、High OOC、Record High/Low
+
+不逐機台篩選 DataFrame：週數據與基線數據合併成一個陣列，以 (機台, 基線/週數據) 為區段 (segment)
+排序一次，各區段的百分位數、最大 / 最小值直接由區段起點與長度取值，OOC 與創新高 / 新低點數以 bincount 累計。
+機台數再多也只有一次排序，其餘都是向量運算。
+
+判斷規則與 pooled chart 相同（門檻由呼叫端傳入）：
+- K-shift：機台當週 P95/P50/P05 與機台基線比較，分母與 resolution / Characteristics 取消規則同 kshift；
+  當週只有 1 點時 pooled chart 的 rolling 補點不適用，機台當週點數 < PER_TOOL_MIN_WEEKLY 時不判斷
+- High OOC：機台當週 OOC 比例 > 門檻且 OOC 點數 > 1（管制界限使用 chart 的 UCL / LCL）
+- Record High/Low：機台當週數據超過機台基線的最大 / 最小值（與 chart 層級相同，不算入 highlight）
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+PER_TOOL_MIN_WEEKLY = 2    # K-shift 需要的機台當週點數
+PER_TOOL_MIN_BASELINE = 10  # K-shift / Record High/Low 需要的機台基線點數
+PER_TOOL_PERCENTILES = {'P05': 5, 'P25': 25, 'P50': 50, 'P75': 75, 'P95': 95, 'P99.865': 99.865, 'P0.135': 0.135}
+PER_TOOL_HL_KEYS = ['HL_P95_shift', 'HL_P50_shift', 'HL_P05_shift', 'HL_high_OOC', 'HL_record_high_low']
+# 與 chart 層級的 OOB_Rule 相同，Record High/Low 只列出不算入機台的 highlight
+PER_TOOL_SUMMARY_KEYS = [key for key in PER_TOOL_HL_KEYS if key != 'HL_record_high_low']
+PER_TOOL_COLUMNS = ['tool', 'weekly_cnt', 'baseline_cnt', 'ooc_cnt', 'ooc_ratio', 'P95_k', 'P50_k', 'P05_k',
+                    'record_high_count', 'record_low_count'] + PER_TOOL_HL_KEYS + ['highlight']
+PER_TOOL_TABLE_KEYS = ['Material_no', 'group_name', 'chart_name', 'chart_ID']
+_EPSILON = 1e-9
+
+
+def default_per_tool_oob_result(reason='N/A'):
+    return {
+        'per_tool_oob_display': reason,
+        'per_tool_tool_count': 0,
+        'per_tool_highlight_count': 0,
+        'per_tool_highlight_tools': 'N/A',
+        'per_tool_oob_json': '[]',
+    }
+
+
+# === 區段 (segment) kernels：values 已依 (區段, 值) 排序，starts / counts 為各區段起點與長度 ===
+def segment_sort(segments, values, n_segments):
+    order = np.lexsort((values, segments))
+    counts = np.bincount(segments, minlength=n_segments)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return values[order], starts, counts
+
+
+def segment_percentile(sorted_values, starts, counts, q):
+    """各區段的百分位數（同 np.percentile 預設的 linear 內插）；空區段為 NaN"""
+    valid = counts > 0
+    position = q / 100.0 * np.maximum(counts - 1, 0)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, np.maximum(counts - 1, 0))
+    fraction = position - lower
+    lower_values = sorted_values[np.where(valid, starts + lower, 0)] if len(sorted_values) else np.zeros(len(counts))
+    upper_values = sorted_values[np.where(valid, starts + upper, 0)] if len(sorted_values) else np.zeros(len(counts))
+    return np.where(valid, lower_values + (upper_values - lower_values) * fraction, np.nan)
+
+
+def segment_min_max(sorted_values, starts, counts):
+    valid = counts > 0
+    if not len(sorted_values):
+        empty = np.full(len(counts), np.nan)
+        return empty, empty.copy()
+    minimum = np.where(valid, sorted_values[np.where(valid, starts, 0)], np.nan)
+    maximum = np.where(valid, sorted_values[np.where(valid, starts + counts - 1, 0)], np.nan)
+    return minimum, maximum
+
+
+def _safe_ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(np.abs(denominator) < _EPSILON, np.nan, np.round(numerator, 8) / denominator)
+
+
+def _kshift_denominators(base, ucl, lcl):
+    """與 kshift 相同：百分位數分母與管制界限分母取大者；為 0 時改用其他兩個中非 0 的較小者"""
+    p95 = _safe_ratio(base['P99.865'] - base['P50'], 3)
+    p50 = _safe_ratio(base['P99.865'] - base['P0.135'], 6)
+    p05 = _safe_ratio(base['P50'] - base['P0.135'], 3)
+    if pd.notna(ucl):
+        p95 = np.fmax(p95, _safe_ratio(ucl - base['P50'], 6))
+    if pd.notna(ucl) and pd.notna(lcl):
+        p50 = np.fmax(p50, _safe_ratio(np.full(len(p50), ucl - lcl), 12))
+    if pd.notna(lcl):
+        p05 = np.fmax(p05, _safe_ratio(base['P50'] - lcl, 6))
+    denominators = {'P95': np.round(p95, 8), 'P50': np.round(p50, 8), 'P05': np.round(p05, 8)}
+    for name, others in (('P95', ('P50', 'P05')), ('P05', ('P50', 'P95')), ('P50', ('P05', 'P95'))):
+        fallback = np.fmin(*[np.where(denominators[o] == 0, np.nan, denominators[o]) for o in others])
+        denominators[name] = np.where(denominators[name] == 0, np.nan_to_num(fallback, nan=0.0), denominators[name])
+    return denominators
+
+
+def _kshift_effective(weekly, base, k_ori, resolution, characteristic):
+    """向量版 kshift_effective_k：差值未達 resolution 或被 Characteristics 取消時為 NaN"""
+    effective = {}
+    has_resolution = pd.notna(resolution) and resolution > 0
+    for name in ('P95', 'P50', 'P05'):
+        diff = np.abs(weekly[name] - base[name])
+        significant = diff >= resolution if has_resolution else ~np.isnan(diff)
+        effective[name] = np.where(significant & ~np.isnan(k_ori[name]), np.abs(k_ori[name]), np.nan)
+
+    cancel = {name: np.zeros(len(k_ori['P95']), dtype=bool) for name in effective}
+    with np.errstate(invalid='ignore'):
+        if characteristic == 'Bigger':
+            cancel['P95'] |= (weekly['P95'] >= base['P05']) | (k_ori['P95'] >= 0)
+            cancel['P50'] |= (weekly['P50'] >= base['P25']) | (k_ori['P50'] >= 0)
+            cancel['P05'] |= k_ori['P05'] >= 0
+        elif characteristic in ('Smaller', 'Sigma'):
+            cancel['P05'] |= (weekly['P05'] <= base['P95']) | (k_ori['P05'] <= 0)
+            cancel['P50'] |= (weekly['P50'] <= base['P75']) | (k_ori['P50'] <= 0)
+            cancel['P95'] |= k_ori['P95'] <= 0
+        elif characteristic == 'Nominal':
+            cancel['P95'] |= (weekly['P95'] <= base['P95']) | (k_ori['P95'] <= 0)
+            cancel['P05'] |= (weekly['P05'] >= base['P05']) | (k_ori['P05'] >= 0)
+            cancel['P50'] |= (base['P25'] <= weekly['P50']) & (weekly['P50'] <= base['P75'])
+    return {name: np.where(cancel[name], np.nan, value) for name, value in effective.items()}
+
+
+def _numeric(value):
+    value = pd.to_numeric(pd.Series([value]), errors='coerce').iloc[0]
+    return float(value) if pd.notna(value) and np.isfinite(value) else np.nan
+
+
+def per_tool_oob_table(weekly_data, baseline_data, ucl=None, lcl=None, resolution=None, characteristic=None,
+                       k_threshold=1.67, ooc_threshold=0.05):
+    """
+    回傳每個機台一列的 DataFrame（欄位 PER_TOOL_COLUMNS），只列出當週有數據的機台，依 highlight、當週點數排序。
+    """
+    weekly = pd.to_numeric(weekly_data['point_val'], errors='coerce').to_numpy(dtype=float)
+    base = pd.to_numeric(baseline_data['point_val'], errors='coerce').to_numpy(dtype=float)
+    tools = pd.concat([weekly_data['Matching'], baseline_data['Matching']], ignore_index=True)
+    codes, names = pd.factorize(tools.fillna('Unknown').astype(str))
+    n_tools = len(names)
+
+    # 區段編號：機台 * 2 + (0 = 基線, 1 = 當週)；NaN 值不列入
+    values = np.concatenate((base, weekly))
+    segments = np.concatenate((codes[len(weekly):] * 2, codes[:len(weekly)] * 2 + 1))
+    valid = ~np.isnan(values)
+    sorted_values, starts, counts = segment_sort(segments[valid], values[valid], n_tools * 2)
+    base_slice, weekly_slice = slice(0, None, 2), slice(1, None, 2)
+    base_starts, base_counts = starts[base_slice], counts[base_slice]
+    weekly_starts, weekly_counts = starts[weekly_slice], counts[weekly_slice]
+
+    # OOC：與 ooc_calculator 相同以 chart 的 UCL / LCL 判斷
+    weekly_valid = ~np.isnan(weekly)
+    weekly_codes = codes[:len(weekly)][weekly_valid]
+    weekly_values = weekly[weekly_valid]
+    ucl, lcl = _numeric(ucl), _numeric(lcl)
+    with np.errstate(invalid='ignore'):
+        ooc_mask = (weekly_values > ucl) | (weekly_values < lcl)
+    ooc_cnt = np.bincount(weekly_codes, weights=ooc_mask, minlength=n_tools).astype(int)
+    ooc_ratio = np.where(weekly_counts > 0, ooc_cnt / np.maximum(weekly_counts, 1), 0.0)
+    hl_ooc = (ooc_ratio > ooc_threshold) & (ooc_cnt > 1)
+
+    # Record High/Low：與 record_high_low_calculator 相同 round 到 8 位並加 epsilon
+    base_min, base_max = segment_min_max(np.round(sorted_values, 8), base_starts, base_counts)
+    rounded_weekly = np.round(weekly_values, 8)
+    with np.errstate(invalid='ignore'):
+        above = rounded_weekly > base_max[weekly_codes] + _EPSILON
+        below = rounded_weekly < base_min[weekly_codes] - _EPSILON
+    record_ready = base_counts >= PER_TOOL_MIN_BASELINE
+    record_high = np.where(record_ready, np.bincount(weekly_codes, weights=above, minlength=n_tools), 0).astype(int)
+    record_low = np.where(record_ready, np.bincount(weekly_codes, weights=below, minlength=n_tools), 0).astype(int)
+
+    # K-shift
+    base_p = {name: segment_percentile(sorted_values, base_starts, base_counts, q)
+              for name, q in PER_TOOL_PERCENTILES.items()}
+    weekly_p = {name: segment_percentile(sorted_values, weekly_starts, weekly_counts, PER_TOOL_PERCENTILES[name])
+                for name in ('P95', 'P50', 'P05')}
+    denominators = _kshift_denominators(base_p, ucl, lcl)
+    k_ori = {name: _safe_ratio(np.round(weekly_p[name] - base_p[name], 8), denominators[name])
+             for name in weekly_p}
+    kshift_ready = (weekly_counts >= PER_TOOL_MIN_WEEKLY) & (base_counts >= PER_TOOL_MIN_BASELINE)
+    effective = _kshift_effective(weekly_p, base_p, k_ori, _numeric(resolution), characteristic)
+
+    table = pd.DataFrame({
+        'tool': np.asarray(names, dtype=object),
+        'weekly_cnt': weekly_counts,
+        'baseline_cnt': base_counts,
+        'ooc_cnt': ooc_cnt,
+        'ooc_ratio': np.round(ooc_ratio, 4),
+        'record_high_count': record_high,
+        'record_low_count': record_low,
+    })
+    for name in ('P95', 'P50', 'P05'):
+        table[f'{name}_k'] = np.round(np.where(kshift_ready, np.abs(k_ori[name]), np.nan), 4)
+        with np.errstate(invalid='ignore'):
+            table[f'HL_{name}_shift'] = kshift_ready & (effective[name] > k_threshold)
+    table['HL_high_OOC'] = hl_ooc
+    table['HL_record_high_low'] = (record_high + record_low) > 0
+    table['highlight'] = table[PER_TOOL_SUMMARY_KEYS].any(axis=1)
+    table = table[table['weekly_cnt'] > 0]
+    table = table.sort_values(['highlight', 'weekly_cnt', 'tool'], ascending=[False, False, True], kind='stable')
+    return table[PER_TOOL_COLUMNS].reset_index(drop=True)
+
+
+def per_tool_oob_result(weekly_data, baseline_data, chart_info, k_threshold=1.67, ooc_threshold=0.05):
+    """OOB 結果欄位：機台數、有異常的機台、每機台明細 JSON"""
+    if weekly_data is None or weekly_data.empty:
+        return default_per_tool_oob_result('No weekly data')
+    if 'Matching' not in weekly_data.columns or 'Matching' not in baseline_data.columns:
+        return default_per_tool_oob_result('No Matching column')
+    table = per_tool_oob_table(weekly_data, baseline_data, chart_info.get('UCL'), chart_info.get('LCL'),
+                               chart_info.get('Resolution'), chart_info.get('Characteristics'),
+                               k_threshold=k_threshold, ooc_threshold=ooc_threshold)
+    flagged = table[table['highlight']]
+    records = table.astype(object).where(table.notna(), None).to_dict('records')
+    for record in records:
+        for key in PER_TOOL_HL_KEYS + ['highlight']:
+            record[key] = 'HIGHLIGHT' if record[key] else 'NO_HIGHLIGHT'
+    return {
+        'per_tool_oob_display': f"Tools={len(table)}, Highlighted={len(flagged)}",
+        'per_tool_tool_count': int(len(table)),
+        'per_tool_highlight_count': int(len(flagged)),
+        'per_tool_highlight_tools': ', '.join(flagged['tool']) if len(flagged) else 'N/A',
+        'per_tool_oob_json': json.dumps(records, ensure_ascii=False),
+    }
+
+
+def per_tool_highlight_table(results, highlighted_only=False):
+    """所有 chart 的每機台明細（chart 欄位 + PER_TOOL_COLUMNS），供匯出"""
+    frames = []
+    for result in results:
+        text = result.get('per_tool_oob_json')
+        if not text or text == '[]':
+            continue
+        try:
+            frame = pd.DataFrame(json.loads(text))
+        except (TypeError, ValueError):
+            continue
+        for key in reversed(PER_TOOL_TABLE_KEYS):
+            frame.insert(0, key, result.get(key, 'N/A'))
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=PER_TOOL_TABLE_KEYS + PER_TOOL_COLUMNS)
+    table = pd.concat(frames, ignore_index=True)
+    if highlighted_only:
+        table = table[table['highlight'] == 'HIGHLIGHT'].reset_index(drop=True)
+    return table.reindex(columns=PER_TOOL_TABLE_KEYS + PER_TOOL_COLUMNS)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+分段計時 Profiler：記錄每張 chart 在各處理階段 (stage) 花費的時間，
+彙整成百分位數統計與最慢 chart 清單，輸出 JSON 與 Excel summary sheet。
+
+停用時 stage() 直接回傳共用的空 context manager，幾乎不增加成本。
+其他量測 (例如 memory_monitor) 可透過 add_hook() 掛在同一組 stage 上。
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+# 標準階段名稱（報表依此順序排列，未列出的階段排在後面）
+# OOB 規則的階段名稱即 oob_rule_registry 的 rule.name，依註冊順序排列
+STAGE_ORDER = [
+    'file_lookup', 'csv_read', 'preprocessing', 'data_type_detection',
+    'kshift', 'discrete_oob', 'high_ooc', '3o7d', 'sticking', 'trending', 'record_high_low',
+    'by_tool_median_shift', 'ewma_cusum', 'subgroup_chart', 'per_tool_oob',
+    'we_rules', 'cpk', 'rendering', 'by_tool_rendering', 'excel_export',
+    'cl_calculation', 'cl_rendering',
+]
+RUN_LEVEL_KEY = '__run__'
+
+
+class _NullContext:
+    """停用時使用的空 context manager"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class _StageTimer:
+    __slots__ = ('profiler', 'stage', 'chart', 'start', 'hook_states')
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+        self.chart = profiler.current_chart
+        self.hook_states = None
+
+    def __enter__(self):
+        hooks = self.profiler.hooks
+        if hooks:
+            self.hook_states = [hook.on_stage_enter(self.stage, self.chart) for hook in hooks]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        if self.profiler.enabled:
+            self.profiler.record(self.stage, elapsed, self.chart)
+        if self.hook_states is not None:
+            for hook, state in zip(self.profiler.hooks, self.hook_states):
+                hook.on_stage_exit(self.stage, self.chart, state)
+        return False
+
+
+class StageProfiler:
+    """
+    使用方式：
+        with PROFILER.chart('Group_Chart'):
+            with PROFILER.stage('csv_read'):
+                ...
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.hooks = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, run_name=None):
+        with self._lock:
+            self.run_name = run_name
+            self.run_started = time.time()
+            self.timings = {}  # {chart_key: {stage: seconds}}
+
+    @property
+    def current_chart(self):
+        return getattr(self._local, 'chart', None) or RUN_LEVEL_KEY
+
+    def set_chart(self, chart_key):
+        """設定目前處理中的 chart（None 代表整體 run 層級）"""
+        self._local.chart = None if chart_key is None else str(chart_key)
+
+    @contextmanager
+    def chart(self, chart_key):
+        previous = getattr(self._local, 'chart', None)
+        self._local.chart = str(chart_key)
+        try:
+            yield
+        finally:
+            self._local.chart = previous
+
+    def add_hook(self, hook):
+        """hook 需提供 on_stage_enter(stage, chart) -> state 與 on_stage_exit(stage, chart, state)"""
+        if hook not in self.hooks:
+            self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+
+    def stage(self, name):
+        if not self.enabled and not self.hooks:
+            return _NULL_CONTEXT
+        return _StageTimer(self, name)
+
+    def record(self, stage, seconds, chart_key=None):
+        chart_key = chart_key or self.current_chart
+        with self._lock:
+            chart_timings = self.timings.setdefault(chart_key, {})
+            chart_timings[stage] = chart_timings.get(stage, 0.0) + seconds
+
+    # === 報表 ===
+    def _ordered_stages(self):
+        seen = set()
+        for chart_timings in self.timings.values():
+            seen.update(chart_timings)
+        ordered = [s for s in STAGE_ORDER if s in seen]
+        return ordered + sorted(seen - set(ordered))
+
+    def summary(self, top_n=20):
+        stages = []
+        for stage in self._ordered_stages():
+            values = np.array([t[stage] for key, t in self.timings.items()
+                               if stage in t and key != RUN_LEVEL_KEY], dtype=float)
+            run_level = self.timings.get(RUN_LEVEL_KEY, {}).get(stage, 0.0)
+            total = float(values.sum()) + run_level
+            if values.size:
+                p50, p90, p95, p99 = np.percentile(values, [50, 90, 95, 99])
+                stats = {
+                    'charts': int(values.size),
+                    'mean_s': float(values.mean()),
+                    'p50_s': float(p50),
+                    'p90_s': float(p90),
+                    'p95_s': float(p95),
+                    'p99_s': float(p99),
+                    'max_s': float(values.max()),
+                }
+            else:
+                stats = {'charts': 0, 'mean_s': np.nan, 'p50_s': np.nan, 'p90_s': np.nan,
+                         'p95_s': np.nan, 'p99_s': np.nan, 'max_s': np.nan}
+            stages.append(dict(stage=stage, total_s=total, run_level_s=run_level, **stats))
+
+        grand_total = sum(s['total_s'] for s in stages) or 1.0
+        for s in stages:
+            s['share_pct'] = 100.0 * s['total_s'] / grand_total
+
+        chart_totals = sorted(
+            ((key, sum(t.values()), t) for key, t in self.timings.items() if key != RUN_LEVEL_KEY),
+            key=lambda item: item[1], reverse=True
+        )
+        slowest = []
+        for key, total, chart_timings in chart_totals[:top_n]:
+            top_stage = max(chart_timings, key=chart_timings.get)
+            slowest.append({'chart': key, 'total_s': total, 'slowest_stage': top_stage,
+                            'stages': dict(chart_timings)})
+
+        return {
+            'run_name': self.run_name,
+            'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.run_started)),
+            'wall_clock_s': time.time() - self.run_started,
+            'chart_count': len(chart_totals),
+            'stages': stages,
+            'slowest_charts': slowest,
+        }
+
+    def print_summary(self, top_n=10):
+        report = self.summary(top_n=top_n)
+        print(f"=== Stage profile: {report['chart_count']} charts, wall clock {report['wall_clock_s']:.1f}s ===")
+        for s in report['stages']:
+            print(f"  {s['stage']:<22} total={s['total_s']:8.2f}s ({s['share_pct']:5.1f}%)  "
+                  f"p50={s['p50_s']:.3f}s p95={s['p95_s']:.3f}s max={s['max_s']:.3f}s")
+        for c in report['slowest_charts']:
+            print(f"  [slow] {c['chart']}: {c['total_s']:.2f}s (mostly {c['slowest_stage']})")
+        return report
+
+    def write_json(self, path, top_n=50):
+        report = self.summary(top_n=top_n)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=float)
+        return path
+
+    def write_excel(self, path, top_n=50):
+        import pandas as pd
+        report = self.summary(top_n=top_n)
+        stages_df = pd.DataFrame(report['stages'])
+        slowest_df = pd.DataFrame([
+            dict(chart=c['chart'], total_s=c['total_s'], slowest_stage=c['slowest_stage'], **c['stages'])
+            for c in report['slowest_charts']
+        ])
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with pd.ExcelWriter(path, engine='xlsxwriter') as writer:
+            stages_df.to_excel(writer, sheet_name='Performance Summary', index=False)
+            slowest_df.to_excel(writer, sheet_name='Slowest Charts', index=False)
+        return path
+
+
+# 環境變數 OOB_PROFILE_STAGES=1 可在不改設定的情況下強制開啟
+PROFILE_ENV_ENABLED = os.environ.get('OOB_PROFILE_STAGES', '0') == '1'
+PROFILER = StageProfiler(enabled=PROFILE_ENV_ENABLED)
+
+
+def get_profiler():
+    return PROFILER
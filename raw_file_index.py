@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+原始資料 CSV 檔案索引 (Raw file index)
+
+各工具原本每張 chart 都 os.listdir 整個原始資料目錄再逐一比對檔名；
+這裡改為每個目錄只用一次 os.scandir 建立索引，以 GroupName_ChartName 前綴為鍵，
+並以目錄指紋 (目錄 mtime) 快取，檔案新增 / 刪除 / 更名時才重建。
+
+副檔名 .csv 比對區分大小寫（與原本的比對規則相同），只有 find_file 在 Windows 上不分大小寫。
+
+索引鍵：檔名 (去掉 .csv) 本身，以及每個 '_' 之前的前綴；值為 (後綴, 檔名) 清單，
+例如 G_C_20220415_20250422.csv 會登記在 'G_C_20220415_20250422'、'G_C_20220415'、'G_C'、'G' 之下。
+
+查詢方式對應原本各工具的比對規則：
+- find         ：{Group}_{Chart}.csv 或分區檔 {Group}_{Chart}_<數字>_<數字>.csv，完全相同的優先
+                 (OOB find_matching_file、Tool Matching)
+- find_prefix  ：{Group}_{Chart}.csv 或 {Group}_{Chart}_*.csv，取檔名最短者 (CL Tighten)
+- find_file    ：指定檔名完全相同 (Data Health Check；Windows 不分大小寫)
+"""
+import os
+import re
+import threading
+
+CSV_SUFFIX = '.csv'
+PARTITION_SUFFIX = re.compile(r'_\d+_\d+')
+
+
+def directory_fingerprint(directory):
+    """目錄指紋：目錄本身的 mtime；新增、刪除、更名檔案都會改變"""
+    try:
+        stat = os.stat(directory)
+        return (int(stat.st_mtime_ns), int(stat.st_ino))
+    except (OSError, TypeError):
+        return None
+
+
+class RawFileIndex:
+    __slots__ = ('directory', 'fingerprint', 'filenames', 'by_prefix', '_lower_names')
+
+    def __init__(self, directory, fingerprint=None, filenames=()):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.filenames = list(filenames)
+        self.by_prefix = {}
+        for filename in self.filenames:
+            stem = filename[:-len(CSV_SUFFIX)]
+            self.by_prefix.setdefault(stem, []).append(('', filename))
+            position = stem.find('_')
+            while position > 0:
+                self.by_prefix.setdefault(stem[:position], []).append((stem[position:], filename))
+                position = stem.find('_', position + 1)
+        self._lower_names = None
+
+    @classmethod
+    def scan(cls, directory):
+        fingerprint = directory_fingerprint(directory)
+        filenames = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.lower().endswith(CSV_SUFFIX) and entry.is_file():
+                        filenames.append(entry.name)
+        except (OSError, TypeError) as e:
+            print(f"[Warning] 無法建立原始資料檔案索引 {directory}: {e}")
+        filenames.sort()
+        return cls(directory, fingerprint, filenames)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def find(self, group_name, chart_name):
+        """{Group}_{Chart}.csv，沒有時找分區檔 {Group}_{Chart}_<數字>_<數字>.csv"""
+        entries = [entry for entry in self.by_prefix.get(f"{group_name}_{chart_name}", ()) if entry[1].endswith(CSV_SUFFIX)]
+        for suffix, filename in entries:
+            if suffix == '':
+                return self._path(filename)
+        for suffix, filename in entries:
+            if PARTITION_SUFFIX.fullmatch(suffix):
+                return self._path(filename)
+        return None
+
+    def find_prefix(self, group_name, chart_name):
+        """{Group}_{Chart}.csv 或 {Group}_{Chart}_*.csv，多個時取檔名最短者"""
+        entries = self.by_prefix.get(f"{str(group_name).strip()}_{str(chart_name).strip()}", ())
+        candidates = sorted((filename for _, filename in entries if filename.endswith(CSV_SUFFIX)), key=len)
+        if len(candidates) > 1:
+            print(f"    [Debug] 找到多個候選檔案: {candidates}，選擇最短的: {candidates[0]}")
+        return self._path(candidates[0]) if candidates else None
+
+    def find_file(self, filename):
+        """檔名完全相同；Windows 檔案系統不分大小寫，比照 os.path.isfile 的結果"""
+        stem = filename[:-len(CSV_SUFFIX)] if filename.lower().endswith(CSV_SUFFIX) else None
+        for suffix, name in self.by_prefix.get(stem, ()) if stem is not None else ():
+            if suffix == '' and name == filename:
+                return self._path(name)
+        if os.name == 'nt':
+            if self._lower_names is None:
+                self._lower_names = {name.lower(): name for name in self.filenames}
+            name = self._lower_names.get(filename.lower())
+            if name is not None:
+                return self._path(name)
+        return None
+
+
+_INDEX_CACHE = {}
+_INDEX_LOCK = threading.Lock()
+
+
+def get_raw_file_index(directory, force=False):
+    """取得目錄的檔案索引；目錄指紋未變時沿用快取，所有工具共用"""
+    key = os.path.abspath(str(directory)) if directory else ''
+    fingerprint = directory_fingerprint(directory) if directory else None
+    with _INDEX_LOCK:
+        cached = _INDEX_CACHE.get(key)
+        if not force and cached is not None and fingerprint is not None and cached.fingerprint == fingerprint:
+            return cached
+    index = RawFileIndex.scan(directory)
+    with _INDEX_LOCK:
+        _INDEX_CACHE[key] = index
+    return index
+
+
+def clear_raw_file_index_cache():
+    with _INDEX_LOCK:
+        _INDEX_CACHE.clear()
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+內容定址結果快取 (Content-addressed result cache)
+
+以 (圖表設定列, 原始資料指紋, 時間窗, 設定, 程式版本) 的雜湊作為鍵，
+將計算完成的結果紀錄存放在本機磁碟，並依總容量做 LRU 淘汰。
+OOB / CL / Tool Matching / Cpk Dashboard 共用同一套機制，各自使用不同 namespace。
+"""
+import os
+import sys
+import json
+import math
+import pickle
+import hashlib
+import datetime
+import threading
+
+import numpy as np
+import pandas as pd
+
+# 快取檔格式版本：格式改變時遞增，舊快取自動失效
+CACHE_FORMAT_VERSION = 1
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+
+
+def get_cache_dir():
+    """取得快取根目錄（與 resource_path 相同基準的 cache/results）"""
+    if getattr(sys, 'frozen', False):  # 如果是打包環境
+        base_dir = os.path.dirname(sys.executable)
+    else:  # 開發環境
+        base_dir = os.path.abspath(".")
+    return os.path.join(base_dir, 'cache', 'results')
+
+
+def _normalize_for_key(value):
+    """將任意設定值轉為可穩定序列化的結構（dict 依 key 排序、NaN 統一）"""
+    if isinstance(value, pd.Series):
+        value = value.to_dict()
+    if isinstance(value, dict):
+        return {str(k): _normalize_for_key(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [_normalize_for_key(v) for v in value]
+        return sorted(items, key=repr) if isinstance(value, (set, frozenset)) else items
+    if isinstance(value, np.ndarray):
+        return [_normalize_for_key(v) for v in value.tolist()]
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return 'Inf' if value > 0 else '-Inf'
+        return repr(value)
+    if isinstance(value, (pd.Timestamp, datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, pd.Timedelta):
+        return str(value)
+    if hasattr(value, 'toPyDateTime'):  # QDateTime
+        return value.toPyDateTime().isoformat()
+    if hasattr(value, 'toPyDate'):  # QDate
+        return value.toPyDate().isoformat()
+    if isinstance(value, str):
+        return value
+    return repr(value)
+
+
+def make_cache_key(*parts):
+    """將多個組成部分雜湊成一個 sha256 鍵"""
+    payload = json.dumps(_normalize_for_key(list(parts)), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def dataframe_fingerprint(df):
+    """
+    原始資料指紋：以欄位名稱、dtype 與逐列內容雜湊組成。
+    使用 pandas 向量化的 hash_pandas_object，不需逐列 Python 迴圈。
+    """
+    if df is None:
+        return 'none'
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode('utf-8'))
+    hasher.update(str(len(df)).encode('utf-8'))
+    if len(df):
+        try:
+            row_hashes = pd.util.hash_pandas_object(df, index=False).values
+        except TypeError:
+            # 含不可雜湊物件（例如 list）的欄位時退回字串表示
+            row_hashes = pd.util.hash_pandas_object(df.astype(str), index=False).values
+        hasher.update(np.ascontiguousarray(row_hashes).tobytes())
+    return hasher.hexdigest()
+
+
+_file_fingerprint_memo = {}
+
+
+def file_fingerprint(filepath):
+    """
+    原始檔案指紋：檔案 bytes 的 blake2b 雜湊。
+    同一行程內以 (路徑, 大小, mtime) 記憶，未變動的檔案不重複讀取。
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    memo_key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+    cached = _file_fingerprint_memo.get(memo_key)
+    if cached is not None:
+        return cached
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    _file_fingerprint_memo[memo_key] = digest
+    return digest
+
+
+_code_version_memo = {}
+
+
+def code_version(*modules_or_paths):
+    """
+    程式版本：對指定模組原始碼做雜湊，程式碼一改動舊快取即失效。
+    """
+    paths = []
+    for item in modules_or_paths:
+        path = getattr(item, '__file__', item)
+        if path:
+            paths.append(os.path.abspath(str(path)))
+    memo_key = tuple(paths)
+    if memo_key in _code_version_memo:
+        return _code_version_memo[memo_key]
+    hasher = hashlib.blake2b(digest_size=8)
+    hasher.update(str(CACHE_FORMAT_VERSION).encode('utf-8'))
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                hasher.update(f.read())
+        except OSError:
+            # 打包環境可能沒有 .py 原始碼，改用路徑本身
+            hasher.update(path.encode('utf-8'))
+    version = hasher.hexdigest()
+    _code_version_memo[memo_key] = version
+    return version
+
+
+def artifact_signature(paths):
+    """輸出檔 (圖片等) 的簽章：(路徑, 大小, mtime)，任一檔案不存在時回傳 None"""
+    signature = []
+    for path in paths:
+        if not path or path == 'N/A' or not os.path.exists(str(path)):
+            return None
+        stat = os.stat(str(path))
+        signature.append((str(path), stat.st_size, stat.st_mtime_ns))
+    return signature
+
+
+class ResultCache:
+    """
+    磁碟結果快取
+
+    - 每筆結果以 pickle 存在 <cache_dir>/<namespace>/<key[:2]>/<key>.pkl
+    - 讀取命中時更新 mtime，淘汰時依 mtime 由舊到新刪除（LRU）
+    - 總容量超過 max_bytes 時淘汰至 max_bytes 的 90%
+    """
+
+    def __init__(self, namespace, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.namespace = str(namespace)
+        self.cache_dir = os.path.join(cache_dir or get_cache_dir(), self.namespace)
+        self.max_bytes = int(max_bytes)
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = None
+        self._lock = threading.Lock()
+
+    def make_key(self, *parts):
+        return make_cache_key(self.namespace, CACHE_FORMAT_VERSION, *parts)
+
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pkl")
+
+    def get(self, key, default=None):
+        if not self.enabled or not key:
+            return default
+        path = self._path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return default
+        except Exception as e:
+            print(f"[Warning] 結果快取讀取失敗，將重新計算: {e}")
+            self._remove(path)
+            self.misses += 1
+            return default
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if not self.enabled or not key:
+            return False
+        path = self._path_for(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            new_size = os.path.getsize(path)
+        except Exception as e:
+            print(f"[Warning] 結果快取寫入失敗: {e}")
+            self._remove(tmp_path)
+            return False
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_total_bytes()
+            else:
+                self._total_bytes += new_size - old_size
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+        return True
+
+    def _iter_entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.pkl'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def _scan_total_bytes(self):
+        return sum(size for _, size, _ in self._iter_entries())
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self, target_bytes=None):
+        """依 LRU 淘汰至 target_bytes（預設為 max_bytes 的 90%）"""
+        target = int(self.max_bytes * 0.9) if target_bytes is None else int(target_bytes)
+        with self._lock:
+            entries = sorted(self._iter_entries(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                self._remove(path)
+                total -= size
+                removed += 1
+            self._total_bytes = total
+        if removed:
+            print(f"[Info] 結果快取 {self.namespace} 淘汰 {removed} 筆，目前大小 {total / 1024 / 1024:.1f} MB")
+        return removed
+
+    def clear(self):
+        self.evict(target_bytes=0)
+
+    def stats(self):
+        return {
+            'namespace': self.namespace,
+            'hits': self.hits,
+            'misses': self.misses,
+            'size_bytes': self._scan_total_bytes(),
+            'max_bytes': self.max_bytes,
+        }
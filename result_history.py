@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+"""
+OOB / CL 結果歷史 (Result history store)
+
+每次執行的純量結果附加寫入本機 SQLite (output/history/result_history.sqlite)，
+以 (ChartID, 週) 為鍵，不必再開舊的 result_with_images.xlsx 比對：
+
+    runs       每次寫入一列（工具、週、chart 數、寫入時間）
+    results    每張 chart 每週一列：(tool, chart_key, week) 為主鍵，另建 (chart_key, week) 索引；
+               payload 為該 chart 全部純量結果的 JSON
+    rule_hits  每張 chart 每週觸發的規則一列（OOB 的 HL_*、WE 規則、OOC；CL 的 TightenNeeded、Final_OOC）
+
+週 (week) 以週期結束日所在週的星期一表示 (YYYY-MM-DD)，連續週相差 7 天；
+同一工具、同一 chart、同一週重跑時覆蓋舊紀錄。
+
+查詢：
+    history = ResultHistory()
+    history.streaks('oob', rule='HL_P50_shift')      # 各 chart 截至最新一週仍持續的連續週數
+    history.first_seen('oob', chart_key='C0001')      # 每個規則第一次 / 最後一次出現的週
+    history.flapping_rules('oob', last_weeks=8)       # 最近 N 週反覆出現 / 消失的規則
+    history.chart_history('C0001')                    # 單張 chart 每週的結果
+
+分析時以 load_lookup() 一次讀入規則出現的週，annotate() 判斷本週規則是新出現 (NEW) 還是持續 (PERSISTENT)。
+"""
+import os
+import sys
+import json
+import math
+import sqlite3
+import datetime
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+HISTORY_FORMAT_VERSION = 1
+HISTORY_FILENAME = 'result_history.sqlite'
+# build_result 開啟「新出現 / 持續」標示時加入的欄位
+HISTORY_COLUMNS = ['History_Status', 'New_Rules', 'Persistent_Rules', 'Max_Streak']
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)""",
+    """CREATE TABLE IF NOT EXISTS runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tool TEXT NOT NULL, week TEXT, recorded TEXT NOT NULL, charts INTEGER NOT NULL, source TEXT)""",
+    """CREATE TABLE IF NOT EXISTS results (
+        tool TEXT NOT NULL, chart_key TEXT NOT NULL, week TEXT NOT NULL, run_id INTEGER NOT NULL,
+        group_name TEXT, chart_name TEXT, material_no TEXT, highlighted INTEGER NOT NULL, rules TEXT, payload TEXT,
+        PRIMARY KEY (tool, chart_key, week))""",
+    """CREATE INDEX IF NOT EXISTS idx_results_chart_week ON results (chart_key, week)""",
+    """CREATE TABLE IF NOT EXISTS rule_hits (
+        tool TEXT NOT NULL, chart_key TEXT NOT NULL, week TEXT NOT NULL, rule TEXT NOT NULL,
+        PRIMARY KEY (tool, chart_key, week, rule))""",
+    """CREATE INDEX IF NOT EXISTS idx_rule_hits_rule ON rule_hits (tool, rule, week)""",
+]
+
+
+def get_history_path():
+    """歷史資料庫路徑（與 resource_path 相同基準的 output/history）"""
+    if getattr(sys, 'frozen', False):  # 如果是打包環境
+        base_dir = os.path.dirname(sys.executable)
+    else:  # 開發環境
+        base_dir = os.path.abspath(".")
+    return os.path.join(base_dir, 'output', 'history', HISTORY_FILENAME)
+
+
+def week_key(value):
+    """時間 → 所在週星期一的日期字串；無效時回傳 None"""
+    try:
+        timestamp = pd.Timestamp(value)
+    except (ValueError, TypeError):
+        return None
+    if pd.isna(timestamp):
+        return None
+    monday = timestamp.normalize() - pd.Timedelta(days=timestamp.weekday())
+    return monday.strftime('%Y-%m-%d')
+
+
+def week_index(week):
+    """週鍵 → 連續整數（相鄰週差 1）"""
+    return (datetime.date.fromisoformat(week).toordinal() - 1) // 7
+
+
+def _is_missing(value):
+    if value is None:
+        return True
+    if isinstance(value, float) and math.isnan(value):
+        return True
+    return str(value).strip() in ('', 'N/A', 'nan', 'None')
+
+
+def chart_key_of(record):
+    """歷史紀錄的 chart 鍵：ChartID；沒有 ChartID 時用 GroupName_ChartName"""
+    chart_id = record.get('chart_ID', record.get('ChartID'))
+    if not _is_missing(chart_id):
+        if isinstance(chart_id, (float, np.floating)) and float(chart_id).is_integer():
+            chart_id = int(chart_id)
+        return str(chart_id).strip()
+    group_name = record.get('group_name', record.get('GroupName'))
+    chart_name = record.get('chart_name', record.get('ChartName'))
+    return f"{group_name}_{chart_name}"
+
+
+def _count(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return 0 if math.isnan(value) else value
+
+
+def _split_rules(text):
+    if _is_missing(text):
+        return []
+    return [rule.strip() for rule in str(text).split(',') if rule.strip()]
+
+
+def result_rules(record, tool='oob'):
+    """紀錄中觸發的規則名稱（依序、不重複）"""
+    if tool == 'cl':
+        rules = []
+        if str(record.get('TightenNeeded', '')).strip().lower() in ('true', 'yes', '1'):
+            rules.append('TightenNeeded')
+        if _count(record.get('Final_OOC_Count')) > 0:
+            rules.append('Final_OOC')
+        return rules
+    rules = _split_rules(record.get('OOB_Rule')) + _split_rules(record.get('WE_Rule'))
+    if _count(record.get('ooc_cnt')) > 0:
+        rules.append('OOC')
+    return list(dict.fromkeys(rules))
+
+
+def _scalar(value):
+    """payload 只保留純量；NaN / Inf 存為 null，時間存為 ISO 字串，其他型別略過"""
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        return None if math.isnan(value) or math.isinf(value) else value
+    if isinstance(value, (pd.Timestamp, datetime.datetime, datetime.date)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, str):
+        return value
+    raise TypeError
+
+
+def _payload(record):
+    items = record.to_dict().items() if hasattr(record, 'to_dict') else dict(record).items()
+    payload = {}
+    for key, value in items:
+        try:
+            payload[str(key)] = _scalar(value)
+        except TypeError:
+            continue
+    return json.dumps(payload, ensure_ascii=False)
+
+
+class RuleHistoryLookup:
+    """
+    規則出現過的週（已讀入記憶體），供分析時逐張 chart 判斷 NEW / PERSISTENT。
+    只需要在每次執行開始時讀一次。
+    """
+    __slots__ = ('tool', 'rule_weeks', 'chart_weeks')
+
+    def __init__(self, tool, rule_weeks=None, chart_weeks=None):
+        self.tool = tool
+        self.rule_weeks = rule_weeks or {}    # chart_key -> {rule: set(週序號)}
+        self.chart_weeks = chart_weeks or {}  # chart_key -> set(週序號)
+
+    def __len__(self):
+        return len(self.chart_weeks)
+
+    def streak_before(self, chart_key, rule, index):
+        """截至 index 前一週（不含 index）為止，規則連續出現的週數"""
+        weeks = self.rule_weeks.get(chart_key, {}).get(rule)
+        streak = 0
+        while weeks and (index - streak - 1) in weeks:
+            streak += 1
+        return streak
+
+    def annotate(self, record, week=None):
+        """
+        回傳本週規則與上一週比較的標示：
+            History_Status   NEW（有上一週沒有的規則）/ PERSISTENT（規則上週都已出現）/
+                             CLEARED（本週無規則、上週有）/ N/A
+            New_Rules        本週新出現的規則
+            Persistent_Rules 延續的規則與連續週數（含本週），例如 'HL_P50_shift(3w)'
+            Max_Streak       本週規則中最長的連續週數（含本週）
+        """
+        week = week or week_key(record.get('weekly_end_date'))
+        chart_key = chart_key_of(record)
+        rules = result_rules(record, self.tool)
+        if week is None:
+            return {'History_Status': 'N/A', 'New_Rules': 'N/A', 'Persistent_Rules': 'N/A', 'Max_Streak': 0}
+        index = week_index(week)
+
+        streaks = {rule: self.streak_before(chart_key, rule, index) for rule in rules}
+        new_rules = [rule for rule in rules if streaks[rule] == 0]
+        persistent = [rule for rule in rules if streaks[rule] > 0]
+        previous_rules = [rule for rule, weeks in self.rule_weeks.get(chart_key, {}).items() if (index - 1) in weeks]
+
+        if new_rules:
+            status = 'NEW'
+        elif persistent:
+            status = 'PERSISTENT'
+        elif previous_rules:
+            status = 'CLEARED'
+        else:
+            status = 'N/A'
+        return {
+            'History_Status': status,
+            'New_Rules': ', '.join(new_rules) or 'N/A',
+            'Persistent_Rules': ', '.join(f"{rule}({streaks[rule] + 1}w)" for rule in persistent) or 'N/A',
+            'Max_Streak': max([streaks[rule] + 1 for rule in rules] or [0]),
+        }
+
+
+class ResultHistory:
+    def __init__(self, path=None):
+        self.path = path or get_history_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('format_version', ?)",
+                         (str(HISTORY_FORMAT_VERSION),))
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _query(self, sql, params=()):
+        with self._connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    # === 寫入 ===
+    def record_run(self, tool, results, week=None, source=None):
+        """
+        寫入一次執行的結果。week 未指定時依各紀錄的 weekly_end_date 決定（OOB），
+        沒有週資訊的紀錄略過。回傳寫入的 chart 數。
+        """
+        recorded = datetime.datetime.now().isoformat(timespec='seconds')
+        rows = []
+        hits = []
+        week_cache = {}  # 同一次執行的週期結束日通常相同，只換算一次
+        for record in results:
+            record_week = week
+            if record_week is None:
+                weekly_end = record.get('weekly_end_date')
+                if weekly_end not in week_cache:
+                    week_cache[weekly_end] = week_key(weekly_end)
+                record_week = week_cache[weekly_end]
+            if record_week is None:
+                continue
+            chart_key = chart_key_of(record)
+            rules = result_rules(record, tool)
+            rows.append((tool, chart_key, record_week,
+                         str(record.get('group_name', record.get('GroupName', ''))),
+                         str(record.get('chart_name', record.get('ChartName', ''))),
+                         str(record.get('Material_no', '')),
+                         int(bool(rules)), ', '.join(rules), _payload(record)))
+            hits.extend((tool, chart_key, record_week, rule) for rule in rules)
+        if not rows:
+            return 0
+
+        weeks = sorted({row[2] for row in rows})
+        with self._connect() as conn:
+            run_id = conn.execute(
+                "INSERT INTO runs (tool, week, recorded, charts, source) VALUES (?, ?, ?, ?, ?)",
+                (tool, weeks[-1] if len(weeks) == 1 else f"{weeks[0]}~{weeks[-1]}", recorded, len(rows), source),
+            ).lastrowid
+            conn.executemany("DELETE FROM rule_hits WHERE tool = ? AND chart_key = ? AND week = ?",
+                             [row[:3] for row in rows])
+            conn.executemany(
+                "INSERT OR REPLACE INTO results (tool, chart_key, week, run_id, group_name, chart_name, material_no, "
+                "highlighted, rules, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [row[:3] + (run_id,) + row[3:] for row in rows],
+            )
+            conn.executemany("INSERT OR IGNORE INTO rule_hits (tool, chart_key, week, rule) VALUES (?, ?, ?, ?)", hits)
+        print(f"[Info] 結果歷史已寫入 {len(rows)} 張 chart ({tool}, {', '.join(weeks)})")
+        return len(rows)
+
+    # === 查詢 ===
+    def weeks(self, tool='oob'):
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT DISTINCT week FROM results WHERE tool = ? ORDER BY week", (tool,))]
+
+    def chart_history(self, chart_key, tool='oob', expand=False):
+        """單張 chart 每週的結果；expand=True 時展開 payload 中的所有純量欄位"""
+        history = self._query(
+            "SELECT week, group_name, chart_name, material_no, highlighted, rules, payload FROM results "
+            "WHERE chart_key = ? AND tool = ? ORDER BY week", (str(chart_key), tool))
+        if expand and not history.empty:
+            payload = pd.DataFrame([json.loads(text) for text in history['payload']])
+            payload = payload.drop(columns=[col for col in payload.columns if col in history.columns])
+            history = pd.concat([history.drop(columns='payload'), payload], axis=1)
+        return history
+
+    def rule_runs(self, tool='oob', rule=None, chart_key=None):
+        """每個 (chart, 規則) 連續出現的區段：start_week、end_week、weeks（連續週數）"""
+        sql = "SELECT chart_key, rule, week FROM rule_hits WHERE tool = ?"
+        params = [tool]
+        if rule is not None:
+            sql += " AND rule = ?"
+            params.append(rule)
+        if chart_key is not None:
+            sql += " AND chart_key = ?"
+            params.append(str(chart_key))
+        hits = self._query(sql, params)
+        columns = ['chart_key', 'rule', 'start_week', 'end_week', 'weeks']
+        if hits.empty:
+            return pd.DataFrame(columns=columns)
+
+        hits['index'] = hits['week'].map(week_index)
+        hits = hits.sort_values(['chart_key', 'rule', 'index'], kind='stable')
+        same_pair = (hits['chart_key'] == hits['chart_key'].shift()) & (hits['rule'] == hits['rule'].shift())
+        hits['segment'] = (~same_pair | (hits['index'].diff() != 1)).cumsum()
+        runs = hits.groupby('segment', sort=False).agg(
+            chart_key=('chart_key', 'first'), rule=('rule', 'first'),
+            start_week=('week', 'first'), end_week=('week', 'last'), weeks=('week', 'size'))
+        return runs[columns].reset_index(drop=True)
+
+    def streaks(self, tool='oob', week=None, rule=None, min_weeks=1):
+        """
+        目前仍持續的規則與連續週數，依週數由多到少。
+        week 指定時取截至該週仍持續者；未指定時以各 chart 最新一次有紀錄的週為準。
+        """
+        runs = self.rule_runs(tool, rule)
+        if runs.empty:
+            return runs
+        if week is not None:
+            latest = pd.Series(week, index=runs.index)
+        else:
+            latest_weeks = self._query("SELECT chart_key, MAX(week) AS week FROM results WHERE tool = ? GROUP BY chart_key",
+                                       (tool,))
+            latest = runs['chart_key'].map(latest_weeks.set_index('chart_key')['week'])
+        current = runs[(runs['end_week'] == latest) & (runs['weeks'] >= min_weeks)]
+        return current.sort_values(['weeks', 'chart_key'], ascending=[False, True], kind='stable').reset_index(drop=True)
+
+    def first_seen(self, tool='oob', rule=None, chart_key=None):
+        """每個 (chart, 規則) 第一次 / 最後一次出現的週與出現的總週數"""
+        sql = ("SELECT chart_key, rule, MIN(week) AS first_seen, MAX(week) AS last_seen, COUNT(*) AS total_weeks "
+               "FROM rule_hits WHERE tool = ?")
+        params = [tool]
+        if rule is not None:
+            sql += " AND rule = ?"
+            params.append(rule)
+        if chart_key is not None:
+            sql += " AND chart_key = ?"
+            params.append(str(chart_key))
+        return self._query(sql + " GROUP BY chart_key, rule ORDER BY chart_key, rule", params)
+
+    def flapping_rules(self, tool='oob', last_weeks=8, min_changes=3):
+        """
+        最近 last_weeks 週內反覆出現 / 消失的規則：只看該 chart 有紀錄的週，
+        出現 ↔ 消失的切換次數 >= min_changes 者列出。
+        """
+        all_weeks = self.weeks(tool)
+        columns = ['chart_key', 'rule', 'changes', 'weeks_on', 'weeks_recorded']
+        if not all_weeks:
+            return pd.DataFrame(columns=columns)
+        since = (datetime.date.fromisoformat(all_weeks[-1]) - datetime.timedelta(weeks=last_weeks - 1)).isoformat()
+        recorded = self._query("SELECT chart_key, week FROM results WHERE tool = ? AND week >= ?", (tool, since))
+        hits = self._query("SELECT chart_key, rule, week FROM rule_hits WHERE tool = ? AND week >= ?", (tool, since))
+        if hits.empty:
+            return pd.DataFrame(columns=columns)
+
+        pairs = hits[['chart_key', 'rule']].drop_duplicates()
+        grid = pairs.merge(recorded, on='chart_key')
+        grid = grid.merge(hits.assign(on=1), on=['chart_key', 'rule', 'week'], how='left')
+        grid['on'] = grid['on'].fillna(0).astype(int)
+        grid = grid.sort_values(['chart_key', 'rule', 'week'], kind='stable')
+        same_pair = (grid['chart_key'] == grid['chart_key'].shift()) & (grid['rule'] == grid['rule'].shift())
+        grid['change'] = (same_pair & (grid['on'] != grid['on'].shift())).astype(int)
+        summary = grid.groupby(['chart_key', 'rule'], sort=False).agg(
+            changes=('change', 'sum'), weeks_on=('on', 'sum'), weeks_recorded=('week', 'size')).reset_index()
+        summary = summary[summary['changes'] >= min_changes]
+        return summary.sort_values(['changes', 'chart_key'], ascending=[False, True], kind='stable')[columns].reset_index(drop=True)
+
+    def load_lookup(self, tool='oob'):
+        """讀入規則出現的週，供 annotate 使用"""
+        rule_weeks = {}
+        chart_weeks = {}
+        with self._connect() as conn:
+            for chart_key, week in conn.execute("SELECT chart_key, week FROM results WHERE tool = ?", (tool,)):
+                chart_weeks.setdefault(chart_key, set()).add(week_index(week))
+            for chart_key, rule, week in conn.execute(
+                    "SELECT chart_key, rule, week FROM rule_hits WHERE tool = ?", (tool,)):
+                rule_weeks.setdefault(chart_key, {}).setdefault(rule, set()).add(week_index(week))
+        return RuleHistoryLookup(tool, rule_weeks, chart_weeks)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+料號 (Material_no) 層級的 OOB 結果彙總
+
+分析完成後以結果表做 groupby 彙總：每個料號 / Group 的 chart 數、有異常的 chart 數、
+OOC / WE / OOB chart 數，以及各 OOB 規則 (HL_*) 觸發的 chart 數。
+OOB_Rule 字串只對不重複的值拆一次再展開成 (料號, Group, 規則) 計數，不逐 chart 迴圈。
+
+輸出每個料號一列小計 (group_name = ROLLUP_ALL_GROUPS) 接著該料號各 Group 的明細，
+料號依有異常的 chart 數由多到少排列。
+"""
+import numpy as np
+import pandas as pd
+
+from result_store import results_to_dataframe
+
+ROLLUP_ALL_GROUPS = '(All)'
+ROLLUP_KEYS = ['Material_no', 'group_name']
+ROLLUP_COUNT_COLUMNS = ['charts', 'highlighted_charts', 'ooc_charts', 'we_charts', 'oob_charts']
+_SOURCE_COLUMNS = ['Material_no', 'group_name', 'ooc_cnt', 'WE_Rule', 'OOB_Rule']
+
+
+def _unique_text(values):
+    """字串欄位轉成 (codes, 去空白後的不重複值)；字串處理只對不重複值做一次，空值 code 為 -1"""
+    codes, uniques = pd.factorize(values)
+    return codes, pd.Index(uniques, dtype=object).astype(str).str.strip()
+
+
+def _has_rule(values):
+    codes, text = _unique_text(values)
+    flags = np.append(~text.isin(['', 'N/A', 'nan']), False)
+    return flags[codes]
+
+
+def _label(values):
+    codes, text = _unique_text(values)
+    labels = np.append(np.where(text.isin(['', 'nan']), 'N/A', text).astype(object), 'N/A')
+    return labels[codes]
+
+
+def material_rollup(results, rule_order=None):
+    """
+    results：ChartResult / dict 清單或結果 DataFrame。
+    rule_order：HL_* 規則欄位的排列順序（例如 OOB_KEYS）；未列出的規則依名稱排在後面。
+    """
+    if isinstance(results, pd.DataFrame):
+        df = results.reindex(columns=_SOURCE_COLUMNS)
+    else:
+        df = results_to_dataframe(results, columns=_SOURCE_COLUMNS)
+    if df.empty:
+        return pd.DataFrame(columns=ROLLUP_KEYS + ROLLUP_COUNT_COLUMNS + ['highlight_rate'])
+
+    has_ooc = pd.to_numeric(df['ooc_cnt'], errors='coerce').fillna(0).to_numpy() > 0
+    has_we = _has_rule(df['WE_Rule'])
+    has_oob = _has_rule(df['OOB_Rule'])
+    flags = pd.DataFrame({
+        'Material_no': _label(df['Material_no']),
+        'group_name': _label(df['group_name']),
+        'charts': 1,
+        'highlighted_charts': (has_ooc | has_we | has_oob).astype(int),
+        'ooc_charts': has_ooc.astype(int),
+        'we_charts': has_we.astype(int),
+        'oob_charts': has_oob.astype(int),
+    })
+    rollup = flags.groupby(ROLLUP_KEYS, sort=False)[ROLLUP_COUNT_COLUMNS].sum()
+
+    # OOB_Rule "HL_a, HL_b"：先依 (料號, Group, OOB_Rule 字串) 計數，
+    # 再把不重複的 OOB_Rule 字串拆成規則展開，避免逐 chart 拆字串
+    if has_oob.any():
+        rule_text = df['OOB_Rule'][has_oob].astype(str)
+        combos = (flags.loc[has_oob, ROLLUP_KEYS].assign(rule_text=rule_text.values)
+                  .groupby(ROLLUP_KEYS + ['rule_text'], sort=False).size().rename('count').reset_index())
+        unique_text = pd.Series(combos['rule_text'].unique())
+        split = unique_text.str.split(',').explode().str.strip()
+        split = pd.DataFrame({'rule_text': unique_text[split.index].values, 'rule': split.values})
+        split = split[split['rule'] != ''].drop_duplicates()
+        rule_counts = (combos.merge(split, on='rule_text')
+                       .groupby(ROLLUP_KEYS + ['rule'], sort=False)['count'].sum().unstack(fill_value=0))
+        order = [key for key in (rule_order or []) if key in rule_counts.columns]
+        order += sorted(key for key in rule_counts.columns if key not in order)
+        rollup = rollup.join(rule_counts[order]).fillna(0)
+    rule_columns = [col for col in rollup.columns if col not in ROLLUP_COUNT_COLUMNS]
+    rollup = rollup.astype(int)
+
+    totals = rollup.groupby(level='Material_no', sort=False).sum()
+    totals.index = pd.MultiIndex.from_arrays([totals.index, [ROLLUP_ALL_GROUPS] * len(totals)], names=ROLLUP_KEYS)
+
+    # 排序：料號依小計的異常 chart 數、小計列在前、Group 依異常 chart 數
+    combined = pd.concat([totals.assign(_is_detail=False), rollup.assign(_is_detail=True)]).reset_index()
+    material_rank = totals['highlighted_charts'].droplevel('group_name').rank(method='first', ascending=False)
+    combined['_material_rank'] = combined['Material_no'].map(material_rank)
+    combined = combined.sort_values(['_material_rank', '_is_detail', 'highlighted_charts', 'charts'],
+                                    ascending=[True, True, False, False], kind='stable')
+    combined['highlight_rate'] = (combined['highlighted_charts'] / combined['charts']).round(3)
+    columns = ROLLUP_KEYS + ROLLUP_COUNT_COLUMNS + ['highlight_rate'] + rule_columns
+    return combined[columns].reset_index(drop=True)
+
+
+def material_totals(rollup):
+    """只取料號小計列"""
+    if rollup is None or rollup.empty:
+        return rollup
+    return rollup[rollup['group_name'] == ROLLUP_ALL_GROUPS].drop(columns='group_name').reset_index(drop=True)
+
+
+def top_rules(row, rule_columns, limit=3):
+    """小計列中觸發最多的規則，格式 'HL_P95_shift(3), HL_3O7D(1)'"""
+    counts = [(col, int(row[col])) for col in rule_columns if int(row[col]) > 0]
+    counts.sort(key=lambda item: -item[1])
+    return ', '.join(f"{col}({count})" for col, count in counts[:limit]) or 'N/A'
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+精簡結果儲存 (Compact result store)
+
+SPCApp.results 原本每張 chart 一個 ~60 key 的 dict，並持有 raw_df 副本、chart_info 副本與
+FigureCanvas，整個 session 都不釋放。這裡改為：
+- ChartResult：固定欄位 (__slots__) 的純量結果紀錄，提供 dict 相容的 get/[]/in 介面
+- ChartDataStore：以 chart key 保存原始資料的「來源參照」(檔案路徑 + 設定列)，
+  raw_df 需要時才重新讀檔、前處理 (materialize)，只保留最近使用的少量 DataFrame；
+  互動圖 canvas 只保留最近使用的少量 (LRU，約為畫面上可見的列數)，被換出的 canvas 交給
+  canvas_releaser 改存成圖片 / 換回「載入」按鈕，不會每張 chart 都持有 FigureCanvas。
+"""
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# 固定欄位：OOB 結果紀錄的純量欄位（未列出的 key 會放到 extra，不會遺失）
+RESULT_FIELDS = (
+    'group_name', 'chart_name', 'chart_ID', 'Material_no', 'Characteristics', 'data_type',
+    'data_cnt', 'ooc_cnt', 'WE_Rule', 'HL_WE', 'OOB_Rule', 'Cpk', 'Ppk',
+    'USL', 'LSL', 'UCL', 'LCL', 'Target', 'Resolution',
+    'baseline_empty', 'baseline_insufficient',
+    'HL_by_tool_median_shift', 'by_tool_median_shift_display',
+    'by_tool_median_shift_golden_tool', 'by_tool_median_shift_max_tool',
+    'by_tool_median_shift_max_diff', 'by_tool_median_shift_max_k',
+    'by_tool_median_shift_tool_count', 'by_tool_median_shift_top_tools',
+    'by_tool_median_shift_top_count', 'by_tool_median_shift_all_tools_json',
+    'HL_record_high_low', 'record_high', 'record_low',
+    'record_high_count', 'record_low_count', 'record_high_low_count',
+    'record_high_low_risk', 'record_high_low_display',
+    'chart_path', 'weekly_chart_path', 'by_tool_color_path', 'by_tool_group_path',
+    'weekly_start_date', 'weekly_end_date', 'result_cache_key',
+)
+
+# 由 ChartDataStore 持有、依需求重建的大型欄位
+CANVAS_FIELDS = ('spc_canvas', 'weekly_canvas', 'by_tool_color_canvas', 'by_tool_group_canvas')
+DATA_FIELDS = ('raw_df', 'chart_info') + CANVAS_FIELDS
+
+_MISSING = object()
+
+
+class _ChartDataEntry:
+    __slots__ = ('filepath', 'source_info', 'chart_info')
+
+    def __init__(self, filepath, source_info, chart_info):
+        self.filepath = filepath
+        self.source_info = source_info
+        self.chart_info = chart_info
+
+
+class ChartDataStore:
+    """
+    每張 chart 的原始資料來源與圖表物件。
+
+    materializer(entry) -> DataFrame：由呼叫端提供，依 entry.filepath / entry.source_info
+    重新讀檔並做與分析時相同的前處理。
+    canvas_releaser(chart_key, kind, canvas)：canvas 被 LRU 換出時呼叫，由呼叫端存圖並關閉 Figure；
+    未提供時只丟棄參照。
+    """
+
+    def __init__(self, materializer, max_materialized=8, max_canvases=24, canvas_releaser=None):
+        self.materializer = materializer
+        self.max_materialized = max_materialized
+        self.max_canvases = max_canvases
+        self.canvas_releaser = canvas_releaser
+        self._entries = {}
+        self._frames = OrderedDict()  # LRU: chart_key -> DataFrame
+        self._canvases = OrderedDict()  # LRU: (chart_key, kind) -> FigureCanvas
+        self._lock = threading.RLock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._frames.clear()
+            self._canvases.clear()
+
+    def register(self, chart_key, filepath, source_info, chart_info=None, raw_df=None):
+        with self._lock:
+            entry = self._entries.get(chart_key)
+            if entry is None:
+                entry = _ChartDataEntry(filepath, source_info, chart_info)
+                self._entries[chart_key] = entry
+            else:
+                entry.filepath, entry.source_info = filepath, source_info
+                if chart_info is not None:
+                    entry.chart_info = chart_info
+            if raw_df is not None:
+                self._remember_frame(chart_key, raw_df)
+        return entry
+
+    def __contains__(self, chart_key):
+        return chart_key in self._entries
+
+    def entry(self, chart_key):
+        return self._entries.get(chart_key)
+
+    # === raw_df ===
+    def _remember_frame(self, chart_key, df):
+        self._frames[chart_key] = df
+        self._frames.move_to_end(chart_key)
+        while len(self._frames) > self.max_materialized:
+            self._frames.popitem(last=False)
+
+    def get_raw_df(self, chart_key):
+        with self._lock:
+            df = self._frames.get(chart_key)
+            if df is not None:
+                self._frames.move_to_end(chart_key)
+                return df
+            entry = self._entries.get(chart_key)
+        if entry is None:
+            return None
+        try:
+            df = self.materializer(entry)
+        except Exception as e:
+            print(f"[Warning] 重新載入 {chart_key} 原始資料失敗: {e}")
+            return None
+        if df is not None:
+            with self._lock:
+                self._remember_frame(chart_key, df)
+        return df
+
+    def set_raw_df(self, chart_key, df):
+        with self._lock:
+            if df is None:
+                self._frames.pop(chart_key, None)
+            else:
+                self._remember_frame(chart_key, df)
+
+    def materialized_frames(self):
+        with self._lock:
+            return dict(self._frames)
+
+    def release_frames(self):
+        with self._lock:
+            count = len(self._frames)
+            self._frames.clear()
+        return count
+
+    # === canvases ===
+    def get_canvas(self, chart_key, kind):
+        with self._lock:
+            canvas = self._canvases.get((chart_key, kind))
+            if canvas is not None:
+                self._canvases.move_to_end((chart_key, kind))
+            return canvas
+
+    def set_canvas(self, chart_key, kind, canvas):
+        evicted = []
+        with self._lock:
+            if chart_key not in self._entries:
+                self.register(chart_key, None, None)
+            if canvas is None:
+                self._canvases.pop((chart_key, kind), None)
+                return
+            self._canvases[(chart_key, kind)] = canvas
+            self._canvases.move_to_end((chart_key, kind))
+            while len(self._canvases) > self.max_canvases:
+                evicted.append(self._canvases.popitem(last=False))
+        # 在鎖外呼叫，canvas_releaser 可能更新 GUI 或再讀取 store
+        for (evicted_key, evicted_kind), evicted_canvas in evicted:
+            if self.canvas_releaser is None:
+                continue
+            try:
+                self.canvas_releaser(evicted_key, evicted_kind, evicted_canvas)
+            except Exception as e:
+                print(f"[Warning] 釋放 {evicted_key} {evicted_kind} 失敗: {e}")
+
+    def pop_canvas(self, chart_key, kind):
+        with self._lock:
+            return self._canvases.pop((chart_key, kind), None)
+
+
+class ChartResult:
+    """
+    單張 chart 的精簡結果紀錄。
+
+    純量欄位存在 __slots__；raw_df / chart_info / canvas 透過 ChartDataStore 取得，
+    因此 result.get('raw_df') 會在需要時重新載入資料。
+    """
+    __slots__ = RESULT_FIELDS + ('_chart_key', '_store', '_extra')
+
+    def __init__(self, chart_key, store, values=None):
+        self._chart_key = chart_key
+        self._store = store
+        self._extra = None
+        for key, value in (values or {}).items():
+            self[key] = value
+
+    @property
+    def chart_key(self):
+        return self._chart_key
+
+    def _has_scalar(self, key):
+        if key in RESULT_FIELDS:
+            try:
+                getattr(self, key)
+                return True
+            except AttributeError:
+                return False
+        return self._extra is not None and key in self._extra
+
+    # === dict 相容介面 ===
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        if key in RESULT_FIELDS:
+            return getattr(self, key, default)
+        if key == 'raw_df':
+            df = self._store.get_raw_df(self._chart_key)
+            return default if df is None else df
+        if key == 'chart_info':
+            entry = self._store.entry(self._chart_key)
+            return default if entry is None or entry.chart_info is None else entry.chart_info
+        if key in CANVAS_FIELDS:
+            canvas = self._store.get_canvas(self._chart_key, key)
+            return default if canvas is None else canvas
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def __setitem__(self, key, value):
+        if key in RESULT_FIELDS:
+            setattr(self, key, value)
+        elif key == 'raw_df':
+            self._store.set_raw_df(self._chart_key, value)
+        elif key == 'chart_info':
+            entry = self._store.entry(self._chart_key) or self._store.register(self._chart_key, None, None)
+            entry.chart_info = value
+        elif key in CANVAS_FIELDS:
+            self._store.set_canvas(self._chart_key, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        if key in CANVAS_FIELDS:
+            return self._store.get_canvas(self._chart_key, key) is not None
+        if key in ('raw_df', 'chart_info'):
+            return self._chart_key in self._store
+        return self._has_scalar(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self.get(key)
+
+    def pop(self, key, default=None):
+        if key in CANVAS_FIELDS:
+            canvas = self._store.pop_canvas(self._chart_key, key)
+            return default if canvas is None else canvas
+        if key in RESULT_FIELDS:
+            value = getattr(self, key, default)
+            if self._has_scalar(key):
+                delattr(self, key)
+            return value
+        if self._extra is not None:
+            return self._extra.pop(key, default)
+        return default
+
+    def keys(self):
+        keys = [key for key in RESULT_FIELDS if self._has_scalar(key)]
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self.get(key)) for key in self.keys()]
+
+    def to_dict(self):
+        """純量欄位 (不含 raw_df / chart_info / canvas)"""
+        return dict(self.items())
+
+    def has_chart_data(self):
+        """是否可取得 raw_df 與 chart_info（不觸發重新載入）"""
+        entry = self._store.entry(self._chart_key)
+        return entry is not None and entry.chart_info is not None
+
+    def held_objects(self):
+        """目前實際佔用記憶體的大型物件（不觸發重新載入），供記憶體統計使用"""
+        held = {}
+        frame = self._store.materialized_frames().get(self._chart_key)
+        if frame is not None:
+            held['raw_df'] = frame
+        for kind in CANVAS_FIELDS:
+            canvas = self._store.get_canvas(self._chart_key, kind)
+            if canvas is not None:
+                held[kind] = canvas
+        return held
+
+    def __repr__(self):
+        return f"ChartResult({self._chart_key!r}, OOB_Rule={self.get('OOB_Rule')!r})"
+
+
+def results_to_dataframe(results, columns=None):
+    """將結果紀錄轉成 DataFrame（只取純量欄位）；指定 columns 時逐欄讀取，不轉出整筆紀錄"""
+    if columns is not None:
+        return pd.DataFrame({col: [r.get(col) for r in results] for col in columns}, columns=columns)
+    rows = [r.to_dict() if isinstance(r, ChartResult) else dict(r) for r in results]
+    return pd.DataFrame(rows, columns=columns)
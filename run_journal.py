@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoint journal：每完成一張 chart 就把結果附加寫入 JSONL，
+程式中途失敗時可用相同輸入 (相同 fingerprint) 續跑，已完成的 chart 直接從 journal 讀回。
+
+檔案格式（每行一個 JSON 物件）：
+    {"type": "header", "run": "oob", "fingerprint": "...", "created": "..."}
+    {"type": "chart", "key": "...", "status": "processed", "source": [...], "record": {...}}
+    {"type": "complete", "charts": 123, "finished": "..."}
+
+限制：journal 只負責中斷後續跑，不會降低執行中的記憶體。匯出仍在最後一次寫出，
+所以每張 chart 的結果在 save_results / export_results 之前都留在記憶體中：
+- OOB：self.results 保留每張 chart 的 ChartResult 純量紀錄與 chart_info。
+  raw_df 與 canvas 由 ChartDataStore 以 LRU 保留，不在此列。
+- CL：self.results 保留完整的結果 dict。
+匯出時不會從 journal 串流讀回。
+"""
+import os
+import json
+import math
+import time
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from result_cache import make_cache_key
+
+JOURNAL_FORMAT_VERSION = 1
+
+
+def _encode_value(value):
+    """轉為可 JSON 序列化、且可還原型別的結構"""
+    if isinstance(value, pd.Series):
+        return {'__series__': {str(k): _encode_value(v) for k, v in value.items()}}
+    if isinstance(value, dict):
+        return {str(k): _encode_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_encode_value(v) for v in value]
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        if math.isnan(value) or math.isinf(value):
+            return {'__float__': repr(value)}
+        return value
+    if isinstance(value, (pd.Timestamp, datetime.datetime)):
+        return {'__timestamp__': pd.Timestamp(value).isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__timestamp__': pd.Timestamp(value).isoformat()}
+    if isinstance(value, (pd.Timedelta, datetime.timedelta)):
+        return {'__timedelta__': pd.Timedelta(value).isoformat()}
+    if isinstance(value, str):
+        return value
+    return str(value)
+
+
+def _decode_value(value):
+    if isinstance(value, list):
+        return [_decode_value(v) for v in value]
+    if isinstance(value, dict):
+        if len(value) == 1:
+            (tag, payload), = value.items()
+            if tag == '__float__':
+                return float(payload)
+            if tag == '__timestamp__':
+                return pd.Timestamp(payload)
+            if tag == '__timedelta__':
+                return pd.Timedelta(payload)
+            if tag == '__series__':
+                return pd.Series({k: _decode_value(v) for k, v in payload.items()}, dtype=object)
+        return {k: _decode_value(v) for k, v in value.items()}
+    return value
+
+
+def file_source_signature(filepath):
+    """原始檔簽章 (大小, mtime)：續跑時檔案有變動就重新計算"""
+    try:
+        stat = os.stat(filepath)
+        return [int(stat.st_size), int(stat.st_mtime_ns)]
+    except (OSError, TypeError):
+        return None
+
+
+def directory_signature(directory, suffix='.csv'):
+    """目錄內檔案 (名稱, 大小, mtime) 的雜湊，只讀 metadata 不讀內容"""
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.lower().endswith(suffix):
+                    stat = entry.stat()
+                    entries.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    except OSError:
+        return None
+    return make_cache_key(sorted(entries))
+
+
+class RunJournal:
+    """
+    使用方式：
+        journal = RunJournal(path, fingerprint, run_name='oob', resume=True)
+        done = journal.completed            # {key: entry}
+        journal.append(key, record, status='processed', source=[...])
+        journal.mark_complete()
+    """
+
+    def __init__(self, path, fingerprint, run_name='run', resume=False, fsync_every=20, meta=None):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.run_name = run_name
+        self.meta = dict(meta or {})  # 額外寫入 header 的資訊（例如分片編號）
+        self.fsync_every = max(int(fsync_every), 1)
+        self.completed = {}
+        self._pending_sync = 0
+        self._file = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if resume:
+            self.completed = self._load_existing()
+        if self.completed:
+            print(f"[Info] 從 checkpoint 續跑：{len(self.completed)} 張 chart 已完成 ({os.path.basename(path)})")
+            self._file = open(path, 'a', encoding='utf-8')
+        else:
+            self._file = open(path, 'w', encoding='utf-8')
+            self._write(self._header(), sync=True)
+
+    def _header(self):
+        header = {
+            'type': 'header', 'version': JOURNAL_FORMAT_VERSION, 'run': self.run_name,
+            'fingerprint': self.fingerprint, 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        if self.meta:
+            header['meta'] = self.meta
+        return header
+
+    def _load_existing(self):
+        if not os.path.exists(self.path):
+            return {}
+        completed = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                header = None
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 中斷時最後一行可能只寫了一半
+                        print("[Warning] checkpoint 最後一筆不完整，已忽略")
+                        break
+                    if header is None:
+                        header = item
+                        if (item.get('type') != 'header' or item.get('version') != JOURNAL_FORMAT_VERSION
+                                or item.get('fingerprint') != self.fingerprint):
+                            print("[Info] checkpoint 的輸入 fingerprint 不同，重新開始")
+                            return {}
+                        continue
+                    if item.get('type') == 'chart':
+                        item['record'] = _decode_value(item.get('record'))
+                        completed[item['key']] = item
+        except OSError as e:
+            print(f"[Warning] 讀取 checkpoint 失敗，重新開始: {e}")
+            return {}
+        if completed:
+            # 去掉不完整的尾行，之後的 append 從乾淨的行首開始
+            self._rewrite(completed)
+        return completed
+
+    def _rewrite(self, completed):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self._header(), ensure_ascii=False) + '\n')
+            for key, item in completed.items():
+                f.write(json.dumps(dict(item, record=_encode_value(item.get('record'))), ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def _write(self, item, sync=False):
+        self._file.write(json.dumps(item, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self._pending_sync += 1
+        if sync or self._pending_sync >= self.fsync_every:
+            try:
+                os.fsync(self._file.fileno())
+            except OSError:
+                pass
+            self._pending_sync = 0
+
+    def get(self, key, source=None):
+        """取得已完成的紀錄；source 簽章不同時視為未完成"""
+        item = self.completed.get(key)
+        if item is None:
+            return None
+        stored = item.get('source')
+        if (list(stored) if stored is not None else None) != (list(source) if source is not None else None):
+            return None
+        return item
+
+    def append(self, key, record, status='processed', source=None):
+        item = {'type': 'chart', 'key': key, 'status': status, 'source': source,
+                'record': _encode_value(record)}
+        self._write(item)
+        self.completed[key] = dict(item, record=record)
+
+    def mark_complete(self):
+        self._write({'type': 'complete', 'charts': len(self.completed),
+                     'finished': time.strftime('%Y-%m-%d %H:%M:%S')}, sync=True)
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            try:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError:
+                pass
+            self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def read_journal(path):
+    """
+    唯讀載入 journal（不檢查 fingerprint），回傳 (header, entries, complete)。
+    entries 依寫入順序，同一個 key 只保留最後一筆。
+    """
+    header, entries, complete = None, {}, False
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if header is None:
+                header = item if item.get('type') == 'header' else {}
+                continue
+            if item.get('type') == 'chart':
+                item['record'] = _decode_value(item.get('record'))
+                entries.pop(item['key'], None)
+                entries[item['key']] = item
+            elif item.get('type') == 'complete':
+                complete = True
+    return header or {}, list(entries.values()), complete
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+多機分片執行 (sharded batch run) 與結果合併
+
+批次 OOB / CL 計算可依 GroupName/ChartName 的穩定雜湊切成 n 片，每台機器（或每個 process）只跑其中一片，
+結果寫在各自的工作目錄：
+    <work-dir>/oob_shard.jsonl 或 cl_shard.jsonl   分片結果（header 記錄分片編號、總 chart 數與輸入 fingerprint）
+    <work-dir>/result_with_images.xlsx 等          分片自己的報表與圖檔
+合併時檢查所有分片的輸入一致、且每張 chart 恰好出現一次，依設定檔順序重建結果，
+產生與單機執行相同的 result_with_images.xlsx / CL_Calculation_Results.xlsx（圖檔複製到合併端的 output 目錄）。
+
+使用方式：
+    python shard_runner.py run --kind oob --shard 1/3 --work-dir shards/oob_1_of_3
+    python shard_runner.py merge --kind oob shards/oob_1_of_3 shards/oob_2_of_3 shards/oob_3_of_3
+    （OOB 報表的附加 sheet 依分片執行時的設定產生，記錄在分片 header；merge 也可用 --settings 覆寫）
+    python shard_runner.py local --kind cl --shards 3      # 本機以 3 個 process 執行後合併
+"""
+import os
+import sys
+import shutil
+import argparse
+import subprocess
+import traceback
+from datetime import datetime
+
+from CL_limit_class import CLTightenCalculator
+import CL_limit_class
+from chart_scheduler import parse_shard_spec, in_shard
+from result_cache import make_cache_key, file_fingerprint, code_version
+from run_journal import RunJournal, read_journal
+
+SHARD_FILES = {'oob': 'oob_shard.jsonl', 'cl': 'cl_shard.jsonl'}
+REPORT_FILES = {'oob': 'result_with_images.xlsx', 'cl': 'CL_Calculation_Results.xlsx'}
+OOB_IMAGE_FIELDS = ('chart_path', 'weekly_chart_path', 'by_tool_color_path', 'by_tool_group_path')
+
+
+def _to_shard_relative(value, root):
+    """圖檔路徑改為相對於分片工作目錄，整個目錄搬到合併端後仍可找到"""
+    if isinstance(value, str) and value.lower().endswith('.png'):
+        full = os.path.abspath(value)
+        if full.startswith(root + os.sep) and os.path.exists(full):
+            return os.path.relpath(full, root)
+    return value
+
+
+def _import_artifact(value, shard_dir, dest_root, absolute):
+    """把分片的圖檔複製到合併端相同的相對位置，回傳合併端的路徑"""
+    if not (isinstance(value, str) and value.lower().endswith('.png')) or os.path.isabs(value):
+        return value
+    source = os.path.join(shard_dir, value)
+    if not os.path.exists(source):
+        print(f"[Warning] 分片圖檔不存在: {source}")
+        return value
+    target = os.path.join(dest_root, value)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.copy2(source, target)
+    return os.path.abspath(target) if absolute else value
+
+
+def _parse_date(text):
+    return datetime.strptime(text, '%Y-%m-%d') if text else None
+
+
+# === 分片執行 ===
+def run_oob_shard(chart_info_path, raw_data_directory, shard, settings=None):
+    """在目前工作目錄執行 OOB 分片，回傳寫入的 chart 數"""
+    # CL 分片與合併不需要載入 GUI 模組，OOB 才匯入
+    import oob_module_NGK_nostatic as oob
+    from oob_watch_service import create_headless_app, analyze_chart_task, chart_key_of
+
+    k, n = shard
+    root = os.path.abspath('.')
+    app = create_headless_app(chart_info_path, raw_data_directory, settings)
+    all_charts_info = oob.load_chart_information(chart_info_path)
+    if all_charts_info.empty:
+        raise ValueError(f"無法載入有效的圖表配置: {chart_info_path}")
+    execution_time = oob.load_execution_time(chart_info_path)
+    window = app.get_custom_time_range()
+    file_index = oob.build_raw_file_index(raw_data_directory)
+
+    fingerprint = make_cache_key(
+        'oob_shard', file_fingerprint(chart_info_path), execution_time, window,
+        {key: app.oob_settings.get(key) for key in oob.OOB_ANALYSIS_SETTING_KEYS},
+        oob.analysis_code_version(), n,
+    )
+    charts = [(position, row) for position, (_, row) in enumerate(all_charts_info.iterrows()) if in_shard(row, shard)]
+    print(f"[Info] OOB 分片 {k}/{n}：{len(charts)} / {len(all_charts_info)} 張 chart")
+
+    outcomes = []
+    for position, row in charts:
+        filepath = oob.find_matching_file_from_index(file_index, row['GroupName'], row['ChartName'])
+        print(f"\n[{position + 1}/{len(all_charts_info)}] 正在處理圖表: {chart_key_of(row)}")
+        outcomes.append(analyze_chart_task(app, position, row, filepath, execution_time, window) + (filepath, row))
+
+    # 與 watch service 相同：依設定檔順序重建結果後匯出分片報表（同時產生圖檔）
+    app.chart_store.clear()
+    processed = [(position, app.make_result_record(chart_key_of(row), dict(record), filepath, row))
+                 for position, status, record, filepath, row in outcomes if status == 'processed']
+    app.results = [result for _, result in processed]
+    if app.results:
+        app.save_results(excel_path=REPORT_FILES['oob'])
+
+    journal = RunJournal(SHARD_FILES['oob'], fingerprint, run_name='oob_shard',
+                         meta={'shard': k, 'shards': n, 'charts': len(all_charts_info),
+                               'settings': {key: app.oob_settings.get(key) for key in oob.EXPORT_SHEET_SETTING_KEYS}})
+    try:
+        results = dict(processed)
+        for position, status, _, _, row in outcomes:
+            record = None
+            if status == 'processed':
+                record = results[position].to_dict()
+                for field in OOB_IMAGE_FIELDS:
+                    record[field] = _to_shard_relative(record.get(field), root)
+            journal.append(f"{position}|{chart_key_of(row)}", record, status=status)
+        journal.mark_complete()
+    finally:
+        journal.close()
+    return len(outcomes)
+
+
+def run_cl_shard(chart_info_path, raw_data_directory, shard, start_date=None, end_date=None):
+    """在目前工作目錄執行 CL 分片，回傳寫入的 chart 數"""
+    k, n = shard
+    root = os.path.abspath('.')
+    calculator = CLTightenCalculator(chart_info_path, raw_data_directory, start_date, end_date)
+    results_df = calculator.run_calculation(shard=shard)
+    if not results_df.empty:
+        calculator.export_results(results_df, REPORT_FILES['cl'])
+
+    fingerprint = make_cache_key(
+        'cl_shard', file_fingerprint(chart_info_path), start_date, end_date, code_version(CL_limit_class), n,
+    )
+    total = len(calculator.load_chart_information(chart_info_path))
+    journal = RunJournal(SHARD_FILES['cl'], fingerprint, run_name='cl_shard',
+                         meta={'shard': k, 'shards': n, 'charts': total})
+    try:
+        for position, record in zip(calculator.result_positions, calculator.results):
+            record = dict(record)
+            record['PlotFile'] = _to_shard_relative(record.get('PlotFile'), root)
+            journal.append(f"{position}|{record.get('GroupName', 'N/A')}_{record.get('ChartName', 'N/A')}", record)
+        journal.mark_complete()
+    finally:
+        journal.close()
+    return len(calculator.results)
+
+
+def run_shard(kind, chart_info_path, raw_data_directory, shard, work_dir, settings=None,
+              start_date=None, end_date=None):
+    """切換到分片工作目錄執行（輸出圖檔、報表、checkpoint 都留在該目錄）"""
+    chart_info_path = os.path.abspath(chart_info_path)
+    raw_data_directory = os.path.abspath(raw_data_directory)
+    os.makedirs(work_dir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        if kind == 'oob':
+            return run_oob_shard(chart_info_path, raw_data_directory, shard, settings)
+        return run_cl_shard(chart_info_path, raw_data_directory, shard, start_date, end_date)
+    finally:
+        os.chdir(cwd)
+
+
+# === 合併 ===
+def load_shard_results(kind, shard_dirs):
+    """
+    讀取所有分片結果並檢查完整性，回傳 (依設定檔順序排列的 [(position, status, record, shard_dir), ...], 分片 meta)。
+    分片缺漏、未完成、輸入不一致或 chart 重複 / 遺漏時 raise ValueError。
+    """
+    headers, items = {}, {}
+    for shard_dir in shard_dirs:
+        path = os.path.join(shard_dir, SHARD_FILES[kind])
+        if not os.path.exists(path):
+            raise ValueError(f"找不到分片結果: {path}")
+        header, entries, complete = read_journal(path)
+        meta = header.get('meta') or {}
+        if header.get('run') != f"{kind}_shard" or 'shard' not in meta:
+            raise ValueError(f"不是 {kind} 分片結果: {path}")
+        if not complete:
+            raise ValueError(f"分片 {meta['shard']}/{meta['shards']} 尚未執行完成: {path}")
+        if meta['shard'] in headers:
+            raise ValueError(f"分片 {meta['shard']}/{meta['shards']} 重複: {path}")
+        headers[meta['shard']] = header
+        for entry in entries:
+            position = int(entry['key'].split('|', 1)[0])
+            if position in items:
+                raise ValueError(f"chart {entry['key']} 同時出現在多個分片")
+            items[position] = (position, entry.get('status'), entry.get('record'), shard_dir)
+
+    first = next(iter(headers.values()), None)
+    if first is None:
+        raise ValueError("沒有任何分片結果")
+    shard_count, total = first['meta']['shards'], first['meta']['charts']
+    if any(h['fingerprint'] != first['fingerprint'] for h in headers.values()):
+        raise ValueError("分片的輸入 (設定檔、日期、設定或程式版本) 不一致，無法合併")
+    missing_shards = sorted(set(range(1, shard_count + 1)) - set(headers))
+    if missing_shards:
+        raise ValueError(f"缺少分片: {', '.join(f'{k}/{shard_count}' for k in missing_shards)}")
+    missing_charts = sorted(set(range(total)) - set(items))
+    if missing_charts:
+        raise ValueError(f"有 {len(missing_charts)} 張 chart 不在任何分片結果中 (設定檔位置 {missing_charts[:10]})")
+    print(f"[Info] 已載入 {shard_count} 個分片，共 {total} 張 chart")
+    return [items[position] for position in sorted(items)], first['meta']
+
+
+def merge_oob_shards(shard_dirs, excel_path=REPORT_FILES['oob'], settings=None):
+    """settings：附加 sheet 使用的 OOB 設定，覆寫分片執行時記錄的設定（未指定的 key 沿用分片記錄）"""
+    import oob_module_NGK_nostatic as oob
+
+    dest_root = oob.resource_path('.')
+    results = []
+    items, meta = load_shard_results('oob', shard_dirs)
+    if 'settings' not in meta and not settings:
+        print("[Warning] 分片未記錄 OOB 設定（舊版分片），只輸出料號彙總 sheet")
+    settings = {**(meta.get('settings') or {}), **(settings or {})}
+    for _, status, record, shard_dir in items:
+        if status != 'processed':
+            continue
+        for field in OOB_IMAGE_FIELDS:
+            record[field] = _import_artifact(record.get(field), shard_dir, dest_root, absolute=True)
+        results.append(record)
+    if not results:
+        print("[Warning] 所有分片都沒有可匯出的結果")
+        return False
+    oob.save_results_to_excel(oob.build_results_dataframe(results), output_path=excel_path,
+                              extra_sheets=oob.build_export_sheets(results, settings))
+    print(f"[Info] 合併報表已輸出: {os.path.abspath(excel_path)}（{len(results)} 張 chart）")
+    return True
+
+
+def merge_cl_shards(shard_dirs, excel_path=REPORT_FILES['cl']):
+    records = []
+    for _, _, record, shard_dir in load_shard_results('cl', shard_dirs)[0]:
+        record['PlotFile'] = _import_artifact(record.get('PlotFile'), shard_dir, '.', absolute=False)
+        records.append(record)
+    results_df = CLTightenCalculator.build_output_dataframe(records)
+    return CLTightenCalculator().export_results(results_df, excel_path)
+
+
+def merge_shards(kind, shard_dirs, excel_path=None, settings=None):
+    excel_path = excel_path or REPORT_FILES[kind]
+    if kind == 'oob':
+        return merge_oob_shards(shard_dirs, excel_path, settings)
+    return merge_cl_shards(shard_dirs, excel_path)
+
+
+# === 本機測試：每片一個 process ===
+def run_local(kind, shard_count, work_root, passthrough, excel_path=None, settings=None):
+    shard_dirs, processes = [], []
+    for k in range(1, shard_count + 1):
+        work_dir = os.path.join(work_root, f"{kind}_{k}_of_{shard_count}")
+        os.makedirs(work_dir, exist_ok=True)
+        log = open(os.path.join(work_dir, 'shard.log'), 'w', encoding='utf-8')
+        command = [sys.executable, os.path.abspath(__file__), 'run', '--kind', kind,
+                   '--shard', f"{k}/{shard_count}", '--work-dir', work_dir] + passthrough
+        processes.append((k, subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT), log))
+        shard_dirs.append(work_dir)
+    print(f"[Info] 已啟動 {shard_count} 個分片 process，log 位於 {work_root}")
+
+    failed = []
+    for k, process, log in processes:
+        if process.wait() != 0:
+            failed.append(k)
+        log.close()
+    if failed:
+        print(f"[Error] 分片 {failed} 執行失敗，請查看 shard.log")
+        return 1
+    return 0 if merge_shards(kind, shard_dirs, excel_path, settings) else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded OOB / CL batch run")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def add_input_args(p):
+        p.add_argument('--kind', choices=sorted(SHARD_FILES), required=True)
+        p.add_argument('--chart-info', default='input/All_Chart_Information.xlsx')
+        p.add_argument('--raw-dir', default='input/raw_charts/')
+        p.add_argument('--settings', help="(OOB) JSON 檔，覆寫 OOB 設定")
+        p.add_argument('--start', help="(CL) 自訂起始日期 YYYY-MM-DD")
+        p.add_argument('--end', help="(CL) 自訂結束日期 YYYY-MM-DD")
+
+    run_parser = sub.add_parser('run', help="執行單一分片")
+    add_input_args(run_parser)
+    run_parser.add_argument('--shard', required=True, help="k/n，例如 1/4")
+    run_parser.add_argument('--work-dir', required=True, help="分片輸出目錄")
+
+    merge_parser = sub.add_parser('merge', help="合併分片結果")
+    merge_parser.add_argument('--kind', choices=sorted(SHARD_FILES), required=True)
+    merge_parser.add_argument('--excel', help="輸出報表路徑（預設與單機執行相同）")
+    merge_parser.add_argument('--settings', help="(OOB) JSON 檔，覆寫附加 sheet 使用的設定（預設沿用分片記錄的設定）")
+    merge_parser.add_argument('shard_dirs', nargs='+')
+
+    local_parser = sub.add_parser('local', help="本機以多個 process 執行所有分片後合併")
+    add_input_args(local_parser)
+    local_parser.add_argument('--shards', type=int, required=True)
+    local_parser.add_argument('--work-root', default='shards')
+    local_parser.add_argument('--excel')
+
+    args = parser.parse_args(argv)
+    try:
+        settings = None
+        if args.settings:
+            from oob_watch_service import load_settings_file
+            settings = load_settings_file(args.settings)
+        if args.command == 'merge':
+            return 0 if merge_shards(args.kind, args.shard_dirs, args.excel, settings) else 1
+
+        if args.command == 'local':
+            passthrough = ['--chart-info', os.path.abspath(args.chart_info), '--raw-dir', os.path.abspath(args.raw_dir)]
+            for flag, value in (('--settings', args.settings), ('--start', args.start), ('--end', args.end)):
+                if value:
+                    passthrough += [flag, os.path.abspath(value) if flag == '--settings' else value]
+            return run_local(args.kind, parse_shard_spec(f"1/{args.shards}")[1], args.work_root, passthrough, args.excel,
+                             settings)
+
+        count = run_shard(args.kind, args.chart_info, args.raw_dir, parse_shard_spec(args.shard), args.work_dir,
+                          settings=settings, start_date=_parse_date(args.start), end_date=_parse_date(args.end))
+        print(f"[Info] 分片 {args.shard} 完成：{count} 張 chart，結果位於 {os.path.abspath(args.work_dir)}")
+        return 0
+    except ValueError as e:
+        print(f"[Error] {e}")
+        return 1
+    except Exception as e:
+        print(f"[Error] 分片執行失敗: {e}")
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
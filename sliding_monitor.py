@@ -0,0 +1,569 @@
+# -*- coding: utf-8 -*-
+"""
+近即時滑動視窗監看 (sliding-window monitor)
+
+OOB 分析以 execTime 結束的 7 天為週期；監看模式改為每小時以「現在」為週期結束，對重點 chart 重算 OOB。
+每張 chart 保留一份 SlidingChartState：
+- 環狀緩衝 (ring buffer)：依時間排序的點，只保留最近 2 年 + 7 天（最長的兩年基線所需）。
+- 原始檔只讀新增的位元組 (byte offset)，新增點依原本的前處理流程 (時間 / CHART_CREATE_TIME / 規格外排除) 處理後併入。
+- 基線：排序後的基線值、各值點數 (眾數) 與合計，隨時間窗前進只加入 / 移除進出基線的點；
+  百分位數由排序陣列直接取值（與 np.percentile linear 相同的內插，結果逐位元相同）。
+- 週期資料、最近 7 週 (trending) 與基線 DataFrame 都是緩衝區的 view，需要時才建立。
+
+因此每個 tick 的計算量與新增 / 進出時間窗的點數成正比；規則仍是 OOB_RULES 中的同一組函式，
+highlight 結果與對同一份資料重跑 process_single_chart 相同。
+離散型 chart 與 auto_baseline_changepoint 開啟時，改以緩衝區資料整張重算。
+
+使用方式：
+    python sliding_monitor.py --chart-info input/All_Chart_Information.xlsx --raw-dir input/raw_charts \\
+        --charts GroupA_Chart1,GroupB_Chart2 --interval 3600
+    python sliding_monitor.py --once            # 只計算一次（適合排程器每小時呼叫）
+未指定 --charts 時，監看設定檔中 Sliding_Monitor 欄位為 Y 的 chart。
+"""
+import io
+import os
+import sys
+import time
+import heapq
+import argparse
+import contextlib
+import traceback
+
+import numpy as np
+import pandas as pd
+
+import oob_module_NGK_nostatic as oob
+from oob_rule_registry import RuleContext, HIGHLIGHT
+from chart_config import as_chart_info
+
+SLIDING_MONITOR_COLUMN = 'Sliding_Monitor'
+SLIDING_OUTPUT = 'output/sliding_monitor_live.csv'
+SLIDING_WEEKLY_DAYS = 6                      # 週期 = [now - 6 天, now]，與 resolve_analysis_window 相同
+SLIDING_BASELINE_DAYS = 365
+SLIDING_TRENDING_DAYS = 48                   # trending 的 7 週
+SLIDING_RETENTION = pd.Timedelta(days=365 * 2 + SLIDING_WEEKLY_DAYS + 1)
+BASELINE_MIN_POINTS = 10
+PERCENTILE_KEYS = (('P05', 5), ('P50', 50), ('P75', 75), ('P25', 25), ('P95', 95),
+                   ('P99.865', 99.865), ('P0.135', 0.135))
+RESULT_COLUMNS = ['chart', 'tick_time', 'mode', 'weekly_start_date', 'weekly_end_date', 'baseline_start_date',
+                  'baseline_end_date', 'data_cnt', 'ooc_cnt', 'baseline_cnt', 'new_points', 'highlight', 'OOB_Rule']
+
+
+def sorted_percentile(sorted_values, q):
+    """已排序陣列的百分位數，與 np.percentile(values, q) (linear) 的內插步驟相同"""
+    n = len(sorted_values)
+    virtual = (n - 1) * np.true_divide(q, 100)
+    if virtual >= n - 1:
+        return sorted_values[-1]
+    if virtual < 0:
+        return sorted_values[0]
+    previous = int(np.floor(virtual))
+    gamma = virtual - previous
+    a = sorted_values[previous]
+    b = sorted_values[previous + 1]
+    diff = b - a
+    if gamma >= 0.5:
+        return b - diff * (1 - gamma)
+    return a + diff * gamma
+
+
+class ValueCounts(dict):
+    """基線各值的點數；mode() 與 pandas Series.mode()[0] 相同（點數相同時取最小值）"""
+
+    def __init__(self):
+        super().__init__()
+        self._heap = []
+
+    def add(self, values, counts):
+        for value, count in zip(values.tolist(), counts.tolist()):
+            total = self.get(value, 0) + count
+            if total > 0:
+                self[value] = total
+                heapq.heappush(self._heap, (-total, value))
+            else:
+                self.pop(value, None)
+        if len(self._heap) > 4 * len(self) + 64:
+            self._heap = [(-count, value) for value, count in self.items()]
+            heapq.heapify(self._heap)
+
+    def mode(self):
+        # heap 中過期的 (點數, 值) 延遲移除
+        while self._heap:
+            count, value = self._heap[0]
+            if self.get(value, 0) == -count:
+                return value
+            heapq.heappop(self._heap)
+        return np.nan
+
+
+class _SlidingContext(RuleContext):
+    """輸入先找 SlidingChartState 提供的值 / 延遲建立函式，其餘交給註冊的 provider"""
+
+    def __init__(self, registry, chart_info, lazy, **kwargs):
+        super().__init__(registry, chart_info, **kwargs)
+        self._lazy = lazy
+
+    def get(self, name):
+        if name not in self._values and name in self._lazy:
+            self._values[name] = self._lazy[name]()
+        return super().get(name)
+
+    __getitem__ = get
+
+
+class SlidingChartState:
+    """單張 chart 的滑動狀態：依時間排序的環狀緩衝與增量維護的基線統計"""
+
+    def __init__(self, key, chart_info, data_type, columns, spec_limits):
+        self.key = key
+        self.chart_info = chart_info
+        self.data_type = data_type
+        self.columns = list(columns)          # 與 preprocess_data 的輸出欄位相同
+        self.spec_limits = spec_limits        # 首次載入時的 (USL, LSL)，新增點沿用
+        self.text_columns = ()                # 首次載入時為文字型別的欄位
+        self.filepath = None
+        self.offset = 0                       # 已讀取的位元組數
+        self.header = b''
+        self._data = {}                       # 欄位 → 緩衝陣列（容量可大於點數）
+        self._head = 0                        # 緩衝中第一個保留點的位置
+        self._size = 0                        # 緩衝中已使用的長度
+        self._origin = 0                      # 緩衝位置 0 的絕對索引（移除舊點後仍保持索引不變）
+        self._base_range = None               # 目前基線的絕對索引 [lo, hi)
+        self._sorted = np.array([])
+        self._counts = ValueCounts()
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self.rebuilds = 0
+
+    # === 環狀緩衝 ===
+    def __len__(self):
+        return self._size - self._head
+
+    @property
+    def times(self):
+        return self._data['point_time'][self._head:self._size]
+
+    def _position(self, absolute):
+        return absolute - self._origin
+
+    def _compact(self, capacity):
+        keep = self._size - self._head
+        for name, array in self._data.items():
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[:keep] = array[self._head:self._size]
+            self._data[name] = grown
+        self._origin += self._head
+        self._size = keep
+        self._head = 0
+
+    def _column_arrays(self, df):
+        arrays = {'point_time': df['point_time'].to_numpy(dtype='datetime64[ns]').view('i8')}
+        for name in self.columns:
+            if name == 'point_val':
+                arrays[name] = df[name].to_numpy(dtype=float)
+            elif name != 'point_time':
+                arrays[name] = df[name].to_numpy(dtype=object)
+        return arrays
+
+    def append(self, df):
+        """加入已前處理的點；全部晚於緩衝中最後一點時直接接在尾端，否則重新排序並重建基線"""
+        if df is None or df.empty:
+            return 0
+        arrays = self._column_arrays(df)
+        order = np.argsort(arrays['point_time'], kind='stable')
+        arrays = {name: array[order] for name, array in arrays.items()}
+        count = len(order)
+
+        if not self._data:
+            self._data = arrays
+            self._size = count
+            return count
+
+        in_order = len(self) == 0 or arrays['point_time'][0] >= self.times[-1]
+        if not in_order:
+            # 補進較早時間的點：合併後重新排序（少見），基線索引失效
+            merged = {name: np.concatenate([self._data[name][self._head:self._size], arrays[name]])
+                      for name in self._data}
+            order = np.argsort(merged['point_time'], kind='stable')
+            self._origin += self._head
+            self._data = {name: array[order] for name, array in merged.items()}
+            self._head = 0
+            self._size = len(order)
+            self._base_range = None
+            return count
+
+        capacity = len(self._data['point_time'])
+        if self._size + count > capacity:
+            self._compact(max(2 * (len(self) + count), 1024))
+        for name, array in arrays.items():
+            self._data[name][self._size:self._size + count] = array
+        self._size += count
+        return count
+
+    def trim(self, before_ns):
+        """移除早於 before_ns 的點（只移動起點，空間在下次擴充時回收）"""
+        self._head += int(np.searchsorted(self.times, before_ns, side='left'))
+        if self._head > (self._size >> 1) and self._head > 4096:
+            self._compact(max(2 * len(self), 1024))
+
+    def index_range(self, start_ns, end_ns):
+        """時間 [start, end] 的絕對索引 [lo, hi)"""
+        times = self.times
+        offset = self._origin + self._head
+        return (offset + int(np.searchsorted(times, start_ns, side='left')),
+                offset + int(np.searchsorted(times, end_ns, side='right')))
+
+    def column(self, name, lo, hi):
+        return self._data[name][self._position(lo):self._position(hi)]
+
+    def frame(self, lo, hi):
+        """緩衝區 [lo, hi) 的 DataFrame（數值與時間欄位為 view）"""
+        data = {}
+        for name in self.columns:
+            array = self.column(name, lo, hi)
+            data[name] = array.view('datetime64[ns]') if name == 'point_time' else array
+        return pd.DataFrame(data, columns=self.columns, copy=False)
+
+    # === 增量基線 ===
+    def _apply(self, lo, hi, sign):
+        if hi <= lo:
+            return
+        values = self.column('point_val', lo, hi)
+        unique, counts = np.unique(values, return_counts=True)
+        self._counts.add(unique, sign * counts)
+        self._sum += sign * float(values.sum())
+        self._sumsq += sign * float(np.dot(values, values))
+        ordered = np.sort(values)
+        if sign > 0:
+            self._sorted = np.insert(self._sorted, np.searchsorted(self._sorted, ordered), ordered)
+        else:
+            # 重複值：同一個值依序刪除相鄰的位置
+            positions = np.searchsorted(self._sorted, ordered, side='left')
+            positions += np.arange(len(ordered)) - np.searchsorted(ordered, ordered, side='left')
+            self._sorted = np.delete(self._sorted, positions)
+
+    def _rebuild_baseline(self, lo, hi):
+        self._sorted = np.array([])
+        self._counts = ValueCounts()
+        self._sum = self._sumsq = 0.0
+        self._apply(lo, hi, 1)
+        self.rebuilds += 1
+
+    def advance_baseline(self, lo, hi):
+        """基線時間窗改為 [lo, hi)：只處理進出的點；沒有重疊或變動過大時整段重建"""
+        previous = self._base_range
+        if previous is None or lo >= previous[1] or hi <= previous[0] \
+                or (abs(lo - previous[0]) + abs(hi - previous[1])) > max(hi - lo, 1):
+            self._rebuild_baseline(lo, hi)
+        else:
+            old_lo, old_hi = previous
+            self._apply(old_lo, min(lo, old_hi), -1)
+            self._apply(max(hi, old_lo), old_hi, -1)
+            self._apply(lo, min(old_lo, hi), 1)
+            self._apply(max(old_hi, lo), hi, 1)
+        self._base_range = (lo, hi)
+
+    def baseline_percentiles(self):
+        return {key: sorted_percentile(self._sorted, q) for key, q in PERCENTILE_KEYS}
+
+    def baseline_stats(self, lo, hi):
+        """基線統計：values 為時間順序的 view；mean / sigma 由合計推得（規則只用 values 與百分位數）"""
+        cnt = hi - lo
+        mean = self._sum / cnt if cnt else np.nan
+        sigma = 0.0
+        if cnt > 1:
+            variance = (self._sumsq - cnt * mean * mean) / (cnt - 1)
+            sigma = float(np.sqrt(variance)) if variance > 0 else 0.0
+        return {'values': self.column('point_val', lo, hi), 'cnt': cnt, 'mean': mean, 'sigma': sigma}
+
+    # === 計算 ===
+    def windows(self, now):
+        """與 resolve_analysis_window + process_single_chart 相同的週期 / 基線時間範圍"""
+        weekly_end = pd.Timestamp(now)
+        weekly_start = weekly_end - pd.Timedelta(days=SLIDING_WEEKLY_DAYS)
+        baseline_end = weekly_start - pd.Timedelta(seconds=1)
+        baseline_start = baseline_end - pd.Timedelta(days=SLIDING_BASELINE_DAYS)
+        lo, hi = self.index_range(baseline_start.value, baseline_end.value)
+        insufficient = False
+        if hi - lo < BASELINE_MIN_POINTS:
+            baseline_start = baseline_end - pd.Timedelta(days=SLIDING_BASELINE_DAYS * 2)
+            lo, hi = self.index_range(baseline_start.value, baseline_end.value)
+            insufficient = hi - lo < BASELINE_MIN_POINTS
+        return (weekly_start, weekly_end, baseline_start, baseline_end), (lo, hi), insufficient
+
+    def full_recompute(self, now):
+        """整張重算（離散型 / changepoint 基線），使用緩衝區的資料"""
+        lo = self._origin + self._head
+        raw_df = self.frame(lo, self._origin + self._size).copy()
+        window = self.windows(now)[0]
+        weekly_start, weekly_end, baseline_start, baseline_end = window
+        if self.data_type == 'discrete':
+            return oob.SPCApp._process_discrete_chart(raw_df, self.chart_info.copy(), weekly_start, weekly_end,
+                                                      baseline_start, baseline_end)
+        return oob.process_single_chart(self.chart_info.copy(), raw_df, baseline_start, baseline_end,
+                                        weekly_start, weekly_end)
+
+    def evaluate(self, now):
+        """以 now 為週期結束計算 OOB 規則，回傳與 process_single_chart 相同欄位的結果 (週期無資料時 None)"""
+        window, (base_lo, base_hi), insufficient = self.windows(now)
+        weekly_start, weekly_end = window[0], window[1]
+        week_lo, week_hi = self.index_range(weekly_start.value, weekly_end.value)
+        if week_hi <= week_lo:
+            return None
+        self.advance_baseline(base_lo, base_hi)
+        baseline_empty = base_hi <= base_lo
+        insufficient = insufficient or baseline_empty
+        recent_lo = self.index_range((weekly_end - pd.Timedelta(days=SLIDING_TRENDING_DAYS)).value,
+                                     weekly_end.value)[0]
+        everything = (self._origin + self._head, self._origin + self._size)
+
+        lazy = {
+            'baseline_data': lambda: self.frame(base_lo, base_hi),
+            'raw_df': lambda: self.frame(*everything),
+            'recent_data': lambda: self.frame(recent_lo, week_hi),
+            'baseline_stats': lambda: self.baseline_stats(base_lo, base_hi),
+            'baseline_values': lambda: self.column('point_val', base_lo, base_hi),
+            'baseline_percentiles': self.baseline_percentiles,
+            'baseline_extremes': lambda: self._sorted[[0, -1]] if len(self._sorted) else np.array([]),
+            'baseline_counts': lambda: self._counts,
+        }
+        context = _SlidingContext(
+            oob.OOB_RULES, self.chart_info, lazy, chart_type='continuous',
+            baseline_valid=not insufficient, weekly_data=self.frame(week_lo, week_hi).copy(), window=window,
+        )
+        rule_outputs, _ = oob.OOB_RULES.evaluate(context)
+        return oob.build_chart_result(self.chart_info, context['ooc'], insufficient, baseline_empty, rule_outputs)
+
+    def tick(self, now):
+        """回傳 (結果, 計算方式)"""
+        self.trim((pd.Timestamp(now) - SLIDING_RETENTION).value)
+        if self.data_type == 'discrete' or self.chart_info.auto_baseline_changepoint:
+            return self.full_recompute(now), 'full'
+        return self.evaluate(now), 'incremental'
+
+
+def prepare_points(chart_row, df, spec_limits=None):
+    """
+    與 preprocess_data 相同的前處理（時間轉換、CHART_CREATE_TIME、規格填補與規格外排除、保留欄位）；
+    spec_limits 未指定時使用排序後第一列的規格，回傳 (資料, chart_info, spec_limits)。
+    """
+    df = oob.format_and_clean_data(df, chart_row)
+    if df.empty:
+        return df, chart_row, spec_limits
+    df, chart_info = oob.update_chart_limits(df, chart_row.copy())
+    if spec_limits is None:
+        spec_limits = (df['usl_val'].iat[0], df['lsl_val'].iat[0])
+    df = oob.exclude_oos_data(df, *spec_limits)
+    columns = ['point_val', 'point_time'] + [name for name in ('Batch_ID', 'Matching') if name in df.columns]
+    return df[columns], chart_info, spec_limits
+
+
+def _read_points(data, text_columns=()):
+    # 新增的幾列單獨解析時，Batch_ID / Matching 沿用首次載入時的文字型別（例如 '007' 不變成 7）
+    df = pd.read_csv(io.BytesIO(data), dtype={name: str for name in text_columns})
+    if 'point_time' in df.columns:
+        df['point_time'] = pd.to_datetime(df['point_time'], errors='coerce')
+        df.dropna(subset=['point_time'], inplace=True)
+    return df
+
+
+class SlidingMonitor:
+    """
+    使用方式：
+        monitor = SlidingMonitor('input/All_Chart_Information.xlsx', 'input/raw_charts', charts=['GroupA_Chart1'])
+        rows = monitor.tick()           # 每小時呼叫一次
+    """
+
+    def __init__(self, chart_info_path, raw_data_directory, charts=None, settings=None, quiet=True):
+        self.chart_info_path = chart_info_path
+        self.raw_data_directory = raw_data_directory
+        self.selected = list(charts or [])
+        self.settings = {'run_by_tool_median_shift': False, 'by_tool_median_shift_k_threshold': 1.67,
+                         'run_ewma_cusum': False, 'run_subgroup_charts': False, 'run_per_tool_oob': False,
+                         'auto_baseline_changepoint': False}
+        self.settings.update(settings or {})
+        self.quiet = quiet
+        self.rows = {}
+        self.states = {}
+        self.latest = {}
+        self.load_chart_rows()
+
+    def _quiet_context(self):
+        return contextlib.redirect_stdout(io.StringIO()) if self.quiet else contextlib.nullcontext()
+
+    def load_chart_rows(self):
+        with self._quiet_context():
+            all_charts_info = oob.load_chart_information(self.chart_info_path)
+        by_id = {}
+        rows = {}
+        for _, row in all_charts_info.iterrows():
+            key = f"{row['GroupName']}_{row['ChartName']}"
+            rows.setdefault(key, row)
+            chart_id = str(row.get('ChartID', '')).strip()
+            by_id.setdefault(chart_id[:-2] if chart_id.endswith('.0') else chart_id, key)
+        if self.selected:
+            keys = []
+            for name in self.selected:
+                key = name if name in rows else by_id.get(str(name).strip())
+                if key is None:
+                    print(f"[Warning] 找不到監看的 chart: {name}")
+                elif key not in keys:
+                    keys.append(key)
+        else:
+            keys = [key for key, row in rows.items()
+                    if str(row.get(SLIDING_MONITOR_COLUMN, '')).strip().upper() == 'Y']
+        self.rows = {key: rows[key] for key in keys}
+        print(f"[Info] 滑動視窗監看 {len(self.rows)} 張 chart")
+
+    def _analysis_info(self, chart_info, data_type):
+        chart_info = as_chart_info(chart_info.rename({'Material_no': 'material_no', 'GroupName': 'group_name',
+                                                      'ChartName': 'chart_name'}))
+        chart_info['data_type'] = data_type
+        for name in ('by_tool_median_shift_k_threshold', 'run_by_tool_median_shift', 'run_ewma_cusum',
+                     'run_subgroup_charts', 'run_per_tool_oob', 'auto_baseline_changepoint'):
+            chart_info[name] = self.settings.get(name)
+        return chart_info
+
+    def load_state(self, key):
+        """首次載入（或原始檔被改寫）：讀入整份原始檔並建立狀態"""
+        row = self.rows[key]
+        filepath = oob.find_matching_file(self.raw_data_directory, row['GroupName'], row['ChartName'])
+        if not filepath or not os.path.exists(filepath):
+            raise FileNotFoundError(f"找不到 {row['GroupName']}/{row['ChartName']} 的原始資料")
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        with self._quiet_context():
+            points, chart_info, spec_limits = prepare_points(row.copy(), _read_points(data))
+            if points.empty:
+                raise ValueError("預處理後沒有資料")
+            data_type = oob.determine_data_type(points['point_val'].dropna())
+        state = SlidingChartState(key, self._analysis_info(chart_info, data_type), data_type, points.columns,
+                                  spec_limits)
+        state.text_columns = tuple(name for name in ('Batch_ID', 'Matching')
+                                   if name in points.columns and points[name].dtype == object)
+        state.append(points)
+        state.filepath = filepath
+        state.offset = len(data)
+        state.header = data.split(b'\n', 1)[0] + b'\n'
+        self.states[key] = state
+        return state, len(points)
+
+    def read_new_points(self, state):
+        """讀取原始檔尾端新增的完整列；檔案變小或開頭被改寫時回傳 None（需重新載入）"""
+        size = os.path.getsize(state.filepath)
+        if size < state.offset:
+            return None
+        with open(state.filepath, 'rb') as f:
+            if f.read(len(state.header)) != state.header:
+                return None
+            if size == state.offset:
+                return 0
+            f.seek(state.offset)
+            data = f.read(size - state.offset)
+        end = data.rfind(b'\n') + 1
+        if end <= 0:
+            return 0
+        state.offset += end
+        with self._quiet_context():
+            points, _, _ = prepare_points(self.rows[state.key].copy(), _read_points(state.header + data[:end], state.text_columns),
+                                          state.spec_limits)
+        return state.append(points)
+
+    def tick_chart(self, key, now):
+        state = self.states.get(key)
+        new_points = None if state is None else self.read_new_points(state)
+        if new_points is None:
+            state, new_points = self.load_state(key)
+        with self._quiet_context():
+            result, mode = state.tick(now)
+        return result, mode, new_points, state
+
+    def tick(self, now=None):
+        """對所有監看中的 chart 計算一次，回傳結果列清單"""
+        now = pd.Timestamp.now().floor('s') if now is None else pd.Timestamp(now)
+        rows = []
+        for key in self.rows:
+            try:
+                result, mode, new_points, state = self.tick_chart(key, now)
+            except Exception as e:
+                print(f"[Warning] {key} 滑動視窗計算失敗: {e}")
+                traceback.print_exc()
+                continue
+            if result is None:
+                continue
+            rows.append(self.summarize(key, now, result, mode, new_points, state))
+        for row in rows:
+            self.latest[row['chart']] = row
+        return rows
+
+    @staticmethod
+    def summarize(key, now, result, mode, new_points, state):
+        window = state.windows(now)[0]
+        hl_keys = oob.OOB_RULES.highlight_keys()
+        oob_true_keys = [name for name in oob.OOB_SUMMARY_KEYS if result.get(name) == HIGHLIGHT]
+        row = {
+            'chart': key, 'tick_time': now, 'mode': mode,
+            'weekly_start_date': window[0], 'weekly_end_date': window[1],
+            'baseline_start_date': window[2], 'baseline_end_date': window[3],
+            'data_cnt': result.get('data_cnt'), 'ooc_cnt': result.get('ooc_cnt'),
+            'baseline_cnt': state._base_range[1] - state._base_range[0] if state._base_range else np.nan,
+            'new_points': new_points,
+            'highlight': any(result.get(name) == HIGHLIGHT for name in hl_keys),
+            'OOB_Rule': ', '.join(oob_true_keys) if oob_true_keys else 'N/A',
+        }
+        row.update({name: result.get(name, 'N/A') for name in hl_keys})
+        return row
+
+    def write_live_table(self, path=SLIDING_OUTPUT):
+        if not self.latest:
+            return
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        table = pd.DataFrame(list(self.latest.values()))
+        table = table[RESULT_COLUMNS + [name for name in table.columns if name not in RESULT_COLUMNS]]
+        tmp_path = path + '.tmp'
+        table.to_csv(tmp_path, index=False, encoding='utf-8-sig')
+        os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Near-real-time sliding-window OOB monitor")
+    parser.add_argument('--chart-info', default=oob.resource_path('input/All_Chart_Information.xlsx'))
+    parser.add_argument('--raw-dir', default=oob.resource_path('input/raw_charts/'))
+    parser.add_argument('--charts', help="監看的 chart（GroupName_ChartName 或 ChartID，以逗號分隔）")
+    parser.add_argument('--settings', help="JSON 檔，覆寫 OOB 設定 (例如 run_by_tool_median_shift)")
+    parser.add_argument('--interval', type=float, default=3600.0, help="計算間隔（秒）")
+    parser.add_argument('--output', default=SLIDING_OUTPUT)
+    parser.add_argument('--once', action='store_true', help="計算一次後結束")
+    args = parser.parse_args(argv)
+
+    settings = None
+    if args.settings:
+        import json
+        with open(args.settings, 'r', encoding='utf-8') as f:
+            settings = json.load(f)
+    charts = [name.strip() for name in args.charts.split(',') if name.strip()] if args.charts else None
+    try:
+        monitor = SlidingMonitor(args.chart_info, args.raw_dir, charts=charts, settings=settings)
+    except Exception as e:
+        print(f"[Error] 滑動視窗監看啟動失敗: {e}")
+        traceback.print_exc()
+        return 1
+
+    while True:
+        start = time.time()
+        rows = monitor.tick()
+        monitor.write_live_table(args.output)
+        flagged = sum(1 for row in rows if row['highlight'])
+        print(f"[Info] {pd.Timestamp.now():%Y-%m-%d %H:%M} 計算 {len(rows)} 張 chart，"
+              f"{flagged} 張 highlight，耗時 {time.time() - start:.2f} 秒")
+        if args.once:
+            return 0
+        try:
+            time.sleep(max(args.interval - (time.time() - start), 1.0))
+        except KeyboardInterrupt:
+            print("[Info] 滑動視窗監看結束")
+            return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,6 +7,7 @@ from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 import oob_module_NGK_nostatic as oob_module
+from result_cache import ResultCache, dataframe_fingerprint, code_version
 
 class SlidingToggleSwitch(QtWidgets.QAbstractButton):
     """iOS 風格滑動開關"""
@@ -172,6 +173,51 @@ def calculate_cpk(raw_df, chart_info):
         cpk = round(cpk, 3)
     return {'Cpk': cpk}
 
+def filter_spec_limits(raw_df, chart_info):
+    """過濾超出 USL / LSL 的點（Cpk 計算用）"""
+    usl = chart_info.get('USL', None)
+    lsl = chart_info.get('LSL', None)
+    if usl is not None and lsl is not None:
+        raw_df = raw_df[(raw_df['point_val'] <= usl) & (raw_df['point_val'] >= lsl)]
+    elif usl is not None:
+        raw_df = raw_df[raw_df['point_val'] <= usl]
+    elif lsl is not None:
+        raw_df = raw_df[raw_df['point_val'] >= lsl]
+    return raw_df
+
+def compute_cpk_equal_duration_windows(raw_df, chart_info, start_time, end_time):
+    """將 [start_time, end_time] 平分為三段 (L2, L1, Current) 分別計算 Cpk"""
+    result = {'Cpk': None, 'Cpk_last_month': None, 'Cpk_last2_month': None}
+    if raw_df is None or raw_df.empty:
+        return result
+
+    df = raw_df.copy()
+    df['point_time'] = pd.to_datetime(df['point_time'])
+    
+    # --- 關鍵修正：平分總時長 ---
+    total_range = end_time - start_time
+    duration_segment = total_range / 3  # 每一小格佔 1/3 時長
+    
+    # 重新定義三個等長區間
+    # [Start] --(L2)-- [Start+1/3] --(L1)-- [Start+2/3] --(Current)-- [End]
+    curr_start, curr_end = end_time - duration_segment, end_time
+    l1_start, l1_end     = curr_start - duration_segment, curr_start
+    l2_start, l2_end     = l1_start - duration_segment, l1_start
+    
+    # 篩選數據
+    mask_curr = (df['point_time'] >= curr_start) & (df['point_time'] <= curr_end)
+    mask_l1   = (df['point_time'] >= l1_start)   & (df['point_time'] < l1_end)
+    mask_l2   = (df['point_time'] >= l2_start)   & (df['point_time'] < l2_end)
+    
+    # 分段計算 Cpk
+    if mask_curr.any():
+        result['Cpk'] = calculate_cpk(df[mask_curr], chart_info)['Cpk']
+    if mask_l1.any():
+        result['Cpk_last_month'] = calculate_cpk(df[mask_l1], chart_info)['Cpk']
+    if mask_l2.any():
+        result['Cpk_last2_month'] = calculate_cpk(df[mask_l2], chart_info)['Cpk']
+    return result
+
 def get_app_dir():
     if getattr(sys, 'frozen', False):
         return os.path.dirname(sys.executable)
@@ -188,6 +234,7 @@ class SPCCpkDashboard(QtWidgets.QWidget):
         self.raw_charts_dict = {}
         self.cpk_results = {}  # {(group_name, chart_name): {'Cpk': value}}
         self.chart_date_states = {}  # 每張圖的日期狀態：{'custom': bool, 'start': date, 'end': date}
+        self.result_cache = ResultCache('cpk_dashboard')  # 磁碟結果快取
         self.axis_mode = 'index'  # 'index' (等距) 或 'time'
         
         # 計算模式設定
@@ -1136,19 +1183,16 @@ class SPCCpkDashboard(QtWidgets.QWidget):
             raw_path = oob_module.find_matching_file(raw_data_dir, g_name, c_name)
             if raw_path and os.path.exists(raw_path):
                 try:
-                    raw_df = pd.read_csv(raw_path)
-                    # 過濾超規點邏輯保持不變
-                    usl = chart_info.get('USL', None)
-                    lsl = chart_info.get('LSL', None)
-                    if usl is not None and lsl is not None:
-                        raw_df = raw_df[(raw_df['point_val'] <= usl) & (raw_df['point_val'] >= lsl)]
-                    elif usl is not None:
-                        raw_df = raw_df[raw_df['point_val'] <= usl]
-                    elif lsl is not None:
-                        raw_df = raw_df[raw_df['point_val'] >= lsl]
+                    raw_df = filter_spec_limits(pd.read_csv(raw_path), chart_info)
                     
                     self.raw_charts_dict[(g_name, c_name)] = raw_df
-                    quick_cpk = calculate_cpk(raw_df, chart_info)['Cpk']
+                    cache_key = self.result_cache.make_key(
+                        chart_info, dataframe_fingerprint(raw_df), 'all', code_version(__file__)
+                    )
+                    quick_cpk = self.result_cache.get(cache_key)
+                    if quick_cpk is None:
+                        quick_cpk = calculate_cpk(raw_df, chart_info)['Cpk']
+                        self.result_cache.put(cache_key, quick_cpk)
                     self.cpk_results[(g_name, c_name)] = {'Cpk': quick_cpk}
                     self.chart_date_states[(g_name, c_name)] = {'custom': False, 'start': None, 'end': None}
                 except Exception as e:
@@ -1264,33 +1308,16 @@ class SPCCpkDashboard(QtWidgets.QWidget):
         
         if raw_df is None or raw_df.empty:
             return result
+
+        cache_key = self.result_cache.make_key(
+            chart_info, dataframe_fingerprint(raw_df), (start_time, end_time), code_version(__file__)
+        )
+        cached_result = self.result_cache.get(cache_key)
+        if cached_result is not None:
+            return dict(cached_result)
         
-        df = raw_df.copy()
-        df['point_time'] = pd.to_datetime(df['point_time'])
-        
-        # --- 關鍵修正：平分總時長 ---
-        total_range = end_time - start_time
-        duration_segment = total_range / 3  # 每一小格佔 1/3 時長
-        
-        # 重新定義三個等長區間
-        # [Start] --(L2)-- [Start+1/3] --(L1)-- [Start+2/3] --(Current)-- [End]
-        curr_start, curr_end = end_time - duration_segment, end_time
-        l1_start, l1_end     = curr_start - duration_segment, curr_start
-        l2_start, l2_end     = l1_start - duration_segment, l1_start
-        
-        # 篩選數據
-        mask_curr = (df['point_time'] >= curr_start) & (df['point_time'] <= curr_end)
-        mask_l1   = (df['point_time'] >= l1_start)   & (df['point_time'] < l1_end)
-        mask_l2   = (df['point_time'] >= l2_start)   & (df['point_time'] < l2_end)
-        
-        # 分段計算 Cpk
-        if mask_curr.any():
-            result['Cpk'] = calculate_cpk(df[mask_curr], chart_info)['Cpk']
-        if mask_l1.any():
-            result['Cpk_last_month'] = calculate_cpk(df[mask_l1], chart_info)['Cpk']
-        if mask_l2.any():
-            result['Cpk_last2_month'] = calculate_cpk(df[mask_l2], chart_info)['Cpk']
-            
+        result = compute_cpk_equal_duration_windows(raw_df, chart_info, start_time, end_time)
+        self.result_cache.put(cache_key, dict(result))
         return result
 
     def _recompute_cpk_for_chart(self, chart_info: pd.Series):
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+OOB 規則門檻掃描 (threshold sweep)
+
+調整 K-shift 的 K 門檻 (1.67)、High OOC 的比例門檻 (5%)、By Tool Median Shift 的 K 門檻時，
+原本要每個門檻各跑一次完整分析。分析時各規則已把連續統計量留在結果中：
+- P95/P50/P05_effective_k        ：K-shift 可 highlight 的 K（差值未達 resolution 或被 characteristic 取消時為 NaN）
+- ooc_ratio / ooc_cnt             ：High OOC（比例 > 門檻且 OOC 點數 > 1）
+- by_tool_median_shift_effective_k：By Tool Median Shift 的 max K（差值未達 resolution 時為 NaN）
+因此一次分析後即可把 (chart 數 × 門檻數) 一次比較，得到每個門檻的 highlight 比例。
+
+oob_chart_count 為該門檻下任一 OOB 規則 highlight 的 chart 數：其他規則維持分析時的結果，只有掃描的規則換門檻。
+
+使用方式：
+    python threshold_sweep.py --raw-dir test_data/by_tool_median_shift_sweep_25/raw_charts \\
+        --chart-info test_data/by_tool_median_shift_sweep_25/OOB_ByTool_MedianShift_Sweep25_Workbook.xlsx --output sweep.xlsx
+"""
+import os
+import sys
+import argparse
+import traceback
+
+import numpy as np
+import pandas as pd
+
+from result_store import results_to_dataframe
+
+# 掃描參數：(HL 欄位, 統計量欄位) 清單
+SWEEP_RULES = {
+    'kshift_k': [('HL_P95_shift', 'P95_effective_k'), ('HL_P50_shift', 'P50_effective_k'),
+                 ('HL_P05_shift', 'P05_effective_k')],
+    'ooc_ratio': [('HL_high_OOC', 'ooc_ratio')],
+    'by_tool_k': [('HL_by_tool_median_shift', 'by_tool_median_shift_effective_k')],
+}
+SWEEP_GRIDS = {
+    'kshift_k': (1.0, 1.33, 1.5, 1.67, 1.83, 2.0, 2.5, 3.0),
+    'ooc_ratio': (0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.2),
+    'by_tool_k': (1.0, 1.33, 1.5, 1.67, 1.83, 2.0, 2.5, 3.0),
+}
+SWEEP_ANY_RULE = '(Any)'
+SWEEP_COLUMNS = ['parameter', 'threshold', 'is_current', 'rule', 'highlight_chart_count', 'chart_count',
+                 'highlight_rate', 'oob_chart_count', 'oob_rate']
+
+
+def parse_grid(text):
+    """'1.33,1.5,2' → (1.33, 1.5, 2.0)"""
+    return tuple(float(item) for item in str(text).split(',') if item.strip())
+
+
+def _other_rule_flags(oob_rule, swept_keys):
+    """每張 chart 是否有掃描規則以外的 OOB 規則 highlight；OOB_Rule 字串只對不重複值拆一次"""
+    codes, uniques = pd.factorize(oob_rule)
+    swept = set(swept_keys)
+    flags = [any(rule.strip() and rule.strip() not in swept and not rule.strip().startswith('N/A')
+                 for rule in str(text).split(','))
+             for text in uniques]
+    return np.append(np.asarray(flags, dtype=bool), False)[codes]
+
+
+def threshold_sweep(results, grids=None, current=None, parameters=None):
+    """
+    results：ChartResult / dict 清單或結果 DataFrame（需含上述統計量欄位）。
+    grids：{參數: 門檻清單}，未指定的參數使用 SWEEP_GRIDS。
+    current：{參數: 目前使用的門檻}，對應列標記 is_current。
+    parameters：要掃描的參數（例如 By Tool 規則未執行時不列入 'by_tool_k'）。
+    """
+    grids = {**SWEEP_GRIDS, **(grids or {})}
+    current = current or {}
+    parameters = [name for name in (parameters or SWEEP_RULES) if name in SWEEP_RULES]
+    columns = ['ooc_cnt', 'OOB_Rule'] + [column for name in parameters for _, column in SWEEP_RULES[name]]
+    if isinstance(results, pd.DataFrame):
+        df = results.reindex(columns=columns)
+    else:
+        df = results_to_dataframe(results, columns=columns)
+    chart_count = len(df)
+    if chart_count == 0:
+        return pd.DataFrame(columns=SWEEP_COLUMNS)
+
+    ooc_cnt = pd.to_numeric(df['ooc_cnt'], errors='coerce').fillna(0).to_numpy()
+    rows = []
+    for name in parameters:
+        rules = SWEEP_RULES[name]
+        grid = np.unique(np.asarray(grids[name], dtype=float))
+        is_current = np.isclose(grid, current[name]) if name in current else np.zeros(len(grid), dtype=bool)
+
+        # (chart 數 × 門檻數) 一次比較；NaN 比較結果為 False，即任何門檻都不 highlight
+        any_hits = np.zeros((chart_count, len(grid)), dtype=bool)
+        rule_hits = []
+        for key, column in rules:
+            values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+            with np.errstate(invalid='ignore'):
+                hits = values[:, None] > grid[None, :]
+            if name == 'ooc_ratio':
+                hits &= (ooc_cnt > 1)[:, None]
+            rule_hits.append((key, hits))
+            any_hits |= hits
+        if len(rules) > 1:
+            rule_hits.append((SWEEP_ANY_RULE, any_hits))
+
+        oob_hits = any_hits | _other_rule_flags(df['OOB_Rule'], [key for key, _ in rules])[:, None]
+        oob_counts = oob_hits.sum(axis=0)
+        for key, hits in rule_hits:
+            counts = hits.sum(axis=0)
+            rows.append(pd.DataFrame({
+                'parameter': name,
+                'threshold': grid,
+                'is_current': is_current,
+                'rule': key,
+                'highlight_chart_count': counts,
+                'chart_count': chart_count,
+                'highlight_rate': np.round(counts / chart_count, 4),
+                'oob_chart_count': oob_counts,
+                'oob_rate': np.round(oob_counts / chart_count, 4),
+            }))
+    if not rows:
+        return pd.DataFrame(columns=SWEEP_COLUMNS)
+    return pd.concat(rows, ignore_index=True)[SWEEP_COLUMNS]
+
+
+def sweep_charts(service, limit=None):
+    """以 ChartQueryService 對設定檔中所有 chart 各跑一次 OOB，回傳成功的結果清單"""
+    results = []
+    charts = service.list_charts()
+    for item in charts[:limit] if limit else charts:
+        try:
+            result = service.query_oob(group=item['GroupName'], chart=item['ChartName'])
+        except Exception as e:
+            print(f"[Warning] {item['key']} 分析失敗: {e}")
+            continue
+        if result.get('status') == 'processed':
+            results.append(result)
+    return results
+
+
+def main(argv=None):
+    import chart_query_service
+    import oob_module_NGK_nostatic as oob
+
+    parser = argparse.ArgumentParser(description="OOB rule threshold sweep (one analysis, many thresholds)")
+    parser.add_argument('--chart-info', default=oob.resource_path('input/All_Chart_Information.xlsx'))
+    parser.add_argument('--raw-dir', default=oob.resource_path('input/raw_charts/'))
+    parser.add_argument('--settings', help="JSON 檔，覆寫 OOB 設定")
+    parser.add_argument('--output', help="輸出 .xlsx 或 .csv；未指定時只印出")
+    parser.add_argument('--limit', type=int, help="只分析前 N 張 chart")
+    for name in SWEEP_RULES:
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name,
+                            help=f"{name} 門檻清單，以逗號分隔 (預設 {','.join(map(str, SWEEP_GRIDS[name]))})")
+    args = parser.parse_args(argv)
+
+    settings = {'run_by_tool_median_shift': True}
+    if args.settings:
+        import json
+        with open(args.settings, 'r', encoding='utf-8') as f:
+            settings.update(json.load(f))
+    grids = {name: parse_grid(getattr(args, name)) for name in SWEEP_RULES if getattr(args, name)}
+    current = {'kshift_k': oob.KSHIFT_K_THRESHOLD, 'ooc_ratio': oob.OOC_RATIO_THRESHOLD,
+               'by_tool_k': float(settings.get('by_tool_median_shift_k_threshold', 1.67))}
+    parameters = [name for name in SWEEP_RULES if name != 'by_tool_k' or settings.get('run_by_tool_median_shift')]
+
+    try:
+        service = chart_query_service.ChartQueryService(args.chart_info, args.raw_dir, settings=settings, quiet=True)
+        results = sweep_charts(service, args.limit)
+        table = threshold_sweep(results, grids, current, parameters)
+    except Exception as e:
+        print(f"[Error] 門檻掃描失敗: {e}")
+        traceback.print_exc()
+        return 1
+
+    print(f"[Info] 門檻掃描完成：{len(results)} 張 chart")
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(table.to_string(index=False))
+    if args.output:
+        if args.output.lower().endswith('.csv'):
+            table.to_csv(args.output, index=False, encoding='utf-8-sig')
+        else:
+            table.to_excel(args.output, sheet_name='Threshold Sweep', index=False)
+        print(f"[Info] 門檻掃描結果已輸出: {os.path.abspath(args.output)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+跨 chart 的機台關聯 (tool implication)
+
+By Tool Median Shift 逐張 chart 判斷：同一台機台漂移時，幾十張 chart 各自亮起，看不出共同的機台。
+分析完成後把所有 chart 的 by_tool_median_shift_all_tools_json 展開成稀疏矩陣 (chart × 機台)：
+- K 矩陣：機台中位數與 golden tool 的差 / 分母（未比較的格子不存）
+- highlight 矩陣：該機台在該 chart 是否超過 K 門檻（且差值達 resolution）
+golden tool 是比較基準，不列入矩陣。
+
+機台排名以稀疏矩陣的欄加總計算：牽連的 chart 數、被比較的 chart 數、牽連的 Group 數、
+是該 chart 最大差異機台 (max tool) 的次數與 K 統計；chart 數上萬、機台數上百時也只是 COO 陣列運算。
+"""
+import json
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from result_store import results_to_dataframe
+
+TOOL_JSON_COLUMN = 'by_tool_median_shift_all_tools_json'
+TOOL_CHART_KEYS = ['group_name', 'chart_name']
+TOOL_TOP_CHARTS = 3
+TOOL_RANK_COLUMNS = ['rank', 'tool', 'implicated_charts', 'compared_charts', 'implication_rate', 'primary_charts',
+                     'implicated_groups', 'mean_k', 'max_k', 'top_charts']
+_SOURCE_COLUMNS = TOOL_CHART_KEYS + ['HL_by_tool_median_shift', 'by_tool_median_shift_max_tool', TOOL_JSON_COLUMN]
+
+
+class ToolMatrix:
+    """chart × 機台的稀疏矩陣 (CSR)；charts / tools 為列 / 欄標籤"""
+    __slots__ = ('k', 'highlight', 'charts', 'groups', 'tools', 'max_tool')
+
+    def __init__(self, k, highlight, charts, groups, tools, max_tool):
+        self.k = k                    # float，未比較的格子不存
+        self.highlight = highlight    # int8 (0/1)，只存 highlight 的格子
+        self.charts = charts          # 'Group/Chart' 標籤
+        self.groups = groups          # 每張 chart 的 Group code
+        self.tools = tools
+        self.max_tool = max_tool      # 每張 chart highlight 的最大差異機台 code，無則 -1
+
+    @property
+    def shape(self):
+        return self.k.shape
+
+
+def _tool_records(texts):
+    """不重複的 JSON 字串只解析一次，回傳 (chart 索引, 機台, K, highlight) 陣列"""
+    codes, uniques = pd.factorize(texts)
+    parsed = []
+    for text in uniques:
+        try:
+            records = json.loads(text) if isinstance(text, str) and text not in ('', '[]') else []
+        except ValueError:
+            records = []
+        parsed.append(records if isinstance(records, list) else [])
+    lengths = np.array([len(records) for records in parsed] + [0], dtype=np.int64)
+    per_chart = lengths[codes]
+    rows = np.repeat(np.arange(len(codes)), per_chart)
+    ordered = [parsed[code] for code in codes if code >= 0 and lengths[code]]
+    flat = [record for records in ordered for record in records]
+    tools = np.array([str(record.get('tool', '')) for record in flat], dtype=object)
+    k = pd.to_numeric(pd.Series([record.get('k') for record in flat], dtype=object), errors='coerce').to_numpy(float)
+    highlight = np.array([bool(record.get('highlight', False)) for record in flat], dtype=bool)
+    return rows, tools, k, highlight
+
+
+def tool_implication_matrix(results):
+    """results：ChartResult / dict 清單或結果 DataFrame，回傳 ToolMatrix"""
+    if isinstance(results, pd.DataFrame):
+        df = results.reindex(columns=_SOURCE_COLUMNS)
+    else:
+        df = results_to_dataframe(results, columns=_SOURCE_COLUMNS)
+    charts = (df['group_name'].astype(str) + '/' + df['chart_name'].astype(str)).to_numpy(dtype=object)
+    groups, _ = pd.factorize(df['group_name'].astype(str))
+
+    rows, record_tools, k, highlight = _tool_records(df[TOOL_JSON_COLUMN].to_numpy(dtype=object))
+    highlighted_max = df['by_tool_median_shift_max_tool'].where(df['HL_by_tool_median_shift'] == 'HIGHLIGHT')
+    tool_codes, tools = pd.factorize(np.concatenate([record_tools, highlighted_max.dropna().astype(str).to_numpy(object)]))
+    tools = pd.Index(tools, dtype=object)
+    cols = tool_codes[:len(rows)]
+    max_tool = np.full(len(df), -1, dtype=np.int64)
+    max_tool[highlighted_max.notna().to_numpy()] = tool_codes[len(rows):]
+
+    shape = (len(df), len(tools))
+    valid = ~np.isnan(k)
+    k_matrix = sparse.csr_matrix((k[valid], (rows[valid], cols[valid])), shape=shape)
+    highlight_matrix = sparse.csr_matrix(
+        (np.ones(int(highlight.sum()), dtype=np.int8), (rows[highlight], cols[highlight])), shape=shape)
+    return ToolMatrix(k_matrix, highlight_matrix, charts, groups, tools, max_tool)
+
+
+def _top_charts(matrix, limit=TOOL_TOP_CHARTS):
+    """每個機台 K 最大的前幾張 highlight chart，格式 'G/C(K=2.10), ...'"""
+    hits = matrix.highlight.tocoo()
+    if hits.nnz == 0:
+        return np.full(len(matrix.tools), 'N/A', dtype=object)
+    k_values = np.asarray(matrix.k[hits.row, hits.col]).ravel()
+    order = np.lexsort((-k_values, hits.col))
+    cols, rows, k_values = hits.col[order], hits.row[order], k_values[order]
+    starts = np.searchsorted(cols, cols, side='left')
+    keep = (np.arange(len(cols)) - starts) < limit
+    labels = np.full(len(matrix.tools), 'N/A', dtype=object)
+    table = pd.DataFrame({'col': cols[keep], 'label': [f"{matrix.charts[row]}(K={value:.2f})"
+                                                        for row, value in zip(rows[keep], k_values[keep])]})
+    joined = table.groupby('col', sort=False)['label'].agg(', '.join)
+    labels[joined.index.to_numpy()] = joined.to_numpy()
+    return labels
+
+
+def tool_implication_ranking(results, include_unimplicated=False):
+    """
+    機台排名：依牽連的 chart 數、最大差異機台次數、平均 K 由大到小。
+    include_unimplicated：是否列出沒有任何 chart highlight 的機台。
+    """
+    matrix = results if isinstance(results, ToolMatrix) else tool_implication_matrix(results)
+    if matrix.shape[1] == 0:
+        return pd.DataFrame(columns=TOOL_RANK_COLUMNS)
+
+    n_tools = matrix.shape[1]
+    implicated = np.asarray(matrix.highlight.sum(axis=0)).ravel().astype(int)
+    compared = np.diff(matrix.k.tocsc().indptr)
+    primary = np.bincount(matrix.max_tool[matrix.max_tool >= 0], minlength=n_tools)
+
+    # highlight 格子的 K 統計與牽連的 Group 數
+    hits = matrix.highlight.tocoo()
+    hit_k = np.asarray(matrix.k[hits.row, hits.col]).ravel() if hits.nnz else np.array([])
+    k_sum = np.bincount(hits.col, weights=hit_k, minlength=n_tools)
+    max_k = np.full(n_tools, np.nan)
+    if hits.nnz:
+        np.fmax.at(max_k, hits.col, hit_k)
+        pairs = np.unique(np.stack([hits.col, matrix.groups[hits.row]]), axis=1)
+        group_counts = np.bincount(pairs[0], minlength=n_tools)
+    else:
+        group_counts = np.zeros(n_tools, dtype=int)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_k = np.where(implicated > 0, k_sum / implicated, np.nan)
+        rate = np.where(compared > 0, implicated / compared, np.nan)
+
+    table = pd.DataFrame({
+        'tool': matrix.tools.astype(str),
+        'implicated_charts': implicated,
+        'compared_charts': compared,
+        'implication_rate': np.round(rate, 4),
+        'primary_charts': primary,
+        'implicated_groups': group_counts,
+        'mean_k': np.round(mean_k, 4),
+        'max_k': np.round(max_k, 4),
+        'top_charts': _top_charts(matrix),
+    })
+    if not include_unimplicated:
+        table = table[(table['implicated_charts'] > 0) | (table['primary_charts'] > 0)]
+    table = table.sort_values(['implicated_charts', 'primary_charts', 'mean_k', 'tool'],
+                              ascending=[False, False, False, True], kind='stable', na_position='last')
+    table.insert(0, 'rank', np.arange(1, len(table) + 1))
+    return table[TOOL_RANK_COLUMNS].reset_index(drop=True)
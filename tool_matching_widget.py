@@ -6,6 +6,9 @@ import pickle
 
 # Translation System
 from translations import get_translator, tr
+from result_cache import ResultCache, dataframe_fingerprint, code_version
+from raw_file_index import get_raw_file_index
+from chart_config import read_config_sheet
 
 # Check if openpyxl package is installed
 try:
@@ -366,7 +369,264 @@ class ToolMatchingSettingsDialog(QtWidgets.QDialog):
         self.date_edit.setDate(settings.get('base_date', QtCore.QDate.currentDate()))
 
 
-class ToolMatchingWidget(QtWidgets.QWidget):
+TOOL_MATCHING_COLUMNS = [
+    'GroupName', 'ChartName', 'matching_group', 'compare_to',
+    'mean_matching_index', 'sigma_matching_index', 'K',
+    'mean', 'sigma', 'mean_median', 'sigma_median', 'samplesize', 'characteristic',
+]
+
+
+def prepare_matching_data(subdf, gname, cname, characteristic):
+    """整理單一 chart 的原始資料供 matching 統計使用；資料不足時回傳 None"""
+    if subdf is None or subdf.empty or 'point_val' not in subdf.columns or 'point_time' not in subdf.columns:
+        return None
+
+    # 🔥 自動處理舊版的 ByTool 與新版的 Matching 欄位
+    if 'Matching' in subdf.columns:
+        subdf['matching_group'] = subdf['Matching']
+    elif 'ByTool' in subdf.columns:
+        subdf['matching_group'] = subdf['ByTool']
+    else:
+        subdf['matching_group'] = 'Unknown'
+
+    subdf['characteristic'] = characteristic
+    subdf['GroupName'] = gname
+    subdf['ChartName'] = cname
+    subdf["point_time"] = pd.to_datetime(subdf["point_time"], errors='coerce')
+    subdf = subdf.dropna(subset=['point_time', 'point_val'])
+    return None if subdf.empty else subdf
+
+
+class ToolMatchingStats:
+    """
+    Tool matching 統計（不含 UI）：ToolMatchingWidget 與 chart_query_service 共用。
+    結果每列欄位依 TOOL_MATCHING_COLUMNS。
+    """
+    def get_k_value(self, n):
+        if n <= 4:
+            return "No Comparison"
+        elif 5 <= n <= 10:
+            return 1.73
+        elif 11 <= n <= 120:
+            return 1.414
+        else:
+            return 1.15
+
+    def calculate_mean_index(self, mean1, mean2, min_sigma, characteristic):
+        if min_sigma <= 0:
+            return float('inf')
+        if characteristic == 'Bigger':
+            return (mean2 - mean1) / min_sigma
+        elif characteristic in ['Smaller', 'Sigma']:
+            return (mean1 - mean2) / min_sigma
+        else:
+            return abs(mean1 - mean2) / min_sigma
+
+    def _analyze_chart_rows(self, subdf, gname, cname, characteristic, filter_mode, base_date, fill_num):
+        """單一 chart 的 matching 統計；回傳 (結果列, 繪製箱型圖用的資料)"""
+        chart_rows = []
+        plot_df = subdf
+        if filter_mode == 0:
+            group_stats = subdf.groupby("matching_group")["point_val"].agg(['mean', 'std', 'count']).reset_index()
+            n_groups = len(group_stats)
+            if n_groups == 2:
+                self._analyze_two_groups(group_stats, gname, cname, characteristic, chart_rows)
+            else:
+                self._analyze_multiple_groups(subdf, group_stats, gname, cname, characteristic, chart_rows)
+            plot_df = subdf
+
+        elif filter_mode == 1 or filter_mode == 2:
+            if filter_mode == 1:
+                mean_end = pd.Timestamp(base_date)
+                sigma_end = pd.Timestamp(base_date)
+            else:
+                latest_time = subdf["point_time"].max()
+                mean_end = latest_time
+                sigma_end = latest_time
+
+            mean_start = mean_end - pd.DateOffset(months=1)
+            sigma_start = sigma_end - pd.DateOffset(months=6)
+
+            mean_df = subdf[(subdf["point_time"] > mean_start) & (subdf["point_time"] <= mean_end)].copy()
+            sigma_df = subdf[(subdf["point_time"] > sigma_start) & (subdf["point_time"] <= sigma_end)].copy()
+            min_time = subdf["point_time"].min()
+
+            # 補齊 mean_df
+            for mg in subdf["matching_group"].unique():
+                mg_mean = mean_df[mean_df["matching_group"] == mg]
+                if len(mg_mean) < fill_num:
+                    all_mg = subdf[subdf["matching_group"] == mg].sort_values("point_time")
+                    cur_start = mean_start
+                    while len(mg_mean) < fill_num and cur_start > min_time:
+                        cur_start = cur_start - pd.Timedelta(days=7)
+                        mg_mean = all_mg[(all_mg["point_time"] > cur_start) & (all_mg["point_time"] <= mean_end)]
+                    mean_df = pd.concat([mean_df, mg_mean]).drop_duplicates()
+
+            # 補齊 sigma_df
+            for mg in subdf["matching_group"].unique():
+                mg_sigma = sigma_df[sigma_df["matching_group"] == mg]
+                if len(mg_sigma) < fill_num:
+                    all_mg = subdf[subdf["matching_group"] == mg].sort_values("point_time")
+                    cur_start = sigma_start
+                    while len(mg_sigma) < fill_num and cur_start > min_time:
+                        cur_start = cur_start - pd.Timedelta(days=14)
+                        mg_sigma = all_mg[(all_mg["point_time"] > cur_start) & (all_mg["point_time"] <= sigma_end)]
+                    sigma_df = pd.concat([sigma_df, mg_sigma]).drop_duplicates()
+
+            mean_stats = mean_df.groupby("matching_group")["point_val"].agg(['mean', 'count']).reset_index()
+            sigma_stats = sigma_df.groupby("matching_group")["point_val"].agg(['std']).reset_index()
+            group_stats = pd.merge(mean_stats, sigma_stats, on="matching_group", how="outer")
+            group_stats = group_stats.fillna({"mean": 0, "std": 0, "count": 0})
+
+            n_groups = len(group_stats)
+            if n_groups == 2:
+                self._analyze_two_groups(group_stats, gname, cname, characteristic, chart_rows)
+            else:
+                self._analyze_multiple_groups_time(mean_df, sigma_df, group_stats, gname, cname, characteristic, chart_rows)
+
+            plot_df = mean_df if not mean_df.empty else subdf
+
+        return chart_rows, plot_df
+
+    def _analyze_two_groups(self, group_stats, gname, cname, characteristic, results):
+        row1 = group_stats.iloc[0]
+        row2 = group_stats.iloc[1]
+
+        group1 = row1["matching_group"]
+        group2 = row2["matching_group"]
+        mean1, std1, n1 = row1["mean"], row1["std"], row1["count"]
+        mean2, std2, n2 = row2["mean"], row2["std"], row2["count"]
+
+        min_sigma = min(std1, std2)
+
+        if n1 < 5 or n2 < 5:
+            results.append([gname, cname, group1, 'group_all', 'Insufficient Data', 'Insufficient Data', self.get_k_value(n1), mean1, std1, mean2, min_sigma, n1, characteristic])
+            results.append([gname, cname, group2, 'group_all', 'Insufficient Data', 'Insufficient Data', self.get_k_value(n2), mean2, std2, mean1, min_sigma, n2, characteristic])
+            return
+
+        k1, k2 = self.get_k_value(n1), self.get_k_value(n2)
+
+        if min_sigma > 0:
+            mean_index_1 = self.calculate_mean_index(mean1, mean2, min_sigma, characteristic)
+            sigma_index_1 = std1 / min_sigma
+        else:
+            if len(set([round(m, 8) for m in [mean1, mean2]])) == 1:
+                mean_index_1, sigma_index_1 = 0, 0
+            else:
+                mean_index_1, sigma_index_1 = float('inf'), float('inf')
+
+        results.append([gname, cname, group1, 'group_all', 
+            'Insufficient Data' if k1=="No Comparison" else round(mean_index_1, 2), 
+            'Insufficient Data' if k1=="No Comparison" else round(sigma_index_1, 2),
+            k1 if isinstance(k1, str) else round(k1, 2), 
+            round(mean1, 2), round(std1, 2), round(mean2, 2), round(min_sigma, 2), n1, characteristic])
+
+        if min_sigma > 0:
+            mean_index_2 = self.calculate_mean_index(mean2, mean1, min_sigma, characteristic)
+            sigma_index_2 = std2 / min_sigma
+        else:
+            if len(set([round(m, 8) for m in [mean1, mean2]])) == 1:
+                mean_index_2, sigma_index_2 = 0, 0
+            else:
+                mean_index_2, sigma_index_2 = float('inf'), float('inf')
+
+        results.append([gname, cname, group2, 'group_all', 
+            'Insufficient Data' if k2=="No Comparison" else round(mean_index_2, 2), 
+            'Insufficient Data' if k2=="No Comparison" else round(sigma_index_2, 2),
+            k2 if isinstance(k2, str) else round(k2, 2), 
+            round(mean2, 2), round(std2, 2), round(mean1, 2), round(min_sigma, 2), n2, characteristic])
+
+    def _analyze_multiple_groups(self, subdf, group_stats, gname, cname, characteristic, results):
+        valid_stats = group_stats[group_stats['count'] >= 5]
+        
+        if valid_stats.shape[0] == 2:
+            self._analyze_two_groups(valid_stats, gname, cname, characteristic, results)
+            for i, row in group_stats[group_stats['count'] < 5].iterrows():
+                results.append([gname, cname, row["matching_group"], "group_all", 'Insufficient Data', 'Insufficient Data', self.get_k_value(row["count"]), row["mean"], row["std"], '-', '-', row["count"], characteristic])
+            return
+        
+        if valid_stats.shape[0] <= 1:
+            for i, row in group_stats.iterrows():
+                results.append([gname, cname, row["matching_group"], "group_all", 'Insufficient Data', 'Insufficient Data', self.get_k_value(row["count"]), row["mean"], row["std"], '-', '-', row["count"], characteristic])
+            return
+
+        mean_median = valid_stats['mean'].median() if not valid_stats.empty else 0
+        median_sigma = valid_stats['std'].median() if not valid_stats.empty else 0
+
+        for i, row in group_stats.iterrows():
+            group, mean, std, n = row["matching_group"], row["mean"], row["std"], row["count"]
+            if n < 5:
+                results.append([gname, cname, group, "group_all", 'Insufficient Data', 'Insufficient Data', self.get_k_value(n), mean, std, mean_median, median_sigma, n, characteristic])
+                continue
+
+            if median_sigma > 0:
+                mean_index = self.calculate_mean_index(mean, mean_median, median_sigma, characteristic)
+                sigma_index = std / median_sigma
+            else:
+                all_means = group_stats['mean'].tolist() if not group_stats.empty else [mean]
+                if len(set([round(m, 8) for m in all_means])) == 1:
+                    mean_index, sigma_index = 0, 0
+                else:
+                    mean_index, sigma_index = float('inf'), float('inf')
+
+            K = self.get_k_value(n)
+            results.append([gname, cname, group, "group_all", 
+                'Insufficient Data' if K=="No Comparison" else round(mean_index, 2), 
+                'Insufficient Data' if K=="No Comparison" else round(sigma_index, 2), 
+                K if isinstance(K, str) else round(K, 2), 
+                round(mean, 2), round(std, 2), round(mean_median, 2), round(median_sigma, 2), n, characteristic])
+
+    def _analyze_multiple_groups_time(self, mean_df, sigma_df, group_stats, gname, cname, characteristic, results):
+        valid_mean_df = mean_df.groupby("matching_group").filter(lambda x: len(x) >= 5)
+        sigma_by_group = sigma_df.groupby("matching_group")["point_val"].std()
+        valid_groups = group_stats[group_stats['count'] >= 5]['matching_group']
+        valid_sigma = sigma_by_group[valid_groups] if not valid_groups.empty else pd.Series(dtype=float)
+        
+        if len(valid_groups) == 2:
+            valid_stats = group_stats[group_stats['count'] >= 5]
+            self._analyze_two_groups(valid_stats, gname, cname, characteristic, results)
+            for i, row in group_stats[group_stats['count'] < 5].iterrows():
+                results.append([gname, cname, row["matching_group"], "group_all", 'Insufficient Data', 'Insufficient Data', self.get_k_value(row["count"]), row["mean"], row["std"], '-', '-', row["count"], characteristic])
+            return
+        
+        if len(valid_groups) <= 1:
+            for i, row in group_stats.iterrows():
+                results.append([gname, cname, row["matching_group"], "group_all", 'Insufficient Data', 'Insufficient Data', self.get_k_value(row["count"]), row["mean"], row["std"], '-', '-', row["count"], characteristic])
+            return
+            
+        mean_median = valid_mean_df["point_val"].median() if not valid_mean_df.empty else 0
+        median_sigma = valid_sigma.median() if not valid_sigma.empty else 0
+        
+        for i, row in group_stats.iterrows():
+            group, mean, std, n = row["matching_group"], row["mean"], row["std"], row["count"]
+            if n < 5:
+                results.append([gname, cname, group, "group_all", 'Insufficient Data', 'Insufficient Data', self.get_k_value(n), mean, std, mean_median, median_sigma, n, characteristic])
+                continue
+                
+            if median_sigma > 0:
+                mean_index = self.calculate_mean_index(mean, mean_median, median_sigma, characteristic)
+                sigma_index = std / median_sigma
+            else:
+                all_means = group_stats['mean'].tolist() if not group_stats.empty else [mean]
+                if len(set([round(m, 8) for m in all_means])) == 1:
+                    mean_index, sigma_index = 0, 0
+                else:
+                    mean_index, sigma_index = float('inf'), float('inf')
+                    
+            K = self.get_k_value(n)
+            results.append([gname, cname, group, "group_all", 
+                'Insufficient Data' if K=="No Comparison" else round(mean_index, 2), 
+                'Insufficient Data' if K=="No Comparison" else round(sigma_index, 2), 
+                K if isinstance(K, str) else round(K, 2), 
+                round(mean, 2), round(std, 2), round(mean_median, 2), round(median_sigma, 2), n, characteristic])
+
+    def matching_records(self, subdf, gname, cname, characteristic, filter_mode=0, base_date=None, fill_num=5):
+        """單一 chart 的 matching 統計，以 dict 回傳（欄位同 TOOL_MATCHING_COLUMNS）"""
+        chart_rows, _ = self._analyze_chart_rows(subdf, gname, cname, characteristic, filter_mode, base_date, fill_num)
+        return [dict(zip(TOOL_MATCHING_COLUMNS, row)) for row in chart_rows]
+
+
+class ToolMatchingWidget(QtWidgets.QWidget, ToolMatchingStats):
     """
     Tool Matching Analysis Tool (Auto-OOB Style):
     - Auto read All_Chart_Information.xlsx
@@ -397,6 +657,7 @@ class ToolMatchingWidget(QtWidgets.QWidget):
         }
         
         self.current_export_data = None
+        self.result_cache = ResultCache('tool_matching')
         self.init_ui()
 
     def _get_resource_path(self, relative_path):
@@ -408,14 +669,9 @@ class ToolMatchingWidget(QtWidgets.QWidget):
         return os.path.join(base_path, relative_path)
 
     def _find_matching_file(self, directory, group_name, chart_name):
-        import os, re
-        pattern = re.compile(rf"{re.escape(str(group_name))}_{re.escape(str(chart_name))}(?:_\d+_\d+)?\.csv$")
         if not os.path.exists(directory):
             return None
-        for filename in os.listdir(directory):
-            if pattern.match(filename):
-                return os.path.join(directory, filename)
-        return None
+        return get_raw_file_index(directory).find(str(group_name), str(chart_name))
 
     def refresh_ui_texts(self):
         self.setWindowTitle(tr("tool_matching_title"))
@@ -547,26 +803,6 @@ class ToolMatchingWidget(QtWidgets.QWidget):
         dialog = FormulaExplanationDialog(self)
         dialog.exec()
 
-    def get_k_value(self, n):
-        if n <= 4:
-            return "No Comparison"
-        elif 5 <= n <= 10:
-            return 1.73
-        elif 11 <= n <= 120:
-            return 1.414
-        else:
-            return 1.15
-
-    def calculate_mean_index(self, mean1, mean2, min_sigma, characteristic):
-        if min_sigma <= 0:
-            return float('inf')
-        if characteristic == 'Bigger':
-            return (mean2 - mean1) / min_sigma
-        elif characteristic in ['Smaller', 'Sigma']:
-            return (mean1 - mean2) / min_sigma
-        else:
-            return abs(mean1 - mean2) / min_sigma
-
     def run_analysis(self):
         info_path = self._get_resource_path('input/All_Chart_Information.xlsx')
         raw_dir = self._get_resource_path('input/raw_charts/')
@@ -577,7 +813,7 @@ class ToolMatchingWidget(QtWidgets.QWidget):
             return
 
         try:
-            all_charts_info = pd.read_excel(info_path, sheet_name='Chart', engine='openpyxl')
+            all_charts_info = read_config_sheet(info_path, 'Chart')
         except Exception as e:
             self.status_label.setText(f"讀取 Excel 失敗: {e}")
             return
@@ -593,6 +829,7 @@ class ToolMatchingWidget(QtWidgets.QWidget):
 
         results = []
         self.chart_figures = {}
+        self.chart_plot_sources = {}
         total_charts = len(all_charts_info)
 
         for i, row in all_charts_info.iterrows():
@@ -615,220 +852,39 @@ class ToolMatchingWidget(QtWidgets.QWidget):
             except Exception:
                 continue
 
-            if subdf.empty or 'point_val' not in subdf.columns or 'point_time' not in subdf.columns:
+            subdf = prepare_matching_data(subdf, gname, cname, characteristic)
+            if subdf is None:
                 continue
 
-            # 🔥 自動處理舊版的 ByTool 與新版的 Matching 欄位
-            if 'Matching' in subdf.columns:
-                subdf['matching_group'] = subdf['Matching']
-            elif 'ByTool' in subdf.columns:
-                subdf['matching_group'] = subdf['ByTool']
+            cache_key = self.result_cache.make_key(
+                row,
+                dataframe_fingerprint(subdf),
+                base_date,
+                {'filter_mode': filter_mode, 'fillnum_value': fill_num},
+                code_version(__file__),
+            )
+            cached_entry = self.result_cache.get(cache_key)
+            if cached_entry is not None:
+                chart_rows = cached_entry['rows']
+                plot_index = cached_entry['plot_index']
+                plot_df = subdf if plot_index is None else subdf.loc[plot_index]
             else:
-                subdf['matching_group'] = 'Unknown'
+                chart_rows, plot_df = self._analyze_chart_rows(subdf, gname, cname, characteristic, filter_mode, base_date, fill_num)
+                plot_index = None if plot_df is subdf else list(plot_df.index)
+                self.result_cache.put(cache_key, {'rows': chart_rows, 'plot_index': plot_index})
 
-            subdf['characteristic'] = characteristic
-            subdf['GroupName'] = gname
-            subdf['ChartName'] = cname
-            subdf["point_time"] = pd.to_datetime(subdf["point_time"], errors='coerce')
-            subdf = subdf.dropna(subset=['point_time', 'point_val'])
-
-            if subdf.empty:
-                continue
-
-            if filter_mode == 0:
-                group_stats = subdf.groupby("matching_group")["point_val"].agg(['mean', 'std', 'count']).reset_index()
-                n_groups = len(group_stats)
-                if n_groups == 2:
-                    self._analyze_two_groups(group_stats, gname, cname, characteristic, results)
-                else:
-                    self._analyze_multiple_groups(subdf, group_stats, gname, cname, characteristic, results)
-                self._create_boxplot_single(subdf, gname, cname)
-
-            elif filter_mode == 1 or filter_mode == 2:
-                if filter_mode == 1:
-                    mean_end = pd.Timestamp(base_date)
-                    sigma_end = pd.Timestamp(base_date)
-                else:
-                    latest_time = subdf["point_time"].max()
-                    mean_end = latest_time
-                    sigma_end = latest_time
-
-                mean_start = mean_end - pd.DateOffset(months=1)
-                sigma_start = sigma_end - pd.DateOffset(months=6)
-
-                mean_df = subdf[(subdf["point_time"] > mean_start) & (subdf["point_time"] <= mean_end)].copy()
-                sigma_df = subdf[(subdf["point_time"] > sigma_start) & (subdf["point_time"] <= sigma_end)].copy()
-                min_time = subdf["point_time"].min()
-
-                # 補齊 mean_df
-                for mg in subdf["matching_group"].unique():
-                    mg_mean = mean_df[mean_df["matching_group"] == mg]
-                    if len(mg_mean) < fill_num:
-                        all_mg = subdf[subdf["matching_group"] == mg].sort_values("point_time")
-                        cur_start = mean_start
-                        while len(mg_mean) < fill_num and cur_start > min_time:
-                            cur_start = cur_start - pd.Timedelta(days=7)
-                            mg_mean = all_mg[(all_mg["point_time"] > cur_start) & (all_mg["point_time"] <= mean_end)]
-                        mean_df = pd.concat([mean_df, mg_mean]).drop_duplicates()
-
-                # 補齊 sigma_df
-                for mg in subdf["matching_group"].unique():
-                    mg_sigma = sigma_df[sigma_df["matching_group"] == mg]
-                    if len(mg_sigma) < fill_num:
-                        all_mg = subdf[subdf["matching_group"] == mg].sort_values("point_time")
-                        cur_start = sigma_start
-                        while len(mg_sigma) < fill_num and cur_start > min_time:
-                            cur_start = cur_start - pd.Timedelta(days=14)
-                            mg_sigma = all_mg[(all_mg["point_time"] > cur_start) & (all_mg["point_time"] <= sigma_end)]
-                        sigma_df = pd.concat([sigma_df, mg_sigma]).drop_duplicates()
-
-                mean_stats = mean_df.groupby("matching_group")["point_val"].agg(['mean', 'count']).reset_index()
-                sigma_stats = sigma_df.groupby("matching_group")["point_val"].agg(['std']).reset_index()
-                group_stats = pd.merge(mean_stats, sigma_stats, on="matching_group", how="outer")
-                group_stats = group_stats.fillna({"mean": 0, "std": 0, "count": 0})
-
-                n_groups = len(group_stats)
-                if n_groups == 2:
-                    self._analyze_two_groups(group_stats, gname, cname, characteristic, results)
-                else:
-                    self._analyze_multiple_groups_time(mean_df, sigma_df, group_stats, gname, cname, characteristic, results)
-                
-                self._create_boxplot_single(mean_df if not mean_df.empty else subdf, gname, cname)
+            results.extend(chart_rows)
+            # 圖表延後到檢視明細或匯出時才產生
+            self.chart_plot_sources[(gname, cname)] = plot_df
 
         self.progress_bar.setVisible(False)
         self._display_results(results)
 
-    def _analyze_two_groups(self, group_stats, gname, cname, characteristic, results):
-        row1 = group_stats.iloc[0]
-        row2 = group_stats.iloc[1]
-
-        group1 = row1["matching_group"]
-        group2 = row2["matching_group"]
-        mean1, std1, n1 = row1["mean"], row1["std"], row1["count"]
-        mean2, std2, n2 = row2["mean"], row2["std"], row2["count"]
-
-        min_sigma = min(std1, std2)
-
-        if n1 < 5 or n2 < 5:
-            results.append([gname, cname, group1, 'group_all', 'Insufficient Data', 'Insufficient Data', self.get_k_value(n1), mean1, std1, mean2, min_sigma, n1, characteristic])
-            results.append([gname, cname, group2, 'group_all', 'Insufficient Data', 'Insufficient Data', self.get_k_value(n2), mean2, std2, mean1, min_sigma, n2, characteristic])
-            return
-
-        k1, k2 = self.get_k_value(n1), self.get_k_value(n2)
-
-        if min_sigma > 0:
-            mean_index_1 = self.calculate_mean_index(mean1, mean2, min_sigma, characteristic)
-            sigma_index_1 = std1 / min_sigma
-        else:
-            if len(set([round(m, 8) for m in [mean1, mean2]])) == 1:
-                mean_index_1, sigma_index_1 = 0, 0
-            else:
-                mean_index_1, sigma_index_1 = float('inf'), float('inf')
-
-        results.append([gname, cname, group1, 'group_all', 
-            'Insufficient Data' if k1=="No Comparison" else round(mean_index_1, 2), 
-            'Insufficient Data' if k1=="No Comparison" else round(sigma_index_1, 2),
-            k1 if isinstance(k1, str) else round(k1, 2), 
-            round(mean1, 2), round(std1, 2), round(mean2, 2), round(min_sigma, 2), n1, characteristic])
-
-        if min_sigma > 0:
-            mean_index_2 = self.calculate_mean_index(mean2, mean1, min_sigma, characteristic)
-            sigma_index_2 = std2 / min_sigma
-        else:
-            if len(set([round(m, 8) for m in [mean1, mean2]])) == 1:
-                mean_index_2, sigma_index_2 = 0, 0
-            else:
-                mean_index_2, sigma_index_2 = float('inf'), float('inf')
-
-        results.append([gname, cname, group2, 'group_all', 
-            'Insufficient Data' if k2=="No Comparison" else round(mean_index_2, 2), 
-            'Insufficient Data' if k2=="No Comparison" else round(sigma_index_2, 2),
-            k2 if isinstance(k2, str) else round(k2, 2), 
-            round(mean2, 2), round(std2, 2), round(mean1, 2), round(min_sigma, 2), n2, characteristic])
-
-    def _analyze_multiple_groups(self, subdf, group_stats, gname, cname, characteristic, results):
-        valid_stats = group_stats[group_stats['count'] >= 5]
-        
-        if valid_stats.shape[0] == 2:
-            self._analyze_two_groups(valid_stats, gname, cname, characteristic, results)
-            for i, row in group_stats[group_stats['count'] < 5].iterrows():
-                results.append([gname, cname, row["matching_group"], "group_all", 'Insufficient Data', 'Insufficient Data', self.get_k_value(row["count"]), row["mean"], row["std"], '-', '-', row["count"], characteristic])
-            return
-        
-        if valid_stats.shape[0] <= 1:
-            for i, row in group_stats.iterrows():
-                results.append([gname, cname, row["matching_group"], "group_all", 'Insufficient Data', 'Insufficient Data', self.get_k_value(row["count"]), row["mean"], row["std"], '-', '-', row["count"], characteristic])
-            return
-
-        mean_median = valid_stats['mean'].median() if not valid_stats.empty else 0
-        median_sigma = valid_stats['std'].median() if not valid_stats.empty else 0
-
-        for i, row in group_stats.iterrows():
-            group, mean, std, n = row["matching_group"], row["mean"], row["std"], row["count"]
-            if n < 5:
-                results.append([gname, cname, group, "group_all", 'Insufficient Data', 'Insufficient Data', self.get_k_value(n), mean, std, mean_median, median_sigma, n, characteristic])
-                continue
-
-            if median_sigma > 0:
-                mean_index = self.calculate_mean_index(mean, mean_median, median_sigma, characteristic)
-                sigma_index = std / median_sigma
-            else:
-                all_means = group_stats['mean'].tolist() if not group_stats.empty else [mean]
-                if len(set([round(m, 8) for m in all_means])) == 1:
-                    mean_index, sigma_index = 0, 0
-                else:
-                    mean_index, sigma_index = float('inf'), float('inf')
-
-            K = self.get_k_value(n)
-            results.append([gname, cname, group, "group_all", 
-                'Insufficient Data' if K=="No Comparison" else round(mean_index, 2), 
-                'Insufficient Data' if K=="No Comparison" else round(sigma_index, 2), 
-                K if isinstance(K, str) else round(K, 2), 
-                round(mean, 2), round(std, 2), round(mean_median, 2), round(median_sigma, 2), n, characteristic])
-
-    def _analyze_multiple_groups_time(self, mean_df, sigma_df, group_stats, gname, cname, characteristic, results):
-        valid_mean_df = mean_df.groupby("matching_group").filter(lambda x: len(x) >= 5)
-        sigma_by_group = sigma_df.groupby("matching_group")["point_val"].std()
-        valid_groups = group_stats[group_stats['count'] >= 5]['matching_group']
-        valid_sigma = sigma_by_group[valid_groups] if not valid_groups.empty else pd.Series(dtype=float)
-        
-        if len(valid_groups) == 2:
-            valid_stats = group_stats[group_stats['count'] >= 5]
-            self._analyze_two_groups(valid_stats, gname, cname, characteristic, results)
-            for i, row in group_stats[group_stats['count'] < 5].iterrows():
-                results.append([gname, cname, row["matching_group"], "group_all", 'Insufficient Data', 'Insufficient Data', self.get_k_value(row["count"]), row["mean"], row["std"], '-', '-', row["count"], characteristic])
-            return
-        
-        if len(valid_groups) <= 1:
-            for i, row in group_stats.iterrows():
-                results.append([gname, cname, row["matching_group"], "group_all", 'Insufficient Data', 'Insufficient Data', self.get_k_value(row["count"]), row["mean"], row["std"], '-', '-', row["count"], characteristic])
-            return
-            
-        mean_median = valid_mean_df["point_val"].median() if not valid_mean_df.empty else 0
-        median_sigma = valid_sigma.median() if not valid_sigma.empty else 0
-        
-        for i, row in group_stats.iterrows():
-            group, mean, std, n = row["matching_group"], row["mean"], row["std"], row["count"]
-            if n < 5:
-                results.append([gname, cname, group, "group_all", 'Insufficient Data', 'Insufficient Data', self.get_k_value(n), mean, std, mean_median, median_sigma, n, characteristic])
-                continue
-                
-            if median_sigma > 0:
-                mean_index = self.calculate_mean_index(mean, mean_median, median_sigma, characteristic)
-                sigma_index = std / median_sigma
-            else:
-                all_means = group_stats['mean'].tolist() if not group_stats.empty else [mean]
-                if len(set([round(m, 8) for m in all_means])) == 1:
-                    mean_index, sigma_index = 0, 0
-                else:
-                    mean_index, sigma_index = float('inf'), float('inf')
-                    
-            K = self.get_k_value(n)
-            results.append([gname, cname, group, "group_all", 
-                'Insufficient Data' if K=="No Comparison" else round(mean_index, 2), 
-                'Insufficient Data' if K=="No Comparison" else round(sigma_index, 2), 
-                K if isinstance(K, str) else round(K, 2), 
-                round(mean, 2), round(std, 2), round(mean_median, 2), round(median_sigma, 2), n, characteristic])
+    def _get_chart_figures(self, chart_key):
+        """取得 chart 的 SPC/箱型圖，第一次使用時才繪製"""
+        if chart_key not in self.chart_figures and chart_key in self.chart_plot_sources:
+            self._create_boxplot_single(self.chart_plot_sources[chart_key], *chart_key)
+        return self.chart_figures.get(chart_key)
 
     def _create_boxplot_single(self, subdf, gname, cname):
         try:
@@ -1157,9 +1213,9 @@ class ToolMatchingWidget(QtWidgets.QWidget):
         charts_container_widget = QtWidgets.QWidget()
         charts_layout = QtWidgets.QHBoxLayout(charts_container_widget)
 
-        if hasattr(self, 'chart_figures') and chart_key in self.chart_figures:
-            figures = self.chart_figures[chart_key]
-            if figures['scatter'] and figures['box']:
+        if hasattr(self, 'chart_plot_sources') and chart_key in self.chart_plot_sources:
+            figures = self._get_chart_figures(chart_key) or {}
+            if figures.get('scatter') and figures.get('box'):
                 scatter_fig_copy = pickle.loads(pickle.dumps(figures['scatter']))
                 box_fig_copy = pickle.loads(pickle.dumps(figures['box']))
                 scatter_canvas = FigureCanvas(scatter_fig_copy)
@@ -1226,7 +1282,7 @@ class ToolMatchingWidget(QtWidgets.QWidget):
             abnormal_fill = openpyxl.styles.PatternFill(start_color="FFCCCC", end_color="FFCCCC", fill_type="solid")
             img_display_width, img_display_height = 450, 250
 
-            has_chart_figures = hasattr(self, 'chart_figures') and self.chart_figures
+            has_chart_figures = hasattr(self, 'chart_plot_sources') and self.chart_plot_sources
             
             # 🚀 加速優化 2：圖片快取字典，避免重複存檔 (Savefig) 拖慢速度
             generated_img_cache = {}
@@ -1249,8 +1305,8 @@ class ToolMatchingWidget(QtWidgets.QWidget):
                     group_name, chart_name = str(row_data["GroupName"]), str(row_data["ChartName"])
                     chart_key = (group_name, chart_name)
                     
-                    if has_chart_figures and chart_key in self.chart_figures:
-                        chart_data = self.chart_figures[chart_key]
+                    if has_chart_figures and chart_key in self.chart_plot_sources:
+                        chart_data = self._get_chart_figures(chart_key) or {}
                         
                         # 只有遇到「沒存過圖的 Chart」才執行耗時的 savefig
                         if chart_key not in generated_img_cache: